@@ -18,6 +18,7 @@ from rest_framework.views import APIView
 
 from .models import AsyncTask, CsvColumnMapping, ModelDisplaySetting, QrCodeAction
 from .serializers import CsvColumnMappingSerializer, ModelDisplaySettingSerializer, QrCodeActionSerializer
+from .sync import SYNC_RESOURCES, InvalidWatermarkError, get_changes
 from .tasks import import_csv_task
 
 DATA_TYPE_MODEL_MAPPING = {
@@ -56,6 +57,69 @@ class HealthCheckView(APIView):
         return Response({"status": "ok"}, status=status.HTTP_200_OK)
 
 
+class AsyncTaskStatusView(APIView):
+    """
+    非同期タスク (AsyncTask) の進捗と結果を返すAPIビュー。
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk, *args, **kwargs):
+        try:
+            task = AsyncTask.objects.get(task_id=pk)
+        except AsyncTask.DoesNotExist:
+            return Response(
+                {"status": "error", "message": "タスクが見つかりません。"}, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(
+            {
+                "task_id": task.task_id,
+                "task_name": task.task_name,
+                "status": task.status,
+                "progress": task.progress,
+                "total": task.total,
+                "result": task.result,
+                "created_at": task.created_at,
+                "updated_at": task.updated_at,
+            }
+        )
+
+
+class SyncView(APIView):
+    """
+    ハンディ端末向けの差分同期API。
+    前回の応答で受け取った watermark を since に渡すと、それ以降に変更・削除されたレコードだけを返します。
+    has_more が True の間は、返された watermark で繰り返し呼び出してください。
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        resources = request.query_params.get("resources")
+        resources = [r.strip() for r in resources.split(",") if r.strip()] if resources else list(SYNC_RESOURCES)
+        unknown = [r for r in resources if r not in SYNC_RESOURCES]
+        if unknown:
+            return Response(
+                {"status": "error", "message": f"不明なリソースです: {', '.join(unknown)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            limit = int(request.query_params.get("limit", settings.SYNC_PAGE_SIZE))
+        except ValueError:
+            return Response(
+                {"status": "error", "message": "limit は整数で指定してください。"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, settings.SYNC_MAX_PAGE_SIZE))
+
+        try:
+            data = get_changes(resources, request.query_params.get("since"), limit, context={"request": request})
+        except InvalidWatermarkError:
+            return Response(
+                {"status": "error", "message": "watermark が不正です。"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(data)
+
+
 class ModelDisplaySettingFilter(django_filters.FilterSet):
     data_type = django_filters.ChoiceFilter(choices=[(k, k) for k in DATA_TYPE_MODEL_MAPPING.keys()])
 
@@ -3,11 +3,13 @@ from rest_framework.routers import DefaultRouter
 
 from .api import (
     AppInfoView,
+    AsyncTaskStatusView,
     CsvColumnMappingViewSet,
     HealthCheckView,
     ModelDisplaySettingViewSet,
     ModelFieldsView,
     QrCodeActionViewSet,
+    SyncView,
 )
 
 app_name = "base_api"
@@ -21,6 +23,8 @@ urlpatterns = [
     path("info/", AppInfoView.as_view(), name="app-info"),
     path("health/", HealthCheckView.as_view(), name="health-check"),
     path("model-fields/", ModelFieldsView.as_view(), name="model-fields"),
+    path("sync/", SyncView.as_view(), name="sync"),
+    path("tasks/<str:pk>/", AsyncTaskStatusView.as_view(), name="task-status"),
     path(
         "csv-import-status/<str:pk>/",
         CsvColumnMappingViewSet.as_view({"get": "get_task_status"}),
@@ -5,3 +5,6 @@ class BaseConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "base"
     verbose_name = "基本設定"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = "cache-version:{namespace}"
+
+
+def get_cache_version(namespace):
+    """名前空間のキャッシュバージョンを返します。"""
+    key = VERSION_KEY.format(namespace=namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_cache_version(namespace):
+    """
+    名前空間のキャッシュバージョンを進め、既存のキャッシュをまとめて無効化します。
+    トランザクション内で呼ばれた場合はコミット後に無効化します (コミット前の古い値が再キャッシュされるのを防ぐため)。
+    """
+
+    def _bump():
+        key = VERSION_KEY.format(namespace=namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 2, timeout=None)
+
+    transaction.on_commit(_bump)
+
+
+def get_or_build(namespace, key, builder, timeout=300):
+    """
+    名前空間のバージョン付きキーでキャッシュを参照し、なければ builder() の結果を保存して返します。
+    """
+    cache_key = f"{namespace}:{key}"
+    version = get_cache_version(namespace)
+    value = cache.get(cache_key, version=version)
+    if value is None:
+        value = builder()
+        cache.set(cache_key, value, timeout=timeout, version=version)
+    return value
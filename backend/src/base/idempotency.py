@@ -0,0 +1,112 @@
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyRecord
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+
+class _NotStored(Exception):
+    """成功しなかった応答を、記録ごとロールバックして返すための例外。"""
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def _scope(request):
+    user = request.user
+    return f"user:{user.pk}" if user and user.is_authenticated else "anonymous"
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{request.method} {request.path}\n{body}".encode()).hexdigest()
+
+
+def _claim(scope, key, request_hash, now):
+    """
+    キーの記録を作成して (新しい記録, None) を返します。記録が既にあれば (None, 既存の記録) を返します。
+    同じキーのリクエストが同時に実行中の場合、作成は先のトランザクションが終わるまで待ってから衝突します。
+    """
+    expires_at = now + timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                record = IdempotencyRecord.objects.create(
+                    scope=scope, key=key, request_hash=request_hash, expires_at=expires_at
+                )
+            return record, None
+        except IntegrityError:
+            existing = IdempotencyRecord.objects.filter(scope=scope, key=key).first()
+            if existing is None:
+                continue
+            if existing.expires_at > now:
+                return None, existing
+            # 有効期限切れの記録は削除して作り直す
+            existing.delete()
+    return None, None
+
+
+def _replay(record, request_hash):
+    if record is None:
+        return Response(
+            {"error": "同じ Idempotency-Key のリクエストを処理中です。時間をおいて再送してください。"},
+            status=status.HTTP_409_CONFLICT,
+        )
+    if record.request_hash != request_hash:
+        return Response(
+            {"error": "この Idempotency-Key は別のリクエストで使用済みです。"},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return Response(record.response_body, status=record.status_code, headers={REPLAYED_HEADER: "true"})
+
+
+def idempotent(view_method):
+    """
+    更新系のビューアクションを Idempotency-Key ヘッダーに対応させるデコレーター。
+    ヘッダーがあれば、キーの記録・ビューの処理・応答の保存を1つのトランザクションで行い、同じキーで再送された
+    リクエストには処理を再実行せずに保存済みの応答を返します (ヘッダー Idempotent-Replayed: true)。
+    成功 (2xx) 以外の応答は保存せず、トランザクションごとロールバックするため、同じキーで再試行できます。
+    ヘッダーがなければ通常どおり実行します。
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"{IDEMPOTENCY_HEADER} は{MAX_KEY_LENGTH}文字以内で指定してください。"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        request_hash = _fingerprint(request)
+        try:
+            with transaction.atomic():
+                record, existing = _claim(_scope(request), key, request_hash, timezone.now())
+                if record is None:
+                    return _replay(existing, request_hash)
+                response = view_method(self, request, *args, **kwargs)
+                if not status.is_success(response.status_code):
+                    raise _NotStored(response)
+                record.status_code = response.status_code
+                record.response_body = json.loads(JSONRenderer().render(response.data) or "null")
+                record.save(update_fields=["status_code", "response_body"])
+                return response
+        except _NotStored as e:
+            return e.response
+
+    return wrapper
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0014_remove_qrcodeaction_script_qrcodeaction_action_name_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('resource', models.CharField(max_length=50, verbose_name='リソース')),
+                ('object_id', models.CharField(max_length=64, verbose_name='オブジェクトID')),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='削除日時')),
+            ],
+            options={
+                'verbose_name': '削除記録',
+                'verbose_name_plural': '削除記録',
+                'ordering': ['deleted_at', 'id'],
+                'indexes': [models.Index(fields=['resource', 'deleted_at', 'id'], name='sync_tombstone_watermark_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0015_synctombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyRecord',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('scope', models.CharField(max_length=64, verbose_name='スコープ')),
+                ('key', models.CharField(max_length=255, verbose_name='キー')),
+                ('request_hash', models.CharField(max_length=64, verbose_name='リクエストハッシュ')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='ステータスコード')),
+                ('response_body', models.JSONField(blank=True, null=True, verbose_name='応答')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='有効期限')),
+            ],
+            options={
+                'verbose_name': '冪等キー',
+                'verbose_name_plural': '冪等キー',
+                'constraints': [models.UniqueConstraint(fields=('scope', 'key'), name='idempotency_record_unique_key')],
+            },
+        ),
+    ]
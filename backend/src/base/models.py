@@ -1,6 +1,7 @@
 import uuid
 
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 # 共通のデータ種別選択肢
@@ -253,3 +254,52 @@ class AsyncTask(models.Model):
 
     def __str__(self):
         return f"{self.task_name} ({self.task_id}) - {self.get_status_display()}"
+
+
+class SyncTombstone(models.Model):
+    """
+    差分同期のための削除記録 (トゥームストーン)。
+    同期対象のレコードが削除されると記録され、クライアントは前回同期以降に削除されたIDを取得できます。
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    resource = models.CharField(_("リソース"), max_length=50)
+    object_id = models.CharField(_("オブジェクトID"), max_length=64)
+    deleted_at = models.DateTimeField(_("削除日時"), default=timezone.now)
+
+    class Meta:
+        verbose_name = _("削除記録")
+        verbose_name_plural = _("削除記録")
+        ordering = ["deleted_at", "id"]
+        indexes = [
+            models.Index(fields=["resource", "deleted_at", "id"], name="sync_tombstone_watermark_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.resource}:{self.object_id} ({self.deleted_at})"
+
+
+class IdempotencyRecord(models.Model):
+    """
+    Idempotency-Key 付きで実行された更新系リクエストの記録。
+    同じキーで再送されたリクエストには、処理を再実行せずに保存済みの応答を返します。保持期間を過ぎた記録は定期的に削除します。
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    scope = models.CharField(_("スコープ"), max_length=64)  # キーの名前空間 (ユーザーごと)
+    key = models.CharField(_("キー"), max_length=255)
+    request_hash = models.CharField(_("リクエストハッシュ"), max_length=64)  # 別のリクエストでの使い回しの検出用
+    status_code = models.PositiveSmallIntegerField(_("ステータスコード"), null=True, blank=True)
+    response_body = models.JSONField(_("応答"), null=True, blank=True)
+    created_at = models.DateTimeField(_("作成日時"), auto_now_add=True)
+    expires_at = models.DateTimeField(_("有効期限"), db_index=True)
+
+    class Meta:
+        verbose_name = _("冪等キー")
+        verbose_name_plural = _("冪等キー")
+        constraints = [
+            models.UniqueConstraint(fields=["scope", "key"], name="idempotency_record_unique_key"),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key} ({self.status_code})"
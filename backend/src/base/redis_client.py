@@ -0,0 +1,13 @@
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+
+
+@lru_cache(maxsize=1)
+def get_redis():
+    """
+    アプリケーション共通のRedisクライアントを返します。
+    接続プールはプロセス内で共有されます。
+    """
+    return redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
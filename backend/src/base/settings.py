@@ -14,6 +14,7 @@ from datetime import timedelta
 from pathlib import Path
 
 import environ
+from corsheaders.defaults import default_headers
 
 VERSION = "0.0.0"
 
@@ -46,6 +47,8 @@ CSRF_TRUSTED_ORIGINS = env.list("CSRF_TRUSTED_ORIGINS", default=[])
 # CORS設定: Vite開発サーバーからのAPIリクエストを許可
 # .env ファイルから読み込む。
 CORS_ALLOWED_ORIGINS = env.list("CORS_ALLOWED_ORIGINS", default=[])
+# 再送時の二重実行を防ぐ Idempotency-Key ヘッダーを許可する
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
 
 # --- Cookie, CSRF, and Reverse Proxy Settings ---
 
@@ -143,6 +146,14 @@ DATABASES = {
 }
 
 
+# Cache
+# 複数のワーカープロセス間でキャッシュと無効化を共有するため、既定ではRedisを使用します。
+# ローカルでのテスト時などは CACHE_URL=locmemcache:// を指定できます。
+CACHES = {
+    "default": env.cache("CACHE_URL", default="rediscache://redis:6379/1"),
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -285,11 +296,98 @@ LOGGING = {
 # 有効期限を無効にする場合は 0 や None を設定
 # PASSWORD_EXPIRATION_DAYS = None
 
+# Redis接続先 (Celery以外の用途: スキャン取込ストリームなど)
+REDIS_URL = env("REDIS_URL", default="redis://redis:6379/0")
+
 # Celery Configuration Options
-CELERY_BROKER_URL = "redis://redis:6379/0"
-CELERY_RESULT_BACKEND = "redis://redis:6379/0"
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "Asia/Tokyo"
 CELERY_TASK_TRACK_STARTED = True
+CELERY_BEAT_SCHEDULE = {
+    "purge-sync-tombstones": {
+        "task": "base.tasks.purge_sync_tombstones_task",
+        "schedule": 60 * 60 * 24,
+    },
+    "purge-idempotency-records": {
+        "task": "base.tasks.purge_idempotency_records_task",
+        "schedule": 60 * 60,
+    },
+    "drain-pending-scan-shards": {
+        "task": "inventory.tasks.drain_pending_scan_shards_task",
+        "schedule": 60,
+    },
+}
+
+# スキャナー入出庫の非同期取込 (Redis Stream) の設定
+# 品番・倉庫・棚番ごとの順序を保つため、ストリームはキーのハッシュでシャードに分割されます。
+SCAN_INGEST_SHARDS = env.int("SCAN_INGEST_SHARDS", default=8)
+SCAN_INGEST_BATCH_SIZE = env.int("SCAN_INGEST_BATCH_SIZE", default=500)
+# シャードあたりの未処理件数がこの値に達すると、新規スキャンは 429 で拒否されます (バックプレッシャー)
+SCAN_INGEST_MAX_PENDING = env.int("SCAN_INGEST_MAX_PENDING", default=20000)
+# スキャン状態 (pending/applied/failed) の保持期間 (秒)
+SCAN_INGEST_STATUS_TTL = env.int("SCAN_INGEST_STATUS_TTL", default=60 * 60 * 24)
+# シャードの取込ロックの有効期限 (秒)。1バッチの反映にかかる時間より長くします (バッチごとに延長されます)
+SCAN_INGEST_LOCK_TIMEOUT = env.int("SCAN_INGEST_LOCK_TIMEOUT", default=300)
+# この回数配信しても反映できないスキャンは 1件ずつ反映し直し、失敗したものをデッドレターストリームに移します
+SCAN_INGEST_MAX_DELIVERIES = env.int("SCAN_INGEST_MAX_DELIVERIES", default=5)
+# バッチの反映に失敗した後、シャードの取込を再試行するまでの待ち時間 (秒)
+SCAN_INGEST_RETRY_DELAY_SECONDS = env.int("SCAN_INGEST_RETRY_DELAY_SECONDS", default=30)
+
+# ハンディ端末向け差分同期 (/api/base/sync/) の設定
+# 削除記録 (トゥームストーン) の保持日数。これより古いウォーターマークは全件再同期を要求されます。
+SYNC_TOMBSTONE_RETENTION_DAYS = env.int("SYNC_TOMBSTONE_RETENTION_DAYS", default=30)
+# コミット待ちのトランザクションを取りこぼさないよう、直近この秒数以内の変更は次回同期に回します
+SYNC_SAFETY_LAG_SECONDS = env.int("SYNC_SAFETY_LAG_SECONDS", default=5)
+SYNC_PAGE_SIZE = env.int("SYNC_PAGE_SIZE", default=500)
+SYNC_MAX_PAGE_SIZE = 2000
+
+# 在庫年齢 (FIFO層) の差分集計の設定
+# 入出庫履歴IDは作成時刻順のため、コミットが遅れた履歴を読み飛ばさないよう、
+# 直近この秒数以内に作成された履歴は次回に回します
+INVENTORY_AGING_SAFETY_LAG_SECONDS = env.int("INVENTORY_AGING_SAFETY_LAG_SECONDS", default=300)
+
+# ピッキング作業キューの設定
+# 端末からの応答 (heartbeat) がないままこの秒数が経過した作業は、他の作業者が取得できるようになります。
+PICKING_LEASE_SECONDS = env.int("PICKING_LEASE_SECONDS", default=300)
+PICKING_CLAIM_MAX = 50
+
+# 棚番コードの階層 (ロケーションマップの集約単位)。棚番を区切り文字 (正規表現) で分割し、先頭から順に対応付けます。
+LOCATION_HIERARCHY_LEVELS = ["aisle", "rack", "level"]
+LOCATION_CODE_SEPARATOR = env("LOCATION_CODE_SEPARATOR", default=r"[-_/]")
+
+# 所要量計算 (MRP) の既定値
+# 時間バケットの幅 (日)・計画期間 (日)・計画オーダーの手配日を決めるリードタイム (日)
+MRP_BUCKET_DAYS = env.int("MRP_BUCKET_DAYS", default=7)
+MRP_HORIZON_DAYS = env.int("MRP_HORIZON_DAYS", default=182)
+MRP_DEFAULT_LEAD_TIME_DAYS = env.int("MRP_DEFAULT_LEAD_TIME_DAYS", default=7)
+
+# 生産計画の自動引当 (auto-allocate) の既定ポリシー。リクエストの policy で項目ごとに上書きできます。
+AUTO_ALLOCATION_POLICY = {
+    # 使用部品 (PartsUsed) に指定された倉庫の在庫を優先する
+    "prefer_bom_warehouse": True,
+    # 1つの棚番で賄える場合は分割しない
+    "single_row_first": True,
+    # 引当対象の倉庫と優先順位 (空ならすべての倉庫)
+    "warehouses": env.list("AUTO_ALLOCATION_WAREHOUSES", default=[]),
+    # 1品番あたりの最大分割数 (0 は無制限)
+    "max_splits": 0,
+    # 不足がある場合も、引当可能な分だけ確定する
+    "allow_partial": False,
+}
+
+# 一括引当 (batch-allocate) の既定の対象期間 (日) と、1トランザクションで確定する計画数
+BATCH_ALLOCATION_HORIZON_DAYS = env.int("BATCH_ALLOCATION_HORIZON_DAYS", default=7)
+BATCH_ALLOCATION_CHUNK_SIZE = env.int("BATCH_ALLOCATION_CHUNK_SIZE", default=50)
+
+# 生産スケジューラで、納期がこの時間以内の同じ製品の計画を同じ設備に続けて割り当てる (段取り替えの削減)
+SCHEDULER_SETUP_GROUPING_HOURS = env.int("SCHEDULER_SETUP_GROUPING_HOURS", default=24)
+
+# 更新系 API の Idempotency-Key (再送されたリクエストに保存済みの応答を返す) の保持時間 (時間)
+IDEMPOTENCY_KEY_TTL_HOURS = env.int("IDEMPOTENCY_KEY_TTL_HOURS", default=24)
+
+# 完成品の入庫先ルール (master.OutputRoutingRule) に該当しない製品の完成品を計上する倉庫
+DEFAULT_FINISHED_GOODS_WAREHOUSE = env("DEFAULT_FINISHED_GOODS_WAREHOUSE", default="FG-MAIN")
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import SyncTombstone
+from .sync import resource_for_model
+
+
+@receiver(post_delete)
+def record_sync_tombstone(sender, instance, **kwargs):
+    """差分同期の対象モデルが削除されたとき、端末側でも削除できるようトゥームストーンを記録します。"""
+    resource = resource_for_model(sender)
+    if resource is None:
+        return
+    SyncTombstone.objects.create(resource=resource, object_id=str(instance.pk))
@@ -0,0 +1,149 @@
+import base64
+import binascii
+import json
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.module_loading import import_string
+
+from .models import SyncTombstone
+
+# 差分同期の対象リソース: リソース名 -> (モデル, 更新日時フィールド, シリアライザ)
+SYNC_RESOURCES = {
+    "inventory": ("inventory.Inventory", "last_updated", "inventory.serializers.InventorySerializer"),
+    "purchase_orders": ("inventory.PurchaseOrder", "updated_at", "inventory.serializers.PurchaseOrderSerializer"),
+    "sales_orders": ("inventory.SalesOrder", "updated_at", "inventory.serializers.SalesOrderSerializer"),
+    "items": ("master.Item", "updated_at", "master.serializers.ItemSerializer"),
+    "suppliers": ("master.Supplier", "updated_at", "master.serializers.SupplierSerializer"),
+    "warehouses": ("master.Warehouse", "updated_at", "master.serializers.WarehouseSerializer"),
+}
+
+
+class InvalidWatermarkError(ValueError):
+    """クライアントから渡されたウォーターマークを解釈できないことを示す例外。"""
+
+
+def get_sync_model(resource):
+    model_string = SYNC_RESOURCES[resource][0]
+    return apps.get_model(model_string)
+
+
+def resource_for_model(model):
+    """モデルクラスに対応する同期リソース名を返します (同期対象外なら None)。"""
+    label = model._meta.label
+    for resource, (model_string, _, _) in SYNC_RESOURCES.items():
+        if model_string == label:
+            return resource
+    return None
+
+
+def encode_watermark(cursors):
+    """リソースごとのカーソルを不透明なウォーターマーク文字列に変換します。"""
+    return base64.urlsafe_b64encode(json.dumps(cursors, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_watermark(token):
+    if not token:
+        return {}
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        cursors = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise InvalidWatermarkError("Invalid watermark.") from e
+    if not isinstance(cursors, dict):
+        raise InvalidWatermarkError("Invalid watermark.")
+    return cursors
+
+
+def _after(queryset, time_field, pk_field, cursor):
+    """(更新日時, 主キー) のキーセットでカーソルより後のレコードに絞り込みます。"""
+    if not cursor:
+        return queryset
+    cursor_time = parse_datetime(cursor[0])
+    if cursor_time is None:
+        raise InvalidWatermarkError("Invalid watermark.")
+    return queryset.filter(
+        Q(**{f"{time_field}__gt": cursor_time}) | Q(**{time_field: cursor_time, f"{pk_field}__gt": cursor[1]})
+    )
+
+
+def _page(queryset, time_field, pk_field, cursor, until, limit):
+    rows = list(
+        _after(queryset, time_field, pk_field, cursor)
+        .filter(**{f"{time_field}__lte": until})
+        .order_by(time_field, pk_field)[: limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if rows:
+        last = rows[-1]
+        cursor = [getattr(last, time_field).isoformat(), str(getattr(last, pk_field))]
+    return rows, cursor, has_more
+
+
+def get_changes(resources, watermark, limit, context=None):
+    """
+    ウォーターマーク以降に作成・更新・削除されたレコードをリソースごとに返します。
+    各リソースは (更新日時, 主キー) のキーセットでページングされ、続きがある場合は has_more が True になります。
+    処理中のトランザクションを取りこぼさないよう、直近 SYNC_SAFETY_LAG_SECONDS 秒の変更は次回の同期に回します。
+    カーソルには、削除の記録をどの時点まで受け取り済みか (synced_until) をキーセットの位置とは別に保持し、
+    それがトゥームストーンの保持期間より古い場合だけ全件再同期を要求します。
+    """
+    cursors = decode_watermark(watermark)
+    until = timezone.now() - timedelta(seconds=settings.SYNC_SAFETY_LAG_SECONDS)
+    retention_limit = timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+
+    result = {}
+    new_cursors = dict(cursors)
+    for resource in resources:
+        model_string, time_field, serializer_path = SYNC_RESOURCES[resource]
+        model = apps.get_model(model_string)
+        serializer_class = import_string(serializer_path)
+        resource_cursor = cursors.get(resource) or {}
+
+        # 最後に同期した時点がトゥームストーンの保持期間より古いと削除を追跡できないため、全件再同期を要求する
+        # (synced_until のない以前のウォーターマークは、削除のカーソル位置で判定する)
+        synced_until = resource_cursor.get("synced_until")
+        checkpoint = synced_until or (resource_cursor.get("deletes") or [None])[0]
+        if resource_cursor and checkpoint and (parse_datetime(checkpoint) or until) < retention_limit:
+            result[resource] = {"full_resync_required": True, "changed": [], "deleted": [], "has_more": False}
+            new_cursors.pop(resource, None)
+            continue
+
+        rows, changes_cursor, changes_more = _page(
+            model.objects.all(), time_field, "pk", resource_cursor.get("changes"), until, limit
+        )
+        tombstones, deletes_cursor, deletes_more = _page(
+            SyncTombstone.objects.filter(resource=resource),
+            "deleted_at",
+            "id",
+            resource_cursor.get("deletes"),
+            until,
+            limit,
+        )
+        # 初回同期 (カーソルなし) では削除記録は不要なので、現在位置までスキップする
+        if not resource_cursor:
+            tombstones, deletes_more = [], False
+            last = SyncTombstone.objects.filter(resource=resource, deleted_at__lte=until).order_by("-deleted_at", "-id")
+            last = last.first()
+            deletes_cursor = [last.deleted_at.isoformat(), str(last.id)] if last else [until.isoformat(), "0"]
+        # 削除の記録を今回の上限まで受け取り終えた場合だけ、同期済みの時点を進める
+        if not deletes_more:
+            synced_until = until.isoformat()
+
+        result[resource] = {
+            "changed": serializer_class(rows, many=True, context=context or {}).data,
+            "deleted": [t.object_id for t in tombstones],
+            "has_more": changes_more or deletes_more,
+        }
+        new_cursors[resource] = {"changes": changes_cursor, "deletes": deletes_cursor, "synced_until": synced_until}
+
+    return {
+        "watermark": encode_watermark(new_cursors),
+        "has_more": any(r["has_more"] for r in result.values()),
+        "resources": result,
+    }
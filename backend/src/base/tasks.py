@@ -1,15 +1,17 @@
 import csv
 import io
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from celery import shared_task
 from celery.exceptions import SoftTimeLimitExceeded
 from celery.result import AsyncResult
 from django.apps import apps
+from django.conf import settings
 from django.db import IntegrityError, models, transaction
+from django.utils import timezone
 
-from .models import DATA_TYPE_MODEL_MAPPING, AsyncTask, CsvColumnMapping
+from .models import DATA_TYPE_MODEL_MAPPING, AsyncTask, CsvColumnMapping, IdempotencyRecord, SyncTombstone
 
 
 @shared_task(bind=True)
@@ -140,3 +142,18 @@ def import_csv_task(self, data_type, file_path):
     finally:
         if os.path.exists(file_path):
             os.remove(file_path)
+
+
+@shared_task
+def purge_sync_tombstones_task():
+    """保持期間を過ぎた差分同期用のトゥームストーンを削除します。"""
+    threshold = timezone.now() - timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+    deleted, _ = SyncTombstone.objects.filter(deleted_at__lt=threshold).delete()
+    return deleted
+
+
+@shared_task
+def purge_idempotency_records_task():
+    """有効期限を過ぎた Idempotency-Key の記録を削除します。"""
+    deleted, _ = IdempotencyRecord.objects.filter(expires_at__lt=timezone.now()).delete()
+    return deleted
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Inventory, PurchaseOrder, Receipt, SalesOrder, StockMovement
+from .models import Inventory, PickingTask, PurchaseOrder, Receipt, SalesOrder, StockMovement
 
 # Register your models here.
 
@@ -36,3 +36,11 @@ class ReceiptAdmin(admin.ModelAdmin):
     list_filter = ("received_date", "warehouse")
     search_fields = ("purchase_order__order_number", "warehouse")
     date_hierarchy = "received_date"
+
+
+@admin.register(PickingTask)
+class PickingTaskAdmin(admin.ModelAdmin):
+    list_display = ("sales_order", "part_number", "warehouse", "location", "quantity", "status", "claimed_by")
+    list_filter = ("status", "warehouse")
+    search_fields = ("sales_order__order_number", "part_number")
+    raw_id_fields = ("sales_order",)
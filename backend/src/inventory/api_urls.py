@@ -11,6 +11,11 @@ router.register(r"purchase-orders", rest_views.PurchaseOrderViewSet, basename="p
 router.register(r"sales-orders", rest_views.SalesOrderViewSet, basename="salesorder")
 router.register(r"receipts", rest_views.ReceiptViewSet, basename="receipt")
 router.register(r"stock-movements", rest_views.StockMovementViewSet, basename="stockmovement")
+router.register(r"scans", rest_views.ScanIngestViewSet, basename="scan")
+router.register(r"picking-tasks", rest_views.PickingTaskViewSet, basename="pickingtask")
+router.register(r"demand-forecasts", rest_views.DemandForecastViewSet, basename="demandforecast")
+router.register(r"serial-ranges", rest_views.SerialRangeViewSet, basename="serialrange")
+router.register(r"inventory-aging", rest_views.InventoryAgingViewSet, basename="inventoryaging")
 
 
 urlpatterns = [
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:04
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_part_keys(apps, schema_editor):
+    """既存レコードの品番文字列から品番辞書を作成し、品番キーを設定する。"""
+    PartNumber = apps.get_model("master", "PartNumber")
+    for model_name, source_field in [("inventory", "part_number"), ("stockmovement", "part_number"), ("purchaseorder", "part_number")]:
+        model = apps.get_model("inventory", model_name)
+        codes = model.objects.exclude(**{f"{source_field}__isnull": True}).exclude(**{source_field: ""})
+        codes = codes.values_list(source_field, flat=True).distinct()
+        PartNumber.objects.bulk_create([PartNumber(code=code) for code in codes], ignore_conflicts=True)
+        model.objects.update(
+            part_key=models.Subquery(PartNumber.objects.filter(code=models.OuterRef(source_field)).values("id")[:1])
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0016_purchaseorder_received_quantity'),
+        ('master', '0007_part_number_keys'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='part_key',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='master.partnumber', verbose_name='品番キー'),
+        ),
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='part_key',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='master.partnumber', verbose_name='品番キー'),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='part_key',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='master.partnumber', verbose_name='品番キー'),
+        ),
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(fields=['part_key', 'warehouse'], name='inventory_partkey_wh_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['part_key', 'movement_date'], name='stockmove_partkey_date_idx'),
+        ),
+        migrations.RunPython(backfill_part_keys, migrations.RunPython.noop),
+    ]
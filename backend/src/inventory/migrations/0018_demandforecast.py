@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:08
+
+import django.db.models.deletion
+import uuid6
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0017_part_number_keys'),
+        ('master', '0007_part_number_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DemandForecast',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part_number', models.CharField(max_length=255, verbose_name='品番')),
+                ('movement_type', models.CharField(choices=[('used', '生産使用'), ('outgoing', '出庫')], max_length=20, verbose_name='移動タイプ')),
+                ('method', models.CharField(choices=[('moving_average', '移動平均'), ('exponential_smoothing', '指数平滑'), ('croston', 'Croston法')], max_length=30, verbose_name='採用手法')),
+                ('weekly_forecast', models.FloatField(verbose_name='週次予測数量')),
+                ('moving_average', models.FloatField(verbose_name='移動平均')),
+                ('exponential_smoothing', models.FloatField(verbose_name='指数平滑')),
+                ('croston', models.FloatField(verbose_name='Croston法')),
+                ('history_weeks', models.PositiveIntegerField(verbose_name='履歴週数')),
+                ('nonzero_weeks', models.PositiveIntegerField(verbose_name='需要発生週数')),
+                ('forecast_start', models.DateField(verbose_name='予測開始週')),
+                ('horizon_weeks', models.PositiveIntegerField(verbose_name='予測週数')),
+                ('generated_at', models.DateTimeField(verbose_name='予測実行日時')),
+                ('part_key', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='master.partnumber', verbose_name='品番キー')),
+            ],
+            options={
+                'verbose_name': '需要予測',
+                'verbose_name_plural': '需要予測',
+                'ordering': ['part_number', 'movement_type'],
+                'constraints': [models.UniqueConstraint(fields=('part_key', 'movement_type'), name='unique_demand_forecast')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0018_demandforecast'),
+        ('master', '0007_part_number_keys'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='purchaseorder',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'partially_received'])), fields=['expected_arrival'], name='po_open_arrival_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0019_purchaseorder_open_arrival_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='更新日時'),
+        ),
+        migrations.AddField(
+            model_name='salesorder',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='更新日時'),
+        ),
+        migrations.AlterField(
+            model_name='inventory',
+            name='last_updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='最終更新日時'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:15
+
+import django.db.models.deletion
+import uuid6
+from django.conf import settings
+from django.db import migrations, models
+
+import master.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0020_sync_watermarks'),
+        ('master', '0008_sync_watermarks'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PickingTask',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part_number', models.CharField(max_length=255, verbose_name='品番')),
+                ('warehouse', models.CharField(blank=True, max_length=255, null=True, verbose_name='出庫倉庫')),
+                ('location', models.CharField(blank=True, max_length=255, null=True, verbose_name='推奨棚番')),
+                ('quantity', models.PositiveIntegerField(verbose_name='ピッキング数量')),
+                ('picked_quantity', models.PositiveIntegerField(default=0, verbose_name='ピッキング済数量')),
+                ('expected_shipment', models.DateTimeField(blank=True, null=True, verbose_name='出庫予定日時')),
+                ('status', models.CharField(choices=[('open', '未着手'), ('claimed', '作業中'), ('completed', '完了'), ('canceled', 'キャンセル')], default='open', max_length=20, verbose_name='ステータス')),
+                ('claimed_at', models.DateTimeField(blank=True, null=True, verbose_name='取得日時')),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True, verbose_name='最終応答日時')),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True, verbose_name='リース期限')),
+                ('completed_at', models.DateTimeField(blank=True, null=True, verbose_name='完了日時')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('claimed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='作業者')),
+                ('part_key', models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='master.partnumber', verbose_name='品番キー')),
+                ('sales_order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='picking_tasks', to='inventory.salesorder', verbose_name='出庫予定')),
+            ],
+            options={
+                'verbose_name': 'ピッキング作業',
+                'verbose_name_plural': 'ピッキング作業',
+                'indexes': [models.Index(condition=models.Q(('status__in', ['open', 'claimed'])), fields=['warehouse', 'expected_shipment', 'created_at'], name='picking_queue_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ['open', 'claimed'])), fields=('sales_order',), name='unique_active_picking_task')],
+            },
+            bases=(master.models.PartKeyMixin, models.Model),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:19
+
+import django.db.models.deletion
+import uuid6
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0021_pickingtask'),
+        ('master', '0008_sync_watermarks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryAging',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part_number', models.CharField(max_length=255, verbose_name='品番')),
+                ('warehouse', models.CharField(blank=True, default='', max_length=255, verbose_name='倉庫')),
+                ('on_hand', models.IntegerField(default=0, verbose_name='層の残数量')),
+                ('quantity_0_30', models.IntegerField(default=0, verbose_name='0〜30日')),
+                ('quantity_31_90', models.IntegerField(default=0, verbose_name='31〜90日')),
+                ('quantity_over_90', models.IntegerField(default=0, verbose_name='91日以上')),
+                ('average_age_days', models.FloatField(default=0, verbose_name='平均滞留日数')),
+                ('oldest_receipt_date', models.DateField(blank=True, null=True, verbose_name='最古の受入日')),
+                ('layers', models.JSONField(default=list, verbose_name='FIFO層')),
+                ('unmatched_quantity', models.IntegerField(default=0, verbose_name='未照合払出数量')),
+                ('as_of', models.DateField(verbose_name='基準日')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('part_key', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='master.partnumber', verbose_name='品番キー')),
+            ],
+            options={
+                'verbose_name': '在庫エイジング',
+                'verbose_name_plural': '在庫エイジング',
+                'ordering': ['part_number', 'warehouse'],
+                'constraints': [models.UniqueConstraint(fields=('part_key', 'warehouse'), name='unique_inventory_aging')],
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:22
+
+import django.db.models.deletion
+import uuid6
+from django.db import migrations, models
+
+import master.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0022_inventoryaging'),
+        ('master', '0008_sync_watermarks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SerialRange',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False, verbose_name='ID')),
+                ('part_number', models.CharField(max_length=255, verbose_name='品番')),
+                ('prefix', models.CharField(blank=True, default='', max_length=100, verbose_name='接頭辞')),
+                ('width', models.PositiveSmallIntegerField(default=0, verbose_name='桁数')),
+                ('start', models.BigIntegerField(verbose_name='開始番号')),
+                ('end', models.BigIntegerField(verbose_name='終了番号')),
+                ('warehouse', models.CharField(blank=True, max_length=255, null=True, verbose_name='倉庫')),
+                ('location', models.CharField(blank=True, max_length=255, null=True, verbose_name='棚番')),
+                ('status', models.CharField(choices=[('in_stock', '在庫'), ('issued', '出庫済み'), ('consumed', '生産使用済み'), ('void', '無効')], default='in_stock', max_length=20, verbose_name='ステータス')),
+                ('source_document', models.CharField(blank=True, max_length=255, null=True, verbose_name='発生元')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('last_movement', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='inventory.stockmovement', verbose_name='最終入出庫履歴')),
+                ('part_key', models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='master.partnumber', verbose_name='品番キー')),
+                ('receipt', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='serial_ranges', to='inventory.receipt', verbose_name='入庫実績')),
+            ],
+            options={
+                'verbose_name': 'シリアル番号範囲',
+                'verbose_name_plural': 'シリアル番号範囲',
+                'indexes': [models.Index(fields=['part_key', 'prefix', 'start'], name='serial_range_lookup_idx'), models.Index(fields=['warehouse', 'location', 'part_key', 'prefix', 'start'], name='serial_range_loc_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(('start__lte', models.F('end'))), name='serial_range_start_lte_end')],
+            },
+            bases=(master.models.PartKeyMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='StockMovementSerialRange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('prefix', models.CharField(blank=True, default='', max_length=100, verbose_name='接頭辞')),
+                ('width', models.PositiveSmallIntegerField(default=0, verbose_name='桁数')),
+                ('start', models.BigIntegerField(verbose_name='開始番号')),
+                ('end', models.BigIntegerField(verbose_name='終了番号')),
+                ('movement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='serial_ranges', to='inventory.stockmovement', verbose_name='入出庫履歴')),
+            ],
+            options={
+                'verbose_name': '入出庫シリアル番号範囲',
+                'verbose_name_plural': '入出庫シリアル番号範囲',
+                'indexes': [models.Index(fields=['prefix', 'start'], name='movement_serial_lookup_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_sources(apps, schema_editor):
+    """既存の社内出庫の受注番号 INT-<材料引当IDの先頭15桁> から、作成元の材料引当と生産計画を設定する。"""
+    MaterialAllocation = apps.get_model("production", "MaterialAllocation")
+    SalesOrder = apps.get_model("inventory", "SalesOrder")
+    sources = {
+        f"INT-{allocation_id.hex[:15]}": (allocation_id, plan_id)
+        for allocation_id, plan_id in MaterialAllocation.objects.values_list("id", "production_plan_id").iterator()
+    }
+    order_numbers = list(sources)
+    for start in range(0, len(order_numbers), BATCH_SIZE):
+        orders = list(SalesOrder.objects.filter(order_number__in=order_numbers[start : start + BATCH_SIZE]))
+        for order in orders:
+            order.source_allocation_id, order.source_plan_id = sources[order.order_number]
+        SalesOrder.objects.bulk_update(orders, ["source_allocation", "source_plan"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0023_serial_ranges'),
+        ('production', '0011_productionplan_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesorder',
+            name='source_allocation',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='internal_sales_order', to='production.materialallocation', verbose_name='作成元の材料引当'),
+        ),
+        migrations.AddField(
+            model_name='salesorder',
+            name='source_plan',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='internal_sales_orders', to='production.productionplan', verbose_name='作成元の生産計画'),
+        ),
+        migrations.RunPython(backfill_sources, migrations.RunPython.noop),
+    ]
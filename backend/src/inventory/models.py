@@ -1,22 +1,34 @@
 from django.conf import settings
 from django.db import models
+from django.db.models import Q
 
 # from master.models import Item, Supplier, Warehouse
 from django.utils import timezone
 from uuid6 import uuid7
 
+from master.models import PartKeyMixin
+
 
 # 在庫情報
-class Inventory(models.Model):
+class Inventory(PartKeyMixin, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid7, editable=False, verbose_name="ID")  # UUIDv7を使用
     part_number = models.CharField(
         max_length=255, null=True, blank=True, verbose_name="品番"
     )  # 管理対象の製品/材料の品番 (文字列として保持)
+    part_key = models.ForeignKey(
+        "master.PartNumber",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        verbose_name="品番キー",
+    )  # part_number に対応する整数キー (集計・結合用)
     warehouse = models.CharField(max_length=255, null=True, blank=True, verbose_name="倉庫")  # 倉庫 (文字列として保持)
     quantity = models.IntegerField(default=0, verbose_name="在庫数量")  # 在庫
     reserved = models.IntegerField(default=0, verbose_name="引当済数量")  # 引当在庫
     location = models.CharField(max_length=255, blank=True, null=True, verbose_name="棚番")  # 倉庫や棚の場所
-    last_updated = models.DateTimeField(auto_now=True, verbose_name="最終更新日時")  # 更新日時
+    last_updated = models.DateTimeField(auto_now=True, db_index=True, verbose_name="最終更新日時")  # 更新日時
     is_active = models.BooleanField(default=True, verbose_name="有効フラグ")  # 在庫が有効かどうか
     is_allocatable = models.BooleanField(default=True, verbose_name="引当可能フラグ")  # 引き当て可能かどうか
 
@@ -37,9 +49,14 @@ class Inventory(models.Model):
             f"({self.location}) [{status}, {allocatable}]"
         )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["part_key", "warehouse"], name="inventory_partkey_wh_idx"),
+        ]
+
 
 # 入出庫履歴
-class StockMovement(models.Model):
+class StockMovement(PartKeyMixin, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid7, editable=False, verbose_name="ID")
     MOVEMENT_TYPE_CHOICES = [
         ("incoming", "入庫"),
@@ -53,6 +70,15 @@ class StockMovement(models.Model):
     part_number = models.CharField(
         max_length=255, null=True, blank=True, verbose_name="品番"
     )  # 在庫対象の製品/材料の品番 (文字列として保持)
+    part_key = models.ForeignKey(
+        "master.PartNumber",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        verbose_name="品番キー",
+    )  # part_number に対応する整数キー (集計・結合用)
     warehouse = models.CharField(max_length=255, null=True, blank=True, verbose_name="倉庫")  # どの倉庫に関連する移動か
     location = models.CharField(max_length=255, blank=True, null=True, verbose_name="棚番")  # どの棚番に関連する移動か
     movement_type = models.CharField(
@@ -68,12 +94,35 @@ class StockMovement(models.Model):
         settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="記録者"
     )
 
+    # 棚番移動 (出庫・入庫の対) と在庫調整の履歴に付ける参照ドキュメントの接頭辞。
+    # 実際の消費・入荷ではないため、需要予測や在庫年齢の集計からは除外します。
+    TRANSFER_REFERENCE_PREFIX = "TRANSFER: "
+    ADJUSTMENT_REFERENCE_PREFIX = "ADJUST: "
+    # 接頭辞を付ける前に記録された履歴は備考の書式で判別します
+    TRANSFER_DESCRIPTION_PREFIX = "棚番移動: "
+    ADJUSTMENT_DESCRIPTION_PREFIX = "在庫調整: "
+
     def __str__(self):
         return f"{self.part_number or 'N/A'} - {self.movement_type} - {self.quantity}"
 
+    @classmethod
+    def internal_movement_q(cls):
+        """棚番移動・在庫調整の履歴に一致する条件 (需要や入荷として数えない移動) を返します。"""
+        return (
+            Q(reference_document__startswith=cls.TRANSFER_REFERENCE_PREFIX)
+            | Q(reference_document__startswith=cls.ADJUSTMENT_REFERENCE_PREFIX)
+            | Q(description__startswith=cls.TRANSFER_DESCRIPTION_PREFIX)
+            | Q(description__startswith=cls.ADJUSTMENT_DESCRIPTION_PREFIX)
+        )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["part_key", "movement_date"], name="stockmove_partkey_date_idx"),
+        ]
+
 
 # 入庫予定
-class PurchaseOrder(models.Model):
+class PurchaseOrder(PartKeyMixin, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid7, editable=False, verbose_name="ID")
     order_number = models.CharField(
         max_length=20, unique=True, verbose_name="発注番号", null=True, blank=True
@@ -83,6 +132,15 @@ class PurchaseOrder(models.Model):
     quantity = models.PositiveIntegerField(verbose_name="発注数量", null=True, blank=True)  # 発注数量
     received_quantity = models.PositiveIntegerField(default=0, verbose_name="入庫済数量")
     part_number = models.CharField(max_length=100, blank=True, null=True, verbose_name="品番")
+    part_key = models.ForeignKey(
+        "master.PartNumber",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        verbose_name="品番キー",
+    )  # part_number に対応する整数キー (集計・結合用)
     product_name = models.CharField(max_length=255, blank=True, null=True, verbose_name="品名")
     parent_part_number = models.CharField(max_length=100, blank=True, null=True, verbose_name="親品番")
     instruction_document = models.CharField(max_length=255, blank=True, null=True, verbose_name="指示書")
@@ -98,6 +156,7 @@ class PurchaseOrder(models.Model):
     remarks4 = models.TextField(blank=True, null=True, verbose_name="備考4")
     remarks5 = models.TextField(blank=True, null=True, verbose_name="備考5")
     order_date = models.DateTimeField(auto_now_add=True, verbose_name="発注日")  # 発注日
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="更新日時")  # 差分同期用
     expected_arrival = models.DateTimeField(blank=True, null=True, verbose_name="入荷予定日時")  # 到着予定日
     warehouse = models.CharField(
         max_length=255, blank=True, null=True, verbose_name="入庫倉庫"
@@ -123,6 +182,16 @@ class PurchaseOrder(models.Model):
         item_display = self.item if self.item else "N/A"
         return f"PO {self.order_number} - {item_display} ({self.status})"
 
+    class Meta:
+        indexes = [
+            # 未入庫の発注のみを対象とした部分インデックス (入荷予定カレンダー用)
+            models.Index(
+                fields=["expected_arrival"],
+                condition=models.Q(status__in=["pending", "partially_received"]),
+                name="po_open_arrival_idx",
+            ),
+        ]
+
     @property
     def remaining_quantity(self):
         """残りの未入庫数量を計算して返す"""
@@ -163,6 +232,7 @@ class SalesOrder(models.Model):
     quantity = models.PositiveIntegerField(verbose_name="出庫予定数量")  # 出庫予定数量
     shipped_quantity = models.PositiveIntegerField(default=0, verbose_name="出庫済数量")  # 実際に出庫した数量を保持
     order_date = models.DateTimeField(auto_now_add=True, verbose_name="受注日")  # 受注日
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="更新日時")  # 差分同期用
     expected_shipment = models.DateTimeField(blank=True, null=True, verbose_name="出庫予定日時")  # 出庫予定日
     warehouse = models.CharField(
         max_length=255, null=True, blank=True, verbose_name="出庫倉庫"
@@ -177,6 +247,23 @@ class SalesOrder(models.Model):
         default="pending",
         verbose_name="ステータス",
     )
+    # 生産計画の材料引当で作成された社内出庫 (INT-) の場合、作成元の材料引当と生産計画
+    source_allocation = models.OneToOneField(
+        "production.MaterialAllocation",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="internal_sales_order",
+        verbose_name="作成元の材料引当",
+    )
+    source_plan = models.ForeignKey(
+        "production.ProductionPlan",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="internal_sales_orders",
+        verbose_name="作成元の生産計画",
+    )
 
     def __str__(self):
         item_display = self.item if self.item else "N/A"
@@ -185,3 +272,244 @@ class SalesOrder(models.Model):
     @property
     def remaining_quantity(self):
         return self.quantity - self.shipped_quantity
+
+
+# 需要予測 (品番・移動タイプごとの週次予測)
+class DemandForecast(models.Model):
+    METHOD_CHOICES = [
+        ("moving_average", "移動平均"),
+        ("exponential_smoothing", "指数平滑"),
+        ("croston", "Croston法"),
+    ]
+    MOVEMENT_TYPE_CHOICES = [
+        ("used", "生産使用"),
+        ("outgoing", "出庫"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False, verbose_name="ID")
+    part_number = models.CharField(max_length=255, verbose_name="品番")
+    part_key = models.ForeignKey(
+        "master.PartNumber", on_delete=models.PROTECT, related_name="+", verbose_name="品番キー"
+    )
+    movement_type = models.CharField(max_length=20, choices=MOVEMENT_TYPE_CHOICES, verbose_name="移動タイプ")
+    method = models.CharField(max_length=30, choices=METHOD_CHOICES, verbose_name="採用手法")
+    weekly_forecast = models.FloatField(verbose_name="週次予測数量")  # 採用手法による1週あたりの予測
+    moving_average = models.FloatField(verbose_name="移動平均")
+    exponential_smoothing = models.FloatField(verbose_name="指数平滑")
+    croston = models.FloatField(verbose_name="Croston法")
+    history_weeks = models.PositiveIntegerField(verbose_name="履歴週数")
+    nonzero_weeks = models.PositiveIntegerField(verbose_name="需要発生週数")
+    forecast_start = models.DateField(verbose_name="予測開始週")  # 予測対象の最初の週 (月曜日)
+    horizon_weeks = models.PositiveIntegerField(verbose_name="予測週数")
+    generated_at = models.DateTimeField(verbose_name="予測実行日時")
+
+    class Meta:
+        verbose_name = "需要予測"
+        verbose_name_plural = "需要予測"
+        ordering = ["part_number", "movement_type"]
+        constraints = [
+            models.UniqueConstraint(fields=["part_key", "movement_type"], name="unique_demand_forecast"),
+        ]
+
+    def __str__(self):
+        return f"{self.part_number} ({self.movement_type}) - {self.weekly_forecast:.1f}/week"
+
+
+# ピッキング作業 (出庫予定から生成され、ハンディ端末が取得して作業する)
+class PickingTask(PartKeyMixin, models.Model):
+    STATUS_CHOICES = [
+        ("open", "未着手"),
+        ("claimed", "作業中"),
+        ("completed", "完了"),
+        ("canceled", "キャンセル"),
+    ]
+    ACTIVE_STATUSES = ["open", "claimed"]
+
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False, verbose_name="ID")
+    sales_order = models.ForeignKey(
+        SalesOrder, on_delete=models.CASCADE, related_name="picking_tasks", verbose_name="出庫予定"
+    )
+    part_number = models.CharField(max_length=255, verbose_name="品番")
+    part_key = models.ForeignKey(
+        "master.PartNumber",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        verbose_name="品番キー",
+    )
+    warehouse = models.CharField(max_length=255, null=True, blank=True, verbose_name="出庫倉庫")  # 作業ゾーン
+    location = models.CharField(max_length=255, null=True, blank=True, verbose_name="推奨棚番")
+    quantity = models.PositiveIntegerField(verbose_name="ピッキング数量")
+    picked_quantity = models.PositiveIntegerField(default=0, verbose_name="ピッキング済数量")
+    expected_shipment = models.DateTimeField(null=True, blank=True, verbose_name="出庫予定日時")  # 取得順の基準
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="open", verbose_name="ステータス")
+    claimed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name="作業者",
+    )
+    claimed_at = models.DateTimeField(null=True, blank=True, verbose_name="取得日時")
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name="最終応答日時")
+    lease_expires_at = models.DateTimeField(null=True, blank=True, verbose_name="リース期限")
+    completed_at = models.DateTimeField(null=True, blank=True, verbose_name="完了日時")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    class Meta:
+        verbose_name = "ピッキング作業"
+        verbose_name_plural = "ピッキング作業"
+        indexes = [
+            # 未完了の作業だけを対象とした取得キュー用の部分インデックス
+            models.Index(
+                fields=["warehouse", "expected_shipment", "created_at"],
+                condition=models.Q(status__in=["open", "claimed"]),
+                name="picking_queue_idx",
+            ),
+        ]
+        constraints = [
+            # 1つの出庫予定に対して未完了の作業は1件まで
+            models.UniqueConstraint(
+                fields=["sales_order"],
+                condition=models.Q(status__in=["open", "claimed"]),
+                name="unique_active_picking_task",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Picking {self.part_number} x {self.quantity} ({self.status})"
+
+
+# 在庫エイジング (入出庫履歴を先入先出で再生して求めた品番・倉庫ごとの滞留状況)
+class InventoryAging(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False, verbose_name="ID")
+    part_number = models.CharField(max_length=255, verbose_name="品番")
+    part_key = models.ForeignKey(
+        "master.PartNumber", on_delete=models.PROTECT, related_name="+", verbose_name="品番キー"
+    )
+    warehouse = models.CharField(max_length=255, blank=True, default="", verbose_name="倉庫")
+    on_hand = models.IntegerField(default=0, verbose_name="層の残数量")
+    quantity_0_30 = models.IntegerField(default=0, verbose_name="0〜30日")
+    quantity_31_90 = models.IntegerField(default=0, verbose_name="31〜90日")
+    quantity_over_90 = models.IntegerField(default=0, verbose_name="91日以上")
+    average_age_days = models.FloatField(default=0, verbose_name="平均滞留日数")  # 数量加重平均
+    oldest_receipt_date = models.DateField(null=True, blank=True, verbose_name="最古の受入日")
+    # FIFO層: [[受入日 (序数), 残数量], ...] を古い順に保持 (差分計算の再開に使用)
+    layers = models.JSONField(default=list, verbose_name="FIFO層")
+    unmatched_quantity = models.IntegerField(default=0, verbose_name="未照合払出数量")  # 層を超えた払出の累計
+    as_of = models.DateField(verbose_name="基準日")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    class Meta:
+        verbose_name = "在庫エイジング"
+        verbose_name_plural = "在庫エイジング"
+        ordering = ["part_number", "warehouse"]
+        constraints = [
+            models.UniqueConstraint(fields=["part_key", "warehouse"], name="unique_inventory_aging"),
+        ]
+
+    def __str__(self):
+        return f"{self.part_number} @ {self.warehouse or '-'}: {self.on_hand} ({self.average_age_days:.0f} days)"
+
+
+# シリアル番号の範囲 (連続するシリアル番号を1行の区間 [start, end] として保持する現在の所在)
+class SerialRange(PartKeyMixin, models.Model):
+    STATUS_CHOICES = [
+        ("in_stock", "在庫"),
+        ("issued", "出庫済み"),
+        ("consumed", "生産使用済み"),
+        ("void", "無効"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False, verbose_name="ID")
+    part_number = models.CharField(max_length=255, verbose_name="品番")
+    part_key = models.ForeignKey(
+        "master.PartNumber",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        verbose_name="品番キー",
+    )
+    prefix = models.CharField(max_length=100, blank=True, default="", verbose_name="接頭辞")  # 例: "SN-"
+    width = models.PositiveSmallIntegerField(default=0, verbose_name="桁数")  # 数値部のゼロ埋め桁数
+    start = models.BigIntegerField(verbose_name="開始番号")
+    end = models.BigIntegerField(verbose_name="終了番号")  # 終了番号を含む
+    warehouse = models.CharField(max_length=255, null=True, blank=True, verbose_name="倉庫")
+    location = models.CharField(max_length=255, null=True, blank=True, verbose_name="棚番")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="in_stock", verbose_name="ステータス")
+    receipt = models.ForeignKey(
+        Receipt,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="serial_ranges",
+        verbose_name="入庫実績",
+    )
+    source_document = models.CharField(
+        max_length=255, null=True, blank=True, verbose_name="発生元"
+    )  # 例: PO: PO-123, ProductionPlan-<id>
+    last_movement = models.ForeignKey(
+        StockMovement,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name="最終入出庫履歴",
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    class Meta:
+        verbose_name = "シリアル番号範囲"
+        verbose_name_plural = "シリアル番号範囲"
+        # 同じ品番・接頭辞の範囲は重ならないため、開始番号の B-tree で区間を二分探索できる
+        indexes = [
+            models.Index(fields=["part_key", "prefix", "start"], name="serial_range_lookup_idx"),
+            models.Index(fields=["warehouse", "location", "part_key", "prefix", "start"], name="serial_range_loc_idx"),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(start__lte=models.F("end")), name="serial_range_start_lte_end"),
+        ]
+
+    def __str__(self):
+        return f"{self.part_number} {self.first_serial}..{self.last_serial} ({self.status})"
+
+    @property
+    def quantity(self):
+        return self.end - self.start + 1
+
+    @property
+    def first_serial(self):
+        return f"{self.prefix}{self.start:0{self.width}d}"
+
+    @property
+    def last_serial(self):
+        return f"{self.prefix}{self.end:0{self.width}d}"
+
+
+# 入出庫履歴ごとのシリアル番号範囲 (どの移動でどのシリアルが動いたかの履歴)
+class StockMovementSerialRange(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    movement = models.ForeignKey(
+        StockMovement, on_delete=models.CASCADE, related_name="serial_ranges", verbose_name="入出庫履歴"
+    )
+    prefix = models.CharField(max_length=100, blank=True, default="", verbose_name="接頭辞")
+    width = models.PositiveSmallIntegerField(default=0, verbose_name="桁数")
+    start = models.BigIntegerField(verbose_name="開始番号")
+    end = models.BigIntegerField(verbose_name="終了番号")
+
+    class Meta:
+        verbose_name = "入出庫シリアル番号範囲"
+        verbose_name_plural = "入出庫シリアル番号範囲"
+        indexes = [
+            models.Index(fields=["prefix", "start"], name="movement_serial_lookup_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.prefix}{self.start:0{self.width}d}..{self.prefix}{self.end:0{self.width}d}"
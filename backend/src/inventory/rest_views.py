@@ -1,5 +1,8 @@
-from datetime import datetime
+import uuid
+from datetime import datetime, timedelta
 
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.db import (  # トランザクションのためにインポート # Qオブジェクトをインポートして複雑なクエリを構築
     models,
     transaction,
@@ -9,6 +12,7 @@ from django.db.models import (
     Q,
 )
 from django.shortcuts import get_object_or_404  # オブジェクト取得のためにインポート
+from django.utils import timezone
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.pagination import (
@@ -17,20 +21,56 @@ from rest_framework.pagination import (
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from base.idempotency import idempotent
+from base.models import AsyncTask
+
 from .models import (  # SalesOrder, Receiptモデルをインポート
+    DemandForecast,
     Inventory,
+    InventoryAging,
+    PickingTask,
     PurchaseOrder,
     Receipt,
     SalesOrder,
+    SerialRange,
     StockMovement,
 )
 from .serializers import (
+    DemandForecastSerializer,
+    InventoryAgingSerializer,
     InventorySerializer,
+    PickingTaskSerializer,
     PurchaseOrderSerializer,
     ReceiptSerializer,
     SalesOrderSerializer,
+    ScanMovementSerializer,
+    SerialRangeSerializer,
     StockMovementSerializer,
 )
+from .services import (
+    PickingTaskError,
+    ScanBackPressureError,
+    SerialRangeError,
+    claim_picking_tasks,
+    complete_picking_task,
+    count_serials,
+    enqueue_scan,
+    get_inbound_calendar,
+    get_location_map,
+    get_pending_summary,
+    get_scan_status,
+    heartbeat_picking_tasks,
+    locate_serial,
+    move_serials,
+    parse_serial_ranges,
+    record_slot_changes,
+    register_serials,
+    release_picking_tasks,
+    serials_in_location,
+    suggest_putaway,
+    sync_picking_tasks,
+)
+from .tasks import run_demand_forecast_task, run_inventory_aging_task
 
 
 # DRFのページネーションクラスを定義 (共通で利用可能)
@@ -115,7 +155,29 @@ class InventoryViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(inventory_items, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=["get"], url_path="location-map")
+    def location_map(self, request):
+        """
+        倉庫内の全棚番の品番数・在庫数量・最終更新日時をまとめて返します (倉庫マップ描画用)。
+        group_by (aisle / rack / level) を指定すると棚番の上位階層で集約します。
+        """
+        warehouse = request.query_params.get("warehouse")
+        if not warehouse:
+            return Response(
+                {"success": False, "error": "倉庫(warehouse)は必須のクエリパラメータです。"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        group_by = request.query_params.get("group_by") or None
+        try:
+            rows = get_location_map(warehouse, group_by=group_by)
+        except ValueError:
+            return Response(
+                {"success": False, "error": "group_by が不正です。"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({"warehouse": warehouse, "group_by": group_by, "results": rows})
+
     @action(detail=True, methods=["post"], url_path="move")
+    @idempotent
     def move(self, request, pk=None):
         source_inventory = self.get_object()
 
@@ -142,6 +204,16 @@ class InventoryViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
+        try:
+            serial_ranges = parse_serial_ranges(request.data.get("serial_ranges"))
+        except SerialRangeError as e:
+            return Response({"success": False, "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if serial_ranges and count_serials(serial_ranges) != quantity_to_move:
+            return Response(
+                {"success": False, "error": "シリアル番号の数が移動数量と一致しません。"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
         try:
             with transaction.atomic():
                 # 移動元から在庫を減らす
@@ -159,8 +231,9 @@ class InventoryViewSet(viewsets.ModelViewSet):
                     target_inventory.quantity += quantity_to_move
                     target_inventory.save()
 
-                # 在庫移動履歴を記録
+                # 在庫移動履歴を記録 (出庫・入庫の対は同じ参照ドキュメントで結び付ける)
                 operator = request.user if request.user.is_authenticated else None
+                transfer_reference = f"{StockMovement.TRANSFER_REFERENCE_PREFIX}{uuid.uuid4().hex}"
 
                 # 移動元の履歴 (出庫)
                 StockMovement.objects.create(
@@ -170,22 +243,38 @@ class InventoryViewSet(viewsets.ModelViewSet):
                     warehouse=source_inventory.warehouse,
                     location=source_inventory.location,
                     description=f"棚番移動: {target_warehouse} の {target_location} へ",
+                    reference_document=transfer_reference,
                     operator=operator,
                 )
 
                 # 移動先の履歴 (入庫)
-                StockMovement.objects.create(
+                incoming_movement = StockMovement.objects.create(
                     part_number=source_inventory.part_number,
                     movement_type="incoming",
                     quantity=quantity_to_move,
                     warehouse=target_warehouse,
                     location=target_location,
                     description=f"棚番移動: {source_inventory.warehouse} の {source_inventory.location} から",
+                    reference_document=transfer_reference,
                     operator=operator,
                 )
 
+                if serial_ranges:
+                    move_serials(
+                        source_inventory.part_number,
+                        serial_ranges,
+                        warehouse=target_warehouse,
+                        location=target_location,
+                        movement=incoming_movement,
+                        from_warehouse=source_inventory.warehouse,
+                        from_location=source_inventory.location,
+                    )
+
             return Response({"success": True, "message": "在庫を正常に移動しました。"})
 
+        except SerialRangeError as e:
+            return Response({"success": False, "error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
         except Exception as e:
             return Response(
                 {"success": False, "error": f"在庫移動中にエラーが発生しました: {str(e)}"},
@@ -193,6 +282,7 @@ class InventoryViewSet(viewsets.ModelViewSet):
             )
 
     @action(detail=True, methods=["post"], url_path="adjust")
+    @idempotent
     def adjust(self, request, pk=None):
         """
         在庫数量や棚番を直接調整します。
@@ -221,7 +311,9 @@ class InventoryViewSet(viewsets.ModelViewSet):
         try:
             with transaction.atomic():
                 inventory.quantity = new_quantity
-                if new_location is not None:
+                if new_location is not None and new_location != inventory.location:
+                    # 移動元の棚番は保存時のシグナルでは分からないため、ここで記録する
+                    record_slot_changes([(inventory.warehouse, inventory.location)])
                     inventory.location = new_location
                 inventory.save()
 
@@ -234,6 +326,7 @@ class InventoryViewSet(viewsets.ModelViewSet):
                         warehouse=inventory.warehouse,
                         location=inventory.location,
                         description=f"在庫調整: {old_quantity} -> {new_quantity}",
+                        reference_document=f"{StockMovement.ADJUSTMENT_REFERENCE_PREFIX}{inventory.pk}",
                         operator=request.user if request.user.is_authenticated else None,
                     )
 
@@ -307,6 +400,7 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
         )
 
     @action(detail=False, methods=["post"], url_path="process-receipt")
+    @idempotent
     def process_receipt(self, request):
         """
         指定された発注IDに基づいて入庫処理を行う。
@@ -331,6 +425,16 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
         except (ValueError, TypeError):
             return Response({"error": "入庫数量は正の整数である必要があります。"}, status=status.HTTP_400_BAD_REQUEST)
 
+        # シリアル管理品はシリアル番号の範囲を入庫数量ぶん指定する (任意)
+        try:
+            serial_ranges = parse_serial_ranges(request.data.get("serial_ranges"))
+        except SerialRangeError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if serial_ranges and count_serials(serial_ranges) != received_quantity:
+            return Response(
+                {"error": "シリアル番号の数が入庫数量と一致しません。"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
         try:
             with transaction.atomic():
                 po = get_object_or_404(PurchaseOrder.objects.select_for_update(), pk=purchase_order_id)
@@ -357,7 +461,7 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                     return Response({"error": "入庫倉庫が指定されていません。"}, status=status.HTTP_400_BAD_REQUEST)
 
                 # 1. Create Receipt
-                Receipt.objects.create(
+                receipt = Receipt.objects.create(
                     purchase_order=po,
                     received_quantity=received_quantity,
                     received_date=datetime.now(),
@@ -378,7 +482,7 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                     inventory.save()
 
                 # 3. Create Stock Movement
-                StockMovement.objects.create(
+                movement = StockMovement.objects.create(
                     part_number=po.part_number,
                     movement_type="incoming",
                     quantity=received_quantity,
@@ -388,6 +492,16 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
                     description=f"発注番号 {po.order_number} の入庫",
                     operator=operator,
                 )
+                if serial_ranges:
+                    register_serials(
+                        po.part_number,
+                        serial_ranges,
+                        warehouse,
+                        location,
+                        movement=movement,
+                        receipt=receipt,
+                        source_document=f"PO: {po.order_number}",
+                    )
 
                 # 4. Update Purchase Order status
                 po.received_quantity += received_quantity
@@ -411,12 +525,85 @@ class PurchaseOrderViewSet(viewsets.ModelViewSet):
 
         except PurchaseOrder.DoesNotExist:
             return Response({"error": "指定された発注が見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+        except SerialRangeError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response(
                 {"error": f"処理中に予期せぬエラーが発生しました: {str(e)}"},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
+    @action(detail=False, methods=["post"], url_path="putaway-suggestions")
+    def putaway_suggestions(self, request):
+        """
+        入庫予定の明細ごとに入庫先の棚番候補を返します。
+        明細は purchase_order_id (残数量・倉庫・品番を発注から補完) または part_number と quantity で指定します。
+        """
+        lines = request.data.get("lines")
+        if not isinstance(lines, list) or not lines:
+            return Response({"error": "lines を指定してください。"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = max(1, min(int(request.data.get("limit", 3)), 10))
+        except (TypeError, ValueError):
+            return Response({"error": "limit は整数で指定してください。"}, status=status.HTTP_400_BAD_REQUEST)
+
+        po_ids = {
+            str(line["purchase_order_id"]) for line in lines if isinstance(line, dict) and line.get("purchase_order_id")
+        }
+        try:
+            orders = {str(pk): po for pk, po in PurchaseOrder.objects.in_bulk(po_ids).items()}
+        except (ValueError, ValidationError):
+            return Response({"error": "purchase_order_id が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+
+        normalized = []
+        for i, line in enumerate(lines):
+            if not isinstance(line, dict):
+                return Response({"error": f"{i + 1}行目の形式が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+            po = orders.get(str(line["purchase_order_id"])) if line.get("purchase_order_id") else None
+            part_number = line.get("part_number") or (po.part_number if po else None)
+            quantity = line.get("quantity") or (po.remaining_quantity if po else None)
+            try:
+                quantity = int(quantity)
+            except (TypeError, ValueError):
+                quantity = 0
+            if not part_number or quantity <= 0:
+                return Response(
+                    {"error": f"{i + 1}行目の品番または数量が不正です。"}, status=status.HTTP_400_BAD_REQUEST
+                )
+            normalized.append(
+                {
+                    "purchase_order_id": str(po.id) if po else None,
+                    "part_number": part_number,
+                    "quantity": quantity,
+                    "warehouse": line.get("warehouse") or (po.warehouse if po else None),
+                }
+            )
+
+        return Response({"results": suggest_putaway(normalized, limit=limit)})
+
+    @action(detail=False, methods=["get"], url_path="inbound-calendar")
+    def inbound_calendar(self, request):
+        """
+        未入庫の発注を入荷予定日ごと (および倉庫・仕入先ごと) に集計した入荷予定カレンダーを返します。
+        """
+        group_by = request.query_params.get("group_by") or None
+        try:
+            date_from = request.query_params.get("date_from")
+            date_from = datetime.strptime(date_from, "%Y-%m-%d").date() if date_from else timezone.localdate()
+            date_to = request.query_params.get("date_to")
+            date_to = datetime.strptime(date_to, "%Y-%m-%d").date() if date_to else date_from + timedelta(weeks=4)
+        except ValueError:
+            return Response({"error": "日付は YYYY-MM-DD 形式で指定してください。"}, status=status.HTTP_400_BAD_REQUEST)
+        if date_to < date_from or (date_to - date_from).days > 366:
+            return Response({"error": "期間の指定が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            rows = get_inbound_calendar(date_from, date_to, dimension=group_by)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"group_by": group_by, "date_from": date_from, "date_to": date_to, "results": rows})
+
     @action(detail=False, methods=["get"], url_path="distinct-values")
     def distinct_values(self, request):
         """
@@ -529,3 +716,280 @@ class StockMovementViewSet(viewsets.ReadOnlyModelViewSet):
             filters &= Q(movement_date__date__lte=date_to)
 
         return StockMovement.objects.filter(filters).order_by("-movement_date", "part_number")
+
+
+class ScanIngestViewSet(viewsets.ViewSet):
+    """
+    ハンディスキャナーの入出庫を非同期で取り込むAPI。
+    スキャンは検証後にRedis Streamへ追記され、即座に 202 を返します。
+    在庫への反映はCeleryワーカーがマイクロバッチで行います。
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def create(self, request):
+        serializer = ScanMovementSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            scan_id = enqueue_scan(serializer.validated_data, request.user)
+        except ScanBackPressureError:
+            return Response(
+                {
+                    "success": False,
+                    "error": "スキャンの取込待ちが上限に達しています。しばらくしてから再送してください。",
+                },
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": "5"},
+            )
+        return Response({"success": True, "scan_id": scan_id, "status": "pending"}, status=status.HTTP_202_ACCEPTED)
+
+    def retrieve(self, request, pk=None):
+        scan_status = get_scan_status(pk)
+        if scan_status is None:
+            return Response({"error": "指定されたスキャンが見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"scan_id": pk, **scan_status})
+
+    @action(detail=False, methods=["get"], url_path="pending")
+    def pending(self, request):
+        """取込待ちスキャンの件数をシャードごとに返します。"""
+        return Response(get_pending_summary())
+
+
+class DemandForecastViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    品番ごとの需要予測 (生産使用・出庫) を参照するAPI。
+    予測は run アクションで起動するバッチ処理によって更新されます。
+    """
+
+    serializer_class = DemandForecastSerializer
+    pagination_class = StandardResultsSetPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        filters = Q()
+        part_number = self.request.query_params.get("part_number")
+        if part_number:
+            filters &= Q(part_number__icontains=part_number)
+        movement_type = self.request.query_params.get("movement_type")
+        if movement_type:
+            filters &= Q(movement_type=movement_type)
+        method = self.request.query_params.get("method")
+        if method:
+            filters &= Q(method=method)
+        return DemandForecast.objects.filter(filters).order_by("part_number", "movement_type")
+
+    @action(detail=False, methods=["post"], url_path="run")
+    def run(self, request):
+        """需要予測バッチを非同期で起動します。進捗は /api/base/tasks/{task_id}/ で確認できます。"""
+        try:
+            history_weeks = int(request.data.get("history_weeks", 52))
+            horizon_weeks = int(request.data.get("horizon_weeks", 12))
+        except (TypeError, ValueError):
+            return Response({"error": "週数は整数で指定してください。"}, status=status.HTTP_400_BAD_REQUEST)
+        if history_weeks < 4 or horizon_weeks < 1:
+            return Response(
+                {"error": "履歴は4週以上、予測期間は1週以上を指定してください。"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # ワーカーが先に起動しても参照できるよう、AsyncTask を作成してからタスクを投入する
+        task_id = str(uuid.uuid4())
+        AsyncTask.objects.create(task_id=task_id, task_name="Demand Forecast", status="PENDING")
+        run_demand_forecast_task.apply_async(
+            kwargs={"history_weeks": history_weeks, "horizon_weeks": horizon_weeks}, task_id=task_id
+        )
+        return Response({"status": "processing", "task_id": task_id}, status=status.HTTP_202_ACCEPTED)
+
+
+class PickingTaskViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    出庫ピッキングの作業キューAPI。
+    端末は claim で自分のゾーンの作業を取得し、作業中は heartbeat でリースを延長、complete で出庫を計上します。
+    """
+
+    serializer_class = PickingTaskSerializer
+    pagination_class = StandardResultsSetPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        filters = Q()
+        warehouse = self.request.query_params.get("warehouse")
+        if warehouse:
+            filters &= Q(warehouse=warehouse)
+        task_status = self.request.query_params.get("status")
+        if task_status:
+            filters &= Q(status=task_status)
+        if self.request.query_params.get("mine"):
+            filters &= Q(claimed_by=self.request.user, status="claimed")
+        return (
+            PickingTask.objects.filter(filters)
+            .select_related("sales_order", "claimed_by")
+            .order_by(F("expected_shipment").asc(nulls_last=True), "created_at")
+        )
+
+    def _task_ids(self, request):
+        task_ids = request.data.get("task_ids")
+        if not isinstance(task_ids, list) or not task_ids:
+            return None
+        try:
+            return [uuid.UUID(str(task_id)) for task_id in task_ids]
+        except ValueError:
+            return None
+
+    @action(detail=False, methods=["post"], url_path="claim")
+    def claim(self, request):
+        """指定ゾーン (warehouse, location_prefix) の次の作業を最大 limit 件取得します。"""
+        warehouse = request.data.get("warehouse")
+        if not warehouse:
+            return Response({"success": False, "error": "倉庫は必須です。"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.data.get("limit", 1))
+        except (TypeError, ValueError):
+            return Response(
+                {"success": False, "error": "limit は整数で指定してください。"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, settings.PICKING_CLAIM_MAX))
+
+        tasks = claim_picking_tasks(
+            request.user, warehouse, limit=limit, location_prefix=request.data.get("location_prefix") or None
+        )
+        return Response({"success": True, "tasks": PickingTaskSerializer(tasks, many=True).data})
+
+    @action(detail=False, methods=["post"], url_path="heartbeat")
+    def heartbeat(self, request):
+        """作業中の作業のリースを延長します。lost には他の作業者に再割当された作業IDが返ります。"""
+        task_ids = self._task_ids(request)
+        if task_ids is None:
+            return Response(
+                {"success": False, "error": "task_ids を指定してください。"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        held_ids = set(heartbeat_picking_tasks(request.user, task_ids))
+        return Response(
+            {
+                "success": True,
+                "held": [str(task_id) for task_id in task_ids if task_id in held_ids],
+                "lost": [str(task_id) for task_id in task_ids if task_id not in held_ids],
+            }
+        )
+
+    @action(detail=False, methods=["post"], url_path="release")
+    def release(self, request):
+        """作業中の作業を未着手に戻します。"""
+        task_ids = self._task_ids(request)
+        if task_ids is None:
+            return Response(
+                {"success": False, "error": "task_ids を指定してください。"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        released = release_picking_tasks(request.user, task_ids)
+        return Response({"success": True, "released": released})
+
+    @action(detail=True, methods=["post"], url_path="complete")
+    def complete(self, request, pk=None):
+        """作業を完了して出庫を計上します。quantity・location を省略すると作業数量・推奨棚番で計上します。"""
+        quantity = request.data.get("quantity")
+        try:
+            quantity = int(quantity) if quantity not in (None, "") else None
+        except (TypeError, ValueError):
+            return Response(
+                {"success": False, "error": "数量は整数で指定してください。"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            serial_ranges = parse_serial_ranges(request.data.get("serial_ranges"))
+            task = complete_picking_task(
+                request.user,
+                pk,
+                quantity=quantity,
+                location=request.data.get("location"),
+                serial_ranges=serial_ranges,
+            )
+        except (PickingTaskError, SerialRangeError) as e:
+            return Response({"success": False, "error": str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response({"success": True, "task": PickingTaskSerializer(task).data})
+
+    @action(detail=False, methods=["post"], url_path="sync")
+    def sync(self, request):
+        """ピッキング作業のない未出庫の出庫予定に作業を作成します。"""
+        return Response({"success": True, "created": sync_picking_tasks()})
+
+
+class InventoryAgingViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    品番・倉庫ごとの在庫エイジング (滞留日数の区分別数量) を参照するAPI。
+    集計は run アクションで起動するバッチ処理によって差分更新されます。
+    """
+
+    serializer_class = InventoryAgingSerializer
+    pagination_class = StandardResultsSetPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        filters = Q()
+        part_number = self.request.query_params.get("part_number")
+        if part_number:
+            filters &= Q(part_number__icontains=part_number)
+        warehouse = self.request.query_params.get("warehouse")
+        if warehouse:
+            filters &= Q(warehouse=warehouse)
+        if self.request.query_params.get("over_90_only", "false").lower() == "true":
+            filters &= Q(quantity_over_90__gt=0)
+        if self.request.query_params.get("hide_empty", "true").lower() == "true":
+            filters &= Q(on_hand__gt=0)
+
+        ordering = self.request.query_params.get("ordering")
+        if ordering not in ("average_age_days", "-average_age_days", "quantity_over_90", "-quantity_over_90"):
+            ordering = "part_number"
+        return InventoryAging.objects.filter(filters).order_by(ordering, "warehouse")
+
+    @action(detail=False, methods=["post"], url_path="run")
+    def run(self, request):
+        """エイジング計算を非同期で起動します。full=true で全履歴から再計算します。"""
+        full = str(request.data.get("full", "false")).lower() == "true"
+        task_id = str(uuid.uuid4())
+        AsyncTask.objects.create(task_id=task_id, task_name="Inventory Aging", status="PENDING")
+        run_inventory_aging_task.apply_async(kwargs={"full": full}, task_id=task_id)
+        return Response({"status": "processing", "task_id": task_id}, status=status.HTTP_202_ACCEPTED)
+
+
+class SerialRangeViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    シリアル番号の所在を参照するAPI。
+    シリアル番号は連続する範囲単位で保持され、入庫・棚移動・ピッキング・生産完了の処理で登録・移動されます。
+    """
+
+    serializer_class = SerialRangeSerializer
+    pagination_class = StandardResultsSetPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        warehouse = self.request.query_params.get("warehouse")
+        location = self.request.query_params.get("location")
+        part_number = self.request.query_params.get("part_number")
+        if warehouse and location is not None:
+            return serials_in_location(warehouse, location, part_number=part_number)
+
+        filters = Q()
+        if warehouse:
+            filters &= Q(warehouse=warehouse)
+        if part_number:
+            filters &= Q(part_key__code=part_number)
+        serial_status = self.request.query_params.get("status")
+        if serial_status:
+            filters &= Q(status=serial_status)
+        return SerialRange.objects.filter(filters).order_by("part_number", "prefix", "start")
+
+    @action(detail=False, methods=["get"], url_path="locate")
+    def locate(self, request):
+        """品番とシリアル番号から、そのシリアル番号を含む範囲 (現在の所在) を返します。"""
+        part_number = request.query_params.get("part_number")
+        serial = request.query_params.get("serial")
+        if not part_number or not serial:
+            return Response(
+                {"error": "品番(part_number)とシリアル番号(serial)は必須のクエリパラメータです。"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            serial_range = locate_serial(part_number, serial)
+        except SerialRangeError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if serial_range is None:
+            return Response({"error": "シリアル番号が見つかりません。"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(SerialRangeSerializer(serial_range).data)
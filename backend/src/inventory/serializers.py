@@ -1,13 +1,19 @@
+from datetime import date, timedelta
+
 from rest_framework import serializers
 
 # master.modelsのインポートは、将来的に関連モデルとして扱うための準備か、
 # あるいはビューなどで型ヒント等に利用されている可能性があります。
 # 現状このシリアライザー内では直接参照されていません。
 from .models import (  # StockMovement, SalesOrder, Receiptモデルをインポート
+    DemandForecast,
     Inventory,
+    InventoryAging,
+    PickingTask,
     PurchaseOrder,
     Receipt,
     SalesOrder,
+    SerialRange,
     StockMovement,
 )
 
@@ -219,10 +225,159 @@ class SalesOrderSerializer(serializers.ModelSerializer):
             "warehouse",
             "status",
             "status_display",  # 表示用のステータス名
+            "source_allocation",  # 社内出庫の作成元の材料引当
+            "source_plan",  # 社内出庫の作成元の生産計画
+        ]
+        read_only_fields = [
+            "id",
+            "order_date",
+            "shipped_quantity",
+            "remaining_quantity",
+            "status",
+            "status_display",
+            "source_allocation",
+            "source_plan",
         ]
-        read_only_fields = ["id", "order_date", "shipped_quantity", "remaining_quantity", "status", "status_display"]
 
     def validate_allocations(self, value):
         if not value:
             raise serializers.ValidationError("Allocations list cannot be empty.")
         return value
+
+
+class ScanMovementSerializer(serializers.Serializer):
+    """
+    ハンディスキャナーからの入出庫スキャン1件を検証するシリアライザ。
+    検証のみを行い、データベースにはアクセスしません。
+    """
+
+    part_number = serializers.CharField(max_length=255)
+    warehouse = serializers.CharField(max_length=255)
+    location = serializers.CharField(max_length=255, required=False, allow_blank=True, allow_null=True, default=None)
+    movement_type = serializers.ChoiceField(choices=[("incoming", "入庫"), ("outgoing", "出庫")])
+    quantity = serializers.IntegerField(min_value=1)
+    reference_document = serializers.CharField(max_length=255, required=False, allow_blank=True, default="")
+    scanned_at = serializers.DateTimeField(required=False)
+
+
+class DemandForecastSerializer(serializers.ModelSerializer):
+    """
+    需要予測モデルのためのシリアライザ。
+    forecast には予測期間の週ごとの予測数量を展開して返します。
+    """
+
+    method_display = serializers.CharField(source="get_method_display", read_only=True)
+    forecast = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DemandForecast
+        fields = [
+            "id",
+            "part_number",
+            "movement_type",
+            "method",
+            "method_display",
+            "weekly_forecast",
+            "moving_average",
+            "exponential_smoothing",
+            "croston",
+            "history_weeks",
+            "nonzero_weeks",
+            "forecast_start",
+            "horizon_weeks",
+            "forecast",
+            "generated_at",
+        ]
+        read_only_fields = fields
+
+    def get_forecast(self, obj):
+        return [
+            {"week_start": obj.forecast_start + timedelta(weeks=week), "quantity": round(obj.weekly_forecast, 2)}
+            for week in range(obj.horizon_weeks)
+        ]
+
+
+class PickingTaskSerializer(serializers.ModelSerializer):
+    """ピッキング作業のためのシリアライザ。作業の状態はアクション経由でのみ変更されます。"""
+
+    order_number = serializers.CharField(source="sales_order.order_number", read_only=True)
+    claimed_by_name = serializers.CharField(source="claimed_by.username", read_only=True, default=None)
+
+    class Meta:
+        model = PickingTask
+        fields = [
+            "id",
+            "sales_order",
+            "order_number",
+            "part_number",
+            "warehouse",
+            "location",
+            "quantity",
+            "picked_quantity",
+            "expected_shipment",
+            "status",
+            "claimed_by",
+            "claimed_by_name",
+            "claimed_at",
+            "heartbeat_at",
+            "lease_expires_at",
+            "completed_at",
+        ]
+        read_only_fields = fields
+
+
+class InventoryAgingSerializer(serializers.ModelSerializer):
+    """
+    在庫エイジングのためのシリアライザ。
+    layers は受入日ごとの残数量 (古い順) を日付に変換して返します。
+    """
+
+    layers = serializers.SerializerMethodField()
+
+    class Meta:
+        model = InventoryAging
+        fields = [
+            "id",
+            "part_number",
+            "warehouse",
+            "on_hand",
+            "quantity_0_30",
+            "quantity_31_90",
+            "quantity_over_90",
+            "average_age_days",
+            "oldest_receipt_date",
+            "unmatched_quantity",
+            "layers",
+            "as_of",
+            "updated_at",
+        ]
+        read_only_fields = fields
+
+    def get_layers(self, obj):
+        return [{"received_date": date.fromordinal(day), "quantity": quantity} for day, quantity in obj.layers]
+
+
+class SerialRangeSerializer(serializers.ModelSerializer):
+    """シリアル番号範囲のためのシリアライザ。"""
+
+    class Meta:
+        model = SerialRange
+        fields = [
+            "id",
+            "part_number",
+            "prefix",
+            "width",
+            "start",
+            "end",
+            "first_serial",
+            "last_serial",
+            "quantity",
+            "warehouse",
+            "location",
+            "status",
+            "receipt",
+            "source_document",
+            "last_movement",
+            "updated_at",
+        ]
+        read_only_fields = fields
@@ -0,0 +1,48 @@
+from .location_map import get_location_map, invalidate_location_map
+from .picking import (
+    PickingTaskError,
+    claim_picking_tasks,
+    complete_picking_task,
+    heartbeat_picking_tasks,
+    release_picking_tasks,
+    sync_picking_tasks,
+)
+from .putaway import record_slot_changes, suggest_putaway
+from .scan_ingest import ScanBackPressureError, enqueue_scan, get_pending_summary, get_scan_status
+from .serials import (
+    SerialRangeError,
+    count_serials,
+    locate_serial,
+    move_serials,
+    parse_serial_ranges,
+    register_serials,
+    serials_in_location,
+    void_serials,
+)
+from .supply_calendar import get_inbound_calendar
+
+__all__ = [
+    "PickingTaskError",
+    "ScanBackPressureError",
+    "SerialRangeError",
+    "claim_picking_tasks",
+    "complete_picking_task",
+    "count_serials",
+    "enqueue_scan",
+    "get_inbound_calendar",
+    "get_location_map",
+    "get_pending_summary",
+    "get_scan_status",
+    "heartbeat_picking_tasks",
+    "invalidate_location_map",
+    "locate_serial",
+    "move_serials",
+    "parse_serial_ranges",
+    "record_slot_changes",
+    "register_serials",
+    "release_picking_tasks",
+    "serials_in_location",
+    "suggest_putaway",
+    "sync_picking_tasks",
+    "void_serials",
+]
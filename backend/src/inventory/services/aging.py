@@ -0,0 +1,274 @@
+import logging
+import uuid
+from array import array
+from bisect import bisect_right
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q, Value
+from django.db.models.functions import Coalesce, Concat
+from django.utils import timezone
+
+from base.models import BaseSetting
+
+from ..models import InventoryAging, StockMovement
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_SETTING = "inventory.aging_watermark"
+
+# 受入 (層を積む) / 払出 (古い層から減らす) / 取消 (直近の層から減らす) の移動タイプ
+RECEIVING_TYPES = {"incoming", "PRODUCTION_OUTPUT"}
+ISSUING_TYPES = {"outgoing", "used"}
+REVERSING_TYPES = {"PRODUCTION_REVERSAL"}
+
+# 滞留日数の区分: (上限日数, フィールド名)。上限 None は以降すべて
+AGING_BUCKETS = [(30, "quantity_0_30"), (90, "quantity_31_90"), (None, "quantity_over_90")]
+BUCKET_FIELDS = [field for _, field in AGING_BUCKETS]
+SUMMARY_FIELDS = [*BUCKET_FIELDS, "on_hand", "average_age_days", "oldest_receipt_date", "as_of", "updated_at"]
+
+FLUSH_SIZE = 1000
+
+
+class FifoLayers:
+    """
+    1品番・倉庫分の先入先出の在庫層。
+    受入日 (序数) と残数量を並列の整数配列で持ち、払出は先頭位置をずらすだけで行います (要素の削除はしません)。
+    """
+
+    __slots__ = ("days", "quantities", "head", "unmatched")
+
+    def __init__(self, layers=(), unmatched=0):
+        self.days = array("l", (day for day, _ in layers))
+        self.quantities = array("l", (quantity for _, quantity in layers))
+        self.head = 0
+        self.unmatched = unmatched
+
+    def receive(self, day, quantity):
+        if len(self.days) == self.head or self.days[-1] < day:
+            self.days.append(day)
+            self.quantities.append(quantity)
+        elif self.days[-1] == day:
+            # 同じ日の受入は1つの層にまとめる
+            self.quantities[-1] += quantity
+        else:
+            # 前回の実行より前の日付で登録された受入は、日付順の位置に差し込む
+            position = bisect_right(self.days, day, self.head)
+            self.days.insert(position, day)
+            self.quantities.insert(position, quantity)
+
+    def issue(self, quantity):
+        """古い層から払い出します。層が足りない分は未照合として記録します。"""
+        while quantity and self.head < len(self.days):
+            taken = min(quantity, self.quantities[self.head])
+            self.quantities[self.head] -= taken
+            quantity -= taken
+            if self.quantities[self.head] == 0:
+                self.head += 1
+        self.unmatched += quantity
+
+    def reverse(self, quantity):
+        """直近の層から取り消します (生産完了の取消は最後の受入を打ち消すため)。"""
+        while quantity and len(self.days) > self.head:
+            taken = min(quantity, self.quantities[-1])
+            self.quantities[-1] -= taken
+            quantity -= taken
+            if self.quantities[-1] == 0:
+                self.days.pop()
+                self.quantities.pop()
+        self.unmatched += quantity
+
+    def to_list(self):
+        pairs = zip(self.days[self.head :], self.quantities[self.head :], strict=True)
+        return [[day, quantity] for day, quantity in pairs]
+
+
+def summarize_layers(layers, today):
+    """FIFO層から残数量・区分ごとの数量・平均滞留日数・最古の受入日を計算します。"""
+    today_ordinal = today.toordinal()
+    summary = dict.fromkeys(BUCKET_FIELDS, 0)
+    on_hand = 0
+    weighted_age = 0
+    for day, quantity in layers:
+        age = today_ordinal - day
+        for limit, field in AGING_BUCKETS:
+            if limit is None or age <= limit:
+                summary[field] += quantity
+                break
+        on_hand += quantity
+        weighted_age += age * quantity
+    summary["on_hand"] = on_hand
+    summary["average_age_days"] = round(weighted_age / on_hand, 1) if on_hand else 0
+    summary["oldest_receipt_date"] = date.fromordinal(layers[0][0]) if layers else None
+    summary["as_of"] = today
+    return summary
+
+
+def _uuid7_upper_bound(moment):
+    """
+    指定時刻 (のミリ秒) までに作成された UUIDv7 のどれよりも大きい UUID を返します。
+    UUIDv7 は先頭48ビットがミリ秒単位の作成時刻のため、次のミリ秒の最小値を境界にします。
+    """
+    return uuid.UUID(int=(int(moment.timestamp() * 1000) + 1) << 80)
+
+
+def _ignored_movements():
+    """
+    在庫年齢に影響しない入出庫履歴の条件を返します。
+    在庫調整 (数量の訂正) と、同じ倉庫内の棚番移動 (出庫・入庫の対) は、受入日を今日に付け替えないよう除外します。
+    """
+    counterpart = StockMovement.objects.filter(
+        reference_document=OuterRef("reference_document"),
+        part_key=OuterRef("part_key"),
+        warehouse=OuterRef("warehouse"),
+    ).exclude(id=OuterRef("id"))
+    same_warehouse_transfer = Q(reference_document__startswith=StockMovement.TRANSFER_REFERENCE_PREFIX) & Exists(
+        counterpart
+    )
+    # 参照ドキュメントで対を結び付ける前の履歴は、備考に記録された移動先・移動元の倉庫で判別する
+    legacy_same_warehouse_transfer = Q(
+        reference_document__isnull=True,
+        description__startswith=Concat(Value(StockMovement.TRANSFER_DESCRIPTION_PREFIX), "warehouse", Value(" の ")),
+    )
+    adjustment = Q(reference_document__startswith=StockMovement.ADJUSTMENT_REFERENCE_PREFIX) | Q(
+        description__startswith=StockMovement.ADJUSTMENT_DESCRIPTION_PREFIX
+    )
+    return same_warehouse_transfer | legacy_same_warehouse_transfer | adjustment
+
+
+def _get_watermark():
+    setting, _ = BaseSetting.objects.select_for_update().get_or_create(name=WATERMARK_SETTING)
+    return setting
+
+
+def _flush(rows):
+    InventoryAging.objects.bulk_create(
+        rows,
+        batch_size=FLUSH_SIZE,
+        update_conflicts=True,
+        unique_fields=["part_key", "warehouse"],
+        update_fields=["part_number", "layers", "unmatched_quantity", *SUMMARY_FIELDS],
+    )
+    rows.clear()
+
+
+def refresh_aging_buckets(today=None):
+    """層はそのままで、基準日が古い行の区分を今日時点で再計算します (日数の経過を反映するため)。"""
+    today = today or timezone.localdate()
+    now = timezone.now()
+    batch = []
+    refreshed = 0
+    stale = InventoryAging.objects.filter(as_of__lt=today).only("id", "layers")
+    for aging in stale.iterator(chunk_size=FLUSH_SIZE):
+        for field, value in summarize_layers(aging.layers, today).items():
+            setattr(aging, field, value)
+        aging.updated_at = now
+        batch.append(aging)
+        if len(batch) >= FLUSH_SIZE:
+            InventoryAging.objects.bulk_update(batch, SUMMARY_FIELDS)
+            refreshed += len(batch)
+            batch = []
+    if batch:
+        InventoryAging.objects.bulk_update(batch, SUMMARY_FIELDS)
+        refreshed += len(batch)
+    return refreshed
+
+
+@transaction.atomic
+def run_inventory_aging(full=False):
+    """
+    入出庫履歴を (品番, 倉庫, 移動日時) 順にサーバーサイドカーソルで流し、FIFO層を更新して InventoryAging に保存します。
+    前回処理した最後の入出庫履歴ID (UUIDv7 のため作成順) をウォーターマークとして保持し、以降の履歴だけを反映します。
+    長いトランザクションで作成された履歴は、IDが小さいままウォーターマークより後にコミットされることがあるため、
+    直近 INVENTORY_AGING_SAFETY_LAG_SECONDS 秒以内に作成された履歴は次回に回します。
+    full=True の場合は全履歴から再計算します。
+    ウォーターマークの行をロックするため、同時に実行されたバッチは直列化されます。
+    層とウォーターマークを1トランザクションで保存するため、途中の進捗はコミットまで他から見えません
+    (進捗は報告せず、結果の件数だけを返します)。
+    """
+    today = timezone.localdate()
+    now = timezone.now()
+    watermark = _get_watermark()
+    since = None if full or not watermark.value else watermark.value
+
+    cutoff = _uuid7_upper_bound(now - timedelta(seconds=settings.INVENTORY_AGING_SAFETY_LAG_SECONDS))
+    movements = StockMovement.objects.filter(part_key__isnull=False, id__lt=cutoff)
+    if since:
+        movements = movements.filter(id__gt=since)
+    # 実行中に追加された履歴は次回に回すため、処理範囲の上限を先に確定する
+    last_id = movements.order_by("-id").values_list("id", flat=True).first()
+    if last_id is None:
+        return {"movements": 0, "groups": 0, "refreshed": refresh_aging_buckets(today)}
+    movements = movements.filter(id__lte=last_id)
+
+    if full:
+        InventoryAging.objects.all().delete()
+        existing = {}
+    else:
+        # 差分に含まれる品番・倉庫の既存の層だけを読み込む
+        part_keys = set(movements.values_list("part_key_id", flat=True).distinct().order_by())
+        existing = {
+            (row.part_key_id, row.warehouse): row
+            for row in InventoryAging.objects.filter(part_key_id__in=part_keys).only(
+                "part_key", "warehouse", "layers", "unmatched_quantity"
+            )
+        }
+
+    rows = []
+    processed = groups = 0
+    current_key = None
+    layers = part_number = None
+
+    def finish():
+        row = InventoryAging(
+            part_key_id=current_key[0],
+            warehouse=current_key[1],
+            part_number=part_number,
+            layers=layers.to_list(),
+            unmatched_quantity=layers.unmatched,
+            updated_at=now,
+        )
+        for field, value in summarize_layers(row.layers, today).items():
+            setattr(row, field, value)
+        rows.append(row)
+        if len(rows) >= FLUSH_SIZE:
+            _flush(rows)
+
+    stream = (
+        movements.exclude(_ignored_movements())
+        .annotate(warehouse_key=Coalesce("warehouse", Value("")))
+        .order_by("part_key_id", "warehouse_key", "movement_date", "id")
+        .values_list("part_key_id", "part_number", "warehouse_key", "movement_type", "quantity", "movement_date")
+        .iterator(chunk_size=FLUSH_SIZE)
+    )
+    for part_key, code, warehouse, movement_type, quantity, movement_date in stream:
+        key = (part_key, warehouse)
+        if key != current_key:
+            if current_key is not None:
+                finish()
+                groups += 1
+            current_key = key
+            previous = existing.get(key)
+            layers = FifoLayers(previous.layers, previous.unmatched_quantity) if previous else FifoLayers()
+        part_number = code
+
+        if movement_type in RECEIVING_TYPES:
+            layers.receive(timezone.localdate(movement_date).toordinal(), quantity)
+        elif movement_type in ISSUING_TYPES:
+            layers.issue(quantity)
+        elif movement_type in REVERSING_TYPES:
+            layers.reverse(quantity)
+        processed += 1
+
+    # 差分がすべて集計対象外の履歴だった場合は、更新する層がない
+    if current_key is not None:
+        finish()
+        groups += 1
+    _flush(rows)
+
+    watermark.value = str(last_id)
+    watermark.save(update_fields=["value", "updated_at"])
+    refreshed = refresh_aging_buckets(today)
+    logger.info("Inventory aging: %d movements, %d part/warehouse groups.", processed, groups)
+    return {"movements": processed, "groups": groups, "refreshed": refreshed}
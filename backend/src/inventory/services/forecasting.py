@@ -0,0 +1,181 @@
+import logging
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncWeek
+from django.utils import timezone
+
+from ..models import DemandForecast, StockMovement
+
+logger = logging.getLogger(__name__)
+
+FORECAST_MOVEMENT_TYPES = ["used", "outgoing"]
+
+# 平均需要間隔 (ADI) がこの値を超える品番は間欠需要とみなし、Croston法を採用します (Syntetos-Boylan の閾値)
+INTERMITTENT_ADI_THRESHOLD = 1.32
+
+
+def moving_average(demand, window=8):
+    """直近 window 週の平均を全品番まとめて計算します。demand は (品番数, 週数) の配列です。"""
+    window = min(window, demand.shape[1])
+    return demand[:, -window:].mean(axis=1)
+
+
+def exponential_smoothing(demand, alpha=0.2):
+    """単純指数平滑法。週方向のみループし、品番方向はベクトル演算で計算します。"""
+    level = demand[:, 0].astype(float)
+    for t in range(1, demand.shape[1]):
+        level += alpha * (demand[:, t] - level)
+    return level
+
+
+def croston(demand, alpha=0.1):
+    """
+    Croston法 (間欠需要向け)。需要量と需要間隔をそれぞれ指数平滑し、その比を1週あたりの予測とします。
+    需要が一度も発生していない品番の予測は 0 です。
+    """
+    n_parts = demand.shape[0]
+    size = np.zeros(n_parts)  # 需要発生時の数量の平滑値
+    interval = np.zeros(n_parts)  # 需要間隔の平滑値
+    since_last = np.ones(n_parts)  # 前回の需要発生からの経過週数
+    initialized = np.zeros(n_parts, dtype=bool)
+
+    for t in range(demand.shape[1]):
+        column = demand[:, t]
+        nonzero = column > 0
+        first = nonzero & ~initialized
+        update = nonzero & initialized
+
+        size[first] = column[first]
+        interval[first] = since_last[first]
+        size[update] += alpha * (column[update] - size[update])
+        interval[update] += alpha * (since_last[update] - interval[update])
+
+        initialized |= first
+        since_last = np.where(nonzero, 1, since_last + 1)
+
+    return np.divide(size, interval, out=np.zeros(n_parts), where=interval > 0)
+
+
+def select_method(demand):
+    """
+    品番ごとの採用手法を返します。
+    需要間隔が長い (間欠的な) 品番は Croston法、それ以外は指数平滑法、需要がない品番は移動平均です。
+    """
+    nonzero_weeks = np.count_nonzero(demand, axis=1)
+    adi = np.divide(demand.shape[1], nonzero_weeks, out=np.full(demand.shape[0], np.inf), where=nonzero_weeks > 0)
+    methods = np.where(adi > INTERMITTENT_ADI_THRESHOLD, "croston", "exponential_smoothing")
+    return np.where(nonzero_weeks == 0, "moving_average", methods), nonzero_weeks
+
+
+def load_weekly_consumption(movement_type, start_date, history_weeks):
+    """
+    StockMovement から週次の消費数量を1回の集計クエリで読み込み、(品番数, 週数) の配列にします。
+    棚番移動と在庫調整は実際の消費ではないため含めません。
+    start_date は履歴の最初の週の月曜日です。戻り値は (品番キーの配列, 品番の配列, 需要配列) です。
+    """
+    start = timezone.make_aware(datetime.combine(start_date, time.min))
+    rows = (
+        StockMovement.objects.filter(
+            movement_type=movement_type,
+            movement_date__gte=start,
+            movement_date__lt=start + timedelta(weeks=history_weeks),
+            part_key__isnull=False,
+        )
+        .exclude(StockMovement.internal_movement_q())
+        .annotate(week=TruncWeek("movement_date"))
+        .values_list("part_key_id", "part_key__code", "week")
+        .annotate(total=Sum("quantity"))
+    )
+
+    part_index = {}
+    codes = []
+    row_idx, col_idx, values = [], [], []
+    for part_key, code, week, total in rows:
+        if part_key not in part_index:
+            part_index[part_key] = len(codes)
+            codes.append(code)
+        row_idx.append(part_index[part_key])
+        col_idx.append((timezone.localdate(week) - start_date).days // 7)
+        values.append(total)
+
+    demand = np.zeros((len(codes), history_weeks))
+    if values:
+        np.add.at(demand, (np.array(row_idx), np.clip(np.array(col_idx), 0, history_weeks - 1)), values)
+    return np.fromiter(part_index.keys(), dtype=np.int64, count=len(part_index)), codes, demand
+
+
+def run_demand_forecast(history_weeks=52, horizon_weeks=12, on_progress=None):
+    """
+    全品番の需要予測をまとめて計算し、DemandForecast に保存します。
+    移動タイプごとに1回の集計クエリと1回の一括書き込みで完結します。
+    """
+    now = timezone.now()
+    today = timezone.localdate(now)
+    # 今週 (月曜日始まり) の直前までの完了週を履歴とする
+    forecast_start = today - timedelta(days=today.weekday())
+    history_start = forecast_start - timedelta(weeks=history_weeks)
+
+    summary = {}
+    for step, movement_type in enumerate(FORECAST_MOVEMENT_TYPES, start=1):
+        part_keys, codes, demand = load_weekly_consumption(movement_type, history_start, history_weeks)
+
+        if len(codes):
+            ma = moving_average(demand)
+            ses = exponential_smoothing(demand)
+            crst = croston(demand)
+            methods, nonzero_weeks = select_method(demand)
+            chosen = np.select([methods == "croston", methods == "exponential_smoothing"], [crst, ses], default=ma)
+        else:
+            ma = ses = crst = chosen = nonzero_weeks = methods = []
+
+        forecasts = [
+            DemandForecast(
+                part_number=codes[i],
+                part_key_id=int(part_keys[i]),
+                movement_type=movement_type,
+                method=str(methods[i]),
+                weekly_forecast=float(chosen[i]),
+                moving_average=float(ma[i]),
+                exponential_smoothing=float(ses[i]),
+                croston=float(crst[i]),
+                history_weeks=history_weeks,
+                nonzero_weeks=int(nonzero_weeks[i]),
+                forecast_start=forecast_start,
+                horizon_weeks=horizon_weeks,
+                generated_at=now,
+            )
+            for i in range(len(codes))
+        ]
+
+        with transaction.atomic():
+            DemandForecast.objects.bulk_create(
+                forecasts,
+                batch_size=5000,
+                update_conflicts=True,
+                unique_fields=["part_key", "movement_type"],
+                update_fields=[
+                    "part_number",
+                    "method",
+                    "weekly_forecast",
+                    "moving_average",
+                    "exponential_smoothing",
+                    "croston",
+                    "history_weeks",
+                    "nonzero_weeks",
+                    "forecast_start",
+                    "horizon_weeks",
+                    "generated_at",
+                ],
+            )
+            # 今回の履歴期間に消費実績がなかった品番の古い予測は削除する
+            DemandForecast.objects.filter(movement_type=movement_type, generated_at__lt=now).delete()
+
+        summary[movement_type] = len(forecasts)
+        logger.info("Demand forecast (%s): %d parts", movement_type, len(forecasts))
+        if on_progress:
+            on_progress(step, len(FORECAST_MOVEMENT_TYPES))
+
+    return summary
@@ -0,0 +1,95 @@
+import re
+
+from django.conf import settings
+from django.db.models import Max, Sum
+
+from base.caching import bump_cache_version, get_or_build
+
+from ..models import Inventory
+
+CACHE_NAMESPACE = "location-map:{warehouse}"
+
+
+def cache_namespace(warehouse):
+    """倉庫ごとのロケーションマップのキャッシュ名前空間を返します。"""
+    return CACHE_NAMESPACE.format(warehouse=warehouse or "")
+
+
+def invalidate_location_map(*warehouses):
+    """指定倉庫のロケーションマップのキャッシュを無効化します (bulk_update など signal を通らない更新用)。"""
+    for warehouse in set(warehouses):
+        bump_cache_version(cache_namespace(warehouse))
+
+
+def hierarchy_levels():
+    return list(settings.LOCATION_HIERARCHY_LEVELS)
+
+
+def parse_location(code):
+    """
+    棚番コードを階層 (通路・棚・段) に分解します。
+    例: "A-03-2" -> {"aisle": "A", "rack": "A-03", "level": "A-03-2"}
+    上位階層の値には親のコードを含めるため、異なる通路の同じ棚番号が混ざりません。
+    """
+    code = code or ""
+    # 区切り文字の位置で切った先頭部分をそのまま使うため、元の区切り文字が保たれる
+    ends = [m.start() for m in re.finditer(settings.LOCATION_CODE_SEPARATOR, code)] + [len(code)]
+    return {level: code[: ends[i]] if i < len(ends) and code else None for i, level in enumerate(hierarchy_levels())}
+
+
+def get_location_map(warehouse, group_by=None):
+    """
+    倉庫内の棚番ごとの品番数・在庫数量・引当数量・最終更新日時を返します。
+    (棚番, 品番) 単位の集計クエリ1回で計算し、棚番・上位階層への集約は Python 側で行います。
+    group_by に階層名 (aisle / rack / level) を指定すると、その階層で集約した結果を返します。
+    結果は倉庫の在庫が更新されるまでキャッシュされます。
+    """
+    if group_by is not None and group_by not in hierarchy_levels():
+        raise ValueError(f"group_by must be one of {hierarchy_levels()}.")
+
+    def build():
+        rows = (
+            Inventory.objects.filter(warehouse=warehouse, is_active=True)
+            .values("location", "part_key")
+            .annotate(quantity=Sum("quantity"), reserved=Sum("reserved"), last_updated=Max("last_updated"))
+            .order_by()
+        )
+        groups = {}
+        for row in rows:
+            location = row["location"] or ""
+            key = (parse_location(location)[group_by] or location) if group_by else location
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = {
+                    "key": key,
+                    "parts": set(),
+                    "locations": set(),
+                    "quantity": 0,
+                    "reserved": 0,
+                    "last_updated": row["last_updated"],
+                }
+            if row["quantity"]:
+                group["parts"].add(row["part_key"])
+            group["locations"].add(location)
+            group["quantity"] += row["quantity"] or 0
+            group["reserved"] += row["reserved"] or 0
+            group["last_updated"] = max(group["last_updated"], row["last_updated"])
+
+        result = []
+        for key in sorted(groups):
+            group = groups[key]
+            entry = {
+                "location" if group_by is None else group_by: key,
+                "part_count": len(group["parts"]),
+                "total_quantity": group["quantity"],
+                "reserved_quantity": group["reserved"],
+                "last_updated": group["last_updated"],
+            }
+            if group_by is None:
+                entry.update(parse_location(key))
+            else:
+                entry["location_count"] = len(group["locations"])
+            result.append(entry)
+        return result
+
+    return get_or_build(cache_namespace(warehouse), group_by or "location", build)
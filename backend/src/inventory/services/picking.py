@@ -0,0 +1,265 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from master.models import PartNumber
+
+from ..models import Inventory, PickingTask, SalesOrder, StockMovement
+from .serials import SerialRangeError, count_serials, move_serials
+
+# 生産計画の材料引当で作成される社内出庫 (INT-) は生産実績で消費されるため、ピッキング対象外
+INTERNAL_ORDER_PREFIX = "INT-"
+
+
+class PickingTaskError(Exception):
+    """ピッキング作業の取得・完了・解放ができないことを示す例外。"""
+
+
+def _is_pickable(sales_order):
+    return (
+        sales_order.status == "pending"
+        and not sales_order.order_number.startswith(INTERNAL_ORDER_PREFIX)
+        and bool(sales_order.item)
+        and sales_order.remaining_quantity > 0
+    )
+
+
+def _suggest_locations(pairs):
+    """
+    (品番キー, 倉庫) ごとに、利用可能数が最も多い棚番を推奨棚番として {(品番キー, 倉庫): 棚番} で返します。
+    対象の在庫行は1回のクエリで読み、棚番の選択はメモリ上で行います。
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+    suggestions = {}
+    for part_key, warehouse, location in (
+        Inventory.objects.filter(
+            part_key_id__in={part_key for part_key, _ in pairs},
+            warehouse__in={warehouse for _, warehouse in pairs},
+            is_active=True,
+            is_allocatable=True,
+            quantity__gt=F("reserved"),
+        )
+        .order_by(F("reserved") - F("quantity"), "location")
+        .values_list("part_key_id", "warehouse", "location")
+    ):
+        if (part_key, warehouse) in pairs:
+            suggestions.setdefault((part_key, warehouse), location)
+    return suggestions
+
+
+def _suggest_location(part_key, warehouse):
+    """利用可能数が最も多い棚番を推奨棚番として返します。"""
+    return _suggest_locations([(part_key, warehouse)]).get((part_key, warehouse))
+
+
+def refresh_picking_task(sales_order):
+    """
+    出庫予定の状態に合わせてピッキング作業を作成・更新・キャンセルします。
+    作業中 (claimed) の作業は作業者のものなので、数量の変更やキャンセルは未着手の作業にだけ反映します。
+    """
+    active = PickingTask.objects.filter(sales_order=sales_order, status__in=PickingTask.ACTIVE_STATUSES).first()
+    if not _is_pickable(sales_order):
+        if active is not None and active.status == "open":
+            active.status = "canceled"
+            active.save(update_fields=["status", "updated_at"])
+        return None
+
+    if active is None:
+        part_key = PartNumber.objects.key_for(sales_order.item)
+        return PickingTask.objects.create(
+            sales_order=sales_order,
+            part_number=sales_order.item,
+            part_key_id=part_key,
+            warehouse=sales_order.warehouse,
+            location=_suggest_location(part_key, sales_order.warehouse),
+            quantity=sales_order.remaining_quantity,
+            expected_shipment=sales_order.expected_shipment,
+        )
+
+    if active.status == "open":
+        changed = {
+            "quantity": sales_order.remaining_quantity,
+            "warehouse": sales_order.warehouse,
+            "expected_shipment": sales_order.expected_shipment,
+        }
+        if any(getattr(active, field) != value for field, value in changed.items()):
+            for field, value in changed.items():
+                setattr(active, field, value)
+            active.save(update_fields=[*changed, "updated_at"])
+    return active
+
+
+def sync_picking_tasks():
+    """未出庫の出庫予定のうち、ピッキング作業がないものに作業を一括作成します。実際に作成した件数を返します。"""
+    orders = list(
+        SalesOrder.objects.filter(status="pending", quantity__gt=F("shipped_quantity"))
+        .exclude(order_number__startswith=INTERNAL_ORDER_PREFIX)
+        .exclude(Q(item__isnull=True) | Q(item=""))
+        .exclude(picking_tasks__status__in=PickingTask.ACTIVE_STATUSES)
+    )
+    keys = PartNumber.objects.keys_for({order.item for order in orders})
+    locations = _suggest_locations((keys[order.item], order.warehouse) for order in orders)
+    tasks = [
+        PickingTask(
+            sales_order=order,
+            part_number=order.item,
+            part_key_id=keys[order.item],
+            warehouse=order.warehouse,
+            location=locations.get((keys[order.item], order.warehouse)),
+            quantity=order.remaining_quantity,
+            expected_shipment=order.expected_shipment,
+        )
+        for order in orders
+    ]
+    # 同時に作成された作業とは部分ユニーク制約で衝突するため、重複分は無視する
+    PickingTask.objects.bulk_create(tasks, batch_size=500, ignore_conflicts=True)
+    if not tasks:
+        return 0
+    # 無視された行は保存されないため、作成しようとした ID のうち実際に存在する件数を数える
+    return PickingTask.objects.filter(id__in=[task.id for task in tasks]).count()
+
+
+def claim_picking_tasks(user, warehouse, limit=1, location_prefix=None, lease_seconds=None):
+    """
+    指定ゾーン (倉庫・棚番の接頭辞) の未着手の作業を出庫予定日時の順に最大 limit 件取得します。
+    他の端末がロック中の行は SKIP LOCKED で読み飛ばすため、取得同士がロック待ちになることはありません。
+    リース期限が切れた作業は放棄されたものとみなし、再取得の対象になります。
+    """
+    lease_seconds = lease_seconds or settings.PICKING_LEASE_SECONDS
+    now = timezone.now()
+    filters = Q(warehouse=warehouse) & (Q(status="open") | Q(status="claimed", lease_expires_at__lt=now))
+    # リース切れの作業でも、出庫予定が取り消された・出庫済みになったものは取得しない
+    filters &= Q(sales_order__status="pending")
+    if location_prefix:
+        filters &= Q(location__startswith=location_prefix)
+
+    with transaction.atomic():
+        task_ids = list(
+            PickingTask.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(filters)
+            .order_by(F("expected_shipment").asc(nulls_last=True), "created_at")
+            .values_list("id", flat=True)[:limit]
+        )
+        PickingTask.objects.filter(id__in=task_ids).update(
+            status="claimed",
+            claimed_by=user,
+            claimed_at=now,
+            heartbeat_at=now,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            updated_at=now,
+        )
+    return list(PickingTask.objects.filter(id__in=task_ids).order_by(F("expected_shipment").asc(nulls_last=True)))
+
+
+def heartbeat_picking_tasks(user, task_ids, lease_seconds=None):
+    """作業中の作業のリースを延長します。延長できた (まだ自分が保持している) 作業IDを返します。"""
+    lease_seconds = lease_seconds or settings.PICKING_LEASE_SECONDS
+    now = timezone.now()
+    held_ids = list(
+        PickingTask.objects.filter(id__in=task_ids, status="claimed", claimed_by=user).values_list("id", flat=True)
+    )
+    PickingTask.objects.filter(id__in=held_ids, claimed_by=user).update(
+        heartbeat_at=now, lease_expires_at=now + timedelta(seconds=lease_seconds), updated_at=now
+    )
+    return held_ids
+
+
+@transaction.atomic
+def release_picking_tasks(user, task_ids):
+    """
+    作業中の作業を未着手に戻し、他の作業者が取得できるようにします。解放した件数を返します。
+    出庫予定が取り消されるなどしてピッキング対象でなくなった作業は、未着手に戻さずキャンセルします。
+    """
+    tasks = list(
+        PickingTask.objects.select_for_update(of=("self",))
+        .select_related("sales_order")
+        .filter(id__in=task_ids, status="claimed", claimed_by=user)
+    )
+    released = [task.id for task in tasks if _is_pickable(task.sales_order)]
+    canceled = [task.id for task in tasks if not _is_pickable(task.sales_order)]
+    cleared = {"claimed_by": None, "claimed_at": None, "heartbeat_at": None, "lease_expires_at": None}
+    now = timezone.now()
+    if canceled:
+        PickingTask.objects.filter(id__in=canceled).update(status="canceled", updated_at=now, **cleared)
+    return PickingTask.objects.filter(id__in=released).update(status="open", updated_at=now, **cleared)
+
+
+@transaction.atomic
+def complete_picking_task(user, task_id, quantity=None, location=None, serial_ranges=None):
+    """
+    ピッキング作業を完了し、出庫を計上します (在庫の減算・入出庫履歴の記録・出庫予定の出庫済数量の更新)。
+    数量が作業数量に満たない場合、残数は出庫予定の更新によって新しい作業として再作成されます。
+    serial_ranges (parse_serial_ranges の結果) を指定すると、そのシリアル番号を出庫済みにします。
+    """
+    try:
+        task = PickingTask.objects.select_for_update().get(id=task_id)
+    except PickingTask.DoesNotExist:
+        raise PickingTaskError("指定されたピッキング作業が見つかりません。") from None
+    if task.status != "claimed" or task.claimed_by_id != user.pk:
+        raise PickingTaskError("このピッキング作業は取得されていないか、他の作業者に再割当されています。")
+    # 作業の取得後に出庫予定が取り消された・変更された場合に備えて、ロックしたうえで確認する
+    sales_order = SalesOrder.objects.select_for_update().get(pk=task.sales_order_id)
+    if not _is_pickable(sales_order):
+        raise PickingTaskError("出庫予定が取り消されたか出庫済みのため、このピッキング作業は完了できません。")
+
+    limit = min(task.quantity, sales_order.remaining_quantity)
+    quantity = limit if quantity is None else quantity
+    if quantity <= 0 or quantity > limit:
+        raise PickingTaskError("ピッキング数量は1以上、作業数量と出庫予定の残数以下である必要があります。")
+    location = location or task.location
+    if serial_ranges and count_serials(serial_ranges) != quantity:
+        raise PickingTaskError("シリアル番号の数がピッキング数量と一致しません。")
+
+    inventory = (
+        Inventory.objects.select_for_update()
+        .filter(part_key_id=task.part_key_id, warehouse=task.warehouse, location=location)
+        .first()
+    )
+    if inventory is None or inventory.available_quantity < quantity:
+        raise PickingTaskError(f"棚番 {location} の利用可能在庫が不足しています。")
+
+    inventory.quantity -= quantity
+    inventory.save(update_fields=["quantity", "last_updated"])
+    movement = StockMovement.objects.create(
+        part_number=task.part_number,
+        part_key_id=task.part_key_id,
+        movement_type="outgoing",
+        quantity=quantity,
+        warehouse=task.warehouse,
+        location=location,
+        reference_document=sales_order.order_number,
+        description="ピッキング出庫",
+        operator=user,
+    )
+    if serial_ranges:
+        try:
+            move_serials(
+                task.part_number,
+                serial_ranges,
+                status="issued",
+                movement=movement,
+                from_warehouse=task.warehouse,
+                from_location=location,
+            )
+        except SerialRangeError as e:
+            raise PickingTaskError(str(e)) from e
+
+    now = timezone.now()
+    task.status = "completed"
+    task.picked_quantity = quantity
+    task.location = location
+    task.completed_at = now
+    task.lease_expires_at = None
+    task.save(update_fields=["status", "picked_quantity", "location", "completed_at", "lease_expires_at", "updated_at"])
+
+    # 作業の完了後に出庫予定を保存する (post_save で残数の作業が作成される)
+    sales_order.shipped_quantity += quantity
+    if sales_order.shipped_quantity >= sales_order.quantity:
+        sales_order.status = "shipped"
+    sales_order.save(update_fields=["shipped_quantity", "status", "updated_at"])
+    return task
@@ -0,0 +1,264 @@
+from bisect import bisect_left, insort
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from base.caching import bump_cache_version, get_cache_version
+from master.models import Item, LocationCapacity, PartNumber
+
+from ..models import Inventory
+
+# 倉庫ごとのプロセス内インデックス: {倉庫: (ルールのキャッシュバージョン, 適用済みの変更番号, PutawayIndex)}
+# 在庫の変更は棚番単位の変更ジャーナルから差分で反映し、収容ルールが変わったときだけ再構築します。
+_indexes = {}
+
+RULES_NAMESPACE = "putaway-rules:{warehouse}"
+JOURNAL_SEQUENCE_KEY = "putaway-journal:{warehouse}:seq"
+JOURNAL_ENTRY_KEY = "putaway-journal:{warehouse}:{seq}"
+JOURNAL_TTL = 60 * 60
+# 1回の参照で差分として反映する変更の上限 (これを超える場合は再構築した方が速い)
+MAX_JOURNAL_REPLAY = 1000
+
+# ルールのない棚番の優先順位 (LocationCapacity.priority の既定値と同じ)
+DEFAULT_PRIORITY = 100
+
+
+class PutawayIndex:
+    """
+    1倉庫分の入庫先候補のインデックス。
+    棚番ごとの在庫 (品番別数量)、品番を保管している棚番、空き棚番を事前に計算しておき、提案時はクエリを発行しません。
+    在庫の変更は update_slots で変更された棚番の分だけ反映します。
+    """
+
+    def __init__(self, rows, rules):
+        # 接頭辞が長いルールほど優先するため、長い順に並べておく
+        self.rules = sorted(rules, key=lambda rule: len(rule.location_prefix), reverse=True)
+        self.slots = {}
+        self.part_slots = {}
+        self._part_locations = {}
+        self._free = []  # 空き棚番の (優先順位, 棚番) を昇順に保持する
+        self.update_slots(rows)
+
+    @property
+    def free_slots(self):
+        return [location for _, location in self._free]
+
+    def _priority(self, location):
+        rule = self.rule_for(location)
+        return rule.priority if rule else DEFAULT_PRIORITY
+
+    def _discard_free(self, location):
+        key = (self._priority(location), location)
+        position = bisect_left(self._free, key)
+        if position < len(self._free) and self._free[position] == key:
+            del self._free[position]
+
+    def update_slots(self, rows, locations=()):
+        """
+        棚番の在庫を rows ((棚番, 品番キー, 数量) の集計行) で置き換え、品番別・空き棚番の索引を更新します。
+        locations には読み直した棚番を渡します (在庫行がなくなった棚番は索引から除きます)。
+        """
+        loaded = {location or "": {} for location in locations}
+        present = set()
+        for location, part_key, quantity in rows:
+            location = location or ""
+            present.add(location)
+            parts = loaded.setdefault(location, {})
+            if quantity:
+                parts[part_key] = quantity
+
+        affected_parts = set()
+        for location, parts in loaded.items():
+            previous = self.slots.pop(location, {})
+            for part_key in previous:
+                self._part_locations[part_key].discard(location)
+            self._discard_free(location)
+            affected_parts.update(previous)
+            affected_parts.update(parts)
+            if location not in present:
+                continue
+            self.slots[location] = parts
+            for part_key in parts:
+                self._part_locations.setdefault(part_key, set()).add(location)
+            rule = self.rule_for(location)
+            if not parts and (rule is None or rule.allow_putaway):
+                insort(self._free, (self._priority(location), location))
+
+        # 在庫を集約するため、既に多く保管している棚番から提案する
+        for part_key in affected_parts:
+            part_locations = self._part_locations.get(part_key)
+            if part_locations:
+                self.part_slots[part_key] = sorted(
+                    part_locations, key=lambda location: (-self.slots[location][part_key], location)
+                )
+            else:
+                self._part_locations.pop(part_key, None)
+                self.part_slots.pop(part_key, None)
+
+    def rule_for(self, location):
+        for rule in self.rules:
+            if location.startswith(rule.location_prefix):
+                return rule
+        return None
+
+    def remaining_capacity(self, location, part_key, quantity, pending):
+        """
+        棚番に quantity を追加で収容できる場合は追加後の残り容量 (無制限なら None) を、できない場合は False を返します。
+        pending は同じバッチ内で既に割り当てた分 ({棚番: {品番キー: 数量}}) です。
+        """
+        rule = self.rule_for(location)
+        parts = dict(self.slots.get(location, {}))
+        for key, pending_quantity in pending.get(location, {}).items():
+            parts[key] = parts.get(key, 0) + pending_quantity
+        if rule is None:
+            return None
+        if not rule.allow_putaway:
+            return False
+        if part_key not in parts and len(parts) >= rule.max_parts:
+            return False
+        if rule.max_quantity is None:
+            return None
+        remaining = rule.max_quantity - sum(parts.values()) - quantity
+        return remaining if remaining >= 0 else False
+
+
+def _slot_rows(warehouse, locations=None):
+    rows = Inventory.objects.filter(warehouse=warehouse, is_active=True)
+    if locations is not None:
+        location_filter = Q(location__in=locations)
+        if "" in locations:
+            location_filter |= Q(location__isnull=True)
+        rows = rows.filter(location_filter)
+    return rows.values_list("location", "part_key").annotate(total=Sum("quantity")).order_by()
+
+
+def _build_index(warehouse):
+    rules = list(LocationCapacity.objects.filter(warehouse=warehouse))
+    return PutawayIndex(_slot_rows(warehouse), rules)
+
+
+def record_slot_changes(slots):
+    """
+    在庫行が変更された (倉庫, 棚番) を倉庫ごとの変更ジャーナルに記録します。
+    トランザクション内で呼ばれた場合はコミット後に記録します (インデックスがコミット前の在庫を読み直さないため)。
+    """
+    changes = {}
+    for warehouse, location in slots:
+        changes.setdefault(warehouse or "", set()).add(location or "")
+
+    def _record():
+        for warehouse, locations in changes.items():
+            sequence_key = JOURNAL_SEQUENCE_KEY.format(warehouse=warehouse)
+            cache.add(sequence_key, 0, timeout=None)
+            try:
+                sequence = cache.incr(sequence_key)
+            except ValueError:
+                # 番号が失われた場合は、参照側が番号の巻き戻りを検知して再構築する
+                sequence = 1
+                cache.set(sequence_key, sequence, timeout=None)
+            cache.set(
+                JOURNAL_ENTRY_KEY.format(warehouse=warehouse, seq=sequence), sorted(locations), timeout=JOURNAL_TTL
+            )
+
+    if changes:
+        transaction.on_commit(_record)
+
+
+def invalidate_putaway_rules(warehouse):
+    """収容ルールの変更時に、倉庫のインデックスを次の参照で再構築させます。"""
+    bump_cache_version(RULES_NAMESPACE.format(warehouse=warehouse or ""))
+
+
+def _replay_journal(warehouse, index, applied, sequence):
+    """未反映の変更ジャーナルを適用します。ジャーナルが欠けている (期限切れなど) 場合は False を返します。"""
+    if not applied < sequence <= applied + MAX_JOURNAL_REPLAY:
+        return False
+    keys = [JOURNAL_ENTRY_KEY.format(warehouse=warehouse, seq=seq) for seq in range(applied + 1, sequence + 1)]
+    entries = cache.get_many(keys)
+    if len(entries) != len(keys):
+        return False
+    locations = set().union(*entries.values())
+    index.update_slots(_slot_rows(warehouse, locations), locations)
+    return True
+
+
+def get_putaway_index(warehouse):
+    """
+    倉庫のインデックスを返します。在庫が変更されていれば変更された棚番だけを読み直し、
+    収容ルールの変更・ジャーナルの欠落時は再構築します。
+    """
+    rules_version = get_cache_version(RULES_NAMESPACE.format(warehouse=warehouse or ""))
+    sequence = cache.get(JOURNAL_SEQUENCE_KEY.format(warehouse=warehouse or ""), 0)
+    cached = _indexes.get(warehouse)
+    if cached is not None and cached[0] == rules_version:
+        _, applied, index = cached
+        if applied == sequence or _replay_journal(warehouse or "", index, applied, sequence):
+            _indexes[warehouse] = (rules_version, sequence, index)
+            return index
+    # 再構築中の変更は次の参照でジャーナルから反映されるよう、変更番号を読んでから在庫を読む
+    index = _build_index(warehouse)
+    _indexes[warehouse] = (rules_version, sequence, index)
+    return index
+
+
+def _pick_locations(index, candidates, part_key, quantity, pending, limit):
+    suggestions = []
+    seen = set()
+    for location, reason in candidates:
+        if len(suggestions) >= limit:
+            break
+        if location in seen:
+            continue
+        remaining = index.remaining_capacity(location, part_key, quantity, pending)
+        if remaining is False:
+            continue
+        seen.add(location)
+        current = sum(index.slots.get(location, {}).values())
+        suggestions.append(
+            {"location": location, "reason": reason, "current_quantity": current, "remaining_capacity": remaining}
+        )
+    return suggestions
+
+
+def suggest_putaway(lines, limit=3):
+    """
+    入庫予定の明細 ({"part_number", "quantity", "warehouse"} のリスト) ごとに入庫先の棚番候補を返します。
+    候補の順序: 同じ品番を保管している棚番 → 品番マスターのデフォルト棚番 → 空き棚番 (ルールの優先順位順)。
+    同じバッチ内の明細が同じ空き棚番を取り合わないよう、各明細の第1候補はバッチ内で予約済みとして扱います。
+    """
+    codes = {line["part_number"] for line in lines}
+    part_keys = dict(PartNumber.objects.filter(code__in=codes).values_list("code", "id"))
+    items = {
+        item["code"]: item
+        for item in Item.objects.filter(code__in=codes).values("code", "default_warehouse", "default_location")
+    }
+
+    pending = {}  # {倉庫: {棚番: {品番キー: 数量}}}
+    results = []
+    for line in lines:
+        part_number = line["part_number"]
+        quantity = line["quantity"]
+        item = items.get(part_number, {})
+        warehouse = line.get("warehouse") or item.get("default_warehouse")
+        if not warehouse:
+            results.append({**line, "warehouse": None, "suggestions": [], "error": "入庫倉庫を決定できません。"})
+            continue
+
+        index = get_putaway_index(warehouse)
+        part_key = part_keys.get(part_number)
+        warehouse_pending = pending.setdefault(warehouse, {})
+        candidates = [(location, "same_part") for location in index.part_slots.get(part_key, [])]
+        if item.get("default_location") and item.get("default_warehouse") == warehouse:
+            candidates.append((item["default_location"], "default_location"))
+        # 空き棚番は、同じバッチで既に第1候補として予約された棚番を除く
+        candidates.extend(
+            (location, "empty_slot") for location in index.free_slots if location not in warehouse_pending
+        )
+        suggestions = _pick_locations(index, candidates, part_key, quantity, warehouse_pending, limit)
+
+        if suggestions:
+            slot = warehouse_pending.setdefault(suggestions[0]["location"], {})
+            slot[part_key] = slot.get(part_key, 0) + quantity
+        results.append({**line, "warehouse": warehouse, "suggestions": suggestions})
+    return results
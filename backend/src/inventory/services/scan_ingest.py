@@ -0,0 +1,316 @@
+import logging
+import zlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from redis.exceptions import LockError
+from uuid6 import uuid7
+
+from base.redis_client import get_redis
+from master.models import PartNumber
+
+from ..models import Inventory, StockMovement
+from .location_map import invalidate_location_map
+from .putaway import record_slot_changes
+
+logger = logging.getLogger(__name__)
+
+STREAM_KEY = "inventory:scans:{shard}"
+SCHEDULED_KEY = "inventory:scans:{shard}:scheduled"
+LOCK_KEY = "inventory:scans:{shard}:lock"
+DEAD_LETTER_KEY = "inventory:scans:{shard}:dead"
+STATUS_KEY = "inventory:scan:{scan_id}"
+CONSUMER_GROUP = "scan-appliers"
+CONSUMER_NAME = "applier"
+
+SCAN_FIELDS = ["part_number", "warehouse", "location", "movement_type", "quantity", "reference_document", "scanned_at"]
+
+
+class ScanBackPressureError(Exception):
+    """取込待ちのスキャンが上限に達しているため、新規スキャンを受け付けられないことを示す例外。"""
+
+
+def shard_for(part_number, warehouse, location):
+    """品番・倉庫・棚番から決定的にシャード番号を求めます (同じキーは常に同じシャードで順番に処理されます)。"""
+    key = f"{part_number}\x1f{warehouse}\x1f{location or ''}".encode()
+    return zlib.crc32(key) % settings.SCAN_INGEST_SHARDS
+
+
+def enqueue_scan(scan_data, user):
+    """
+    検証済みのスキャンをRedis Streamに追記し、スキャンIDを返します。
+    在庫への反映は drain_scan_shard がマイクロバッチで行います。
+    """
+    r = get_redis()
+    shard = shard_for(scan_data["part_number"], scan_data["warehouse"], scan_data.get("location"))
+    stream_key = STREAM_KEY.format(shard=shard)
+
+    # 処理済みのエントリは削除しているため、ストリーム長 = 未処理件数
+    if r.xlen(stream_key) >= settings.SCAN_INGEST_MAX_PENDING:
+        raise ScanBackPressureError(f"Scan queue for shard {shard} is full.")
+
+    scan_id = uuid7().hex
+    scanned_at = scan_data.get("scanned_at") or timezone.now()
+    fields = {
+        "scan_id": scan_id,
+        "part_number": scan_data["part_number"],
+        "warehouse": scan_data["warehouse"],
+        "location": scan_data.get("location") or "",
+        "movement_type": scan_data["movement_type"],
+        "quantity": scan_data["quantity"],
+        "reference_document": scan_data.get("reference_document") or "",
+        "scanned_at": scanned_at.isoformat(),
+        "operator_id": str(user.pk) if user and user.is_authenticated else "",
+    }
+
+    pipe = r.pipeline()
+    pipe.hset(STATUS_KEY.format(scan_id=scan_id), mapping={"status": "pending", "shard": shard})
+    pipe.expire(STATUS_KEY.format(scan_id=scan_id), settings.SCAN_INGEST_STATUS_TTL)
+    pipe.xadd(stream_key, fields)
+    pipe.execute()
+
+    schedule_drain(shard)
+    return scan_id
+
+
+def schedule_drain(shard, countdown=None):
+    """シャードの取込タスクが未スケジュールであればCeleryに投入します (countdown 秒後に実行)。"""
+    from ..tasks import drain_scan_shard_task
+
+    if get_redis().set(SCHEDULED_KEY.format(shard=shard), "1", nx=True, ex=60 + (countdown or 0)):
+        drain_scan_shard_task.apply_async((shard,), countdown=countdown)
+
+
+def schedule_pending_drains():
+    """
+    未処理のスキャンが残っているすべてのシャードの取込をスケジュールします (定期実行用)。
+    取込タスクが失われた場合や、失敗したバッチの後に新しいスキャンが届かない場合でも取込を再開させます。
+    """
+    r = get_redis()
+    pipe = r.pipeline()
+    for shard in range(settings.SCAN_INGEST_SHARDS):
+        pipe.xlen(STREAM_KEY.format(shard=shard))
+    pending_shards = [shard for shard, count in enumerate(pipe.execute()) if count]
+    for shard in pending_shards:
+        schedule_drain(shard)
+    return len(pending_shards)
+
+
+def get_scan_status(scan_id):
+    """スキャンの処理状態を返します。保持期間を過ぎたスキャンは None になります。"""
+    data = get_redis().hgetall(STATUS_KEY.format(scan_id=scan_id))
+    return data or None
+
+
+def get_pending_summary():
+    """シャードごとの未処理スキャン件数を返します。"""
+    r = get_redis()
+    pipe = r.pipeline()
+    for shard in range(settings.SCAN_INGEST_SHARDS):
+        pipe.xlen(STREAM_KEY.format(shard=shard))
+    counts = pipe.execute()
+    return {
+        "total_pending": sum(counts),
+        "max_pending_per_shard": settings.SCAN_INGEST_MAX_PENDING,
+        "shards": [{"shard": shard, "pending": count} for shard, count in enumerate(counts)],
+    }
+
+
+def _dead_letter_exhausted(r, shard, scans):
+    """
+    配信回数が SCAN_INGEST_MAX_DELIVERIES に達したバッチを1件ずつ反映し直し、それでも失敗するスキャンを
+    デッドレターストリームに移します。{scan_id: (status, error)} を返し、上限未満のバッチは None を返します。
+    """
+    stream_key = STREAM_KEY.format(shard=shard)
+    entry_ids = [scan["entry_id"] for scan in scans]
+    pending = r.xpending_range(stream_key, CONSUMER_GROUP, min=entry_ids[0], max=entry_ids[-1], count=len(entry_ids))
+    if max((entry["times_delivered"] for entry in pending), default=0) < settings.SCAN_INGEST_MAX_DELIVERIES:
+        return None
+
+    results = {}
+    for scan in scans:
+        try:
+            results.update(apply_scans([scan], check_duplicates=True))
+        except Exception as e:
+            logger.exception("Moving scan %s to the dead-letter stream.", scan["scan_id"])
+            fields = {key: value for key, value in scan.items() if key != "entry_id"}
+            r.xadd(DEAD_LETTER_KEY.format(shard=shard), {**fields, "entry_id": scan["entry_id"], "error": str(e)})
+            results[scan["scan_id"]] = ("failed", f"取込に失敗したためデッドレターに移しました: {e}")
+    return results
+
+
+def drain_scan_shard(shard):
+    """
+    シャードのストリームを空になるまでマイクロバッチで取り込みます。
+    シャードごとにロックを取るため、同じキーのスキャンは常に追記順に反映されます。
+    ロックの有効期限はバッチごとに延長し、延長できない (期限切れで他のワーカーに渡った) 場合はそこで止めます。
+    バッチの反映に失敗した場合は、未ACKのエントリを SCAN_INGEST_RETRY_DELAY_SECONDS 秒後に再試行させます。
+    """
+    r = get_redis()
+    stream_key = STREAM_KEY.format(shard=shard)
+    lock = r.lock(LOCK_KEY.format(shard=shard), timeout=settings.SCAN_INGEST_LOCK_TIMEOUT, blocking=False)
+    if not lock.acquire():
+        return 0
+
+    applied = 0
+    failed = True
+    lost_lock = False
+    try:
+        try:
+            r.xgroup_create(stream_key, CONSUMER_GROUP, id="0", mkstream=True)
+        except Exception as e:  # BUSYGROUP: 既に作成済み
+            if "BUSYGROUP" not in str(e):
+                raise
+
+        # 前回の取込が途中で停止した場合、未ACKのエントリから再開する (二重計上はスキャンIDで防止)
+        stream_id = "0"
+        while True:
+            lock.reacquire()
+            response = r.xreadgroup(
+                CONSUMER_GROUP, CONSUMER_NAME, {stream_key: stream_id}, count=settings.SCAN_INGEST_BATCH_SIZE
+            )
+            entries = response[0][1] if response else []
+            if not entries:
+                if stream_id == "0":
+                    stream_id = ">"
+                    continue
+                break
+
+            scans = [dict(fields, entry_id=entry_id) for entry_id, fields in entries]
+            try:
+                results = apply_scans(scans, check_duplicates=stream_id == "0")
+            except Exception:
+                # 失敗し続けるバッチでシャードが止まらないよう、配信回数の上限を超えたものはデッドレターに移す
+                results = _dead_letter_exhausted(r, shard, scans) if stream_id == "0" else None
+                if results is None:
+                    raise
+
+            pipe = r.pipeline()
+            for scan in scans:
+                status_key = STATUS_KEY.format(scan_id=scan["scan_id"])
+                status, error = results[scan["scan_id"]]
+                pipe.hset(status_key, mapping={"status": status, "error": error or ""})
+                pipe.expire(status_key, settings.SCAN_INGEST_STATUS_TTL)
+            entry_ids = [scan["entry_id"] for scan in scans]
+            pipe.xack(stream_key, CONSUMER_GROUP, *entry_ids)
+            pipe.xdel(stream_key, *entry_ids)
+            pipe.execute()
+            applied += len(scans)
+        failed = False
+    except LockError:
+        logger.warning("Lost the scan shard %s lock; stopping the drain.", shard)
+        failed = False
+        lost_lock = True
+    finally:
+        r.delete(SCHEDULED_KEY.format(shard=shard))
+        try:
+            lock.release()
+        except LockError:
+            pass
+        # ロック解放までの間に追記されたスキャンを取りこぼさないよう再スケジュールする
+        # (失敗したバッチは未ACKのまま残るため、新しいスキャンが届かなくても時間をおいて再試行する)
+        if not lost_lock and r.xlen(stream_key):
+            schedule_drain(shard, countdown=settings.SCAN_INGEST_RETRY_DELAY_SECONDS if failed else None)
+    return applied
+
+
+def apply_scans(scans, check_duplicates=False):
+    """
+    スキャンのバッチを1トランザクションで在庫に反映します。
+    対象の在庫行は1回のクエリでまとめてロックし、更新は bulk_update / bulk_create で行います。
+    戻り値は {scan_id: (status, error)} です。
+    """
+    results = {}
+    now = timezone.now()
+    # 棚番なしは空文字で届くが、在庫行では NULL で保存されているため None に揃える
+    scans = [{**scan, "location": scan.get("location") or None} for scan in scans]
+
+    with transaction.atomic():
+        if check_duplicates:
+            references = {f"SCAN: {scan['scan_id']}": scan["scan_id"] for scan in scans}
+            already_applied = StockMovement.objects.filter(reference_document__in=references).values_list(
+                "reference_document", flat=True
+            )
+            for reference in already_applied:
+                results[references[reference]] = ("applied", None)
+            scans = [scan for scan in scans if scan["scan_id"] not in results]
+        if not scans:
+            return results
+
+        part_keys = PartNumber.objects.keys_for(scan["part_number"] for scan in scans)
+        row_keys = {(part_keys[scan["part_number"]], scan["warehouse"], scan["location"]) for scan in scans}
+
+        row_filter = Q()
+        for part_key, warehouse, location in row_keys:
+            # 過去に空文字で作られた棚番なしの在庫行も同じ行として扱う
+            location_filter = Q(location__isnull=True) | Q(location="") if location is None else Q(location=location)
+            row_filter |= Q(location_filter, part_key_id=part_key, warehouse=warehouse)
+        inventory_map = {}
+        for inventory in Inventory.objects.select_for_update().filter(row_filter).order_by("id"):
+            inventory_map.setdefault(
+                (inventory.part_key_id, inventory.warehouse, inventory.location or None), inventory
+            )
+
+        new_rows = {}
+        movements = []
+        for scan in scans:
+            part_key = part_keys[scan["part_number"]]
+            row_key = (part_key, scan["warehouse"], scan["location"])
+            quantity = int(scan["quantity"])
+            inventory = inventory_map.get(row_key)
+
+            if scan["movement_type"] == "outgoing":
+                if inventory is None:
+                    results[scan["scan_id"]] = ("failed", "在庫が見つかりません。")
+                    continue
+                available = inventory.quantity - inventory.reserved
+                if available < quantity:
+                    results[scan["scan_id"]] = (
+                        "failed",
+                        f"出庫数量({quantity})が利用可能在庫({available})を超えています。",
+                    )
+                    continue
+                inventory.quantity -= quantity
+            else:
+                if inventory is None:
+                    inventory = Inventory(
+                        part_number=scan["part_number"],
+                        part_key_id=part_key,
+                        warehouse=scan["warehouse"],
+                        location=scan["location"],
+                        quantity=0,
+                    )
+                    inventory_map[row_key] = inventory
+                    new_rows[row_key] = inventory
+                inventory.quantity += quantity
+            inventory.last_updated = now
+
+            movements.append(
+                StockMovement(
+                    part_number=scan["part_number"],
+                    part_key_id=part_key,
+                    warehouse=scan["warehouse"],
+                    location=scan["location"],
+                    movement_type=scan["movement_type"],
+                    quantity=quantity,
+                    movement_date=parse_datetime(scan["scanned_at"]) or now,
+                    reference_document=f"SCAN: {scan['scan_id']}",
+                    description=scan["reference_document"] or "スキャナー取込",
+                    operator_id=scan["operator_id"] or None,
+                )
+            )
+            results[scan["scan_id"]] = ("applied", None)
+
+        existing_rows = [inv for key, inv in inventory_map.items() if key not in new_rows]
+        Inventory.objects.bulk_update(existing_rows, ["quantity", "last_updated"])
+        Inventory.objects.bulk_create(new_rows.values())
+        StockMovement.objects.bulk_create(movements)
+        # bulk_update / bulk_create は post_save を発行しないため、ロケーションマップは明示的に無効化する
+        invalidate_location_map(*(scan["warehouse"] for scan in scans))
+        record_slot_changes((inventory.warehouse, inventory.location) for inventory in inventory_map.values())
+
+    logger.info("Applied %d scans (%d failed).", len(movements), len(scans) - len(movements))
+    return results
@@ -0,0 +1,242 @@
+import re
+
+from django.db.models import Q
+
+from master.models import PartNumber
+
+from ..models import SerialRange, StockMovementSerialRange
+
+SERIAL_PATTERN = re.compile(r"^(.*?)(\d+)$")
+
+# この属性がすべて等しい隣接範囲は1行にまとめる
+MERGE_FIELDS = ["width", "warehouse", "location", "status", "receipt_id", "source_document"]
+
+
+class SerialRangeError(ValueError):
+    """シリアル番号の指定が不正、または在庫上のシリアル番号と一致しないことを示す例外。"""
+
+
+def parse_serial(serial):
+    """シリアル番号を (接頭辞, 番号, 桁数) に分解します。例: "SN-00123" -> ("SN-", 123, 5)"""
+    match = SERIAL_PATTERN.match((serial or "").strip())
+    if not match:
+        raise SerialRangeError(f"シリアル番号 {serial} の末尾が数字ではありません。")
+    prefix, digits = match.groups()
+    return prefix, int(digits), len(digits)
+
+
+def format_serial(prefix, number, width):
+    return f"{prefix}{number:0{width}d}"
+
+
+def parse_serial_ranges(items):
+    """
+    [{"from": "SN-001", "to": "SN-010"}, "SN-020", ...] 形式の指定を (接頭辞, 桁数, 開始, 終了) のリストにします。
+    指定同士が重なっている場合はエラーです。
+    """
+    ranges = []
+    for item in items or []:
+        first, last = (item.get("from"), item.get("to")) if isinstance(item, dict) else (item, None)
+        prefix, start, width = parse_serial(first)
+        end = start
+        if last:
+            last_prefix, end, last_width = parse_serial(last)
+            if last_prefix != prefix or last_width != width or end < start:
+                raise SerialRangeError(f"シリアル番号の範囲 {first}..{last} が不正です。")
+        ranges.append((prefix, width, start, end))
+
+    ranges.sort(key=lambda r: (r[0], r[2]))
+    for previous, current in zip(ranges, ranges[1:], strict=False):
+        if previous[0] == current[0] and current[2] <= previous[3]:
+            raise SerialRangeError("指定されたシリアル番号の範囲が重複しています。")
+    return ranges
+
+
+def count_serials(ranges):
+    return sum(end - start + 1 for _, _, start, end in ranges)
+
+
+def _overlapping(part_key, prefix, start, end, lock=False):
+    """
+    [start, end] と重なる範囲を開始番号順に返します。
+    範囲は重ならないため、「start 以下で最大の開始番号を持つ範囲」と「開始番号が (start, end] の範囲」だけを
+    (part_key, prefix, start) のインデックスで探索すれば十分です (全件走査になりません)。
+    """
+    queryset = SerialRange.objects.filter(part_key_id=part_key, prefix=prefix)
+    if lock:
+        queryset = queryset.select_for_update()
+    head = queryset.filter(start__lte=start).order_by("-start").values_list("id", flat=True)[:1]
+    return list(
+        queryset.filter(Q(id__in=list(head), end__gte=start) | Q(start__gt=start, start__lte=end)).order_by("start")
+    )
+
+
+def _carve(ranges, start, end, **changes):
+    """
+    ranges のうち [start, end] に含まれる部分を切り出し、changes の属性を適用します。
+    範囲外にはみ出す部分は元の属性のまま別の行として残します。切り出した (更新後の) 範囲を返します。
+    """
+    remainders = []
+    for serial_range in ranges:
+        if serial_range.start < start:
+            remainders.append(_copy(serial_range, serial_range.start, start - 1))
+            serial_range.start = start
+        if serial_range.end > end:
+            remainders.append(_copy(serial_range, end + 1, serial_range.end))
+            serial_range.end = end
+        for field, value in changes.items():
+            setattr(serial_range, field, value)
+        serial_range.save()
+    SerialRange.objects.bulk_create(remainders)
+    return ranges
+
+
+def _copy(serial_range, start, end):
+    return SerialRange(
+        part_number=serial_range.part_number,
+        part_key_id=serial_range.part_key_id,
+        prefix=serial_range.prefix,
+        width=serial_range.width,
+        start=start,
+        end=end,
+        warehouse=serial_range.warehouse,
+        location=serial_range.location,
+        status=serial_range.status,
+        receipt_id=serial_range.receipt_id,
+        source_document=serial_range.source_document,
+        last_movement_id=serial_range.last_movement_id,
+    )
+
+
+def _merge_key(serial_range):
+    return tuple(getattr(serial_range, field) for field in MERGE_FIELDS)
+
+
+def _merge_neighbors(serial_range):
+    """属性が同じで番号が連続する前後の範囲を1行にまとめます。"""
+    neighbors = SerialRange.objects.select_for_update().filter(
+        Q(end=serial_range.start - 1) | Q(start=serial_range.end + 1),
+        part_key_id=serial_range.part_key_id,
+        prefix=serial_range.prefix,
+    )
+    merged = []
+    for neighbor in neighbors:
+        if _merge_key(neighbor) != _merge_key(serial_range):
+            continue
+        serial_range.start = min(serial_range.start, neighbor.start)
+        serial_range.end = max(serial_range.end, neighbor.end)
+        merged.append(neighbor.id)
+    if merged:
+        SerialRange.objects.filter(id__in=merged).delete()
+        serial_range.save(update_fields=["start", "end", "updated_at"])
+
+
+def _record_movement(movement, ranges):
+    if movement is None:
+        return
+    StockMovementSerialRange.objects.bulk_create(
+        StockMovementSerialRange(movement=movement, prefix=prefix, width=width, start=start, end=end)
+        for prefix, width, start, end in ranges
+    )
+
+
+def register_serials(
+    part_number, ranges, warehouse, location, movement=None, receipt=None, source_document=None, status="in_stock"
+):
+    """
+    受入・生産完了したシリアル番号の範囲を登録します。
+    既に在庫にあるシリアル番号と重なる場合はエラーです。出庫済みのシリアル番号 (返品など) は在庫に戻します。
+    """
+    part_key = PartNumber.objects.key_for(part_number)
+    for prefix, width, start, end in ranges:
+        existing = _overlapping(part_key, prefix, start, end, lock=True)
+        if any(serial_range.status == "in_stock" for serial_range in existing):
+            raise SerialRangeError(
+                f"シリアル番号 {format_serial(prefix, start, width)}..{format_serial(prefix, end, width)} "
+                "の一部は既に在庫にあります。"
+            )
+        if existing:
+            SerialRange.objects.filter(id__in=[r.id for r in _carve(existing, start, end)]).delete()
+        serial_range = SerialRange.objects.create(
+            part_number=part_number,
+            part_key_id=part_key,
+            prefix=prefix,
+            width=width,
+            start=start,
+            end=end,
+            warehouse=warehouse,
+            location=location,
+            status=status,
+            receipt=receipt,
+            source_document=source_document,
+            last_movement=movement,
+        )
+        _merge_neighbors(serial_range)
+    _record_movement(movement, ranges)
+
+
+def move_serials(
+    part_number,
+    ranges,
+    warehouse=None,
+    location=None,
+    status="in_stock",
+    movement=None,
+    from_warehouse=None,
+    from_location=None,
+):
+    """
+    在庫にあるシリアル番号の範囲を移動 (棚移動・出庫・生産使用) します。
+    指定範囲は移動元の在庫として漏れなく存在している必要があります。範囲の一部だけが動く場合は分割し、
+    移動先で属性が同じ範囲と連続すれば結合します。
+    """
+    part_key = PartNumber.objects.key_for(part_number)
+    for prefix, width, start, end in ranges:
+        existing = _overlapping(part_key, prefix, start, end, lock=True)
+        expected = start
+        for serial_range in existing:
+            in_place = from_warehouse is None or (
+                serial_range.warehouse == from_warehouse and (serial_range.location or "") == (from_location or "")
+            )
+            if serial_range.start > expected or serial_range.status != "in_stock" or not in_place:
+                break
+            expected = serial_range.end + 1
+        if expected <= end:
+            raise SerialRangeError(
+                f"シリアル番号 {format_serial(prefix, expected, width)} は移動元の在庫にありません。"
+            )
+
+        moved = _carve(
+            existing, start, end, warehouse=warehouse, location=location, status=status, last_movement=movement
+        )
+        for serial_range in moved:
+            if SerialRange.objects.filter(id=serial_range.id).exists():
+                _merge_neighbors(serial_range)
+    _record_movement(movement, ranges)
+
+
+def void_serials(source_document):
+    """発生元 (生産計画など) の取消に伴い、在庫にあるその発生元のシリアル番号を無効にします。"""
+    return SerialRange.objects.filter(source_document=source_document, status="in_stock").update(status="void")
+
+
+def locate_serial(part_number, serial):
+    """シリアル番号を含む範囲 (現在の所在) を返します。見つからなければ None です。"""
+    part_key = PartNumber.objects.filter(code=part_number).values_list("id", flat=True).first()
+    if part_key is None:
+        return None
+    prefix, number, _ = parse_serial(serial)
+    serial_range = (
+        SerialRange.objects.filter(part_key_id=part_key, prefix=prefix, start__lte=number).order_by("-start").first()
+    )
+    if serial_range is None or serial_range.end < number:
+        return None
+    return serial_range
+
+
+def serials_in_location(warehouse, location, part_number=None):
+    """棚番にある在庫のシリアル番号の範囲を返します。"""
+    queryset = SerialRange.objects.filter(warehouse=warehouse, location=location, status="in_stock")
+    if part_number:
+        queryset = queryset.filter(part_key__code=part_number)
+    return queryset.order_by("part_key", "prefix", "start")
@@ -0,0 +1,57 @@
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from base.caching import get_or_build
+
+from ..models import PurchaseOrder
+
+CACHE_NAMESPACE = "inbound-calendar"
+OPEN_PURCHASE_ORDER_STATUSES = ["pending", "partially_received"]
+CALENDAR_DIMENSIONS = ["warehouse", "supplier"]
+
+
+def open_purchase_orders():
+    """未入庫数量が残っている発注 (部分インデックス po_open_arrival_idx の対象) を返します。"""
+    return PurchaseOrder.objects.filter(status__in=OPEN_PURCHASE_ORDER_STATUSES, quantity__gt=F("received_quantity"))
+
+
+def get_inbound_calendar(date_from, date_to, dimension=None):
+    """
+    入荷予定日 (日単位) と指定の軸 (倉庫・仕入先) ごとの入荷予定数量を返します。
+    1回の集計クエリで計算し、発注・入庫実績が変更されるまでキャッシュします。
+    """
+    if dimension is not None and dimension not in CALENDAR_DIMENSIONS:
+        raise ValueError(f"dimension must be one of {CALENDAR_DIMENSIONS}.")
+
+    def build():
+        start = timezone.make_aware(datetime.combine(date_from, time.min))
+        end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+        group_fields = ["day", dimension] if dimension else ["day"]
+        rows = (
+            open_purchase_orders()
+            .filter(expected_arrival__gte=start, expected_arrival__lt=end)
+            .annotate(day=TruncDate("expected_arrival"))
+            .values(*group_fields)
+            .annotate(
+                remaining_quantity=Sum(F("quantity") - F("received_quantity")),
+                order_count=Count("id"),
+                part_count=Count("part_key", distinct=True),
+            )
+            .order_by(*group_fields)
+        )
+        return [
+            {
+                "date": row["day"],
+                "key": row[dimension] if dimension else None,
+                "remaining_quantity": row["remaining_quantity"],
+                "order_count": row["order_count"],
+                "part_count": row["part_count"],
+            }
+            for row in rows
+        ]
+
+    cache_key = f"{date_from.isoformat()}:{date_to.isoformat()}:{dimension or 'all'}"
+    return get_or_build(CACHE_NAMESPACE, cache_key, build)
@@ -0,0 +1,40 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from base.caching import bump_cache_version
+from master.models import LocationCapacity
+
+from .models import Inventory, PurchaseOrder, Receipt, SalesOrder
+from .services.location_map import invalidate_location_map
+from .services.picking import INTERNAL_ORDER_PREFIX, refresh_picking_task
+from .services.putaway import invalidate_putaway_rules, record_slot_changes
+from .services.supply_calendar import CACHE_NAMESPACE as INBOUND_CALENDAR_CACHE
+
+
+@receiver([post_save, post_delete], sender=PurchaseOrder)
+@receiver([post_save, post_delete], sender=Receipt)
+def invalidate_inbound_calendar(sender, **kwargs):
+    """発注・入庫実績の変更時に入荷予定カレンダーのキャッシュを無効化します。"""
+    bump_cache_version(INBOUND_CALENDAR_CACHE)
+
+
+@receiver(post_save, sender=SalesOrder)
+def sync_picking_task(sender, instance, **kwargs):
+    """出庫予定の作成・変更をピッキング作業キューに反映します。"""
+    if instance.order_number.startswith(INTERNAL_ORDER_PREFIX):
+        return
+    refresh_picking_task(instance)
+
+
+@receiver([post_save, post_delete], sender=Inventory)
+def invalidate_warehouse_location_map(sender, instance, **kwargs):
+    """在庫の変更時に、その倉庫のロケーションマップのキャッシュを無効化し、入庫先インデックスに棚番の変更を記録します。"""
+    invalidate_location_map(instance.warehouse)
+    record_slot_changes([(instance.warehouse, instance.location)])
+
+
+@receiver([post_save, post_delete], sender=LocationCapacity)
+def invalidate_putaway_index(sender, instance, **kwargs):
+    """収容ルールの変更時に、その倉庫のロケーションマップと入庫先インデックスを無効化します。"""
+    invalidate_location_map(instance.warehouse)
+    invalidate_putaway_rules(instance.warehouse)
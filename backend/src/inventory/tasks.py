@@ -0,0 +1,57 @@
+from celery import shared_task
+
+from base.models import AsyncTask
+
+from .services.aging import run_inventory_aging
+from .services.forecasting import run_demand_forecast
+from .services.scan_ingest import drain_scan_shard, schedule_pending_drains
+
+
+@shared_task
+def drain_scan_shard_task(shard):
+    """スキャン取込ストリームの1シャードを在庫に反映します。"""
+    return drain_scan_shard(shard)
+
+
+@shared_task
+def drain_pending_scan_shards_task():
+    """未処理のスキャンが残っているシャードの取込を定期的にスケジュールします。"""
+    return schedule_pending_drains()
+
+
+@shared_task(bind=True)
+def run_demand_forecast_task(self, history_weeks=52, horizon_weeks=12):
+    """全品番の需要予測を計算し、進捗を AsyncTask に記録します。"""
+    task = AsyncTask.objects.get(task_id=self.request.id)
+    task.status = "STARTED"
+    task.save()
+
+    def on_progress(done, total):
+        task.progress = done
+        task.total = total
+        task.save(update_fields=["progress", "total", "updated_at"])
+
+    try:
+        summary = run_demand_forecast(history_weeks=history_weeks, horizon_weeks=horizon_weeks, on_progress=on_progress)
+        task.status = "SUCCESS"
+        task.result = {"forecasted_parts": summary}
+    except Exception as e:
+        task.status = "FAILURE"
+        task.result = {"error": str(e)}
+    task.save()
+
+
+@shared_task(bind=True)
+def run_inventory_aging_task(self, full=False):
+    """入出庫履歴からFIFO層を更新して在庫エイジングを再計算し、結果を AsyncTask に記録します。"""
+    task = AsyncTask.objects.get(task_id=self.request.id)
+    task.status = "STARTED"
+    task.save()
+
+    try:
+        task.result = run_inventory_aging(full=full)
+        task.status = "SUCCESS"
+    except Exception as e:
+        task.status = "FAILURE"
+        task.result = {"error": str(e)}
+    task.save()
@@ -1,9 +1,45 @@
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+
+from base.sync import decode_watermark, encode_watermark, get_changes
+from master.models import LocationCapacity, PartNumber
 
-from .models import Inventory, PurchaseOrder
+from .models import (
+    DemandForecast,
+    Inventory,
+    InventoryAging,
+    PickingTask,
+    PurchaseOrder,
+    SalesOrder,
+    SerialRange,
+    StockMovement,
+)
+from .rest_views import InventoryViewSet
+from .services import putaway
+from .services.aging import run_inventory_aging
+from .services.forecasting import croston, run_demand_forecast, select_method
+from .services.location_map import get_location_map
+from .services.picking import (
+    PickingTaskError,
+    claim_picking_tasks,
+    complete_picking_task,
+    release_picking_tasks,
+    sync_picking_tasks,
+)
+from .services.scan_ingest import apply_scans, drain_scan_shard, schedule_pending_drains
+from .services.serials import locate_serial, move_serials, parse_serial_ranges, register_serials
+from .services.supply_calendar import get_inbound_calendar
 
 User = get_user_model()
 
@@ -83,3 +119,430 @@ class PurchaseOrderAPITests(APITestCase):
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(PurchaseOrder.objects.count(), 1)
+
+
+class ScanIngestApplyTests(TestCase):
+    def _scan(self, scan_id, movement_type, quantity, location="A-01"):
+        return {
+            "scan_id": scan_id,
+            "part_number": "PART-001",
+            "warehouse": "WH-A",
+            "location": location,
+            "movement_type": movement_type,
+            "quantity": str(quantity),
+            "reference_document": "",
+            "scanned_at": "2026-01-01T09:00:00+09:00",
+            "operator_id": "",
+        }
+
+    def test_apply_scans_in_order(self):
+        """スキャンが順番どおりに在庫へ反映され、不足する出庫は失敗になることを確認"""
+        Inventory.objects.create(part_number="PART-001", warehouse="WH-A", location="A-01", quantity=5)
+
+        results = apply_scans(
+            [
+                self._scan("s1", "outgoing", 3),
+                self._scan("s2", "outgoing", 3),
+                self._scan("s3", "incoming", 10),
+                self._scan("s4", "incoming", 4, location="B-01"),
+            ]
+        )
+
+        self.assertEqual(results["s1"], ("applied", None))
+        self.assertEqual(results["s2"][0], "failed")
+        self.assertEqual(Inventory.objects.get(location="A-01").quantity, 12)
+        self.assertEqual(Inventory.objects.get(location="B-01").quantity, 4)
+        self.assertEqual(StockMovement.objects.count(), 3)
+
+    def test_redelivered_scans_are_not_applied_twice(self):
+        """再配信されたスキャンが二重に計上されないことを確認"""
+        apply_scans([self._scan("s1", "incoming", 5)])
+        results = apply_scans([self._scan("s1", "incoming", 5)], check_duplicates=True)
+
+        self.assertEqual(results["s1"], ("applied", None))
+        self.assertEqual(Inventory.objects.get().quantity, 5)
+
+    def test_scans_without_location_use_unlocated_rows(self):
+        """棚番なしのスキャンが既存の棚番なし (NULL) の在庫行に反映され、重複行を作らないことを確認"""
+        Inventory.objects.create(part_number="PART-001", warehouse="WH-A", location=None, quantity=5)
+
+        results = apply_scans(
+            [self._scan("s1", "outgoing", 2, location=""), self._scan("s2", "incoming", 4, location="")]
+        )
+
+        self.assertEqual(results["s1"], ("applied", None))
+        inventory = Inventory.objects.get()
+        self.assertEqual((inventory.location, inventory.quantity), (None, 7))
+        self.assertEqual(set(StockMovement.objects.values_list("location", flat=True)), {None})
+
+
+class ScanDrainRetryTests(TestCase):
+    """Redis は実サーバーがないテスト環境でも動くよう、ストリーム操作をモックして取込の再スケジュールだけを確認する"""
+
+    def _redis(self, pending):
+        r = mock.MagicMock()
+        r.lock.return_value.acquire.return_value = True
+        entries = [("1-0", {"scan_id": "s1"})]
+        # 1回目 (未ACKの読み直し) は空、2回目 (新着) でバッチを1つ返す
+        r.xreadgroup.side_effect = [[], [("stream", entries)]]
+        r.xlen.return_value = pending
+        r.set.return_value = True
+        return r
+
+    @override_settings(SCAN_INGEST_RETRY_DELAY_SECONDS=30)
+    def test_failed_batch_is_retried_without_new_scans(self):
+        """バッチの反映に失敗しても、新しいスキャンを待たずに時間をおいて取込が再スケジュールされることを確認"""
+        r = self._redis(pending=1)
+        with (
+            mock.patch("inventory.services.scan_ingest.get_redis", return_value=r),
+            mock.patch("inventory.services.scan_ingest.apply_scans", side_effect=RuntimeError("db down")),
+            mock.patch("inventory.tasks.drain_scan_shard_task.apply_async") as apply_async,
+        ):
+            with self.assertRaises(RuntimeError):
+                drain_scan_shard(3)
+            apply_async.assert_called_once_with((3,), countdown=30)
+            r.lock.return_value.release.assert_called_once()
+
+            # 定期実行は未処理の残っているシャードをすべてスケジュールし直す
+            apply_async.reset_mock()
+            r.pipeline.return_value.execute.return_value = [0, 0, 0, 2] + [0] * (settings.SCAN_INGEST_SHARDS - 4)
+            self.assertEqual(schedule_pending_drains(), 1)
+            apply_async.assert_called_once_with((3,), countdown=None)
+
+
+class DemandForecastTests(TestCase):
+    def test_croston_for_intermittent_demand(self):
+        """間欠需要の品番に Croston法が選ばれ、需要量/需要間隔で予測されることを確認"""
+        demand = np.array([[0, 0, 6, 0, 0, 6, 0, 0, 6, 0, 0, 6], [5] * 12], dtype=float)
+
+        methods, nonzero_weeks = select_method(demand)
+        forecast = croston(demand)
+
+        self.assertEqual(list(methods), ["croston", "exponential_smoothing"])
+        self.assertEqual(list(nonzero_weeks), [4, 12])
+        self.assertAlmostEqual(forecast[0], 2.0)
+        self.assertAlmostEqual(forecast[1], 5.0)
+
+    def test_run_demand_forecast_stores_forecasts(self):
+        """消費実績から品番ごとの予測が保存されることを確認"""
+        last_week = timezone.now() - timedelta(weeks=1)
+        StockMovement.objects.create(part_number="PART-001", movement_type="used", quantity=7, movement_date=last_week)
+
+        summary = run_demand_forecast(history_weeks=8, horizon_weeks=4)
+
+        self.assertEqual(summary, {"used": 1, "outgoing": 0})
+        forecast = DemandForecast.objects.get(part_number="PART-001", movement_type="used")
+        self.assertEqual(forecast.nonzero_weeks, 1)
+        self.assertEqual(forecast.horizon_weeks, 4)
+
+    def test_shelf_moves_and_adjustments_are_not_demand(self):
+        """棚番移動と在庫調整の出庫が消費実績に数えられず、予測が変わらないことを確認"""
+        user = User.objects.create_user(custom_id="forecaster")
+        inventory = Inventory.objects.create(part_number="PART-001", warehouse="WH-A", location="A-01", quantity=20)
+        StockMovement.objects.create(
+            part_number="PART-001",
+            movement_type="outgoing",
+            quantity=4,
+            movement_date=timezone.now() - timedelta(days=7),
+        )
+        run_demand_forecast(history_weeks=8, horizon_weeks=4)
+        before = DemandForecast.objects.values_list("weekly_forecast", "nonzero_weeks").get(movement_type="outgoing")
+
+        factory = APIRequestFactory()
+        for action, data in (
+            ("move", {"quantity_to_move": 5, "target_warehouse": "WH-A", "target_location": "B-01"}),
+            ("adjust", {"quantity": 12}),
+        ):
+            request = factory.post(f"/api/inventory/inventories/{inventory.pk}/{action}/", data, format="json")
+            force_authenticate(request, user=user)
+            response = InventoryViewSet.as_view({"post": action})(request, pk=str(inventory.pk))
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(StockMovement.objects.filter(movement_type="outgoing").count(), 3)
+
+        run_demand_forecast(history_weeks=8, horizon_weeks=4)
+        after = DemandForecast.objects.values_list("weekly_forecast", "nonzero_weeks").get(movement_type="outgoing")
+        self.assertEqual(after, before)
+
+
+class InboundCalendarTests(TestCase):
+    def test_calendar_groups_open_orders_and_is_invalidated(self):
+        """未入庫の発注が日付・倉庫ごとに集計され、発注の変更でキャッシュが無効化されることを確認"""
+        arrival = timezone.now() + timedelta(days=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            PurchaseOrder.objects.create(order_number="PO-1", quantity=10, warehouse="WH-A", expected_arrival=arrival)
+            PurchaseOrder.objects.create(
+                order_number="PO-2", quantity=5, received_quantity=5, status="fully_received", expected_arrival=arrival
+            )
+        date_from = timezone.localdate()
+
+        rows = get_inbound_calendar(date_from, date_from + timedelta(days=7), dimension="warehouse")
+        self.assertEqual([(r["key"], r["remaining_quantity"]) for r in rows], [("WH-A", 10)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PurchaseOrder.objects.create(order_number="PO-3", quantity=3, warehouse="WH-A", expected_arrival=arrival)
+        rows = get_inbound_calendar(date_from, date_from + timedelta(days=7), dimension="warehouse")
+        self.assertEqual(rows[0]["remaining_quantity"], 13)
+
+
+@override_settings(SYNC_SAFETY_LAG_SECONDS=0)
+class DeltaSyncTests(TestCase):
+    def test_changes_and_deletes_since_watermark(self):
+        """ウォーターマーク以降の変更と削除だけがページングされて返ることを確認"""
+        first = Inventory.objects.create(part_number="PART-001", warehouse="WH-A", location="A-01", quantity=1)
+        Inventory.objects.create(part_number="PART-002", warehouse="WH-A", location="A-02", quantity=2)
+
+        page = get_changes(["inventory"], None, limit=1)
+        self.assertTrue(page["has_more"])
+        page = get_changes(["inventory"], page["watermark"], limit=1)
+        self.assertFalse(page["has_more"])
+        self.assertEqual(page["resources"]["inventory"]["changed"][0]["part_number"], "PART-002")
+
+        first_id = str(first.pk)
+        first.delete()
+        page = get_changes(["inventory"], page["watermark"], limit=10)
+        self.assertEqual(page["resources"]["inventory"]["changed"], [])
+        self.assertEqual(page["resources"]["inventory"]["deleted"], [first_id])
+
+    def test_old_rows_page_without_full_resync(self):
+        """保持期間より古いレコードも複数ページで同期でき、長く変更のないリソースでも全件再同期にならないことを確認"""
+        for index in range(3):
+            Inventory.objects.create(part_number=f"PART-{index}", warehouse="WH-A", location="A-01", quantity=1)
+        Inventory.objects.update(last_updated=timezone.now() - timedelta(days=40))
+
+        page = get_changes(["inventory"], None, limit=2)
+        self.assertTrue(page["has_more"])
+        page = get_changes(["inventory"], page["watermark"], limit=2)
+        resource = page["resources"]["inventory"]
+        self.assertNotIn("full_resync_required", resource)
+        self.assertEqual([row["part_number"] for row in resource["changed"]], ["PART-2"])
+        page = get_changes(["inventory"], page["watermark"], limit=2)
+        self.assertEqual(page["resources"]["inventory"]["changed"], [])
+        self.assertNotIn("full_resync_required", page["resources"]["inventory"])
+
+        # 最後の同期が保持期間より古いクライアントには全件再同期を要求する
+        cursors = decode_watermark(page["watermark"])
+        cursors["inventory"]["synced_until"] = (timezone.now() - timedelta(days=40)).isoformat()
+        page = get_changes(["inventory"], encode_watermark(cursors), limit=2)
+        self.assertTrue(page["resources"]["inventory"]["full_resync_required"])
+
+
+class PickingQueueTests(TestCase):
+    def test_claim_and_partial_complete(self):
+        """取得済みの作業は他の作業者に渡らず、一部完了の残数が新しい作業になることを確認"""
+        picker1 = User.objects.create_user(custom_id="picker1", password="x")
+        picker2 = User.objects.create_user(custom_id="picker2", password="x")
+        Inventory.objects.create(part_number="PART-001", warehouse="WH-A", location="A-01", quantity=10)
+        order = SalesOrder.objects.create(order_number="SO-1", item="PART-001", quantity=6, warehouse="WH-A")
+        SalesOrder.objects.create(order_number="INT-1", item="PART-001", quantity=6, warehouse="WH-A")
+
+        claimed = claim_picking_tasks(picker1, "WH-A", limit=5)
+        self.assertEqual([(t.sales_order_id, t.location) for t in claimed], [(order.id, "A-01")])
+        self.assertEqual(claim_picking_tasks(picker2, "WH-A", limit=5), [])
+
+        complete_picking_task(picker1, claimed[0].id, quantity=4)
+
+        order.refresh_from_db()
+        self.assertEqual(order.shipped_quantity, 4)
+        self.assertEqual(Inventory.objects.get().quantity, 6)
+        remainder = PickingTask.objects.get(status="open")
+        self.assertEqual(remainder.quantity, 2)
+
+    def test_canceled_orders_cannot_be_picked_or_released(self):
+        """取得後に出庫予定が取り消された作業は完了できず、解放するとキャンセルされることを確認"""
+        picker = User.objects.create_user(custom_id="picker1", password="x")
+        Inventory.objects.create(part_number="PART-001", warehouse="WH-A", location="A-01", quantity=10)
+        order = SalesOrder.objects.create(order_number="SO-1", item="PART-001", quantity=5, warehouse="WH-A")
+        task = claim_picking_tasks(picker, "WH-A")[0]
+        order.status = "canceled"
+        order.save()
+
+        with self.assertRaises(PickingTaskError):
+            complete_picking_task(picker, task.id)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.shipped_quantity), ("canceled", 0))
+        self.assertEqual(Inventory.objects.get().quantity, 10)
+        self.assertFalse(StockMovement.objects.filter(movement_type="outgoing").exists())
+
+        self.assertEqual(release_picking_tasks(picker, [task.id]), 0)
+        task.refresh_from_db()
+        self.assertEqual(task.status, "canceled")
+        self.assertEqual(claim_picking_tasks(picker, "WH-A"), [])
+
+    def test_sync_suggests_locations_in_one_query(self):
+        """作業の一括作成で、推奨棚番が出庫予定の件数に関係なく1回のクエリで決まることを確認"""
+        self.addCleanup(PartNumber.objects.clear_cache)
+        for part, location, quantity in (("PART-001", "A-01", 3), ("PART-001", "A-02", 8), ("PART-002", "B-01", 5)):
+            Inventory.objects.create(part_number=part, warehouse="WH-A", location=location, quantity=quantity)
+        for index, part in enumerate(["PART-001", "PART-002", "PART-001", "PART-003"]):
+            SalesOrder.objects.create(order_number=f"SO-{index}", item=part, quantity=1, warehouse="WH-A")
+        PickingTask.objects.all().delete()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sync_picking_tasks(), 4)
+        inventory_queries = [q for q in queries.captured_queries if '"inventory_inventory"' in q["sql"]]
+        self.assertEqual(len(inventory_queries), 1)
+        self.assertEqual(
+            sorted(PickingTask.objects.values_list("part_number", "location")),
+            [("PART-001", "A-02"), ("PART-001", "A-02"), ("PART-002", "B-01"), ("PART-003", None)],
+        )
+
+
+class LocationMapTests(TestCase):
+    def setUp(self):
+        # コミット時コールバックで品番キーがキャッシュされるため、ロールバック後に持ち越さないようにする
+        self.addCleanup(PartNumber.objects.clear_cache)
+
+    def test_location_map_rollup_and_invalidation(self):
+        """棚番ごと・通路ごとの集計が返り、在庫の更新でキャッシュが無効化されることを確認"""
+        with self.captureOnCommitCallbacks(execute=True):
+            Inventory.objects.create(part_number="PART-001", warehouse="WH-A", location="A-01-1", quantity=5)
+            Inventory.objects.create(part_number="PART-002", warehouse="WH-A", location="A-01-1", quantity=3)
+            Inventory.objects.create(part_number="PART-001", warehouse="WH-A", location="A-02-1", quantity=2)
+            Inventory.objects.create(part_number="PART-001", warehouse="WH-B", location="B-01-1", quantity=9)
+
+        rows = get_location_map("WH-A")
+        self.assertEqual(
+            [(r["location"], r["part_count"], r["total_quantity"]) for r in rows], [("A-01-1", 2, 8), ("A-02-1", 1, 2)]
+        )
+        self.assertEqual(rows[0]["rack"], "A-01")
+        aisles = get_location_map("WH-A", group_by="aisle")
+        self.assertEqual([(r["aisle"], r["part_count"], r["location_count"]) for r in aisles], [("A", 2, 2)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Inventory.objects.create(part_number="PART-003", warehouse="WH-A", location="A-02-1", quantity=1)
+        self.assertEqual(get_location_map("WH-A")[1]["part_count"], 2)
+
+
+class PutawaySuggestionTests(TestCase):
+    def setUp(self):
+        self.addCleanup(PartNumber.objects.clear_cache)
+        self.addCleanup(putaway._indexes.clear)
+
+    def test_suggestions_respect_capacity_and_batch_reservations(self):
+        """同じ品番の棚番が優先され、容量超過の棚番は除外され、バッチ内で空き棚番を取り合わないことを確認"""
+        with self.captureOnCommitCallbacks(execute=True):
+            LocationCapacity.objects.create(warehouse="WH-A", location_prefix="A-", max_quantity=10, max_parts=1)
+            Inventory.objects.create(part_number="PART-001", warehouse="WH-A", location="A-01-1", quantity=5)
+            Inventory.objects.create(part_number="PART-002", warehouse="WH-A", location="A-02-1", quantity=0)
+            Inventory.objects.create(part_number="PART-002", warehouse="WH-A", location="A-03-1", quantity=0)
+
+        results = putaway.suggest_putaway(
+            [
+                {"part_number": "PART-001", "quantity": 3, "warehouse": "WH-A"},
+                {"part_number": "PART-009", "quantity": 1, "warehouse": "WH-A"},
+                {"part_number": "PART-001", "quantity": 8, "warehouse": "WH-A"},
+            ]
+        )
+        first, second, third = ([s["location"] for s in r["suggestions"]] for r in results)
+        self.assertEqual(first, ["A-01-1", "A-02-1", "A-03-1"])
+        self.assertEqual(results[0]["suggestions"][0]["remaining_capacity"], 2)
+        # A-01-1 は第1明細で予約済み・他品番不可のため空き棚番から提案される
+        self.assertEqual(second, ["A-02-1", "A-03-1"])
+        # A-01-1 は容量超過、A-02-1 は PART-009 で予約済みのため A-03-1 のみ
+        self.assertEqual(third, ["A-03-1"])
+
+    def test_inventory_writes_update_only_changed_slots(self):
+        """在庫の変更では変更された棚番だけを読み直し、収容ルールの変更では再構築することを確認"""
+        with self.captureOnCommitCallbacks(execute=True):
+            LocationCapacity.objects.create(warehouse="WH-A", location_prefix="A-", max_quantity=10, max_parts=1)
+            Inventory.objects.create(part_number="PART-001", warehouse="WH-A", location="A-01-1", quantity=5)
+            empty = Inventory.objects.create(part_number="PART-002", warehouse="WH-A", location="A-02-1", quantity=0)
+        index = putaway.get_putaway_index("WH-A")
+        self.assertEqual(index.free_slots, ["A-02-1"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            empty.quantity = 4
+            empty.save()
+            Inventory.objects.create(part_number="PART-002", warehouse="WH-A", location="A-03-1", quantity=0)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIs(putaway.get_putaway_index("WH-A"), index)
+        # 変更された棚番の在庫を読む1回だけで、収容ルールは読み直さない
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(index.free_slots, ["A-03-1"])
+        self.assertEqual(index.part_slots[PartNumber.objects.key_for("PART-002")], ["A-02-1"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            LocationCapacity.objects.filter(warehouse="WH-A").get().save()
+        self.assertIsNot(putaway.get_putaway_index("WH-A"), index)
+
+
+@override_settings(INVENTORY_AGING_SAFETY_LAG_SECONDS=0)
+class InventoryAgingTests(TestCase):
+    def _movement(self, movement_type, quantity, days_ago):
+        StockMovement.objects.create(
+            part_number="PART-001",
+            warehouse="WH-A",
+            movement_type=movement_type,
+            quantity=quantity,
+            movement_date=timezone.now() - timedelta(days=days_ago),
+        )
+
+    def test_fifo_layers_are_updated_incrementally(self):
+        """払出が古い受入から消し込まれ、差分実行で前回の層から続けて計算されることを確認"""
+        self._movement("incoming", 10, 120)
+        self._movement("incoming", 5, 60)
+        self._movement("used", 12, 50)
+        run_inventory_aging()
+
+        aging = InventoryAging.objects.get()
+        self.assertEqual((aging.on_hand, aging.quantity_31_90, aging.quantity_over_90), (3, 3, 0))
+
+        self._movement("incoming", 4, 1)
+        self._movement("outgoing", 2, 0)
+        summary = run_inventory_aging()
+
+        self.assertEqual(summary["movements"], 2)
+        aging.refresh_from_db()
+        self.assertEqual((aging.on_hand, aging.quantity_0_30, aging.quantity_31_90), (5, 4, 1))
+
+    def test_shelf_moves_and_adjustments_keep_receipt_age(self):
+        """同じ倉庫内の棚番移動と在庫調整で、受入日が今日に付け替えられないことを確認"""
+        self._movement("incoming", 10, 120)
+        inventory = Inventory.objects.create(part_number="PART-001", warehouse="WH-A", location="A-01", quantity=10)
+        user = User.objects.create_user(custom_id="aging")
+        factory = APIRequestFactory()
+        for action, data in (
+            ("move", {"quantity_to_move": 4, "target_warehouse": "WH-A", "target_location": "B-01"}),
+            ("adjust", {"quantity": 5}),
+        ):
+            request = factory.post(f"/api/inventory/inventories/{inventory.pk}/{action}/", data, format="json")
+            force_authenticate(request, user=user)
+            self.assertEqual(InventoryViewSet.as_view({"post": action})(request, pk=str(inventory.pk)).status_code, 200)
+        # 参照ドキュメントで対を結び付ける前に記録された棚番移動
+        StockMovement.objects.create(
+            part_number="PART-001",
+            warehouse="WH-A",
+            movement_type="outgoing",
+            quantity=2,
+            description="棚番移動: WH-A の C-01 へ",
+        )
+
+        run_inventory_aging()
+        aging = InventoryAging.objects.get()
+        self.assertEqual((aging.on_hand, aging.quantity_0_30, aging.quantity_over_90), (10, 0, 10))
+
+    @override_settings(INVENTORY_AGING_SAFETY_LAG_SECONDS=300)
+    def test_recent_movements_wait_for_the_safety_lag(self):
+        """直近に作成された履歴はウォーターマークを進めず、次回以降の実行で反映されることを確認"""
+        self._movement("incoming", 10, 120)
+        summary = run_inventory_aging()
+        self.assertEqual(summary["movements"], 0)
+
+        with override_settings(INVENTORY_AGING_SAFETY_LAG_SECONDS=0):
+            self.assertEqual(run_inventory_aging()["movements"], 1)
+
+
+class SerialRangeTests(TestCase):
+    def test_ranges_split_and_merge_as_units_move(self):
+        """一部の移動で範囲が分割され、戻すと1つの範囲に結合されることを確認"""
+        register_serials("PART-001", parse_serial_ranges([{"from": "SN-0001", "to": "SN-0100"}]), "WH-A", "A-01")
+
+        move_serials("PART-001", parse_serial_ranges([{"from": "SN-0040", "to": "SN-0049"}]), "WH-A", "B-01")
+        self.assertEqual(SerialRange.objects.count(), 3)
+        self.assertEqual(locate_serial("PART-001", "SN-0045").location, "B-01")
+        self.assertEqual(locate_serial("PART-001", "SN-0050").location, "A-01")
+        self.assertIsNone(locate_serial("PART-001", "SN-0101"))
+
+        move_serials("PART-001", parse_serial_ranges([{"from": "SN-0040", "to": "SN-0049"}]), "WH-A", "A-01")
+        merged = SerialRange.objects.get()
+        self.assertEqual((merged.first_serial, merged.last_serial, merged.location), ("SN-0001", "SN-0100", "A-01"))
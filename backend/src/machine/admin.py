@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Machine
+from .models import Machine, MachineCapability
 
 # Register your models here.
 
@@ -10,3 +10,10 @@ class MachineAdmin(admin.ModelAdmin):
     list_display = ("machine_number", "name", "location", "created_at")
     search_fields = ("machine_number", "name", "location")
     list_filter = ("created_at",)
+
+
+@admin.register(MachineCapability)
+class MachineCapabilityAdmin(admin.ModelAdmin):
+    list_display = ("machine", "product_code", "units_per_hour", "setup_minutes", "is_active")
+    list_filter = ("is_active", "machine")
+    search_fields = ("machine__machine_number", "product_code")
@@ -7,6 +7,7 @@ app_name = "machine_api"
 
 router = DefaultRouter()
 router.register(r"machines", rest_views.MachineViewSet, basename="machine")
+router.register(r"machine-capabilities", rest_views.MachineCapabilityViewSet, basename="machine-capability")
 
 urlpatterns = [
     path("", include(router.urls)),
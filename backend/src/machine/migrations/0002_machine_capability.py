@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:45
+
+import django.db.models.deletion
+import uuid6
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machine', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MachineCapability',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False)),
+                ('product_code', models.CharField(max_length=100, verbose_name='製品コード')),
+                ('units_per_hour', models.DecimalField(decimal_places=3, max_digits=12, verbose_name='処理能力 (個/時)')),
+                ('setup_minutes', models.PositiveIntegerField(default=0, verbose_name='段取り時間 (分)')),
+                ('is_active', models.BooleanField(default=True, verbose_name='有効')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('machine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='capabilities', to='machine.machine', verbose_name='設備')),
+            ],
+            options={
+                'verbose_name': '設備能力',
+                'verbose_name_plural': '設備能力',
+                'ordering': ['machine', 'product_code'],
+                'constraints': [models.UniqueConstraint(fields=('machine', 'product_code'), name='machine_capability_unique')],
+            },
+        ),
+    ]
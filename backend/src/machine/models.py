@@ -21,3 +21,31 @@ class Machine(models.Model):
         verbose_name = "設備"
         verbose_name_plural = "設備"
         ordering = ["machine_number"]
+
+
+class MachineCapability(models.Model):
+    """
+    設備で生産できる製品と、その処理能力・段取り時間。
+    生産スケジューラはこの表に登録された設備だけに生産計画を割り当てます。
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
+    machine = models.ForeignKey(Machine, on_delete=models.CASCADE, related_name="capabilities", verbose_name="設備")
+    product_code = models.CharField(max_length=100, verbose_name="製品コード")
+    units_per_hour = models.DecimalField(max_digits=12, decimal_places=3, verbose_name="処理能力 (個/時)")
+    # 直前に別の製品を生産していた場合に、この製品に切り替えるための段取り時間
+    setup_minutes = models.PositiveIntegerField(default=0, verbose_name="段取り時間 (分)")
+    is_active = models.BooleanField(default=True, verbose_name="有効")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.machine.machine_number} - {self.product_code} ({self.units_per_hour}/h)"
+
+    class Meta:
+        verbose_name = "設備能力"
+        verbose_name_plural = "設備能力"
+        ordering = ["machine", "product_code"]
+        constraints = [
+            models.UniqueConstraint(fields=["machine", "product_code"], name="machine_capability_unique"),
+        ]
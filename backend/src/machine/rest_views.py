@@ -3,8 +3,8 @@ from rest_framework.permissions import IsAuthenticated
 
 from master.rest_views import CustomSuccessMessageMixin
 
-from .models import Machine
-from .serializers import MachineCreateUpdateSerializer, MachineSerializer
+from .models import Machine, MachineCapability
+from .serializers import MachineCapabilitySerializer, MachineCreateUpdateSerializer, MachineSerializer
 
 
 class MachineViewSet(CustomSuccessMessageMixin, viewsets.ModelViewSet):
@@ -19,3 +19,23 @@ class MachineViewSet(CustomSuccessMessageMixin, viewsets.ModelViewSet):
         if self.action in ["list"]:
             return MachineSerializer
         return MachineCreateUpdateSerializer
+
+
+class MachineCapabilityViewSet(CustomSuccessMessageMixin, viewsets.ModelViewSet):
+    """
+    API endpoint for managing which products each machine can produce.
+    """
+
+    queryset = MachineCapability.objects.select_related("machine").order_by("machine__machine_number", "product_code")
+    serializer_class = MachineCapabilitySerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        machine_id = self.request.query_params.get("machine")
+        if machine_id:
+            queryset = queryset.filter(machine_id=machine_id)
+        product_code = self.request.query_params.get("product_code")
+        if product_code:
+            queryset = queryset.filter(product_code=product_code)
+        return queryset
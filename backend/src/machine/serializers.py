@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 
-from .models import Machine
+from .models import Machine, MachineCapability
 
 
 class MachineSerializer(serializers.ModelSerializer):
@@ -21,3 +21,27 @@ class MachineCreateUpdateSerializer(serializers.ModelSerializer):
                 ],
             },
         }
+
+
+class MachineCapabilitySerializer(serializers.ModelSerializer):
+    machine_number = serializers.CharField(source="machine.machine_number", read_only=True)
+
+    class Meta:
+        model = MachineCapability
+        fields = [
+            "id",
+            "machine",
+            "machine_number",
+            "product_code",
+            "units_per_hour",
+            "setup_minutes",
+            "is_active",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = ["id", "created_at", "updated_at"]
+
+    def validate_units_per_hour(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("処理能力は0より大きい値を指定してください。")
+        return value
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Item, Supplier, Warehouse
+from .models import Item, LocationCapacity, OutputRoutingRule, PartNumber, Supplier, Warehouse
 
 # Register your models here.
 
@@ -28,3 +28,22 @@ class SupplierAdmin(admin.ModelAdmin):
 
 
 admin.site.register(Warehouse)
+
+
+@admin.register(PartNumber)
+class PartNumberAdmin(admin.ModelAdmin):
+    list_display = ("id", "code", "created_at")
+    search_fields = ("code",)
+
+
+@admin.register(LocationCapacity)
+class LocationCapacityAdmin(admin.ModelAdmin):
+    list_display = ("warehouse", "location_prefix", "max_quantity", "max_parts", "allow_putaway", "priority")
+    list_filter = ("warehouse", "allow_putaway")
+
+
+@admin.register(OutputRoutingRule)
+class OutputRoutingRuleAdmin(admin.ModelAdmin):
+    list_display = ("product_code", "machine", "warehouse", "location", "is_active")
+    list_filter = ("warehouse", "is_active")
+    search_fields = ("product_code",)
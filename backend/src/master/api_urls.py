@@ -9,6 +9,8 @@ router = DefaultRouter()
 router.register(r"items", rest_views.ItemViewSet, basename="item")
 router.register(r"suppliers", rest_views.SupplierViewSet, basename="supplier")
 router.register(r"warehouses", rest_views.WarehouseViewSet, basename="warehouse")
+router.register(r"location-capacities", rest_views.LocationCapacityViewSet, basename="location-capacity")
+router.register(r"output-routing-rules", rest_views.OutputRoutingRuleViewSet, basename="output-routing-rule")
 
 urlpatterns = [
     path("", include(router.urls)),
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('master', '0006_alter_item_provision_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartNumber',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('code', models.CharField(max_length=255, unique=True, verbose_name='品番')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': '品番辞書',
+                'verbose_name_plural': '品番辞書',
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:25
+
+import uuid6
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('master', '0008_sync_watermarks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LocationCapacity',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False)),
+                ('warehouse', models.CharField(max_length=255, verbose_name='倉庫')),
+                ('location_prefix', models.CharField(blank=True, default='', max_length=255, verbose_name='棚番の接頭辞')),
+                ('max_quantity', models.PositiveIntegerField(blank=True, null=True, verbose_name='最大収容数量')),
+                ('max_parts', models.PositiveSmallIntegerField(default=1, verbose_name='混載可能な品番数')),
+                ('allow_putaway', models.BooleanField(default=True, verbose_name='入庫提案の対象')),
+                ('priority', models.PositiveSmallIntegerField(default=100, verbose_name='優先順位')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '棚番収容ルール',
+                'verbose_name_plural': '棚番収容ルール',
+                'ordering': ['warehouse', 'location_prefix'],
+                'constraints': [models.UniqueConstraint(fields=('warehouse', 'location_prefix'), name='unique_location_capacity')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:58
+
+import django.db.models.deletion
+import uuid6
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('machine', '0002_machine_capability'),
+        ('master', '0009_location_capacity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutputRoutingRule',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False)),
+                ('product_code', models.CharField(blank=True, default='', max_length=255, verbose_name='製品コード')),
+                ('warehouse', models.CharField(max_length=255, verbose_name='入庫倉庫')),
+                ('location', models.CharField(blank=True, default='', max_length=255, verbose_name='入庫棚番')),
+                ('is_active', models.BooleanField(default=True, verbose_name='有効')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('machine', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='output_routing_rules', to='machine.machine', verbose_name='設備')),
+            ],
+            options={
+                'verbose_name': '完成品入庫ルール',
+                'verbose_name_plural': '完成品入庫ルール',
+                'ordering': ['product_code', 'machine'],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('machine__isnull', False)), fields=('product_code', 'machine'), name='unique_output_routing_machine'), models.UniqueConstraint(condition=models.Q(('machine__isnull', True)), fields=('product_code',), name='unique_output_routing_product')],
+            },
+        ),
+    ]
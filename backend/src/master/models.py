@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from uuid6 import uuid7
 
 
@@ -34,6 +34,7 @@ class Item(models.Model):
         verbose_name="支給種別",
     )  # 有償支給、無償支給等
     created_at = models.DateTimeField(auto_now_add=True)  # 登録日時
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # 更新日時 (差分同期用)
 
     def __str__(self):
         return f"{self.name} ({self.get_item_type_display()})"
@@ -50,6 +51,7 @@ class Supplier(models.Model):
     email = models.EmailField(blank=True, null=True)  # メールアドレス
     address = models.TextField(blank=True, null=True)  # 住所
     created_at = models.DateTimeField(auto_now_add=True)  # 登録日時
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # 更新日時 (差分同期用)
 
     def __str__(self):
         return f"{self.supplier_number} - {self.name}"
@@ -61,6 +63,147 @@ class Warehouse(models.Model):
     warehouse_number = models.CharField(max_length=50, unique=True)  # 倉庫番号（ユニーク）
     name = models.CharField(max_length=255)  # 倉庫名
     location = models.CharField(max_length=255, blank=True, null=True)  # 住所や場所情報
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # 更新日時 (差分同期用)
 
     def __str__(self):
         return f"{self.warehouse_number} - {self.name}"
+
+
+
+# 棚番の収容ルール (入庫時の棚番提案で使用)
+class LocationCapacity(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
+    warehouse = models.CharField(max_length=255, verbose_name="倉庫")
+    location_prefix = models.CharField(
+        max_length=255, blank=True, default="", verbose_name="棚番の接頭辞"
+    )  # 空の場合は倉庫内のすべての棚番に適用 (最も長い接頭辞のルールが優先されます)
+    max_quantity = models.PositiveIntegerField(null=True, blank=True, verbose_name="最大収容数量")  # 空欄は無制限
+    max_parts = models.PositiveSmallIntegerField(default=1, verbose_name="混載可能な品番数")
+    allow_putaway = models.BooleanField(default=True, verbose_name="入庫提案の対象")
+    priority = models.PositiveSmallIntegerField(default=100, verbose_name="優先順位")  # 小さいほど優先して空き棚を提案
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "棚番収容ルール"
+        verbose_name_plural = "棚番収容ルール"
+        ordering = ["warehouse", "location_prefix"]
+        constraints = [
+            models.UniqueConstraint(fields=["warehouse", "location_prefix"], name="unique_location_capacity"),
+        ]
+
+    def __str__(self):
+        return f"{self.warehouse} {self.location_prefix or '*'}"
+
+
+# 完成品の入庫先ルール (生産完了時に完成品在庫を計上する倉庫・棚番)
+class OutputRoutingRule(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
+    product_code = models.CharField(
+        max_length=255, blank=True, default="", verbose_name="製品コード"
+    )  # 空の場合はすべての製品に適用
+    machine = models.ForeignKey(
+        "machine.Machine",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="output_routing_rules",
+        verbose_name="設備",
+    )  # 空の場合はすべての設備に適用 (製品・設備の両方が一致するルールが最も優先されます)
+    warehouse = models.CharField(max_length=255, verbose_name="入庫倉庫")
+    location = models.CharField(max_length=255, blank=True, default="", verbose_name="入庫棚番")
+    is_active = models.BooleanField(default=True, verbose_name="有効")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "完成品入庫ルール"
+        verbose_name_plural = "完成品入庫ルール"
+        ordering = ["product_code", "machine"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product_code", "machine"],
+                condition=models.Q(machine__isnull=False),
+                name="unique_output_routing_machine",
+            ),
+            models.UniqueConstraint(
+                fields=["product_code"], condition=models.Q(machine__isnull=True), name="unique_output_routing_product"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product_code or '*'} / {self.machine_id or '*'} -> {self.warehouse} {self.location}".rstrip()
+
+
+class PartNumberManager(models.Manager):
+    """
+    品番文字列と整数キーの対応を解決するマネージャー。
+    確定済みの対応はプロセス内にキャッシュし、書き込みのたびにクエリが発生しないようにします。
+    """
+
+    _cache = {}
+
+    def key_for(self, code):
+        """品番文字列に対応するキーを返します。未登録の品番は自動的に登録されます。"""
+        if not code:
+            return None
+        key = self._cache.get(code)
+        if key is None:
+            key = self.keys_for([code])[code]
+        return key
+
+    def keys_for(self, codes):
+        """複数の品番文字列をまとめて解決し、{品番: キー} の辞書を返します。"""
+        codes = {code for code in codes if code}
+        result = {code: self._cache[code] for code in codes if code in self._cache}
+        missing = codes - result.keys()
+        if missing:
+            self.bulk_create([self.model(code=code) for code in missing], ignore_conflicts=True)
+            fetched = dict(self.filter(code__in=missing).values_list("code", "id"))
+            result.update(fetched)
+            # ロールバックされたキーをキャッシュしないよう、コミット後にのみキャッシュへ反映します
+            transaction.on_commit(lambda: self._cache.update(fetched))
+        return result
+
+    def existing_keys_for(self, codes):
+        """登録済みの品番だけを解決し、{品番: キー} の辞書を返します (未登録の品番は登録せず、結果に含めません)。"""
+        codes = {code for code in codes if code}
+        result = {code: self._cache[code] for code in codes if code in self._cache}
+        missing = codes - result.keys()
+        if missing:
+            result.update(self.filter(code__in=missing).values_list("code", "id"))
+        return result
+
+    def clear_cache(self):
+        """プロセス内のキャッシュを破棄します (主にテストでロールバックされたキーを捨てるため)。"""
+        self._cache.clear()
+
+
+# 品番辞書 (品番文字列を整数キーに置き換えるための辞書テーブル)
+class PartNumber(models.Model):
+    id = models.AutoField(primary_key=True)  # 4バイト整数キー
+    code = models.CharField(max_length=255, unique=True, verbose_name="品番")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = PartNumberManager()
+
+    class Meta:
+        verbose_name = "品番辞書"
+        verbose_name_plural = "品番辞書"
+
+    def __str__(self):
+        return self.code
+
+
+class PartKeyMixin:
+    """
+    品番文字列フィールド (part_key_source) から品番キー (part_key) を自動で設定するミックスイン。
+    bulk_create / bulk_update を使う場合は PartNumber.objects.keys_for() で明示的に設定してください。
+    """
+
+    part_key_source = "part_number"
+
+    def save(self, *args, **kwargs):
+        self.part_key_id = PartNumber.objects.key_for(getattr(self, self.part_key_source))
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and self.part_key_source in update_fields:
+            kwargs["update_fields"] = {*update_fields, "part_key"}
+        super().save(*args, **kwargs)
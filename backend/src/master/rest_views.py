@@ -3,10 +3,12 @@ from rest_framework import status, viewsets
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from .models import Item, Supplier, Warehouse  # master.models を直接参照
+from .models import Item, LocationCapacity, OutputRoutingRule, Supplier, Warehouse  # master.models を直接参照
 from .serializers import (
     ItemCreateUpdateSerializer,
     ItemSerializer,
+    LocationCapacitySerializer,
+    OutputRoutingRuleSerializer,
     SupplierCreateUpdateSerializer,
     SupplierSerializer,
     WarehouseCreateUpdateSerializer,
@@ -104,3 +106,15 @@ class WarehouseViewSet(CustomSuccessMessageMixin, viewsets.ModelViewSet):
         if self.action in ["list"]:
             return WarehouseSerializer
         return WarehouseCreateUpdateSerializer
+
+
+class LocationCapacityViewSet(CustomSuccessMessageMixin, viewsets.ModelViewSet):
+    queryset = LocationCapacity.objects.all().order_by("warehouse", "location_prefix")
+    serializer_class = LocationCapacitySerializer
+    permission_classes = [IsAuthenticated]
+
+
+class OutputRoutingRuleViewSet(CustomSuccessMessageMixin, viewsets.ModelViewSet):
+    queryset = OutputRoutingRule.objects.all().order_by("product_code", "machine")
+    serializer_class = OutputRoutingRuleSerializer
+    permission_classes = [IsAuthenticated]
@@ -1,7 +1,7 @@
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 
-from .models import Item, Supplier, Warehouse
+from .models import Item, LocationCapacity, OutputRoutingRule, Supplier, Warehouse
 
 
 class ItemSerializer(serializers.ModelSerializer):
@@ -117,3 +117,16 @@ class WarehouseCreateUpdateSerializer(serializers.ModelSerializer):
                 ],
             },
         }
+
+
+class LocationCapacitySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = LocationCapacity
+        fields = ["id", "warehouse", "location_prefix", "max_quantity", "max_parts", "allow_putaway", "priority"]
+
+
+class OutputRoutingRuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OutputRoutingRule
+        fields = ["id", "product_code", "machine", "warehouse", "location", "is_active", "updated_at"]
+        read_only_fields = ["id", "updated_at"]
@@ -1 +1,21 @@
-# Create your tests here.
+from django.test import TestCase
+
+from inventory.models import Inventory, StockMovement
+from master.models import PartNumber
+
+
+class PartNumberTests(TestCase):
+    def test_part_key_is_assigned_on_save(self):
+        """品番文字列の保存時に品番キーが自動で設定されることを確認"""
+        inventory = Inventory.objects.create(part_number="PART-001", warehouse="WH-A", quantity=10)
+        movement = StockMovement.objects.create(part_number="PART-001", movement_type="incoming", quantity=10)
+
+        self.assertIsNotNone(inventory.part_key_id)
+        self.assertEqual(inventory.part_key_id, movement.part_key_id)
+        self.assertEqual(PartNumber.objects.get(pk=inventory.part_key_id).code, "PART-001")
+
+    def test_keys_for_resolves_many_codes(self):
+        """複数の品番をまとめて解決できることを確認"""
+        keys = PartNumber.objects.keys_for(["A", "B", "A", None])
+        self.assertEqual(set(keys), {"A", "B"})
+        self.assertEqual(PartNumber.objects.count(), 2)
@@ -1,13 +1,30 @@
 from django.contrib import admin
 
-from .models import MaterialAllocation, PartsUsed, ProductionPlan, WorkProgress
+from .models import (
+    BomClosure,
+    MaterialAllocation,
+    MrpRun,
+    PartsUsed,
+    ProductionKpiDaily,
+    ProductionPlan,
+    ScheduleRun,
+    WorkProgress,
+)
 
 # Register your models here.
 
 
 @admin.register(ProductionPlan)
 class ProductionPlanAdmin(admin.ModelAdmin):
-    list_display = ("plan_name", "product_code", "planned_quantity", "planned_start_datetime", "status", "created_at")
+    list_display = (
+        "plan_name",
+        "product_code",
+        "planned_quantity",
+        "planned_start_datetime",
+        "priority",
+        "status",
+        "created_at",
+    )
     list_filter = ("status", "planned_start_datetime")
     search_fields = ("plan_name", "product_code")
     date_hierarchy = "planned_start_datetime"
@@ -45,3 +62,42 @@ class WorkProgressAdmin(admin.ModelAdmin):
     list_filter = ("status", "process_step", "operator")
     search_fields = ("production_plan__plan_name", "process_step", "operator__username")
     autocomplete_fields = ["production_plan", "operator"]
+
+
+@admin.register(BomClosure)
+class BomClosureAdmin(admin.ModelAdmin):
+    list_display = ("ancestor_code", "descendant_code", "depth", "max_depth", "extended_quantity", "is_leaf")
+    list_filter = ("depth", "is_leaf")
+    search_fields = ("ancestor_code", "descendant_code")
+    readonly_fields = [field.name for field in BomClosure._meta.fields]
+
+
+@admin.register(MrpRun)
+class MrpRunAdmin(admin.ModelAdmin):
+    list_display = ("start_date", "status", "bucket_days", "horizon_days", "created_by", "finished_at")
+    list_filter = ("status",)
+    readonly_fields = ("task", "summary", "started_at", "finished_at", "created_at")
+
+
+@admin.register(ScheduleRun)
+class ScheduleRunAdmin(admin.ModelAdmin):
+    list_display = ("start_from", "status", "grouping_hours", "created_by", "finished_at", "committed_at")
+    list_filter = ("status",)
+    readonly_fields = ("task", "summary", "started_at", "finished_at", "committed_at", "created_at")
+
+
+@admin.register(ProductionKpiDaily)
+class ProductionKpiDailyAdmin(admin.ModelAdmin):
+    list_display = (
+        "date",
+        "product_code",
+        "operator",
+        "completed_plans",
+        "good_quantity",
+        "reported_quantity",
+        "defective_quantity",
+        "late_plans",
+    )
+    list_filter = ("date",)
+    search_fields = ("product_code",)
+    readonly_fields = [field.name for field in ProductionKpiDaily._meta.fields]
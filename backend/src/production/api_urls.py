@@ -8,6 +8,10 @@ router.register(r"plans", rest_views.ProductionPlanViewSet, basename="production
 router.register(r"parts-used", rest_views.PartsUsedViewSet, basename="parts-used")
 router.register(r"material-allocations", rest_views.MaterialAllocationViewSet, basename="material-allocation")
 router.register(r"work-progress", rest_views.WorkProgressViewSet, basename="work-progress")
+router.register(r"bom", rest_views.BomViewSet, basename="bom")
+router.register(r"mrp-runs", rest_views.MrpRunViewSet, basename="mrp-run")
+router.register(r"schedule-runs", rest_views.ScheduleRunViewSet, basename="schedule-run")
+router.register(r"kpis", rest_views.ProductionKpiViewSet, basename="production-kpi")
 
 app_name = "production_api"
 
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from production.services import rebuild_production_kpis
+
+
+class Command(BaseCommand):
+    help = "完了済みの生産計画から生産KPI日次集計を作り直します (導入時のバックフィルやデータ修正後)。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--date-from", help="対象の開始日 (YYYY-MM-DD、完了日基準)。省略時は最初から")
+        parser.add_argument("--date-to", help="対象の終了日 (YYYY-MM-DD、完了日基準)。省略時は最後まで")
+
+    def handle(self, *args, **options):
+        dates = {}
+        for name in ("date_from", "date_to"):
+            value = options[name]
+            if value:
+                try:
+                    dates[name] = parse_date(value)
+                except ValueError:
+                    dates[name] = None
+                if dates[name] is None:
+                    raise CommandError(f"--{name.replace('_', '-')} の形式が不正です: {value}")
+        rows = rebuild_production_kpis(**dates)
+        self.stdout.write(self.style.SUCCESS(f"生産KPI日次集計を {rows} 行作成しました。"))
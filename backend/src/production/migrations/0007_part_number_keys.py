@@ -0,0 +1,39 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_part_keys(apps, schema_editor):
+    """既存レコードの品番文字列から品番辞書を作成し、品番キーを設定する。"""
+    PartNumber = apps.get_model("master", "PartNumber")
+    for model_name, source_field in [("partsused", "part_code"), ("materialallocation", "material_code")]:
+        model = apps.get_model("production", model_name)
+        codes = model.objects.exclude(**{f"{source_field}__isnull": True}).exclude(**{source_field: ""})
+        codes = codes.values_list(source_field, flat=True).distinct()
+        PartNumber.objects.bulk_create([PartNumber(code=code) for code in codes], ignore_conflicts=True)
+        model.objects.update(
+            part_key=models.Subquery(PartNumber.objects.filter(code=models.OuterRef(source_field)).values("id")[:1])
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('master', '0007_part_number_keys'),
+        ('production', '0006_materialallocation_warehouse'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='materialallocation',
+            name='part_key',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='master.partnumber', verbose_name='品番キー'),
+        ),
+        migrations.AddField(
+            model_name='partsused',
+            name='part_key',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='master.partnumber', verbose_name='品番キー'),
+        ),
+        migrations.RunPython(backfill_part_keys, migrations.RunPython.noop),
+    ]
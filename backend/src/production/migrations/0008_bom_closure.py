@@ -0,0 +1,39 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:29
+
+import django.db.models.deletion
+import uuid6
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('master', '0009_location_capacity'),
+        ('production', '0007_part_number_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BomClosure',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False)),
+                ('ancestor_code', models.CharField(max_length=255, verbose_name='製品コード')),
+                ('descendant_code', models.CharField(max_length=255, verbose_name='部品コード')),
+                ('depth', models.PositiveSmallIntegerField(verbose_name='階層')),
+                ('max_depth', models.PositiveSmallIntegerField(verbose_name='最大階層')),
+                ('extended_quantity', models.DecimalField(decimal_places=6, max_digits=20, verbose_name='所要量 (製品1個あたり)')),
+                ('path_count', models.PositiveIntegerField(default=1, verbose_name='経路数')),
+                ('is_leaf', models.BooleanField(default=True, verbose_name='末端部品')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('ancestor_key', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='master.partnumber', verbose_name='製品キー')),
+                ('descendant_key', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='master.partnumber', verbose_name='部品キー')),
+            ],
+            options={
+                'verbose_name': 'BOM推移閉包',
+                'verbose_name_plural': 'BOM推移閉包',
+                'ordering': ['ancestor_code', 'depth', 'descendant_code'],
+                'indexes': [models.Index(fields=['ancestor_key', 'depth'], name='bom_explosion_idx'), models.Index(fields=['descendant_key', 'depth'], name='bom_implosion_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor_key', 'descendant_key'), name='unique_bom_closure')],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:32
+
+import django.db.models.deletion
+import uuid6
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0015_synctombstone'),
+        ('master', '0009_location_capacity'),
+        ('production', '0008_bom_closure'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MrpRun',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('PENDING', '待機中'), ('RUNNING', '実行中'), ('COMPLETED', '完了'), ('FAILED', '失敗')], default='PENDING', max_length=20, verbose_name='ステータス')),
+                ('start_date', models.DateField(verbose_name='計算開始日')),
+                ('bucket_days', models.PositiveSmallIntegerField(verbose_name='期間の日数')),
+                ('horizon_days', models.PositiveIntegerField(verbose_name='計画期間 (日)')),
+                ('lead_time_days', models.PositiveIntegerField(verbose_name='リードタイム (日)')),
+                ('summary', models.JSONField(blank=True, default=dict, verbose_name='集計結果')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='開始日時')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='終了日時')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='実行者')),
+                ('task', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='base.asynctask', verbose_name='非同期タスク')),
+            ],
+            options={
+                'verbose_name': 'MRP実行',
+                'verbose_name_plural': 'MRP実行',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MrpRequirement',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False)),
+                ('part_code', models.CharField(max_length=255, verbose_name='品番')),
+                ('low_level_code', models.PositiveSmallIntegerField(default=0, verbose_name='低位レベルコード')),
+                ('order_type', models.CharField(choices=[('purchase', '購買'), ('production', '生産')], max_length=20, verbose_name='手配区分')),
+                ('bucket_start', models.DateField(verbose_name='期間開始日')),
+                ('gross_requirement', models.DecimalField(decimal_places=3, default=0, max_digits=18, verbose_name='総所要量')),
+                ('scheduled_receipts', models.DecimalField(decimal_places=3, default=0, max_digits=18, verbose_name='入庫予定')),
+                ('projected_on_hand', models.DecimalField(decimal_places=3, default=0, max_digits=18, verbose_name='予定在庫')),
+                ('net_requirement', models.DecimalField(decimal_places=3, default=0, max_digits=18, verbose_name='正味所要量')),
+                ('planned_order_quantity', models.DecimalField(decimal_places=3, default=0, max_digits=18, verbose_name='計画オーダー数量')),
+                ('planned_release_date', models.DateField(blank=True, null=True, verbose_name='手配日')),
+                ('is_past_due', models.BooleanField(default=False, verbose_name='手配遅れ')),
+                ('part_key', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='master.partnumber', verbose_name='品番キー')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='requirements', to='production.mrprun', verbose_name='MRP実行')),
+            ],
+            options={
+                'verbose_name': 'MRP所要量',
+                'verbose_name_plural': 'MRP所要量',
+                'ordering': ['low_level_code', 'part_code', 'bucket_start'],
+                'indexes': [models.Index(fields=['run', 'part_code', 'bucket_start'], name='mrp_requirement_idx')],
+            },
+        ),
+    ]
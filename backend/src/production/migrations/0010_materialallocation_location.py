@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0009_mrp_runs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='materialallocation',
+            name='location',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='引当棚番'),
+        ),
+    ]
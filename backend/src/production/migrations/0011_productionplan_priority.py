@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0010_materialallocation_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productionplan',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=100, verbose_name='優先度'),
+        ),
+    ]
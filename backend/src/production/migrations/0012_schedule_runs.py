@@ -0,0 +1,70 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:45
+
+import django.db.models.deletion
+import uuid6
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0015_synctombstone'),
+        ('machine', '0002_machine_capability'),
+        ('production', '0011_productionplan_priority'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productionplan',
+            name='machine',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='production_plans', to='machine.machine', verbose_name='割当設備'),
+        ),
+        migrations.CreateModel(
+            name='ScheduleRun',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('PENDING', '待機中'), ('RUNNING', '実行中'), ('PREVIEW', '確認待ち'), ('COMMITTED', '確定済'), ('FAILED', '失敗')], default='PENDING', max_length=20, verbose_name='ステータス')),
+                ('start_from', models.DateTimeField(verbose_name='割当開始日時')),
+                ('statuses', models.JSONField(default=list, verbose_name='対象ステータス')),
+                ('grouping_hours', models.PositiveIntegerField(verbose_name='段取りまとめ幅 (時間)')),
+                ('summary', models.JSONField(blank=True, default=dict, verbose_name='集計結果')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='開始日時')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='終了日時')),
+                ('committed_at', models.DateTimeField(blank=True, null=True, verbose_name='確定日時')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='作成日時')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='実行者')),
+                ('task', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='base.asynctask', verbose_name='非同期タスク')),
+            ],
+            options={
+                'verbose_name': 'スケジューリング実行',
+                'verbose_name_plural': 'スケジューリング実行',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ScheduleAssignment',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False)),
+                ('sequence', models.PositiveIntegerField(verbose_name='設備内の順序')),
+                ('previous_start_datetime', models.DateTimeField(verbose_name='変更前の計画開始日時')),
+                ('previous_end_datetime', models.DateTimeField(verbose_name='変更前の計画終了日時')),
+                ('planned_start_datetime', models.DateTimeField(verbose_name='計画開始日時')),
+                ('planned_end_datetime', models.DateTimeField(verbose_name='計画終了日時')),
+                ('setup_minutes', models.PositiveIntegerField(default=0, verbose_name='段取り時間 (分)')),
+                ('is_late', models.BooleanField(default=False, verbose_name='納期遅れ')),
+                ('is_changed', models.BooleanField(default=False, verbose_name='変更あり')),
+                ('machine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='machine.machine', verbose_name='割当設備')),
+                ('previous_machine', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='machine.machine', verbose_name='変更前の設備')),
+                ('production_plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='production.productionplan', verbose_name='生産計画')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='assignments', to='production.schedulerun', verbose_name='実行')),
+            ],
+            options={
+                'verbose_name': 'スケジューリング割当',
+                'verbose_name_plural': 'スケジューリング割当',
+                'ordering': ['machine', 'sequence'],
+                'indexes': [models.Index(fields=['run', 'machine', 'sequence'], name='schedule_assignment_idx')],
+            },
+        ),
+    ]
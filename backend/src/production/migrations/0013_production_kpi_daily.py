@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:51
+
+import django.db.models.deletion
+import uuid6
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0012_schedule_runs'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductionKpiDaily',
+            fields=[
+                ('id', models.UUIDField(default=uuid6.uuid7, editable=False, primary_key=True, serialize=False)),
+                ('date', models.DateField(verbose_name='完了日')),
+                ('product_code', models.CharField(max_length=255, verbose_name='製品コード')),
+                ('completed_plans', models.PositiveIntegerField(default=0, verbose_name='完了計画数')),
+                ('late_plans', models.PositiveIntegerField(default=0, verbose_name='納期遅れ計画数')),
+                ('planned_quantity', models.PositiveIntegerField(default=0, verbose_name='計画数量')),
+                ('good_quantity', models.PositiveIntegerField(default=0, verbose_name='良品数')),
+                ('reported_quantity', models.PositiveIntegerField(default=0, verbose_name='総生産数')),
+                ('defective_quantity', models.PositiveIntegerField(default=0, verbose_name='不良数')),
+                ('lead_time_seconds', models.BigIntegerField(default=0, verbose_name='実績リードタイム合計 (秒)')),
+                ('planned_lead_time_seconds', models.BigIntegerField(default=0, verbose_name='計画リードタイム合計 (秒)')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新日時')),
+                ('operator', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='作業者')),
+            ],
+            options={
+                'verbose_name': '生産KPI日次集計',
+                'verbose_name_plural': '生産KPI日次集計',
+                'ordering': ['date', 'product_code'],
+                'indexes': [models.Index(fields=['date', 'product_code'], name='production_kpi_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-19 06:58
+
+from django.db import migrations, models
+
+# 入庫ルール導入前は、完成品をすべてこの倉庫 (棚番なし) に計上していた
+LEGACY_FINISHED_GOODS_WAREHOUSE = "FG-MAIN"
+
+
+def backfill_output_location(apps, schema_editor):
+    """完了済みの計画に、導入前の完成品の計上先を記録する (完了取消で同じ在庫行から戻すため)。"""
+    ProductionPlan = apps.get_model("production", "ProductionPlan")
+    ProductionPlan.objects.filter(status="COMPLETED").update(output_warehouse=LEGACY_FINISHED_GOODS_WAREHOUSE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0013_production_kpi_daily'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productionplan',
+            name='output_location',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='完成品入庫棚番'),
+        ),
+        migrations.AddField(
+            model_name='productionplan',
+            name='output_warehouse',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='完成品入庫倉庫'),
+        ),
+        migrations.RunPython(backfill_output_location, migrations.RunPython.noop),
+    ]
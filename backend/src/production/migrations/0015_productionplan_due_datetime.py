@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-19 07:32
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_due_datetime(apps, schema_editor):
+    """既存の計画の納期を、現在の計画終了日時で初期化する。"""
+    ProductionPlan = apps.get_model("production", "ProductionPlan")
+    ProductionPlan.objects.filter(due_datetime__isnull=True).update(due_datetime=F("planned_end_datetime"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0014_productionplan_output_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productionplan',
+            name='due_datetime',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='納期'),
+        ),
+        migrations.RunPython(backfill_due_datetime, migrations.RunPython.noop),
+    ]
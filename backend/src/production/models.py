@@ -3,6 +3,8 @@ from django.db import models
 from django.utils import timezone
 from uuid6 import uuid7
 
+from master.models import PartKeyMixin
+
 # Create your models here.
 
 
@@ -35,13 +37,54 @@ class ProductionPlan(models.Model):
     planned_quantity = models.PositiveIntegerField(verbose_name="計画数量")
     planned_start_datetime = models.DateTimeField(verbose_name="計画開始日時")
     planned_end_datetime = models.DateTimeField(verbose_name="計画終了日時")
+    # 納期。スケジューラは計画開始・終了日時を書き換えるため、納期遅れの判定と並び順にはこちらを使う
+    # (省略時は作成時の計画終了日時)
+    due_datetime = models.DateTimeField(null=True, blank=True, verbose_name="納期")
     actual_start_datetime = models.DateTimeField(null=True, blank=True, verbose_name="実績開始日時")
     actual_end_datetime = models.DateTimeField(null=True, blank=True, verbose_name="実績終了日時")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="PENDING", verbose_name="ステータス")
+    # 開始日時が同じ計画の間の優先順位 (小さいほど優先)。一括引当の順序に使います。
+    priority = models.PositiveSmallIntegerField(default=100, verbose_name="優先度")
+    machine = models.ForeignKey(
+        "machine.Machine",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="production_plans",
+        verbose_name="割当設備",
+    )
+    # 完成品を計上した倉庫・棚番 (完成数量の変更・完了取消は入庫ルールが変わってもこの在庫行に対して行う)
+    output_warehouse = models.CharField(max_length=255, null=True, blank=True, verbose_name="完成品入庫倉庫")
+    output_location = models.CharField(max_length=255, null=True, blank=True, verbose_name="完成品入庫棚番")
     remarks = models.TextField(blank=True, null=True, verbose_name="備考")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
 
+    # BOM (製品構成) の推移閉包に影響するフィールド
+    # (開始日時は製品の BOM に使う計画の選択に、ステータスは中止かどうかだけが影響する)
+    BOM_FIELDS = ("product_code", "production_plan", "planned_quantity", "planned_start_datetime", "status")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 保存時に BOM に影響する変更があったかを判定するため、読み込み時の値を保持する
+        if all(field in field_names for field in cls.BOM_FIELDS):
+            instance._loaded_bom_values = instance.bom_values()
+        return instance
+
+    def bom_values(self):
+        return tuple(
+            self.status == self.Status.CANCELLED if field == "status" else getattr(self, field)
+            for field in self.BOM_FIELDS
+        )
+
+    def save(self, *args, **kwargs):
+        if self.due_datetime is None:
+            self.due_datetime = self.planned_end_datetime
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "due_datetime"}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.plan_name} ({self.product_code})"
 
@@ -51,11 +94,13 @@ class ProductionPlan(models.Model):
         ordering = ["-planned_start_datetime"]
 
 
-class PartsUsed(models.Model):
+class PartsUsed(PartKeyMixin, models.Model):
     """
     使用部品モデル
     """
 
+    part_key_source = "part_code"
+
     id = models.UUIDField(primary_key=True, default=uuid7, editable=False)  # UUIDv7を使用
     # production_plan = models.ForeignKey(
     #     ProductionPlan, on_delete=models.CASCADE, related_name='parts_used', verbose_name="生産計画"
@@ -68,6 +113,15 @@ class PartsUsed(models.Model):
         help_text="関連する生産計画の名前やIDなどの識別子を文字列で記録します。",
     )
     part_code = models.CharField(max_length=100, verbose_name="部品コード (仮)")
+    part_key = models.ForeignKey(
+        "master.PartNumber",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        verbose_name="品番キー",
+    )  # part_code に対応する整数キー (集計・結合用)
     warehouse = models.CharField(
         max_length=255, null=True, blank=True, verbose_name="使用倉庫"
     )  # 部品がどの倉庫から使用されるか
@@ -77,6 +131,20 @@ class PartsUsed(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
 
+    # BOM (製品構成) の推移閉包に影響するフィールド
+    BOM_FIELDS = ("production_plan", "part_code", "quantity_used")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 保存時に BOM に影響する変更があったかを判定するため、読み込み時の値を保持する
+        if all(field in field_names for field in cls.BOM_FIELDS):
+            instance._loaded_bom_values = instance.bom_values()
+        return instance
+
+    def bom_values(self):
+        return tuple(getattr(self, field) for field in self.BOM_FIELDS)
+
     def __str__(self):
         # production_plan は文字列フィールドになったため、直接参照します。
         # 以前のように .plan_name でアクセスすることはできません。
@@ -90,11 +158,13 @@ class PartsUsed(models.Model):
         ordering = ["-used_datetime"]
 
 
-class MaterialAllocation(models.Model):
+class MaterialAllocation(PartKeyMixin, models.Model):
     """
     材料引当モデル
     """
 
+    part_key_source = "material_code"
+
     id = models.UUIDField(primary_key=True, default=uuid7, editable=False)  # UUIDv7を使用
     STATUS_CHOICES = [
         ("ALLOCATED", "引当済"),
@@ -108,7 +178,17 @@ class MaterialAllocation(models.Model):
     # TODO: master.Materialモデルが定義されたらForeignKeyに変更する
     # material = models.ForeignKey('master.Material', on_delete=models.PROTECT, verbose_name="材料")
     material_code = models.CharField(max_length=100, verbose_name="材料コード (仮)")
+    part_key = models.ForeignKey(
+        "master.PartNumber",
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="+",
+        verbose_name="品番キー",
+    )  # material_code に対応する整数キー (集計・結合用)
     warehouse = models.CharField(max_length=255, null=True, blank=True, verbose_name="引当倉庫")
+    location = models.CharField(max_length=255, null=True, blank=True, verbose_name="引当棚番")
     allocated_quantity = models.PositiveIntegerField(verbose_name="引当数量")
     allocation_datetime = models.DateTimeField(default=timezone.now, verbose_name="引当日時")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="ALLOCATED", verbose_name="ステータス")
@@ -116,6 +196,9 @@ class MaterialAllocation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
 
+    # 計画の所要量を満たしているとみなす引当ステータス (返却済みは除く)
+    COVERING_STATUSES = ("ALLOCATED", "ISSUED")
+
     def __str__(self):
         return f"{self.material_code} - {self.allocated_quantity} units for {self.production_plan.plan_name}"
 
@@ -136,6 +219,9 @@ class WorkProgress(models.Model):
         COMPLETED = "COMPLETED", "完了"
         PAUSED = "PAUSED", "一時停止"
 
+    # 計画全体の進捗を表す工程ステップ (進捗更新 API が計画ごとに1行作成する)
+    OVERALL_PROCESS_STEP = "Overall Plan Progress"
+
     id = models.UUIDField(primary_key=True, default=uuid7, editable=False)  # UUIDv7を使用
     STATUS_CHOICES = Status.choices
 
@@ -167,3 +253,256 @@ class WorkProgress(models.Model):
         verbose_name = "作業進捗"
         verbose_name_plural = "作業進捗"
         ordering = ["production_plan", "start_datetime"]
+
+
+class BomClosure(models.Model):
+    """
+    BOM 推移閉包モデル
+    製品 (祖先) から見たすべての階層の構成部品 (子孫) を1行ずつ保持し、展開・逆展開を1回のクエリで行えるようにします。
+    使用部品と生産計画から再計算される派生データのため、直接編集しません。
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)  # UUIDv7を使用
+    ancestor_code = models.CharField(max_length=255, verbose_name="製品コード")
+    ancestor_key = models.ForeignKey(
+        "master.PartNumber", on_delete=models.PROTECT, related_name="+", verbose_name="製品キー"
+    )
+    descendant_code = models.CharField(max_length=255, verbose_name="部品コード")
+    descendant_key = models.ForeignKey(
+        "master.PartNumber", on_delete=models.PROTECT, related_name="+", verbose_name="部品キー"
+    )
+    depth = models.PositiveSmallIntegerField(verbose_name="階層")  # 製品から最短の階層 (直下が1)
+    max_depth = models.PositiveSmallIntegerField(verbose_name="最大階層")  # 複数の経路がある場合の最も深い階層
+    extended_quantity = models.DecimalField(
+        max_digits=20, decimal_places=6, verbose_name="所要量 (製品1個あたり)"
+    )  # すべての経路の数量を掛け合わせて合計した値
+    path_count = models.PositiveIntegerField(default=1, verbose_name="経路数")
+    is_leaf = models.BooleanField(default=True, verbose_name="末端部品")  # 部品自体に構成がない (購入品・原材料)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    def __str__(self):
+        return f"{self.ancestor_code} > {self.descendant_code} (depth {self.depth}, x{self.extended_quantity})"
+
+    class Meta:
+        verbose_name = "BOM推移閉包"
+        verbose_name_plural = "BOM推移閉包"
+        ordering = ["ancestor_code", "depth", "descendant_code"]
+        constraints = [
+            models.UniqueConstraint(fields=["ancestor_key", "descendant_key"], name="unique_bom_closure"),
+        ]
+        indexes = [
+            models.Index(fields=["ancestor_key", "depth"], name="bom_explosion_idx"),
+            models.Index(fields=["descendant_key", "depth"], name="bom_implosion_idx"),
+        ]
+
+
+class MrpRun(models.Model):
+    """
+    所要量計算 (MRP) の実行モデル
+    実行条件と集計結果を保持し、期間別の正味所要量・計画オーダーは MrpRequirement に保存します。
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "待機中"
+        RUNNING = "RUNNING", "実行中"
+        COMPLETED = "COMPLETED", "完了"
+        FAILED = "FAILED", "失敗"
+
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)  # UUIDv7を使用
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING, verbose_name="ステータス")
+    task = models.ForeignKey(
+        "base.AsyncTask",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name="非同期タスク",
+    )
+    start_date = models.DateField(verbose_name="計算開始日")
+    bucket_days = models.PositiveSmallIntegerField(verbose_name="期間の日数")  # 時間バケットの幅 (7なら週単位)
+    horizon_days = models.PositiveIntegerField(verbose_name="計画期間 (日)")
+    lead_time_days = models.PositiveIntegerField(verbose_name="リードタイム (日)")
+    summary = models.JSONField(default=dict, blank=True, verbose_name="集計結果")
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="実行者"
+    )
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="開始日時")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="終了日時")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
+
+    def __str__(self):
+        return f"MRP {self.start_date} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "MRP実行"
+        verbose_name_plural = "MRP実行"
+        ordering = ["-created_at"]
+
+
+class MrpRequirement(models.Model):
+    """
+    MRP の期間別の所要量モデル
+    品番・期間ごとの総所要量・入庫予定・予定在庫・正味所要量と、それを満たす計画オーダー (発注・生産) を保持します。
+    """
+
+    ORDER_TYPE_CHOICES = [
+        ("purchase", "購買"),
+        ("production", "生産"),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)  # UUIDv7を使用
+    run = models.ForeignKey(MrpRun, on_delete=models.CASCADE, related_name="requirements", verbose_name="MRP実行")
+    part_code = models.CharField(max_length=255, verbose_name="品番")
+    part_key = models.ForeignKey(
+        "master.PartNumber", on_delete=models.PROTECT, related_name="+", verbose_name="品番キー"
+    )
+    low_level_code = models.PositiveSmallIntegerField(default=0, verbose_name="低位レベルコード")
+    order_type = models.CharField(max_length=20, choices=ORDER_TYPE_CHOICES, verbose_name="手配区分")
+    bucket_start = models.DateField(verbose_name="期間開始日")
+    gross_requirement = models.DecimalField(max_digits=18, decimal_places=3, default=0, verbose_name="総所要量")
+    scheduled_receipts = models.DecimalField(max_digits=18, decimal_places=3, default=0, verbose_name="入庫予定")
+    projected_on_hand = models.DecimalField(max_digits=18, decimal_places=3, default=0, verbose_name="予定在庫")
+    net_requirement = models.DecimalField(max_digits=18, decimal_places=3, default=0, verbose_name="正味所要量")
+    planned_order_quantity = models.DecimalField(
+        max_digits=18, decimal_places=3, default=0, verbose_name="計画オーダー数量"
+    )
+    planned_release_date = models.DateField(null=True, blank=True, verbose_name="手配日")
+    is_past_due = models.BooleanField(default=False, verbose_name="手配遅れ")  # 手配日が計算開始日より前
+
+    def __str__(self):
+        return f"{self.part_code} {self.bucket_start}: net {self.net_requirement}"
+
+    class Meta:
+        verbose_name = "MRP所要量"
+        verbose_name_plural = "MRP所要量"
+        ordering = ["low_level_code", "part_code", "bucket_start"]
+        indexes = [
+            models.Index(fields=["run", "part_code", "bucket_start"], name="mrp_requirement_idx"),
+        ]
+
+
+class ScheduleRun(models.Model):
+    """
+    生産スケジューリング (設備への割当) の実行モデル
+    計算結果は ScheduleAssignment にプレビューとして保存し、確定 (commit) したときに生産計画へ書き戻します。
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "待機中"
+        RUNNING = "RUNNING", "実行中"
+        PREVIEW = "PREVIEW", "確認待ち"
+        COMMITTED = "COMMITTED", "確定済"
+        FAILED = "FAILED", "失敗"
+
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)  # UUIDv7を使用
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING, verbose_name="ステータス")
+    task = models.ForeignKey(
+        "base.AsyncTask",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name="非同期タスク",
+    )
+    start_from = models.DateTimeField(verbose_name="割当開始日時")
+    statuses = models.JSONField(default=list, verbose_name="対象ステータス")
+    grouping_hours = models.PositiveIntegerField(verbose_name="段取りまとめ幅 (時間)")
+    summary = models.JSONField(default=dict, blank=True, verbose_name="集計結果")
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="実行者"
+    )
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="開始日時")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="終了日時")
+    committed_at = models.DateTimeField(null=True, blank=True, verbose_name="確定日時")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="作成日時")
+
+    def __str__(self):
+        return f"Schedule {self.start_from:%Y-%m-%d %H:%M} ({self.get_status_display()})"
+
+    class Meta:
+        verbose_name = "スケジューリング実行"
+        verbose_name_plural = "スケジューリング実行"
+        ordering = ["-created_at"]
+
+
+class ScheduleAssignment(models.Model):
+    """
+    スケジューリング結果の計画ごとの割当モデル
+    変更前と変更後の設備・計画日時を並べて保持し、確定前の差分の確認に使います。
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)  # UUIDv7を使用
+    run = models.ForeignKey(ScheduleRun, on_delete=models.CASCADE, related_name="assignments", verbose_name="実行")
+    production_plan = models.ForeignKey(
+        ProductionPlan, on_delete=models.CASCADE, related_name="+", verbose_name="生産計画"
+    )
+    sequence = models.PositiveIntegerField(verbose_name="設備内の順序")
+    machine = models.ForeignKey("machine.Machine", on_delete=models.CASCADE, related_name="+", verbose_name="割当設備")
+    previous_machine = models.ForeignKey(
+        "machine.Machine",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name="変更前の設備",
+    )
+    previous_start_datetime = models.DateTimeField(verbose_name="変更前の計画開始日時")
+    previous_end_datetime = models.DateTimeField(verbose_name="変更前の計画終了日時")
+    planned_start_datetime = models.DateTimeField(verbose_name="計画開始日時")
+    planned_end_datetime = models.DateTimeField(verbose_name="計画終了日時")
+    setup_minutes = models.PositiveIntegerField(default=0, verbose_name="段取り時間 (分)")
+    is_late = models.BooleanField(default=False, verbose_name="納期遅れ")  # 計画の納期を過ぎる
+    is_changed = models.BooleanField(default=False, verbose_name="変更あり")
+
+    def __str__(self):
+        return f"{self.production_plan_id} -> {self.machine_id} {self.planned_start_datetime:%Y-%m-%d %H:%M}"
+
+    class Meta:
+        verbose_name = "スケジューリング割当"
+        verbose_name_plural = "スケジューリング割当"
+        ordering = ["machine", "sequence"]
+        indexes = [
+            models.Index(fields=["run", "machine", "sequence"], name="schedule_assignment_idx"),
+        ]
+
+
+class ProductionKpiDaily(models.Model):
+    """
+    生産KPI日次集計モデル
+    完了した計画を完了日・製品・作業者ごとに集計した行で、歩留まり・スループット・リードタイムの集計に使います。
+    進捗更新で計画が完了 (または完了が取り消) されるたびに該当する日・製品の行を再集計する派生データのため、
+    直接編集しません。
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)  # UUIDv7を使用
+    date = models.DateField(verbose_name="完了日")
+    product_code = models.CharField(max_length=255, verbose_name="製品コード")
+    operator = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+        verbose_name="作業者",
+    )
+    completed_plans = models.PositiveIntegerField(default=0, verbose_name="完了計画数")
+    late_plans = models.PositiveIntegerField(default=0, verbose_name="納期遅れ計画数")  # 納期より後に完了
+    planned_quantity = models.PositiveIntegerField(default=0, verbose_name="計画数量")
+    good_quantity = models.PositiveIntegerField(default=0, verbose_name="良品数")
+    reported_quantity = models.PositiveIntegerField(default=0, verbose_name="総生産数")
+    defective_quantity = models.PositiveIntegerField(default=0, verbose_name="不良数")
+    # リードタイムは平均を期間・グループ単位で計算できるよう秒の合計で持つ
+    lead_time_seconds = models.BigIntegerField(default=0, verbose_name="実績リードタイム合計 (秒)")
+    planned_lead_time_seconds = models.BigIntegerField(default=0, verbose_name="計画リードタイム合計 (秒)")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="更新日時")
+
+    def __str__(self):
+        return f"{self.date} {self.product_code} ({self.operator_id or '-'})"
+
+    class Meta:
+        verbose_name = "生産KPI日次集計"
+        verbose_name_plural = "生産KPI日次集計"
+        ordering = ["date", "product_code"]
+        indexes = [
+            models.Index(fields=["date", "product_code"], name="production_kpi_date_idx"),
+        ]
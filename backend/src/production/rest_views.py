@@ -1,7 +1,12 @@
+import uuid
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
 from django.db import transaction  # トランザクションのためにインポート
 from django.db.models import Q  # Qオブジェクトをインポート
 from django.utils import timezone  # timezoneをインポート
-from django.utils.dateparse import parse_datetime  # 日時文字列のパース用
+from django.conf import settings
+from django.utils.dateparse import parse_date, parse_datetime  # 日時文字列のパース用
 from rest_framework import (
     status,  # HTTPステータスコードをインポート
     viewsets,
@@ -14,31 +19,51 @@ from rest_framework.pagination import PageNumberPagination  # Import PageNumberP
 from rest_framework.response import Response  # Responseをインポート
 from django_filters import rest_framework as filters  # django-filterをインポート
 
+from base.idempotency import idempotent
+from base.models import AsyncTask
 from inventory.models import Inventory, SalesOrder, StockMovement  # Add StockMovement and SalesOrder
 from inventory.rest_views import StandardResultsSetPagination  # inventoryアプリのページネーションクラスをインポート
+from inventory.serializers import SalesOrderSerializer
 
-from .models import MaterialAllocation, PartsUsed, ProductionPlan, WorkProgress
+from .models import MaterialAllocation, MrpRun, PartsUsed, ProductionPlan, ScheduleRun, WorkProgress
 from .serializers import (
     MaterialAllocationSerializer,
+    MrpRequirementSerializer,
+    MrpRunSerializer,
     PartsUsedSerializer,
     ProductionPlanSerializer,
     RequiredPartSerializer,
+    ScheduleAssignmentSerializer,
+    ScheduleRunSerializer,
     WorkProgressSerializer,
 )
 from .services import (
+    BulkProgressError,
     allocate_materials_service,
+    annotate_plan_coverage,
+    annotate_plan_progress,
+    auto_allocate_materials_service,
+    bulk_update_production_progress_service,
+    commit_schedule,
+    create_mrp_run,
+    create_schedule_run,
+    explode_bom,
     get_production_plan_required_parts,
+    get_required_parts_for_plans,
+    implode_bom,
+    query_production_kpis,
+    refresh_bom_closure,
+    resolve_allocation_policy,
+    simulate_plan_changes,
     update_production_progress_service,
 )
+from .services.scheduling import SCHEDULABLE_STATUSES
+from .tasks import batch_allocate_task, run_mrp_task, run_schedule_task
 
 # from .models import Product, BillOfMaterialItem
 # BOMに関連するモデル (仮のインポート、実際には適切なモデルを定義・インポートしてください)
 # from .serializers import RequiredPartSerializer # BOM部品用のシリアライザ (仮のインポート)
 
-# Define a constant for the default finished goods warehouse
-DEFAULT_FINISHED_GOODS_WAREHOUSE = "FG-MAIN"  # TODO: Make this configurable
-
-
 # Define a pagination class specifically for Production Plans API
 class ProductionPlanApiPagination(PageNumberPagination):
     page_size = 100  # Default number of items per page
@@ -92,7 +117,14 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # django-filterが自動で処理するため、手動のフィルタリングを削除
-        return ProductionPlan.objects.all()
+        queryset = ProductionPlan.objects.all()
+        # 一覧画面で計画ごとに作業進捗・材料引当を取得しなくて済むよう、指定された集計を同じクエリで付ける
+        params = self.request.query_params
+        if params.get("with_progress", "").lower() in ("1", "true"):
+            queryset = annotate_plan_progress(queryset)
+        if params.get("with_coverage", "").lower() in ("1", "true"):
+            queryset = annotate_plan_coverage(queryset)
+        return queryset
 
     @action(detail=True, methods=["get"], url_path="required-parts")
     def required_parts(self, request, pk=None):
@@ -111,7 +143,31 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=["get"], url_path="required-parts")
+    def required_parts_batch(self, request):
+        """
+        複数の生産計画 (ids にカンマ区切りで指定) の必要部品リストを {計画ID: [部品]} で返します。
+        一覧画面の表示中の計画をまとめて1回のリクエストで取得するためのもので、計画数に関係なく数回のクエリで完了します。
+        """
+        ids = [value for value in request.query_params.get("ids", "").split(",") if value.strip()]
+        if not ids:
+            return Response({"error": "ids を指定してください。"}, status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > ProductionPlanApiPagination.max_page_size:
+            return Response(
+                {"error": f"ids は {ProductionPlanApiPagination.max_page_size} 件以内で指定してください。"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            plans = list(ProductionPlan.objects.filter(id__in=[uuid.UUID(value.strip()) for value in ids]))
+        except ValueError:
+            return Response({"error": "ids の形式が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+        required_parts = get_required_parts_for_plans(plans)
+        return Response(
+            {str(plan_id): RequiredPartSerializer(parts, many=True).data for plan_id, parts in required_parts.items()}
+        )
+
     @action(detail=True, methods=["post"], url_path="allocate-materials")
+    @idempotent
     def allocate_materials(self, request, pk=None):
         """
         特定の生産計画に対して資材を割り当てます。
@@ -138,7 +194,82 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
+    @action(detail=True, methods=["post"], url_path="auto-allocate")
+    def auto_allocate(self, request, pk=None):
+        """
+        未引当の所要量について、倉庫・棚番をまたいだ引当案を返します。
+        commit=true の場合は引当案をそのまま引き当てます。policy で AUTO_ALLOCATION_POLICY の項目を上書きできます。
+        """
+        production_plan = self.get_object()
+        commit = str(request.data.get("commit", "false")).lower() == "true"
+        policy = request.data.get("policy") or {}
+        if not isinstance(policy, dict):
+            return Response({"error": "policy must be an object."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            result = auto_allocate_materials_service(production_plan, policy_overrides=policy, commit=commit)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        result["production_plan_id"] = production_plan.id
+        if commit and not result["committed"]:
+            # 不足があるため確定しなかった場合は、引当案と不足を返す
+            return Response(result, status=status.HTTP_409_CONFLICT)
+        return Response(result, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"], url_path="internal-orders")
+    def internal_orders(self, request, pk=None):
+        """材料引当で作成された社内出庫予定の一覧。status で絞り込めます。"""
+        production_plan = self.get_object()
+        queryset = SalesOrder.objects.filter(source_plan=production_plan)
+        if request.query_params.get("status"):
+            queryset = queryset.filter(status=request.query_params["status"])
+        queryset = queryset.order_by("expected_shipment", "order_number")
+        return Response(SalesOrderSerializer(queryset, many=True).data, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["post"], url_path="batch-allocate")
+    def batch_allocate(self, request):
+        """
+        期間内に開始する生産計画の材料を一括で引き当てるバックグラウンドジョブを開始します。
+        date_from (既定: 今日)・date_to (既定: BATCH_ALLOCATION_HORIZON_DAYS 日後)・statuses (既定: PENDING)・
+        policy を指定できます。進捗と不足の一覧は返した task_id の AsyncTask で確認します。
+        """
+        date_from = parse_date(request.data["date_from"]) if request.data.get("date_from") else timezone.localdate()
+        if date_from is None:
+            return Response({"error": "date_from の形式が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+        if request.data.get("date_to"):
+            date_to = parse_date(request.data["date_to"])
+        else:
+            date_to = date_from + timedelta(days=settings.BATCH_ALLOCATION_HORIZON_DAYS)
+        if date_to is None or date_to <= date_from:
+            return Response(
+                {"error": "date_to は date_from より後の日付で指定してください。"}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        statuses = request.data.get("statuses") or [ProductionPlan.Status.PENDING]
+        if not isinstance(statuses, list) or any(value not in ProductionPlan.Status.values for value in statuses):
+            return Response({"error": "statuses の指定が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+        policy = request.data.get("policy") or {}
+        if not isinstance(policy, dict):
+            return Response({"error": "policy must be an object."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            resolve_allocation_policy(policy)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        task_id = str(uuid.uuid4())
+        AsyncTask.objects.create(task_id=task_id, task_name="Batch Material Allocation", status="PENDING")
+        batch_allocate_task.apply_async(
+            kwargs={
+                "date_from": date_from.isoformat(),
+                "date_to": date_to.isoformat(),
+                "statuses": statuses,
+                "policy": policy,
+            },
+            task_id=task_id,
+        )
+        return Response({"status": "processing", "task_id": task_id}, status=status.HTTP_202_ACCEPTED)
+
     @action(detail=True, methods=["post"], url_path="update-progress")
+    @idempotent
     def update_progress(self, request, pk=None):
         """
         生産計画の進捗を更新します。
@@ -166,6 +297,51 @@ class ProductionPlanViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
+    @action(detail=False, methods=["post"], url_path="bulk-update-progress")
+    @idempotent
+    def bulk_update_progress(self, request):
+        """
+        複数の生産計画の進捗をまとめて更新します。
+        entries: [{"plan_id", "status", "good_quantity", "actual_quantity", "defective_quantity"}]
+        atomic=true の場合、1件でも失敗すれば何も更新せず 400 で計画ごとの結果を返します。
+        """
+        entries = request.data.get("entries")
+        atomic = str(request.data.get("atomic", "false")).lower() == "true"
+        try:
+            results = bulk_update_production_progress_service(entries, request.user, atomic=atomic)
+        except BulkProgressError as e:
+            return Response({"error": str(e), "results": e.results}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        succeeded = sum(1 for result in results if result["success"])
+        return Response(
+            {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results},
+            status=status.HTTP_200_OK,
+        )
+
+    @action(detail=False, methods=["post"])
+    def simulate(self, request):
+        """
+        生産計画の日程・数量の変更を仮に適用した場合に、不足する計画・品番と間に合わなくなる発注を返します。
+        changes: [{"plan_id", "planned_start_datetime", "planned_end_datetime", "planned_quantity"}] (変更する項目のみ)
+        horizon_days (既定: MRP_HORIZON_DAYS) までの需給を対象とし、データベースは更新しません。
+        """
+        horizon_days = request.data.get("horizon_days")
+        if horizon_days not in (None, ""):
+            try:
+                horizon_days = int(horizon_days)
+                if horizon_days < 1:
+                    raise ValueError
+            except (TypeError, ValueError):
+                return Response({"error": "horizon_days の指定が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            horizon_days = None
+        try:
+            result = simulate_plan_changes(request.data.get("changes"), horizon_days=horizon_days)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_200_OK)
+
 
 class PartsUsedViewSet(viewsets.ModelViewSet):
     """
@@ -227,3 +403,210 @@ class WorkProgressViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(operator_id=operator_id)
 
         return queryset
+
+
+class BomViewSet(viewsets.ViewSet):
+    """
+    BOM の多階層展開 (製品に必要なすべての部品) と逆展開 (部品を使うすべての製品) を返すAPI。
+    事前計算済みの BOM 推移閉包を参照するため、階層の深さに関係なく1回のクエリで応答します。
+    """
+
+    @staticmethod
+    def _max_depth(request):
+        max_depth = request.query_params.get("max_depth")
+        return int(max_depth) if max_depth else None
+
+    @action(detail=False, methods=["get"])
+    def explode(self, request):
+        product_code = request.query_params.get("product_code")
+        if not product_code:
+            return Response({"error": "product_code を指定してください。"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            quantity = Decimal(request.query_params.get("quantity", "1"))
+            max_depth = self._max_depth(request)
+        except (InvalidOperation, ValueError):
+            return Response(
+                {"error": "quantity または max_depth が不正です。"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        leaves_only = request.query_params.get("leaves_only", "").lower() in ("1", "true")
+        components = explode_bom(product_code, quantity, max_depth=max_depth, leaves_only=leaves_only)
+        return Response({"product_code": product_code, "quantity": quantity, "components": components})
+
+    @action(detail=False, methods=["get"])
+    def implode(self, request):
+        part_code = request.query_params.get("part_code")
+        if not part_code:
+            return Response({"error": "part_code を指定してください。"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            max_depth = self._max_depth(request)
+        except ValueError:
+            return Response({"error": "max_depth が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"part_code": part_code, "used_in": implode_bom(part_code, max_depth=max_depth)})
+
+    @action(detail=False, methods=["post"])
+    def rebuild(self, request):
+        """BOM 推移閉包をすべて再計算します (データ移行後など)。"""
+        return Response({"rows": refresh_bom_closure()})
+
+
+class MrpRunViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    所要量計算 (MRP) の実行と結果確認のAPI。
+    run で未着手・進行中のすべての生産計画を対象にバックグラウンドで計算し、requirements で期間別の結果を確認します。
+    """
+
+    queryset = MrpRun.objects.all().select_related("task")
+    serializer_class = MrpRunSerializer
+    pagination_class = StandardResultsSetPagination
+
+    @action(detail=False, methods=["post"])
+    def run(self, request):
+        try:
+            params = {
+                field: int(request.data[field]) if request.data.get(field) not in (None, "") else None
+                for field in ("bucket_days", "horizon_days", "lead_time_days")
+            }
+        except (TypeError, ValueError):
+            return Response({"error": "数値項目の指定が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+        minimums = {"bucket_days": 1, "horizon_days": 1, "lead_time_days": 0}
+        if any(value is not None and value < minimums[field] for field, value in params.items()):
+            return Response({"error": "数値項目の指定が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # ワーカーが先に起動しても参照できるよう、AsyncTask を作成してからタスクを投入する
+        task_id = str(uuid.uuid4())
+        task = AsyncTask.objects.create(task_id=task_id, task_name="MRP Run", status="PENDING")
+        mrp_run = create_mrp_run(user=request.user, **params)
+        mrp_run.task = task
+        mrp_run.save(update_fields=["task"])
+        run_mrp_task.apply_async(kwargs={"run_id": str(mrp_run.id)}, task_id=task_id)
+        return Response(
+            {"status": "processing", "task_id": task_id, "run": MrpRunSerializer(mrp_run).data},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=True, methods=["get"])
+    def requirements(self, request, pk=None):
+        """期間別の所要量。part_code / order_type / planned_only=true で絞り込めます。"""
+        mrp_run = self.get_object()
+        queryset = mrp_run.requirements.all()
+        part_code = request.query_params.get("part_code")
+        if part_code:
+            queryset = queryset.filter(part_code=part_code)
+        order_type = request.query_params.get("order_type")
+        if order_type:
+            queryset = queryset.filter(order_type=order_type)
+        if request.query_params.get("planned_only", "").lower() in ("1", "true"):
+            queryset = queryset.filter(planned_order_quantity__gt=0)
+        page = self.paginate_queryset(queryset)
+        serializer = MrpRequirementSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class ScheduleRunViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    生産スケジューリング (設備への割当) の実行・確認・確定のAPI。
+    run でバックグラウンドで計算し、assignments で変更前後の差分を確認してから commit で生産計画に書き戻します。
+    """
+
+    queryset = ScheduleRun.objects.all().select_related("task")
+    serializer_class = ScheduleRunSerializer
+    pagination_class = StandardResultsSetPagination
+
+    @action(detail=False, methods=["post"])
+    def run(self, request):
+        start_from = None
+        if request.data.get("start_from"):
+            start_from = parse_datetime(request.data["start_from"])
+            if start_from is None:
+                return Response({"error": "start_from の形式が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(start_from):
+                start_from = timezone.make_aware(start_from)
+        statuses = request.data.get("statuses") or [ProductionPlan.Status.PENDING]
+        if not isinstance(statuses, list) or any(value not in SCHEDULABLE_STATUSES for value in statuses):
+            return Response({"error": "statuses の指定が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+        grouping_hours = request.data.get("grouping_hours")
+        if grouping_hours not in (None, ""):
+            try:
+                grouping_hours = int(grouping_hours)
+                if grouping_hours < 0:
+                    raise ValueError
+            except (TypeError, ValueError):
+                return Response({"error": "grouping_hours の指定が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            grouping_hours = None
+
+        task_id = str(uuid.uuid4())
+        task = AsyncTask.objects.create(task_id=task_id, task_name="Production Scheduling", status="PENDING")
+        schedule_run = create_schedule_run(
+            user=request.user, start_from=start_from, statuses=statuses, grouping_hours=grouping_hours
+        )
+        schedule_run.task = task
+        schedule_run.save(update_fields=["task"])
+        run_schedule_task.apply_async(kwargs={"run_id": str(schedule_run.id)}, task_id=task_id)
+        return Response(
+            {"status": "processing", "task_id": task_id, "run": ScheduleRunSerializer(schedule_run).data},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=True, methods=["get"])
+    def assignments(self, request, pk=None):
+        """計画ごとの割当 (変更前後)。machine / changed_only=true / late_only=true で絞り込めます。"""
+        schedule_run = self.get_object()
+        queryset = schedule_run.assignments.select_related("production_plan", "machine", "previous_machine")
+        machine_id = request.query_params.get("machine")
+        if machine_id:
+            queryset = queryset.filter(machine_id=machine_id)
+        if request.query_params.get("changed_only", "").lower() in ("1", "true"):
+            queryset = queryset.filter(is_changed=True)
+        if request.query_params.get("late_only", "").lower() in ("1", "true"):
+            queryset = queryset.filter(is_late=True)
+        page = self.paginate_queryset(queryset.order_by("machine__machine_number", "sequence"))
+        serializer = ScheduleAssignmentSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=["post"])
+    def commit(self, request, pk=None):
+        """プレビューの割当を生産計画の設備・計画日時に書き戻します。"""
+        schedule_run = self.get_object()
+        try:
+            result = commit_schedule(schedule_run)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        return Response(result, status=status.HTTP_200_OK)
+
+
+class ProductionKpiViewSet(viewsets.ViewSet):
+    """
+    生産KPI (歩留まり・スループット・リードタイム) の集計API。
+    計画の完了時に更新される日次集計行だけを読み、期間と軸を指定して合算します。
+    """
+
+    # 日付範囲を省略した場合の日数 (今日を含む)
+    DEFAULT_RANGE_DAYS = 30
+
+    def list(self, request):
+        """date_from / date_to (YYYY-MM-DD)、period (day / week / month)、group_by (product,operator) で集計します。"""
+        date_to = timezone.localdate()
+        date_from = date_to - timedelta(days=self.DEFAULT_RANGE_DAYS - 1)
+        for name in ("date_from", "date_to"):
+            value = request.query_params.get(name)
+            if value:
+                try:
+                    parsed = parse_date(value)
+                except ValueError:
+                    parsed = None
+                if parsed is None:
+                    return Response({"error": f"{name} の形式が不正です。"}, status=status.HTTP_400_BAD_REQUEST)
+                if name == "date_from":
+                    date_from = parsed
+                else:
+                    date_to = parsed
+        group_by = [group for group in request.query_params.get("group_by", "").split(",") if group]
+        period = request.query_params.get("period", "day")
+        try:
+            results = query_production_kpis(date_from, date_to, period=period, group_by=group_by)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {"date_from": date_from, "date_to": date_to, "period": period, "group_by": group_by, "results": results}
+        )
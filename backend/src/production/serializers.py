@@ -1,6 +1,15 @@
 from rest_framework import serializers
 
-from .models import MaterialAllocation, PartsUsed, ProductionPlan, WorkProgress
+from .models import (
+    MaterialAllocation,
+    MrpRequirement,
+    MrpRun,
+    PartsUsed,
+    ProductionPlan,
+    ScheduleAssignment,
+    ScheduleRun,
+    WorkProgress,
+)
 
 
 class ProductionPlanSerializer(serializers.ModelSerializer):
@@ -17,15 +26,20 @@ class ProductionPlanSerializer(serializers.ModelSerializer):
             "planned_quantity",
             "planned_start_datetime",
             "planned_end_datetime",
+            "due_datetime",  # 納期 (省略時は計画終了日時。スケジューラでは変更されません)
             "actual_start_datetime",
             "actual_end_datetime",
             "status",  # ステータスの内部キー (例: 'PENDING', 'IN_PROGRESS')
             "status_display",  # ステータスの表示名 (例: '未着手', '進行中')
+            "priority",
+            "machine",  # 割当設備 (スケジューラで設定)
+            "output_warehouse",  # 完成品を計上した倉庫・棚番 (進捗更新で設定)
+            "output_location",
             "remarks",
             "created_at",
             "updated_at",
         ]
-        read_only_fields = ["id", "created_at", "updated_at", "status_display"]
+        read_only_fields = ["id", "created_at", "updated_at", "status_display", "output_warehouse", "output_location"]
 
     def validate(self, data):
         """
@@ -59,6 +73,21 @@ class ProductionPlanSerializer(serializers.ModelSerializer):
                 )
         return data
 
+    # with_progress / with_coverage 指定時に一覧のクエリで付けられる集計 (付いている場合だけ出力します)
+    PROGRESS_FIELDS = ["progress_status", "progress_step", "completed_quantity"]
+    COVERAGE_FIELDS = ["required_quantity", "allocated_quantity"]
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        for field in self.PROGRESS_FIELDS + self.COVERAGE_FIELDS:
+            if hasattr(instance, field):
+                data[field] = getattr(instance, field)
+        if hasattr(instance, "required_quantity"):
+            # 引当数量 / 必要数量 (1を上限、使用部品がなければ null)
+            required = instance.required_quantity
+            data["allocation_coverage"] = round(min(instance.allocated_quantity / required, 1), 4) if required else None
+        return data
+
 
 class PartsUsedSerializer(serializers.ModelSerializer):
     """
@@ -118,6 +147,8 @@ class MaterialAllocationSerializer(serializers.ModelSerializer):
             "production_plan",
             "production_plan_name",
             "material_code",
+            "warehouse",
+            "location",
             "allocated_quantity",
             "allocation_datetime",
             "status",
@@ -183,3 +214,118 @@ class WorkProgressSerializer(serializers.ModelSerializer):
             if start >= end:
                 raise serializers.ValidationError({"end_datetime": "End datetime must be after start datetime."})
         return data
+
+
+class MrpRunSerializer(serializers.ModelSerializer):
+    """
+    MRP実行のためのシリアライザ
+    """
+
+    status_display = serializers.CharField(source="get_status_display", read_only=True)
+    task_id = serializers.CharField(source="task.task_id", read_only=True, allow_null=True)
+
+    class Meta:
+        model = MrpRun
+        fields = [
+            "id",
+            "status",
+            "status_display",
+            "task_id",
+            "start_date",
+            "bucket_days",
+            "horizon_days",
+            "lead_time_days",
+            "summary",
+            "created_by",
+            "started_at",
+            "finished_at",
+            "created_at",
+        ]
+        read_only_fields = fields
+
+
+class MrpRequirementSerializer(serializers.ModelSerializer):
+    """
+    MRP所要量 (期間別の正味所要量・計画オーダー) のためのシリアライザ
+    """
+
+    class Meta:
+        model = MrpRequirement
+        fields = [
+            "id",
+            "part_code",
+            "low_level_code",
+            "order_type",
+            "bucket_start",
+            "gross_requirement",
+            "scheduled_receipts",
+            "projected_on_hand",
+            "net_requirement",
+            "planned_order_quantity",
+            "planned_release_date",
+            "is_past_due",
+        ]
+        read_only_fields = fields
+
+
+class ScheduleRunSerializer(serializers.ModelSerializer):
+    """
+    生産スケジューリング実行のためのシリアライザ
+    """
+
+    status_display = serializers.CharField(source="get_status_display", read_only=True)
+    task_id = serializers.CharField(source="task.task_id", read_only=True, allow_null=True)
+
+    class Meta:
+        model = ScheduleRun
+        fields = [
+            "id",
+            "status",
+            "status_display",
+            "task_id",
+            "start_from",
+            "statuses",
+            "grouping_hours",
+            "summary",
+            "created_by",
+            "started_at",
+            "finished_at",
+            "committed_at",
+            "created_at",
+        ]
+        read_only_fields = fields
+
+
+class ScheduleAssignmentSerializer(serializers.ModelSerializer):
+    """
+    スケジューリング結果 (変更前後の設備・計画日時) のためのシリアライザ
+    """
+
+    plan_name = serializers.CharField(source="production_plan.plan_name", read_only=True)
+    product_code = serializers.CharField(source="production_plan.product_code", read_only=True)
+    machine_number = serializers.CharField(source="machine.machine_number", read_only=True)
+    previous_machine_number = serializers.CharField(
+        source="previous_machine.machine_number", read_only=True, allow_null=True
+    )
+
+    class Meta:
+        model = ScheduleAssignment
+        fields = [
+            "id",
+            "production_plan",
+            "plan_name",
+            "product_code",
+            "sequence",
+            "machine",
+            "machine_number",
+            "previous_machine",
+            "previous_machine_number",
+            "previous_start_datetime",
+            "previous_end_datetime",
+            "planned_start_datetime",
+            "planned_end_datetime",
+            "setup_minutes",
+            "is_late",
+            "is_changed",
+        ]
+        read_only_fields = fields
@@ -1,9 +1,44 @@
-from .allocation import allocate_materials_service
-from .progress import update_production_progress_service
-from .queries import get_production_plan_required_parts
+from .allocation import (
+    allocate_materials_service,
+    auto_allocate_materials_service,
+    batch_allocate_materials_service,
+    resolve_allocation_policy,
+)
+from .bom import explode_bom, implode_bom, refresh_bom_closure
+from .kpi import query_production_kpis, rebuild_production_kpis, refresh_production_kpis
+from .mrp import create_mrp_run, run_mrp
+from .progress import BulkProgressError, bulk_update_production_progress_service, update_production_progress_service
+from .queries import (
+    annotate_plan_coverage,
+    annotate_plan_progress,
+    get_production_plan_required_parts,
+    get_required_parts_for_plans,
+)
+from .scheduling import commit_schedule, create_schedule_run, run_schedule
+from .simulation import simulate_plan_changes
 
 __all__ = [
+    'BulkProgressError',
     'allocate_materials_service',
+    'annotate_plan_coverage',
+    'annotate_plan_progress',
+    'auto_allocate_materials_service',
+    'batch_allocate_materials_service',
+    'bulk_update_production_progress_service',
+    'commit_schedule',
+    'create_mrp_run',
+    'create_schedule_run',
+    'explode_bom',
+    'implode_bom',
+    'query_production_kpis',
+    'rebuild_production_kpis',
+    'refresh_bom_closure',
+    'refresh_production_kpis',
+    'resolve_allocation_policy',
+    'run_mrp',
+    'run_schedule',
+    'simulate_plan_changes',
     'update_production_progress_service',
     'get_production_plan_required_parts',
+    'get_required_parts_for_plans',
 ]
@@ -1,16 +1,30 @@
-from django.db import transaction
-from django.db.models import Sum
 import logging
+from datetime import datetime, time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
 
 from inventory.models import Inventory, SalesOrder
-from ..models import MaterialAllocation, PartsUsed
+from inventory.services.location_map import invalidate_location_map
+from inventory.services.picking import INTERNAL_ORDER_PREFIX
+from master.models import PartNumber
+
+from ..models import MaterialAllocation, PartsUsed, ProductionPlan
 
 logger = logging.getLogger(__name__)
 
+# 一括引当で計画を処理する順序 (開始日時 → 優先度 → 作成日時)
+BATCH_PLAN_ORDERING = ("planned_start_datetime", "priority", "created_at")
+
 def allocate_materials_service(production_plan, allocations_data):
     """
     生産計画に対して資材を割り当てるサービス。
     在庫の引き当て更新と MaterialAllocation レコードの作成を行います。
+    1つの明細を複数の棚番から引き当てた場合は、在庫行ごとに MaterialAllocation を作成します。
+    対象の在庫行は1回のクエリでまとめてロックし、検証はメモリ上で行い、書き込みは一括更新・一括作成で行うため、
+    明細数に関係なく数回のクエリで完了します。
     """
     if not isinstance(allocations_data, list):
         raise ValueError("Allocations data must be a list.")
@@ -26,40 +40,72 @@ def allocate_materials_service(production_plan, allocations_data):
     if plan_identifier:
         parts_used = PartsUsed.objects.filter(production_plan=plan_identifier)
         for p in parts_used:
-            required_parts[p.part_code] = required_parts.get(p.part_code, 0) + p.quantity_used
+            required_parts[p.part_key_id] = required_parts.get(p.part_key_id, 0) + p.quantity_used
 
-    # 既に引き当て済みの数量を取得
-    existing_allocations = MaterialAllocation.objects.filter(
-        production_plan=production_plan
-    ).values('material_code').annotate(total=Sum('allocated_quantity'))
-    allocated_map = {a['material_code']: a['total'] for a in existing_allocations}
+    # 既に引き当て済みの数量を取得 (品番キーで集計、返却済みは除く)
+    existing_allocations = (
+        MaterialAllocation.objects.filter(
+            production_plan=production_plan, status__in=MaterialAllocation.COVERING_STATUSES
+        )
+        .values("part_key_id")
+        .annotate(total=Sum("allocated_quantity"))
+    )
+    allocated_map = {a["part_key_id"]: a["total"] for a in existing_allocations}
+
+    # 1. 入力の検証と正規化 (クエリなし)
+    lines = []
+    for alloc_item_data in allocations_data:
+        part_number = alloc_item_data.get("part_number")
+        warehouse = alloc_item_data.get("warehouse")
+        quantity_to_allocate = alloc_item_data.get("quantity_to_allocate")
+        location = alloc_item_data.get("location") or None  # 省略時は倉庫内の棚番から引き当てる
+
+        if not all([part_number, warehouse, quantity_to_allocate is not None]):
+            errors.append(
+                f"Missing data for allocation item (part_number, warehouse, or quantity_to_allocate): {alloc_item_data}"
+            )
+            continue
+
+        try:
+            quantity_to_allocate = int(quantity_to_allocate)
+            if quantity_to_allocate <= 0:
+                if quantity_to_allocate < 0:
+                    errors.append(f"Quantity to allocate must be non-negative for {part_number}.")
+                continue
+        except ValueError:
+            errors.append(f"Invalid quantity for {part_number}.")
+            continue
+        lines.append((part_number, warehouse, location, quantity_to_allocate))
 
     with transaction.atomic():
-        for alloc_item_data in allocations_data:
-            part_number = alloc_item_data.get("part_number")
-            warehouse = alloc_item_data.get("warehouse")
-            quantity_to_allocate = alloc_item_data.get("quantity_to_allocate")
+        # 入力の品番は登録しない (誤入力の品番が品番辞書に残らないよう、在庫のある登録済みの品番だけを解決する)
+        part_keys = PartNumber.objects.existing_keys_for({line[0] for line in lines})
 
-            if not all([part_number, warehouse, quantity_to_allocate is not None]):
-                errors.append(
-                    f"Missing data for allocation item (part_number, warehouse, or quantity_to_allocate): {alloc_item_data}"
+        # 2. 対象の在庫行を1回のクエリでまとめてロックする (ID順にロックしてデッドロックを避ける)
+        pairs = {
+            (part_keys[part_number], warehouse) for part_number, warehouse, _, _ in lines if part_number in part_keys
+        }
+        inventory_rows = {}
+        if pairs:
+            condition = Q()
+            for part_key, warehouse in pairs:
+                condition |= Q(part_key_id=part_key, warehouse=warehouse)
+            for inventory_item in Inventory.objects.select_for_update().filter(condition).order_by("id"):
+                inventory_rows.setdefault((inventory_item.part_key_id, inventory_item.warehouse), []).append(
+                    inventory_item
                 )
-                continue
 
-            try:
-                quantity_to_allocate = int(quantity_to_allocate)
-                if quantity_to_allocate <= 0:
-                    if quantity_to_allocate < 0:
-                        errors.append(f"Quantity to allocate must be non-negative for {part_number}.")
-                    continue
-            except ValueError:
-                errors.append(f"Invalid quantity for {part_number}.")
+        # 3. BOM・在庫のバリデーションと引当数量の計算 (メモリ上で行う)
+        allocations = []
+        touched = {}
+        for part_number, warehouse, location, quantity_to_allocate in lines:
+            part_key = part_keys.get(part_number)
+            if part_key is None:
+                errors.append(f"Inventory not found for part '{part_number}' in warehouse '{warehouse}'.")
                 continue
-
-            # BOMバリデーション
-            if plan_identifier and part_number in required_parts:
-                req_qty = required_parts[part_number]
-                already_alloc = allocated_map.get(part_number, 0)
+            if plan_identifier and part_key in required_parts:
+                req_qty = required_parts[part_key]
+                already_alloc = allocated_map.get(part_key, 0)
                 if already_alloc + quantity_to_allocate > req_qty:
                     errors.append(
                         f"Allocation exceeds BOM requirement for {part_number}. "
@@ -69,65 +115,363 @@ def allocate_materials_service(production_plan, allocations_data):
             elif plan_identifier:
                 logger.warning(f"Allocating part {part_number} not found in BOM for plan {plan_identifier}")
 
-            try:
-                inventory_item = Inventory.objects.select_for_update().get(part_number=part_number, warehouse=warehouse)
-            except Inventory.DoesNotExist:
-                errors.append(f"Inventory not found for part '{part_number}' in warehouse '{warehouse}'.")
+            rows = inventory_rows.get((part_key, warehouse), [])
+            if location:
+                rows = [row for row in rows if row.location == location]
+            if not rows:
+                place = f"warehouse '{warehouse}'" + (f" location '{location}'" if location else "")
+                errors.append(f"Inventory not found for part '{part_number}' in {place}.")
                 continue
 
-            if not inventory_item.is_active or not inventory_item.is_allocatable:
+            allocatable_rows = [row for row in rows if row.is_active and row.is_allocatable]
+            if not allocatable_rows:
                 errors.append(
                     f"Inventory for part '{part_number}' in warehouse '{warehouse}' is not active or allocatable."
                 )
                 continue
 
-            if inventory_item.available_quantity < quantity_to_allocate:
+            available = sum(row.available_quantity for row in allocatable_rows)
+            if available < quantity_to_allocate:
                 errors.append(
                     f"Insufficient available stock for part '{part_number}' in warehouse '{warehouse}'. "
-                    f"Required: {quantity_to_allocate}, Available: {inventory_item.available_quantity}"
+                    f"Required: {quantity_to_allocate}, Available: {available}"
                 )
                 continue
 
-            # 在庫の引き当て（予約）
-            inventory_item.reserved += quantity_to_allocate
-            inventory_item.save()
+            # 在庫の引き当て（予約）: 同じ倉庫に複数の棚番がある場合は利用可能数の多い行から引き当てる
+            # 消費・取消で同じ行から払い出せるよう、引き当てた在庫行 (棚番) ごとに材料引当を作成する
+            remaining = quantity_to_allocate
+            for inventory_item in sorted(allocatable_rows, key=lambda row: -row.available_quantity):
+                taken = min(remaining, inventory_item.available_quantity)
+                if taken:
+                    inventory_item.reserved += taken
+                    touched[inventory_item.id] = inventory_item
+                    remaining -= taken
+                    allocations.append(
+                        (part_number, part_key, warehouse, inventory_item.location, taken, allocatable_rows)
+                    )
+                if not remaining:
+                    break
+            allocated_map[part_key] = allocated_map.get(part_key, 0) + quantity_to_allocate
+
+        if errors:
+            raise ValueError(f"Errors occurred during allocation process: {'; '.join(errors)}")
+
+        # 4. 在庫・材料引当・社内出庫予定をまとめて書き込む
+        now = timezone.now()
+        for inventory_item in touched.values():
+            inventory_item.last_updated = now
+        Inventory.objects.bulk_update(touched.values(), ["reserved", "last_updated"], batch_size=500)
+        invalidate_location_map(*{inventory_item.warehouse for inventory_item in touched.values()})
 
-            # MaterialAllocationレコードの作成
-            material_allocation = MaterialAllocation.objects.create(
+        material_allocations = [
+            MaterialAllocation(
                 production_plan=production_plan,
                 material_code=part_number,
+                part_key_id=part_key,
                 warehouse=warehouse,
+                location=location,
                 allocated_quantity=quantity_to_allocate,
                 status="ALLOCATED",
             )
+            for part_number, part_key, warehouse, location, quantity_to_allocate, _ in allocations
+        ]
+        MaterialAllocation.objects.bulk_create(material_allocations, batch_size=500)
 
-            # 出庫予定（SalesOrder）の作成
-            so_order_number = f"INT-{material_allocation.id.hex[:15]}"
-            sales_order, so_created = SalesOrder.objects.get_or_create(
-                order_number=so_order_number,
-                defaults={
-                    "item": material_allocation.material_code,
-                    "quantity": material_allocation.allocated_quantity,
-                    "warehouse": warehouse,
-                    "expected_shipment": production_plan.planned_start_datetime,
-                    "status": "pending",
-                },
+        sales_orders = [
+            SalesOrder(
+                order_number=f"{INTERNAL_ORDER_PREFIX}{material_allocation.id.hex[:15]}",
+                item=material_allocation.material_code,
+                quantity=material_allocation.allocated_quantity,
+                warehouse=material_allocation.warehouse,
+                expected_shipment=production_plan.planned_start_datetime,
+                status="pending",
+                source_allocation=material_allocation,
+                source_plan=production_plan,
             )
+            for material_allocation in material_allocations
+        ]
+        SalesOrder.objects.bulk_create(sales_orders, batch_size=500)
 
+        for (part_number, _, warehouse, location, quantity_to_allocate, rows), material_allocation, sales_order in zip(
+            allocations, material_allocations, sales_orders, strict=True
+        ):
             processed_allocations_summary.append(
                 {
                     "part_number": part_number,
                     "warehouse": warehouse,
+                    "location": location,
                     "allocated_quantity": quantity_to_allocate,
                     "material_allocation_id": material_allocation.id,
-                    "new_inventory_reserved": inventory_item.reserved,
-                    "new_inventory_available": inventory_item.available_quantity,
+                    "new_inventory_reserved": sum(row.reserved for row in rows),
+                    "new_inventory_available": sum(row.available_quantity for row in rows),
                     "sales_order_id": sales_order.id,
                     "sales_order_number": sales_order.order_number,
                 }
             )
 
-        if errors:
-            raise ValueError(f"Errors occurred during allocation process: {'; '.join(errors)}")
-
     return processed_allocations_summary
+
+
+def resolve_allocation_policy(overrides=None):
+    """設定 AUTO_ALLOCATION_POLICY に、リクエストで指定された項目を上書きした自動引当ポリシーを返します。"""
+    policy = dict(settings.AUTO_ALLOCATION_POLICY)
+    for key, value in (overrides or {}).items():
+        if key not in policy:
+            raise ValueError(f"Unknown allocation policy option: {key}")
+        policy[key] = value
+    policy["warehouses"] = list(policy.get("warehouses") or [])
+    policy["max_splits"] = int(policy.get("max_splits") or 0)
+    return policy
+
+
+def load_plan_requirements(production_plans):
+    """
+    生産計画ごとの未引当の所要量を一括クエリで返します。
+    戻り値: {計画ID: [{"part_number", "part_key", "preferred_warehouses", "remaining"}]}
+    preferred_warehouses は使用部品に指定された倉庫 (数量の多い順) です。
+    """
+    plans = list(production_plans)
+    identifiers = {plan.production_plan for plan in plans if plan.production_plan}
+    usage = {}
+    for identifier, part_code, part_key, warehouse, total in (
+        PartsUsed.objects.filter(production_plan__in=identifiers)
+        .values_list("production_plan", "part_code", "part_key_id", "warehouse")
+        .annotate(total=Sum("quantity_used"))
+        .order_by()
+    ):
+        entry = usage.setdefault(identifier, {}).setdefault(
+            part_key, {"part_number": part_code, "part_key": part_key, "required": 0, "warehouses": {}}
+        )
+        entry["required"] += total
+        if warehouse:
+            entry["warehouses"][warehouse] = entry["warehouses"].get(warehouse, 0) + total
+
+    allocations = (
+        MaterialAllocation.objects.filter(
+            production_plan__in=[plan.pk for plan in plans], status__in=MaterialAllocation.COVERING_STATUSES
+        )
+        .values_list("production_plan_id", "part_key_id")
+        .annotate(total=Sum("allocated_quantity"))
+        .order_by()
+    )
+    allocated = {(plan_id, part_key): total for plan_id, part_key, total in allocations}
+
+    requirements = {}
+    for plan in plans:
+        lines = []
+        for part_key, entry in usage.get(plan.production_plan, {}).items():
+            remaining = entry["required"] - allocated.get((plan.pk, part_key), 0)
+            if remaining > 0:
+                warehouses = sorted(entry["warehouses"], key=lambda w: -entry["warehouses"][w])
+                lines.append(
+                    {
+                        "part_number": entry["part_number"],
+                        "part_key": part_key,
+                        "preferred_warehouses": warehouses,
+                        "remaining": remaining,
+                    }
+                )
+        requirements[plan.pk] = sorted(lines, key=lambda line: line["part_number"])
+    return requirements
+
+
+def load_allocatable_stock(part_keys, lock=False):
+    """
+    品番キーごとの引当可能な在庫行を1回のクエリで返します: {品番キー: [{"id", "warehouse", "location", "available"}]}
+    lock=True の場合は行をID順にロックします。
+    """
+    queryset = Inventory.objects.filter(
+        part_key_id__in=part_keys, is_active=True, is_allocatable=True, quantity__gt=F("reserved")
+    ).order_by("id")
+    if lock:
+        queryset = queryset.select_for_update()
+    stock = {}
+    for row_id, part_key, warehouse, location, quantity, reserved in queryset.values_list(
+        "id", "part_key_id", "warehouse", "location", "quantity", "reserved"
+    ):
+        stock.setdefault(part_key, []).append(
+            {"id": row_id, "warehouse": warehouse, "location": location, "available": quantity - reserved}
+        )
+    return stock
+
+
+def pick_stock(candidates, quantity, preferred_warehouses, policy):
+    """
+    所要量 quantity を在庫行 candidates から貪欲法で選び、[(在庫行, 数量)] を返します。
+    選んだ分は candidates の利用可能数から減算します。
+    優先度 (使用部品の指定倉庫 → ポリシーの倉庫の順位) の高いグループから順に、利用可能数の多い棚番を使います。
+    single_row_first の場合、グループ内の1つの棚番で残りを賄えるなら、最も利用可能数が少ない棚番だけを使います
+    (分割せず、大きなロットも崩さないため)。
+    """
+    allowed = policy["warehouses"]
+
+    def priority(row):
+        preferred = policy["prefer_bom_warehouse"] and row["warehouse"] in preferred_warehouses
+        return (not preferred, allowed.index(row["warehouse"]) if allowed else 0)
+
+    tiers = {}
+    for row in candidates:
+        if row["available"] > 0 and (not allowed or row["warehouse"] in allowed):
+            tiers.setdefault(priority(row), []).append(row)
+
+    picks = []
+
+    def take(row, amount):
+        row["available"] -= amount
+        picks.append((row, amount))
+        return amount
+
+    for key in sorted(tiers):
+        if policy["max_splits"] and len(picks) >= policy["max_splits"]:
+            break
+        rows = sorted(tiers[key], key=lambda row: (-row["available"], row["warehouse"] or "", row["location"] or ""))
+        if policy["single_row_first"]:
+            covering = [row for row in rows if row["available"] >= quantity]
+            if covering:
+                take(min(covering, key=lambda row: row["available"]), quantity)
+                return picks
+        for row in rows:
+            if quantity <= 0 or (policy["max_splits"] and len(picks) >= policy["max_splits"]):
+                return picks
+            quantity -= take(row, min(quantity, row["available"]))
+        if quantity <= 0:
+            break
+    return picks
+
+
+def propose_allocation(requirements, stock, policy):
+    """
+    所要量の一覧 (load_plan_requirements の1計画分) に対する引当案と不足を返します。stock の利用可能数は減算します。
+    引当案の明細は allocate_materials_service にそのまま渡せる形式です。
+    """
+    lines = []
+    shortages = []
+    for requirement in requirements:
+        candidates = stock.get(requirement["part_key"], [])
+        picks = pick_stock(candidates, requirement["remaining"], requirement["preferred_warehouses"], policy)
+        for row, quantity in picks:
+            lines.append(
+                {
+                    "part_number": requirement["part_number"],
+                    "warehouse": row["warehouse"],
+                    "location": row["location"],
+                    "quantity_to_allocate": quantity,
+                }
+            )
+        allocated = sum(quantity for _, quantity in picks)
+        if allocated < requirement["remaining"]:
+            shortages.append(
+                {
+                    "part_number": requirement["part_number"],
+                    "required_quantity": requirement["remaining"],
+                    "allocatable_quantity": allocated,
+                    "shortage_quantity": requirement["remaining"] - allocated,
+                }
+            )
+    return lines, shortages
+
+
+def auto_allocate_materials_service(production_plan, policy_overrides=None, commit=False):
+    """
+    生産計画の未引当の所要量について、倉庫・棚番をまたいだ引当案を作成します。
+    在庫は1回のクエリで読み込み、引当案はメモリ上で貪欲法により決めます。
+    commit=True の場合は在庫行をロックしたうえで引当案をそのまま引き当てます。不足がある場合は、
+    ポリシーの allow_partial が有効なときだけ引当可能な分を引き当てます。
+    """
+    policy = resolve_allocation_policy(policy_overrides)
+    with transaction.atomic():
+        requirements = load_plan_requirements([production_plan])[production_plan.pk]
+        stock = load_allocatable_stock({requirement["part_key"] for requirement in requirements}, lock=commit)
+        lines, shortages = propose_allocation(requirements, stock, policy)
+        result = {"proposal": lines, "shortages": shortages, "policy": policy, "committed": False}
+        if commit and lines and (not shortages or policy["allow_partial"]):
+            result["allocations_summary"] = allocate_materials_service(production_plan, lines)
+            result["committed"] = True
+    return result
+
+
+def _day_start(value):
+    return timezone.make_aware(datetime.combine(value, time.min))
+
+
+def batch_allocate_materials_service(
+    date_from, date_to, statuses=None, policy_overrides=None, chunk_size=None, on_progress=None
+):
+    """
+    date_from 以降 date_to より前 (日付) に開始する生産計画の未引当の所要量を一括で引き当てます。
+    所要量と在庫はまとめて読み込み、計画を開始日時 → 優先度 → 作成日時の順に、先の計画が使った残りの在庫から
+    メモリ上で引当案を決めます。確定は chunk_size 件の計画ごとのトランザクションで行い、読み込み後に在庫が
+    変わって引き当てられなかった計画は失敗として記録して続行します。不足の一覧を含む集計結果を返します。
+    """
+    policy = resolve_allocation_policy(policy_overrides)
+    chunk_size = chunk_size or settings.BATCH_ALLOCATION_CHUNK_SIZE
+    statuses = statuses or [ProductionPlan.Status.PENDING]
+    plans = list(
+        ProductionPlan.objects.filter(
+            status__in=statuses,
+            planned_start_datetime__gte=_day_start(date_from),
+            planned_start_datetime__lt=_day_start(date_to),
+        ).order_by(*BATCH_PLAN_ORDERING)
+    )
+    requirements = load_plan_requirements(plans)
+    stock = load_allocatable_stock({line["part_key"] for lines in requirements.values() for line in lines})
+
+    report = {
+        "date_from": date_from.isoformat(),
+        "date_to": date_to.isoformat(),
+        "plans": len(plans),
+        "allocated_plans": 0,
+        "allocated_lines": 0,
+        "skipped_plans": 0,
+        "shortages": [],
+        "failures": [],
+    }
+    proposals = []
+    for plan in plans:
+        plan_requirements = requirements[plan.pk]
+        if not plan_requirements:
+            continue
+        snapshot = [
+            (row, row["available"]) for line in plan_requirements for row in stock.get(line["part_key"], [])
+        ]
+        lines, shortages = propose_allocation(plan_requirements, stock, policy)
+        commit = bool(lines) and (not shortages or policy["allow_partial"])
+        if shortages:
+            report["shortages"].append(
+                {
+                    "production_plan_id": str(plan.pk),
+                    "plan_name": plan.plan_name,
+                    "planned_start_datetime": plan.planned_start_datetime.isoformat(),
+                    "partially_allocated": commit,
+                    "lines": shortages,
+                }
+            )
+        if commit:
+            proposals.append((plan, lines))
+        else:
+            # 引き当てない計画の引当案が使った在庫は、後続の計画に回す
+            for row, available in snapshot:
+                row["available"] = available
+            report["skipped_plans"] += 1
+
+    total = len(proposals)
+    if on_progress:
+        on_progress(0, total)
+    for start in range(0, total, chunk_size):
+        with transaction.atomic():
+            for plan, lines in proposals[start : start + chunk_size]:
+                try:
+                    # 1計画の失敗でチャンク全体が巻き戻らないよう、計画ごとにセーブポイントを置く
+                    with transaction.atomic():
+                        allocate_materials_service(plan, lines)
+                except ValueError as e:
+                    report["failures"].append(
+                        {"production_plan_id": str(plan.pk), "plan_name": plan.plan_name, "error": str(e)}
+                    )
+                    continue
+                report["allocated_plans"] += 1
+                report["allocated_lines"] += len(lines)
+        if on_progress:
+            on_progress(min(start + chunk_size, total), total)
+    return report
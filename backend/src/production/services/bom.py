@@ -0,0 +1,272 @@
+import logging
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+
+from master.models import PartNumber
+
+from ..models import BomClosure, PartsUsed, ProductionPlan
+
+logger = logging.getLogger(__name__)
+
+QUANTITY_PLACES = Decimal("0.000001")
+CLOSURE_FIELDS = [
+    "ancestor_code",
+    "descendant_code",
+    "depth",
+    "max_depth",
+    "extended_quantity",
+    "path_count",
+    "is_leaf",
+]
+
+
+class BomCycleError(ValueError):
+    """BOM に循環 (製品が自分自身の構成部品になる経路) があることを示す例外。"""
+
+
+def _load_direct_edges(product_codes=None):
+    """load_bom_edges の1階層分。product_codes を指定するとその製品の直下の構成だけを読み込みます。"""
+    identifiers = PartsUsed.objects.values("production_plan")
+    plans = ProductionPlan.objects.filter(production_plan__in=identifiers, planned_quantity__gt=0)
+    if product_codes is not None:
+        plans = plans.filter(product_code__in=product_codes)
+    plans = (
+        plans.exclude(status=ProductionPlan.Status.CANCELLED)
+        .order_by("product_code", "-planned_start_datetime", "-created_at")
+        .values_list("product_code", "production_plan", "planned_quantity")
+    )
+    bom_plans = {}
+    for product_code, identifier, planned_quantity in plans:
+        bom_plans.setdefault(product_code, (identifier, planned_quantity))
+
+    usage = (
+        PartsUsed.objects.filter(production_plan__in={identifier for identifier, _ in bom_plans.values()})
+        .values_list("production_plan", "part_code")
+        .annotate(total=Sum("quantity_used"))
+        .order_by()
+    )
+    usage_by_identifier = {}
+    for identifier, part_code, total in usage:
+        usage_by_identifier.setdefault(identifier, {})[part_code] = total
+
+    edges = {}
+    for product_code, (identifier, planned_quantity) in bom_plans.items():
+        children = {
+            part_code: Decimal(total) / planned_quantity
+            for part_code, total in usage_by_identifier.get(identifier, {}).items()
+            if part_code != product_code
+        }
+        if children:
+            edges[product_code] = children
+    return edges
+
+
+def load_bom_edges(product_codes=None):
+    """
+    製品ごとの直下の構成 {製品コード: {部品コード: 製品1個あたりの使用数量}} を返します。
+    製品の構成は、その製品コードの生産計画 (中止を除く) のうち、参照生産計画の識別子に使用部品が登録されている
+    最新の計画から取ります。使用数量は計画全体の数量のため、計画数量で割って製品1個あたりに換算します。
+    product_codes を指定すると、その製品から辿れる製品・部品の構成だけを階層ごとに読み込みます。
+    """
+    if product_codes is None:
+        return _load_direct_edges()
+    edges = {}
+    loaded = set()
+    pending = set(product_codes)
+    while pending:
+        level = _load_direct_edges(pending)
+        edges.update(level)
+        loaded |= pending
+        pending = {child for children in level.values() for child in children} - loaded
+    return edges
+
+
+def compute_closure(product_code, edges, memo=None, visiting=None):
+    """
+    製品のすべての階層の構成部品を {部品コード: [最短階層, 最大階層, 所要量, 経路数]} で返します。
+    部分木の結果は memo に保持し、同じ中間組立品を何度も展開しないようにします。
+    """
+    memo = {} if memo is None else memo
+    visiting = set() if visiting is None else visiting
+    if product_code in memo:
+        return memo[product_code]
+    if product_code in visiting:
+        raise BomCycleError(f"BOM に循環があります: {product_code}")
+
+    visiting.add(product_code)
+    closure = {}
+    for child, quantity in edges.get(product_code, {}).items():
+        paths = [(child, 1, 1, quantity, 1)]
+        for descendant, (depth, max_depth, extended, path_count) in compute_closure(
+            child, edges, memo, visiting
+        ).items():
+            paths.append((descendant, depth + 1, max_depth + 1, quantity * extended, path_count))
+        for descendant, depth, max_depth, extended, path_count in paths:
+            entry = closure.get(descendant)
+            if entry is None:
+                closure[descendant] = [depth, max_depth, extended, path_count]
+            else:
+                entry[0] = min(entry[0], depth)
+                entry[1] = max(entry[1], max_depth)
+                entry[2] += extended
+                entry[3] += path_count
+    visiting.discard(product_code)
+    memo[product_code] = closure
+    return closure
+
+
+@transaction.atomic
+def refresh_bom_closure(product_codes=None):
+    """
+    BOM 推移閉包を再計算します。
+    product_codes を指定すると、その製品と、それを構成部品として使うすべての上位製品 (閉包表から1回のクエリで取得)
+    だけを再計算します。省略するとすべて再計算します。保存した行数を返します。
+    """
+    if product_codes is None:
+        edges = load_bom_edges()
+        affected = set(edges)
+        BomClosure.objects.all().delete()
+    else:
+        product_codes = {code for code in product_codes if code}
+        ancestors = BomClosure.objects.filter(descendant_key__code__in=product_codes).values_list(
+            "ancestor_code", flat=True
+        )
+        affected = product_codes | set(ancestors)
+        # 再計算する製品から辿れる構成だけを読み込む
+        edges = load_bom_edges(affected)
+        BomClosure.objects.filter(ancestor_key__code__in=affected).delete()
+
+    memo = {}
+    closures = {}
+    for product_code in sorted(affected):
+        try:
+            closures[product_code] = compute_closure(product_code, edges, memo)
+        except BomCycleError as e:
+            # 循環した製品は閉包を作らず、他の製品の再計算は続ける
+            logger.warning("Skipping BOM closure for %s: %s", product_code, e)
+
+    codes = set(closures)
+    for closure in closures.values():
+        codes.update(closure)
+    keys = PartNumber.objects.keys_for(codes)
+    rows = [
+        BomClosure(
+            ancestor_code=product_code,
+            ancestor_key_id=keys[product_code],
+            descendant_code=descendant,
+            descendant_key_id=keys[descendant],
+            depth=depth,
+            max_depth=max_depth,
+            extended_quantity=extended.quantize(QUANTITY_PLACES),
+            path_count=path_count,
+            is_leaf=descendant not in edges,
+        )
+        for product_code, closure in closures.items()
+        for descendant, (depth, max_depth, extended, path_count) in closure.items()
+    ]
+    # 同時に実行された再計算と衝突した場合は後から計算した値で上書きする
+    BomClosure.objects.bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=["ancestor_key", "descendant_key"],
+        update_fields=[*CLOSURE_FIELDS, "updated_at"],
+    )
+    return len(rows)
+
+
+class _PendingBomRefresh:
+    """1つのトランザクションで変更された製品・識別子を集め、コミット後に1回だけ閉包を再計算するコールバック。"""
+
+    def __init__(self):
+        self.product_codes = set()
+        self.identifiers = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        product_codes = set(self.product_codes)
+        if self.identifiers:
+            product_codes.update(
+                ProductionPlan.objects.filter(production_plan__in=self.identifiers).values_list(
+                    "product_code", flat=True
+                )
+            )
+        if product_codes:
+            refresh_bom_closure(product_codes)
+
+
+def schedule_bom_refresh(product_codes=(), identifiers=()):
+    """
+    製品コード・参照生産計画の識別子の閉包の再計算を、トランザクションのコミット後に予約します。
+    同じトランザクション内の予約 (CSV インポートの各行など) は1回の再計算にまとめます。
+    """
+    if not product_codes and not identifiers:
+        return
+    connection = transaction.get_connection()
+    pending = None
+    if connection.in_atomic_block:
+        savepoints = set(connection.savepoint_ids)
+        for sids, callback, _robust in connection.run_on_commit:
+            # 今のセーブポイントより内側で予約されたものは、ロールバックで消えることがあるため使わない
+            if isinstance(callback, _PendingBomRefresh) and not callback.done and sids <= savepoints:
+                pending = callback
+                break
+    created = pending is None
+    if created:
+        pending = _PendingBomRefresh()
+    pending.product_codes.update(product_codes)
+    pending.identifiers.update(identifiers)
+    if created:
+        # トランザクション外では on_commit がすぐに実行されるため、対象を集めてから登録する
+        transaction.on_commit(pending)
+
+
+def explode_bom(product_code, quantity=1, max_depth=None, leaves_only=False):
+    """
+    製品に必要なすべての階層の構成部品と所要量 (quantity 個分) を返します。
+    閉包表を (製品キー, 階層) のインデックスで1回検索するだけで、階層の深さに関係なく結果が得られます。
+    """
+    queryset = BomClosure.objects.filter(ancestor_key__code=product_code)
+    if max_depth is not None:
+        queryset = queryset.filter(depth__lte=max_depth)
+    if leaves_only:
+        queryset = queryset.filter(is_leaf=True)
+    queryset = queryset.order_by("depth", "descendant_code").values_list(
+        "descendant_code", "depth", "max_depth", "extended_quantity", "path_count", "is_leaf"
+    )
+    quantity = Decimal(quantity)
+    return [
+        {
+            "part_code": code,
+            "depth": depth,
+            "max_depth": max_depth,
+            "quantity_per_unit": extended,
+            "required_quantity": extended * quantity,
+            "path_count": path_count,
+            "is_leaf": is_leaf,
+        }
+        for code, depth, max_depth, extended, path_count, is_leaf in queryset
+    ]
+
+
+def implode_bom(part_code, max_depth=None):
+    """部品を使用するすべての上位製品 (直接・間接) と、製品1個あたりの使用量を返します。"""
+    queryset = BomClosure.objects.filter(descendant_key__code=part_code)
+    if max_depth is not None:
+        queryset = queryset.filter(depth__lte=max_depth)
+    queryset = queryset.order_by("depth", "ancestor_code").values_list(
+        "ancestor_code", "depth", "max_depth", "extended_quantity", "path_count"
+    )
+    return [
+        {
+            "product_code": code,
+            "depth": depth,
+            "max_depth": max_depth,
+            "quantity_per_unit": extended,
+            "path_count": path_count,
+        }
+        for code, depth, max_depth, extended, path_count in queryset
+    ]
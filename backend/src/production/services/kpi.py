@@ -0,0 +1,200 @@
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from django.utils import timezone
+
+from master.models import PartNumber
+
+from ..models import ProductionKpiDaily, ProductionPlan, WorkProgress
+
+logger = logging.getLogger(__name__)
+
+# 集計期間: 日次の行をそのまま使うか、週 (月曜始まり)・月の初日に丸めて合算する
+KPI_PERIODS = {"day": None, "week": TruncWeek, "month": TruncMonth}
+# グループ化の軸: API のキー -> 集計行のフィールド
+KPI_GROUPS = {"product": ["product_code"], "operator": ["operator", "operator__username"]}
+SUM_FIELDS = [
+    "completed_plans",
+    "late_plans",
+    "planned_quantity",
+    "good_quantity",
+    "reported_quantity",
+    "defective_quantity",
+    "lead_time_seconds",
+    "planned_lead_time_seconds",
+]
+SOURCE_FIELDS = [
+    "production_plan__actual_end_datetime",
+    "production_plan__product_code",
+    "operator_id",
+    "production_plan__planned_quantity",
+    "quantity_completed",
+    "actual_reported_quantity",
+    "defective_reported_quantity",
+    "production_plan__actual_start_datetime",
+    "production_plan__planned_start_datetime",
+    "production_plan__planned_end_datetime",
+    "production_plan__due_datetime",
+]
+
+
+def kpi_key(plan):
+    """完了済みの計画が集計される (完了日, 製品コード) を返します。完了していなければ None です。"""
+    if plan.status == ProductionPlan.Status.COMPLETED and plan.actual_end_datetime:
+        return timezone.localdate(plan.actual_end_datetime), plan.product_code
+    return None
+
+
+def _completed_progress(**filters):
+    """完了した計画の全体進捗を、集計に必要な列だけのタプルで返します。"""
+    return WorkProgress.objects.filter(
+        process_step=WorkProgress.OVERALL_PROCESS_STEP,
+        production_plan__status=ProductionPlan.Status.COMPLETED,
+        production_plan__actual_end_datetime__isnull=False,
+        **filters,
+    ).values_list(*SOURCE_FIELDS)
+
+
+def aggregate_kpi_rows(source):
+    """完了した計画の進捗を (完了日, 製品, 作業者) ごとに集計し、保存前の集計行のリストを返します。"""
+    rows = {}
+    for (
+        end,
+        product_code,
+        operator_id,
+        planned_quantity,
+        good,
+        reported,
+        defective,
+        start,
+        planned_start,
+        planned_end,
+        due,
+    ) in source:
+        key = (timezone.localdate(end), product_code, operator_id)
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = ProductionKpiDaily(date=key[0], product_code=product_code, operator_id=operator_id)
+        defective = defective or 0
+        row.completed_plans += 1
+        # 納期遅れは納期で判定する (スケジューラが書き換える計画終了日時とは比べない)
+        row.late_plans += end > (due or planned_end)
+        row.planned_quantity += planned_quantity
+        row.good_quantity += good
+        # 総生産数が報告されていない場合は良品数 + 不良数とみなす
+        row.reported_quantity += reported if reported is not None else good + defective
+        row.defective_quantity += defective
+        row.lead_time_seconds += int((end - (start or end)).total_seconds())
+        row.planned_lead_time_seconds += int((planned_end - planned_start).total_seconds())
+    return list(rows.values())
+
+
+@transaction.atomic
+def refresh_production_kpis(keys):
+    """
+    (完了日, 製品コード) の集計行を元データから作り直します。進捗更新で計画が完了・完了取消されたときに、
+    変更前と変更後の (完了日, 製品コード) を渡して呼び出します。作り直した行数を返します。
+    """
+    keys = {key for key in keys if key}
+    if not keys:
+        return 0
+    dates = {date for date, _ in keys}
+    product_codes = {product_code for _, product_code in keys}
+    # 同じ製品の集計行を同時に作り直して重複させないよう、製品の品番行をロックしてから削除・再作成する
+    list(PartNumber.objects.select_for_update().filter(code__in=product_codes).order_by("id").values_list("id"))
+
+    ProductionKpiDaily.objects.filter(date__in=dates, product_code__in=product_codes).delete()
+    rows = aggregate_kpi_rows(
+        _completed_progress(
+            production_plan__actual_end_datetime__date__in=dates,
+            production_plan__product_code__in=product_codes,
+        )
+    )
+    ProductionKpiDaily.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+@transaction.atomic
+def rebuild_production_kpis(date_from=None, date_to=None):
+    """
+    期間内 (省略時はすべて) の集計行を元データから作り直します (導入時のバックフィルやデータ修正後)。
+    元データは1回のクエリで順に読み、集計は (完了日, 製品, 作業者) の単位でメモリ上で行います。作成した行数を返します。
+    """
+    rollups = ProductionKpiDaily.objects.all()
+    filters = {}
+    if date_from:
+        rollups = rollups.filter(date__gte=date_from)
+        filters["production_plan__actual_end_datetime__date__gte"] = date_from
+    if date_to:
+        rollups = rollups.filter(date__lte=date_to)
+        filters["production_plan__actual_end_datetime__date__lte"] = date_to
+    rollups.delete()
+
+    rows = aggregate_kpi_rows(_completed_progress(**filters).iterator(chunk_size=2000))
+    ProductionKpiDaily.objects.bulk_create(rows, batch_size=1000)
+    logger.info("Rebuilt %s production KPI rows (%s - %s)", len(rows), date_from, date_to)
+    return len(rows)
+
+
+def _period_days(start, period, date_from, date_to):
+    """集計期間のうち、指定された日付範囲に含まれる日数を返します (スループットの日平均に使います)。"""
+    if period == "day":
+        end = start
+    elif period == "week":
+        end = start + timedelta(days=6)
+    else:
+        end = (start.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    return (min(end, date_to) - max(start, date_from)).days + 1
+
+
+def _ratio(numerator, denominator, places=4):
+    return round(numerator / denominator, places) if denominator else None
+
+
+def query_production_kpis(date_from, date_to, period="day", group_by=()):
+    """
+    集計行を期間 (day / week / month) と軸 (product / operator) ごとに合算し、歩留まり・スループット・
+    リードタイムの指標を付けて返します。計画の履歴ではなく事前集計済みの行だけを読みます。
+    """
+    if period not in KPI_PERIODS:
+        raise ValueError(f"period must be one of: {', '.join(KPI_PERIODS)}")
+    unknown = set(group_by) - set(KPI_GROUPS)
+    if unknown:
+        raise ValueError(f"Unknown group_by: {', '.join(sorted(unknown))}")
+    if date_from > date_to:
+        raise ValueError("date_from must be on or before date_to.")
+
+    truncate = KPI_PERIODS[period]
+    dimensions = [field for group in group_by for field in KPI_GROUPS[group]]
+    queryset = (
+        ProductionKpiDaily.objects.filter(date__gte=date_from, date__lte=date_to)
+        .annotate(period=truncate("date") if truncate else F("date"))
+        .values("period", *dimensions)
+        .annotate(**{field: Sum(field) for field in SUM_FIELDS})
+        .order_by("period", *dimensions)
+    )
+
+    results = []
+    for row in queryset:
+        plans = row["completed_plans"]
+        result = {
+            "period": row["period"],
+            **{field: row[field] for field in dimensions},
+            **{field: row[field] for field in SUM_FIELDS if not field.endswith("_seconds")},
+            "yield_rate": _ratio(row["good_quantity"], row["reported_quantity"]),
+            "defect_rate": _ratio(row["defective_quantity"], row["reported_quantity"]),
+            "on_time_rate": _ratio(plans - row["late_plans"], plans),
+            "average_lead_time_hours": _ratio(row["lead_time_seconds"], plans * 3600, 2),
+            "average_planned_lead_time_hours": _ratio(row["planned_lead_time_seconds"], plans * 3600, 2),
+            "lead_time_ratio": _ratio(row["lead_time_seconds"], row["planned_lead_time_seconds"]),
+            "throughput_per_day": _ratio(
+                row["good_quantity"], _period_days(row["period"], period, date_from, date_to), 2
+            ),
+        }
+        if "operator" in result:
+            result["operator_name"] = result.pop("operator__username")
+        results.append(result)
+    return results
@@ -0,0 +1,310 @@
+import logging
+import math
+from collections import deque
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from inventory.models import Inventory
+from inventory.services.supply_calendar import open_purchase_orders
+from master.models import PartNumber
+
+from ..models import MaterialAllocation, MrpRequirement, MrpRun, PartsUsed, ProductionPlan
+from .bom import load_bom_edges
+
+logger = logging.getLogger(__name__)
+
+OPEN_PLAN_STATUSES = [ProductionPlan.Status.PENDING, ProductionPlan.Status.IN_PROGRESS]
+# 浮動小数点の誤差で計画オーダーが1個増えないようにするための許容誤差
+EPSILON = 1e-9
+
+
+def _local_date(value):
+    return timezone.localdate(value) if value is not None else None
+
+
+def load_mrp_inputs(plans=None):
+    """
+    MRP の入力を一括クエリで読み込みます (生産計画ごとのクエリは発行しません)。
+    plans を省略すると未着手・進行中のすべての生産計画が対象です。戻り値の辞書:
+      demands: [(品番, 必要日, 数量)] 生産計画の使用部品から、その計画に引当・出庫済みの数量を差し引いた所要量
+      receipts: [(品番, 入庫予定日, 数量)] 未入庫の発注残と、生産計画の完成予定数量
+      on_hand: {品番: 利用可能数量 (在庫 - 引当)}
+      edges: BOM の直下の構成 (load_bom_edges)
+    """
+    if plans is None:
+        plans = ProductionPlan.objects.filter(status__in=OPEN_PLAN_STATUSES)
+    plan_rows = list(
+        plans.values_list(
+            "id",
+            "product_code",
+            "production_plan",
+            "planned_quantity",
+            "planned_start_datetime",
+            "planned_end_datetime",
+        )
+    )
+
+    usage = {}
+    identifiers = {row[2] for row in plan_rows if row[2]}
+    for identifier, part_code, total in (
+        PartsUsed.objects.filter(production_plan__in=identifiers)
+        .values_list("production_plan", "part_code")
+        .annotate(total=Sum("quantity_used"))
+        .order_by()
+    ):
+        usage.setdefault(identifier, {})[part_code] = total
+
+    covered = {}
+    for plan_id, material_code, total in (
+        MaterialAllocation.objects.filter(production_plan__in=plans, status__in=MaterialAllocation.COVERING_STATUSES)
+        .values_list("production_plan_id", "material_code")
+        .annotate(total=Sum("allocated_quantity"))
+        .order_by()
+    ):
+        covered[(plan_id, material_code)] = total
+
+    demands = []
+    receipts = []
+    for plan_id, product_code, identifier, planned_quantity, start, end in plan_rows:
+        for part_code, quantity in usage.get(identifier, {}).items():
+            remaining = quantity - covered.get((plan_id, part_code), 0)
+            if remaining > 0:
+                demands.append((part_code, _local_date(start), remaining))
+        if planned_quantity:
+            receipts.append((product_code, _local_date(end), planned_quantity))
+
+    for part_code, arrival, remaining in (
+        open_purchase_orders()
+        .filter(part_key__isnull=False)
+        .values_list("part_key__code", "expected_arrival")
+        .annotate(remaining=Sum(F("quantity") - F("received_quantity")))
+        .order_by()
+    ):
+        receipts.append((part_code, _local_date(arrival), remaining))
+
+    on_hand = dict(
+        Inventory.objects.filter(is_active=True, is_allocatable=True, part_key__isnull=False)
+        .values_list("part_key__code")
+        .annotate(available=Sum(F("quantity") - F("reserved")))
+        .order_by()
+    )
+    return {"demands": demands, "receipts": receipts, "on_hand": on_hand, "edges": load_bom_edges()}
+
+
+def low_level_codes(codes, edges):
+    """
+    品番ごとの低位レベルコード (BOM 上で現れる最も深い階層) を返します。
+    親の計画オーダーから子の従属所要量が決まるため、レベルの小さい順に計算すれば各品番を1回だけ処理できます。
+    """
+    levels = dict.fromkeys(codes, 0)
+    indegree = dict.fromkeys(codes, 0)
+    for parent in codes:
+        for child in edges.get(parent, {}):
+            if child in indegree:
+                indegree[child] += 1
+    queue = deque(code for code, count in indegree.items() if count == 0)
+    while queue:
+        parent = queue.popleft()
+        for child in edges.get(parent, {}):
+            if child not in indegree:
+                continue
+            levels[child] = max(levels[child], levels[parent] + 1)
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                queue.append(child)
+    cyclic = [code for code, count in indegree.items() if count > 0]
+    if cyclic:
+        logger.warning("BOM cycle detected; dependent demand below %s is not exploded.", sorted(cyclic))
+    return levels
+
+
+def _release(planned, lead_buckets):
+    """計画オーダーの入庫期間をリードタイム分前倒しした手配期間に移します。計算開始前にはみ出す分は最初の期間に寄せます。"""
+    if lead_buckets == 0:
+        return planned.copy()
+    releases = np.zeros_like(planned)
+    n_buckets = planned.shape[-1]
+    if lead_buckets < n_buckets:
+        releases[..., : n_buckets - lead_buckets] = planned[..., lead_buckets:]
+    releases[..., 0] += planned[..., : min(lead_buckets, n_buckets)].sum(axis=-1)
+    return releases
+
+
+def compute_mrp(inputs, start_date, bucket_days, horizon_days, lead_time_days, on_progress=None):
+    """
+    時間バケット別の正味所要量と計画オーダー (ロット・フォー・ロット) を計算します。
+    (品番数, 期間数) の配列で、低位レベルコードごとに全品番の引当計算をまとめて行い、
+    生産品の計画オーダーは手配期間の従属所要量として子品番に展開します。データベースにはアクセスしません。
+    """
+    n_buckets = max(1, math.ceil(horizon_days / bucket_days))
+    lead_buckets = math.ceil(lead_time_days / bucket_days)
+    edges = inputs["edges"]
+
+    # 所要のある品番と、生産品であればその下位の構成部品すべてが計算対象
+    codes = {part_code for part_code, _, _ in inputs["demands"]}
+    pending = list(codes)
+    while pending:
+        for child in edges.get(pending.pop(), {}):
+            if child not in codes:
+                codes.add(child)
+                pending.append(child)
+    levels = low_level_codes(codes, edges)
+    codes = sorted(codes, key=lambda code: (levels[code], code))
+    index = {code: i for i, code in enumerate(codes)}
+
+    def bucket_of(day):
+        if day is None:
+            return 0
+        bucket = max(0, (day - start_date).days // bucket_days)
+        return bucket if bucket < n_buckets else None
+
+    beyond_horizon = 0
+
+    def accumulate(target, entries):
+        nonlocal beyond_horizon
+        rows, cols, values = [], [], []
+        for part_code, day, quantity in entries:
+            if part_code not in index:
+                continue
+            bucket = bucket_of(day)
+            if bucket is None:
+                beyond_horizon += 1
+                continue
+            rows.append(index[part_code])
+            cols.append(bucket)
+            values.append(float(quantity))
+        if values:
+            np.add.at(target, (np.array(rows), np.array(cols)), values)
+
+    shape = (len(codes), n_buckets)
+    gross = np.zeros(shape)
+    receipts = np.zeros(shape)
+    accumulate(gross, inputs["demands"])
+    accumulate(receipts, inputs["receipts"])
+    on_hand = np.array([max(float(inputs["on_hand"].get(code) or 0), 0.0) for code in codes])
+
+    projected = np.zeros(shape)
+    net = np.zeros(shape)
+    planned = np.zeros(shape)
+    distinct_levels = sorted(set(levels.values()))
+    for done, level in enumerate(distinct_levels, start=1):
+        rows = np.array([index[code] for code in codes if levels[code] == level])
+        available = on_hand[rows, None] + np.cumsum(receipts[rows] - gross[rows], axis=1)
+        # 期間ごとの累積不足数量 (一度補充した分は以降の期間にも残る)
+        shortage = np.maximum.accumulate(np.maximum(-available, 0), axis=1)
+        ordered = np.ceil(shortage - EPSILON)
+        net[rows] = np.diff(shortage, axis=1, prepend=0)
+        planned[rows] = np.diff(ordered, axis=1, prepend=0)
+        projected[rows] = available + ordered
+
+        for row in rows:
+            children = edges.get(codes[row])
+            if not children or not planned[row].any():
+                continue
+            releases = _release(planned[row], lead_buckets)
+            for child, per_unit in children.items():
+                if levels.get(child, -1) > level:
+                    gross[index[child]] += releases * float(per_unit)
+        if on_progress:
+            on_progress(done, len(distinct_levels))
+
+    return {
+        "codes": codes,
+        "levels": [levels[code] for code in codes],
+        "order_types": ["production" if code in edges else "purchase" for code in codes],
+        "bucket_dates": [start_date + timedelta(days=bucket_days * i) for i in range(n_buckets)],
+        "lead_buckets": lead_buckets,
+        "gross": gross,
+        "receipts": receipts,
+        "projected": projected,
+        "net": net,
+        "planned": planned,
+        "beyond_horizon": beyond_horizon,
+    }
+
+
+def summarize_mrp(result):
+    planned = result["planned"]
+    past_due = planned[:, : result["lead_buckets"]]
+    return {
+        "parts": len(result["codes"]),
+        "shortage_parts": int(np.count_nonzero(planned.any(axis=1))),
+        "planned_orders": int(np.count_nonzero(planned)),
+        "planned_quantity": float(planned.sum()),
+        "past_due_orders": int(np.count_nonzero(past_due)),
+        "beyond_horizon_entries": result["beyond_horizon"],
+    }
+
+
+def _decimal(value):
+    return Decimal(f"{value:.3f}")
+
+
+def build_requirements(run, result, lead_time_days):
+    """計算結果のうち、所要・入庫予定・計画オーダーのいずれかがある期間を MrpRequirement にします。"""
+    codes = result["codes"]
+    keys = PartNumber.objects.keys_for(codes)
+    bucket_dates = result["bucket_dates"]
+    gross, receipts, planned = result["gross"], result["receipts"], result["planned"]
+    rows, cols = np.nonzero((gross > EPSILON) | (receipts > EPSILON) | (planned > 0))
+    requirements = []
+    for i, j in zip(rows.tolist(), cols.tolist(), strict=True):
+        release_date = None
+        if planned[i, j] > 0:
+            release_date = bucket_dates[j] - timedelta(days=lead_time_days)
+        requirements.append(
+            MrpRequirement(
+                run=run,
+                part_code=codes[i],
+                part_key_id=keys[codes[i]],
+                low_level_code=result["levels"][i],
+                order_type=result["order_types"][i],
+                bucket_start=bucket_dates[j],
+                gross_requirement=_decimal(gross[i, j]),
+                scheduled_receipts=_decimal(receipts[i, j]),
+                projected_on_hand=_decimal(result["projected"][i, j]),
+                net_requirement=_decimal(result["net"][i, j]),
+                planned_order_quantity=_decimal(planned[i, j]),
+                planned_release_date=release_date,
+                is_past_due=release_date is not None and release_date < bucket_dates[0],
+            )
+        )
+    return requirements
+
+
+def create_mrp_run(user=None, start_date=None, bucket_days=None, horizon_days=None, lead_time_days=None):
+    return MrpRun.objects.create(
+        created_by=user if user is not None and user.is_authenticated else None,
+        start_date=start_date or timezone.localdate(),
+        bucket_days=bucket_days or settings.MRP_BUCKET_DAYS,
+        horizon_days=horizon_days or settings.MRP_HORIZON_DAYS,
+        lead_time_days=settings.MRP_DEFAULT_LEAD_TIME_DAYS if lead_time_days is None else lead_time_days,
+    )
+
+
+def run_mrp(run, on_progress=None):
+    """MRP を実行し、期間別の所要量を保存します。同じ実行の以前の結果は置き換えます。"""
+    run.status = MrpRun.Status.RUNNING
+    run.started_at = timezone.now()
+    run.save(update_fields=["status", "started_at"])
+
+    inputs = load_mrp_inputs()
+    result = compute_mrp(
+        inputs, run.start_date, run.bucket_days, run.horizon_days, run.lead_time_days, on_progress=on_progress
+    )
+    requirements = build_requirements(run, result, run.lead_time_days)
+    with transaction.atomic():
+        run.requirements.all().delete()
+        MrpRequirement.objects.bulk_create(requirements, batch_size=1000)
+        run.summary = summarize_mrp(result)
+        run.status = MrpRun.Status.COMPLETED
+        run.finished_at = timezone.now()
+        run.save(update_fields=["summary", "status", "finished_at"])
+    logger.info("MRP run %s: %s", run.id, run.summary)
+    return run.summary
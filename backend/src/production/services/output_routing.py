@@ -0,0 +1,52 @@
+from django.conf import settings
+
+from base.caching import get_cache_version
+from master.models import OutputRoutingRule
+
+CACHE_NAMESPACE = "output-routing"
+
+# プロセス内のルール表: [キャッシュバージョン, {(製品コード, 設備ID): (倉庫, 棚番)}]
+# ルールの変更でバージョンが進むと (production.signals)、次の参照時に1回のクエリで読み直します。
+_rules = [None, {}]
+
+
+def _load_rules():
+    version = get_cache_version(CACHE_NAMESPACE)
+    if _rules[0] != version:
+        rules = {
+            (product_code, machine_id): (warehouse, location or None)
+            for product_code, machine_id, warehouse, location in OutputRoutingRule.objects.filter(
+                is_active=True
+            ).values_list("product_code", "machine_id", "warehouse", "location")
+        }
+        _rules[:] = [version, rules]
+    return _rules[1]
+
+
+def clear_cache():
+    """プロセス内のルール表を破棄します (主にテストでロールバックされたルールを捨てるため)。"""
+    _rules[:] = [None, {}]
+
+
+def resolve_output_location(product_code, machine_id=None):
+    """
+    製品 (と生産する設備) の完成品を計上する (倉庫, 棚番) を返します。
+    製品・設備の両方が一致するルール → 製品だけのルール → 設備だけのルール → 全体のルールの順に探し、
+    どれもなければ既定の完成品倉庫 (棚番なし) です。
+    """
+    rules = _load_rules()
+    for key in ((product_code, machine_id), (product_code, None), ("", machine_id), ("", None)):
+        if key in rules:
+            return rules[key]
+    return settings.DEFAULT_FINISHED_GOODS_WAREHOUSE, None
+
+
+def output_location_for(plan):
+    """
+    計画の完成品を計上する (倉庫, 棚番) を返します。
+    計上済みの計画は記録した場所 (ルールが変わっても数量の変更・取消は同じ在庫行に対して行う) を、
+    未計上ならルールで決めた場所を返します。
+    """
+    if plan.output_warehouse:
+        return plan.output_warehouse, plan.output_location
+    return resolve_output_location(plan.product_code, plan.machine_id)
@@ -1,13 +1,32 @@
+import uuid
+
 from django.db import transaction
+from django.db.models import F, Q
 from django.utils import timezone
 import logging
 
 from inventory.models import Inventory, SalesOrder, StockMovement
+from inventory.services.location_map import invalidate_location_map
+from inventory.services.putaway import record_slot_changes
+from inventory.services.serials import count_serials, parse_serial_ranges, register_serials, void_serials
+from master.models import PartNumber
 from ..models import MaterialAllocation, ProductionPlan, WorkProgress
+from .bom import schedule_bom_refresh
+from .kpi import kpi_key, refresh_production_kpis
+from .output_routing import output_location_for
 
 logger = logging.getLogger(__name__)
 
-DEFAULT_FINISHED_GOODS_WAREHOUSE = "FG-MAIN"
+PROCESS_STEP_OVERALL = WorkProgress.OVERALL_PROCESS_STEP
+
+
+class BulkProgressError(ValueError):
+    """一括進捗更新 (all-or-nothing) で失敗した計画があることを示す例外。results に計画ごとの結果を持ちます。"""
+
+    def __init__(self, results):
+        super().__init__("One or more production plans could not be updated.")
+        self.results = results
+
 
 def update_production_progress_service(plan, data, user):
     """
@@ -19,7 +38,6 @@ def update_production_progress_service(plan, data, user):
         raise ValueError("New status is required.")
 
     now = timezone.now()
-    PROCESS_STEP_OVERALL = "Overall Plan Progress"
 
     with transaction.atomic():
         work_progress, _ = WorkProgress.objects.select_for_update().get_or_create(
@@ -32,28 +50,21 @@ def update_production_progress_service(plan, data, user):
         )
         previous_wp_completed_quantity = work_progress.quantity_completed
         old_plan_status = plan.status
-        plan.status = new_status
-
-        # ステータスに応じたロジックをハンドラに委譲
-        if new_status == ProductionPlan.Status.IN_PROGRESS:
-            _handle_in_progress_status(plan, work_progress, old_plan_status, now)
-        elif new_status == ProductionPlan.Status.COMPLETED:
-            _handle_completed_status(plan, work_progress, data, now)
-        elif new_status == ProductionPlan.Status.ON_HOLD:
-            _handle_on_hold_status(work_progress)
-        elif new_status == ProductionPlan.Status.CANCELLED:
-            _handle_cancelled_status(plan, work_progress, now)
-        elif new_status == ProductionPlan.Status.PENDING:
-            _handle_pending_status(work_progress)
+        previous_kpi_key = kpi_key(plan)
+        _apply_status(plan, work_progress, new_status, data, now)
 
         # COMPLETEDから別のステータスに戻る場合の在庫逆仕訳（完成品を減らし、材料を引き当て状態に戻す）
         if old_plan_status == ProductionPlan.Status.COMPLETED and new_status != ProductionPlan.Status.COMPLETED:
             if previous_wp_completed_quantity > 0:
                 _reverse_inventory(plan, previous_wp_completed_quantity, now, user)
-                _restore_materials_for_plan(plan, now, user)
+                _restore_materials_for_plans([plan], now, user)
                 work_progress.quantity_completed = 0
                 work_progress.actual_reported_quantity = None
                 work_progress.defective_reported_quantity = None
+            # 次に完了したときは、その時点の入庫ルールで計上先を決め直す
+            plan.output_warehouse = plan.output_location = None
+        elif new_status == ProductionPlan.Status.COMPLETED:
+            plan.output_warehouse, plan.output_location = output_location_for(plan)
 
         plan.save()
         work_progress.save()
@@ -64,17 +75,318 @@ def update_production_progress_service(plan, data, user):
             adjustment = newly_reported_completed_quantity
             if old_plan_status == ProductionPlan.Status.COMPLETED:
                 adjustment = newly_reported_completed_quantity - previous_wp_completed_quantity
-            
+
             if adjustment != 0:
-                _adjust_inventory_for_completion(plan, adjustment, newly_reported_completed_quantity, now, user)
-            
+                movement = _adjust_inventory_for_completion(
+                    plan, adjustment, newly_reported_completed_quantity, now, user
+                )
+                # 完成品のシリアル番号 (任意) は増加分と同数を指定する
+                serial_ranges = parse_serial_ranges(data.get("serial_ranges"))
+                if serial_ranges:
+                    if adjustment < 0 or count_serials(serial_ranges) != adjustment:
+                        raise ValueError("The number of serial numbers must match the added completed quantity.")
+                    register_serials(
+                        plan.product_code,
+                        serial_ranges,
+                        plan.output_warehouse,
+                        plan.output_location,
+                        movement=movement,
+                        source_document=f"ProductionPlan-{plan.id}",
+                    )
+
             # 初めて完了になった場合に部材を消費
             if old_plan_status != ProductionPlan.Status.COMPLETED:
-                _consume_materials_for_plan(plan, now, user)
+                _consume_materials_for_plans([plan], now, user)
+
+        # 完了・完了取消・完了数量の変更を KPI 集計に反映する
+        refresh_production_kpis({previous_kpi_key, kpi_key(plan)})
 
     return plan, work_progress
 
 
+def bulk_update_production_progress_service(entries, user, atomic=False):
+    """
+    複数の生産計画の進捗を一括で更新します (シフト終了時の締め処理など)。
+    entries は {"plan_id", "status", "good_quantity", "actual_quantity", "defective_quantity"} のリストです。
+    計画・進捗・完成品在庫の行はそれぞれ1回のクエリでロックし、各計画の変更をメモリ上で検証したうえで、
+    完成品在庫の増減を製品ごとに集計して一括で反映します。入出庫履歴・材料の消費/戻しもまとめて書き込みます。
+    計画ごとの結果 ({"plan_id", "success", "new_status" または "error"}) を返します。
+    atomic=True の場合、1件でも失敗すれば何も更新せずに BulkProgressError を送出します。
+    """
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("Entries must be a non-empty list.")
+
+    now = timezone.now()
+    operator = user if user and user.is_authenticated else None
+    plan_ids = set()
+    for entry in entries:
+        try:
+            plan_ids.add(uuid.UUID(str(entry.get("plan_id"))))
+        except (AttributeError, ValueError):
+            continue
+
+    with transaction.atomic():
+        plans = {
+            plan.pk: plan for plan in ProductionPlan.objects.select_for_update().filter(id__in=plan_ids).order_by("id")
+        }
+        work_progresses = {}
+        for work_progress in (
+            WorkProgress.objects.select_for_update()
+            .filter(production_plan__in=list(plans), process_step=PROCESS_STEP_OVERALL)
+            .order_by("id")
+        ):
+            work_progresses.setdefault(work_progress.production_plan_id, work_progress)
+        # 計画ごとの完成品の計上先 (品番, 倉庫, 棚番)。計上済みなら記録した場所、未計上なら入庫ルールで決める
+        targets = {plan.pk: (plan.product_code, *output_location_for(plan)) for plan in plans.values()}
+        finished_goods = _lock_finished_goods(set(targets.values()))
+        balances = {target: inventory_item.quantity for target, inventory_item in finished_goods.items()}
+
+        results = []
+        applied = []  # [(計画, 進捗, 変更前ステータス, 逆仕訳数量, 完成数量の増減)]
+        seen = set()
+        kpi_keys = set()
+        for entry in entries:
+            plan_id = str(entry.get("plan_id") if isinstance(entry, dict) else "")
+            try:
+                if not isinstance(entry, dict):
+                    raise ValueError("Each entry must be an object.")
+                plan = _plan_for_entry(plan_id, plans, seen)
+                work_progress = work_progresses.get(plan.pk) or WorkProgress(
+                    production_plan=plan,
+                    process_step=PROCESS_STEP_OVERALL,
+                    operator=operator,
+                    status=WorkProgress.Status.NOT_STARTED,
+                )
+                previous_kpi_key = kpi_key(plan)
+                change = _apply_progress_entry(entry, plan, work_progress, balances, targets[plan.pk], now)
+            except ValueError as e:
+                results.append({"plan_id": plan_id, "success": False, "error": str(e)})
+                continue
+            applied.append((plan, work_progress, *change))
+            kpi_keys.update((previous_kpi_key, kpi_key(plan)))
+            results.append({"plan_id": plan_id, "success": True, "new_status": plan.get_status_display()})
+
+        if atomic and not all(result["success"] for result in results):
+            raise BulkProgressError(results)
+        if applied:
+            _write_bulk_progress(applied, finished_goods, targets, now, user)
+            refresh_production_kpis(kpi_keys)
+    return results
+
+
+def _plan_for_entry(plan_id, plans, seen):
+    try:
+        plan = plans.get(uuid.UUID(plan_id))
+    except ValueError:
+        plan = None
+    if plan is None:
+        raise ValueError("Production plan not found.")
+    if plan.pk in seen:
+        raise ValueError("Duplicate entry for the same production plan.")
+    seen.add(plan.pk)
+    return plan
+
+
+def _apply_progress_entry(entry, plan, work_progress, balances, target, now):
+    """
+    1件分の進捗を計画・進捗にメモリ上で反映し、(変更前ステータス, 逆仕訳数量, 完成数量の増減) を返します。
+    完成品在庫が足りない場合は ValueError です。balances (計上先ごとの完成品在庫) は反映後の数量に更新します。
+    """
+    new_status = entry.get("status")
+    if not new_status:
+        raise ValueError("New status is required.")
+    if entry.get("serial_ranges"):
+        raise ValueError("serial_ranges cannot be used in bulk updates; use update-progress.")
+    data = {
+        "good_quantity": entry.get("good_quantity"),
+        "actual_quantity": entry.get("actual_quantity"),
+        "defective_quantity": entry.get("defective_quantity"),
+    }
+    previous_completed = work_progress.quantity_completed
+    old_plan_status = plan.status
+    _apply_status(plan, work_progress, new_status, data, now)
+
+    product_code = plan.product_code
+    reversal = 0
+    if old_plan_status == ProductionPlan.Status.COMPLETED and new_status != ProductionPlan.Status.COMPLETED:
+        if previous_completed > 0:
+            if target not in balances:
+                raise ValueError(f"Inventory for product {product_code} not found for reversal.")
+            if balances[target] < previous_completed:
+                raise ValueError(f"Cannot reverse production: insufficient stock for {product_code}.")
+            reversal = previous_completed
+            work_progress.quantity_completed = 0
+            work_progress.actual_reported_quantity = None
+            work_progress.defective_reported_quantity = None
+        plan.output_warehouse = plan.output_location = None
+
+    adjustment = 0
+    if new_status == ProductionPlan.Status.COMPLETED:
+        adjustment = work_progress.quantity_completed
+        if old_plan_status == ProductionPlan.Status.COMPLETED:
+            adjustment -= previous_completed
+        if adjustment < 0 and balances.get(target, 0) < -adjustment:
+            raise ValueError(f"Cannot reduce completed quantity: insufficient stock for {product_code}.")
+        plan.output_warehouse, plan.output_location = target[1:]
+
+    if reversal or adjustment:
+        balances[target] = balances.get(target, 0) - reversal + adjustment
+    return old_plan_status, reversal, adjustment
+
+
+def _lock_finished_goods(targets):
+    """完成品の計上先 (品番, 倉庫, 棚番) の在庫行を1回のクエリで ID 順にロックし、{計上先: 在庫行} を返します。"""
+    if not targets:
+        return {}
+    condition = Q()
+    for product_code, warehouse, location in targets:
+        condition |= Q(part_number=product_code, warehouse=warehouse, location=location)
+    finished_goods = {}
+    for inventory_item in Inventory.objects.select_for_update().filter(condition).order_by("id"):
+        target = (inventory_item.part_number, inventory_item.warehouse, inventory_item.location)
+        finished_goods.setdefault(target, inventory_item)
+    return finished_goods
+
+
+def _write_bulk_progress(applied, finished_goods, targets, now, user):
+    """一括進捗更新で検証済みの変更を、計画・進捗・完成品在庫・入出庫履歴・材料へ一括で書き込みます。"""
+    operator = user if user and user.is_authenticated else None
+    plans = [plan for plan, *_ in applied]
+    for plan in plans:
+        plan.updated_at = now
+    ProductionPlan.objects.bulk_update(
+        plans,
+        ["status", "actual_start_datetime", "actual_end_datetime", "output_warehouse", "output_location", "updated_at"],
+        batch_size=500,
+    )
+    # bulk_update はシグナルを通らないため、中止になった・中止が解除された製品の推移閉包はここで再計算する
+    bom_products = set()
+    for plan in plans:
+        loaded = getattr(plan, "_loaded_bom_values", None)
+        if loaded != plan.bom_values():
+            bom_products.add(plan.product_code)
+            plan._loaded_bom_values = plan.bom_values()
+    if bom_products:
+        schedule_bom_refresh(product_codes=bom_products)
+
+    work_progresses = [work_progress for _, work_progress, *_ in applied]
+    for work_progress in work_progresses:
+        work_progress.updated_at = now
+    WorkProgress.objects.bulk_create([wp for wp in work_progresses if wp._state.adding], batch_size=500)
+    WorkProgress.objects.bulk_update(
+        [wp for wp in work_progresses if not wp._state.adding],
+        [
+            "status",
+            "start_datetime",
+            "end_datetime",
+            "quantity_completed",
+            "actual_reported_quantity",
+            "defective_reported_quantity",
+            "updated_at",
+        ],
+        batch_size=500,
+    )
+
+    # 完成品在庫の増減を計上先ごとに集計して反映する
+    deltas = {}
+    movements = []
+    for plan, work_progress, _, reversal, adjustment in applied:
+        target = targets[plan.pk]
+        _, warehouse, location = target
+        if reversal:
+            deltas[target] = deltas.get(target, 0) - reversal
+            movements.append(
+                StockMovement(
+                    part_number=plan.product_code,
+                    quantity=reversal,
+                    warehouse=warehouse,
+                    location=location,
+                    movement_type="PRODUCTION_REVERSAL",
+                    movement_date=now,
+                    reference_document=f"Reversal for PPlan-{plan.id}",
+                    description=f"Prod. completion reversed for plan {plan.id}.",
+                    operator=operator,
+                )
+            )
+        if adjustment:
+            deltas[target] = deltas.get(target, 0) + adjustment
+            movements.append(
+                StockMovement(
+                    part_number=plan.product_code,
+                    quantity=abs(adjustment),
+                    warehouse=warehouse,
+                    location=location,
+                    movement_type="PRODUCTION_OUTPUT" if adjustment > 0 else "PRODUCTION_REVERSAL",
+                    movement_date=now,
+                    reference_document=f"ProductionPlan-{plan.id}",
+                    description=(
+                        f"Plan {plan.id} completion. Qty changed by: {adjustment}. "
+                        f"New total: {work_progress.quantity_completed}."
+                    ),
+                    operator=operator,
+                )
+            )
+
+    keys = PartNumber.objects.keys_for({product_code for product_code, _, _ in deltas})
+    updated = []
+    created = []
+    for (product_code, warehouse, location), delta in deltas.items():
+        inventory_item = finished_goods.get((product_code, warehouse, location))
+        if inventory_item is None:
+            created.append(
+                Inventory(
+                    part_number=product_code,
+                    part_key_id=keys[product_code],
+                    warehouse=warehouse,
+                    location=location,
+                    quantity=delta,
+                    reserved=0,
+                    is_active=True,
+                    is_allocatable=True,
+                )
+            )
+        elif delta:
+            inventory_item.quantity += delta
+            inventory_item.last_updated = now
+            updated.append(inventory_item)
+    Inventory.objects.bulk_create(created, batch_size=500)
+    Inventory.objects.bulk_update(updated, ["quantity", "last_updated"], batch_size=500)
+    if created or updated:
+        invalidate_location_map(*{inventory_item.warehouse for inventory_item in created + updated})
+        record_slot_changes((inventory_item.warehouse, inventory_item.location) for inventory_item in created + updated)
+    for movement in movements:
+        movement.part_key_id = keys[movement.part_number]
+    StockMovement.objects.bulk_create(movements, batch_size=500)
+
+    # 取り消した完成品のシリアル番号を無効にし、材料を引き当て状態に戻す / 初めて完了した計画の材料を消費する
+    reversed_plans = [plan for plan, _, _, reversal, _ in applied if reversal]
+    for plan in reversed_plans:
+        void_serials(f"ProductionPlan-{plan.id}")
+    _restore_materials_for_plans(reversed_plans, now, user)
+    completed_plans = [
+        plan
+        for plan, _, old_status, _, _ in applied
+        if plan.status == ProductionPlan.Status.COMPLETED and old_status != ProductionPlan.Status.COMPLETED
+    ]
+    _consume_materials_for_plans(completed_plans, now, user)
+
+
+def _apply_status(plan, work_progress, new_status, data, now):
+    """ステータスに応じたロジックをハンドラに委譲します (計画・進捗はメモリ上で更新し、保存はしません)。"""
+    old_plan_status = plan.status
+    plan.status = new_status
+    if new_status == ProductionPlan.Status.IN_PROGRESS:
+        _handle_in_progress_status(plan, work_progress, old_plan_status, now)
+    elif new_status == ProductionPlan.Status.COMPLETED:
+        _handle_completed_status(plan, work_progress, data, now)
+    elif new_status == ProductionPlan.Status.ON_HOLD:
+        _handle_on_hold_status(work_progress)
+    elif new_status == ProductionPlan.Status.CANCELLED:
+        _handle_cancelled_status(plan, work_progress, now)
+    elif new_status == ProductionPlan.Status.PENDING:
+        _handle_pending_status(work_progress)
+
+
 def _handle_in_progress_status(plan, work_progress, old_plan_status, now):
     if old_plan_status in [ProductionPlan.Status.PENDING, ProductionPlan.Status.ON_HOLD]:
         if not plan.actual_start_datetime:
@@ -150,18 +462,23 @@ def _handle_pending_status(work_progress):
 
 def _reverse_inventory(plan, quantity, now, user):
     product_code = plan.product_code
-    warehouse = DEFAULT_FINISHED_GOODS_WAREHOUSE
+    warehouse, location = output_location_for(plan)
     try:
-        inventory_item = Inventory.objects.select_for_update().get(part_number=product_code, warehouse=warehouse)
+        inventory_item = Inventory.objects.select_for_update().get(
+            part_number=product_code, warehouse=warehouse, location=location
+        )
         if inventory_item.quantity < quantity:
             raise ValueError(f"Cannot reverse production: insufficient stock for {product_code}.")
         inventory_item.quantity -= quantity
         inventory_item.save()
+        # 取り消した完成品のシリアル番号は無効にする
+        void_serials(f"ProductionPlan-{plan.id}")
 
         StockMovement.objects.create(
             part_number=product_code,
             quantity=quantity,
             warehouse=warehouse,
+            location=location,
             movement_type="PRODUCTION_REVERSAL",
             movement_date=now,
             reference_document=f"Reversal for PPlan-{plan.id}",
@@ -174,10 +491,11 @@ def _reverse_inventory(plan, quantity, now, user):
 
 def _adjust_inventory_for_completion(plan, adjustment, total_completed, now, user):
     product_code = plan.product_code
-    target_warehouse = DEFAULT_FINISHED_GOODS_WAREHOUSE
+    target_warehouse, target_location = output_location_for(plan)
     inventory_item, created = Inventory.objects.select_for_update().get_or_create(
         part_number=product_code,
         warehouse=target_warehouse,
+        location=target_location,
         defaults={"quantity": 0, "reserved": 0, "is_active": True, "is_allocatable": True},
     )
 
@@ -187,10 +505,11 @@ def _adjust_inventory_for_completion(plan, adjustment, total_completed, now, use
     inventory_item.quantity += adjustment
     inventory_item.save()
 
-    StockMovement.objects.create(
+    return StockMovement.objects.create(
         part_number=product_code,
         quantity=abs(adjustment),
         warehouse=target_warehouse,
+        location=target_location,
         movement_type="PRODUCTION_OUTPUT" if adjustment > 0 else "PRODUCTION_REVERSAL",
         movement_date=now,
         reference_document=f"ProductionPlan-{plan.id}",
@@ -199,94 +518,228 @@ def _adjust_inventory_for_completion(plan, adjustment, total_completed, now, use
     )
 
 
-def _consume_materials_for_plan(plan, now, user):
+def _lock_allocation_inventory(allocations):
     """
-    生産計画に関連付けられた材料を消費（出庫）処理します。
-    在庫の quantity と reserved を両方減らします。
+    引当の (品番キー, 倉庫) に該当する在庫行を1回のクエリで ID 順にロックします。
+    ロック順序を一定にすることで、同じ在庫行を扱う他の処理とデッドロックしないようにします。
+    戻り値: {(品番キー, 倉庫): [在庫行]}
     """
-    allocations = MaterialAllocation.objects.filter(production_plan=plan, status="ALLOCATED").select_for_update()
+    condition = Q()
+    for part_key, warehouse in {(alloc.part_key_id, alloc.warehouse) for alloc in allocations}:
+        condition |= Q(part_key_id=part_key, warehouse=warehouse)
+    rows = {}
+    if not condition:
+        return rows
+    for inventory_item in Inventory.objects.select_for_update().filter(condition).order_by("id"):
+        rows.setdefault((inventory_item.part_key_id, inventory_item.warehouse), []).append(inventory_item)
+    return rows
 
-    for alloc in allocations:
-        if not alloc.warehouse:
-            continue
 
-        try:
-            inventory_item = Inventory.objects.select_for_update().get(
-                part_number=alloc.material_code, warehouse=alloc.warehouse
-            )
+def _same_location(row, location):
+    return (row.location or None) == (location or None)
+
+
+def _inventory_row_for(alloc, rows):
+    """
+    引当の棚番の在庫行を返します (棚番のない引当は棚番のない行)。
+    棚番のない行もない場合 (複数の棚番にまたがる引当を1件で記録していた以前の引当) は、引当数の最も多い行を使います。
+    """
+    candidates = rows.get((alloc.part_key_id, alloc.warehouse), [])
+    matched = [row for row in candidates if _same_location(row, alloc.location)]
+    if matched:
+        return matched[0]
+    if alloc.location:
+        return None
+    return max(candidates, key=lambda row: row.reserved, default=None)
 
-            # 在庫と引当の減少
-            quantity_to_consume = alloc.allocated_quantity
-            inventory_item.quantity -= quantity_to_consume
-            inventory_item.reserved -= quantity_to_consume
-            inventory_item.save()
 
-            # ステータス更新
-            alloc.status = "ISSUED"
-            alloc.save()
+def _split_legacy_allocation(alloc, rows):
+    """
+    複数の棚番にまたがる引当を棚番なしの1件で記録していた以前の引当について、各在庫行の引当数を上限に
+    引当数の多い行から割り振った [(在庫行, 数量)] を返します。
+    棚番のある引当や、棚番のない在庫行がある場合は None を返します。
+    """
+    candidates = rows.get((alloc.part_key_id, alloc.warehouse), [])
+    if alloc.location or any(_same_location(row, None) for row in candidates):
+        return None
+    picks = []
+    remaining = alloc.allocated_quantity
+    for inventory_item in sorted(candidates, key=lambda row: -row.reserved):
+        taken = min(remaining, inventory_item.reserved)
+        if taken > 0:
+            picks.append((inventory_item, taken))
+            remaining -= taken
+        if not remaining:
+            break
+    if remaining and picks:
+        # 引当数が記録とずれている場合、割り振れなかった分は最も引当数の多い行から払い出す
+        picks[0] = (picks[0][0], picks[0][1] + remaining)
+    return picks or None
+
+
+def _save_inventory_rows(rows, now):
+    for inventory_item in rows:
+        inventory_item.last_updated = now
+    Inventory.objects.bulk_update(rows, ["quantity", "reserved", "last_updated"], batch_size=500)
+    invalidate_location_map(*{inventory_item.warehouse for inventory_item in rows})
+    record_slot_changes((inventory_item.warehouse, inventory_item.location) for inventory_item in rows)
+
+
+def _consume_materials_for_plans(plans, now, user):
+    """
+    生産計画 (複数可) に関連付けられた材料を消費（出庫）処理します。
+    在庫の quantity と reserved を両方減らします。
+    在庫行は1回のクエリでロックし、在庫・引当・社内出庫予定の更新と入出庫履歴の作成はそれぞれ1回の文で行います。
+    """
+    allocations = list(
+        MaterialAllocation.objects.select_for_update()
+        .filter(production_plan__in=plans, status="ALLOCATED")
+        .exclude(Q(warehouse__isnull=True) | Q(warehouse=""))
+        .order_by("id")
+    )
+    rows = _lock_allocation_inventory(allocations)
 
-            # 在庫移動履歴の作成
-            StockMovement.objects.create(
+    consumed = []
+    consumed_allocations = []
+    relocated = []
+    split = []
+    touched = {}
+    for alloc in allocations:
+        picks = _split_legacy_allocation(alloc, rows)
+        if picks is None:
+            inventory_item = _inventory_row_for(alloc, rows)
+            picks = [(inventory_item, alloc.allocated_quantity)] if inventory_item is not None else []
+        if not picks:
+            logger.error(f"Inventory not found for consumption: {alloc.material_code} in {alloc.warehouse}")
+            continue
+        consumed_allocations.append(alloc)
+        for index, (inventory_item, quantity) in enumerate(picks):
+            # 在庫と引当の減少 (在庫行ごとに、その行から引き当てた数量だけ減らす)
+            inventory_item.quantity -= quantity
+            inventory_item.reserved -= quantity
+            touched[inventory_item.id] = inventory_item
+            if len(picks) == 1:
+                consumed.append((alloc, inventory_item))
+                continue
+            # 以前の棚番なしの引当は、取消で同じ行に戻せるよう在庫行ごとの引当に分けて記録する
+            if index == 0:
+                record = alloc
+                relocated.append(alloc)
+            else:
+                record = MaterialAllocation(
+                    production_plan_id=alloc.production_plan_id,
+                    material_code=alloc.material_code,
+                    part_key_id=alloc.part_key_id,
+                    warehouse=alloc.warehouse,
+                    allocation_datetime=alloc.allocation_datetime,
+                    status="ISSUED",
+                    remarks=alloc.remarks,
+                )
+                split.append(record)
+            record.location = inventory_item.location
+            record.allocated_quantity = quantity
+            record.updated_at = now
+            consumed.append((record, inventory_item))
+    if not consumed:
+        return
+
+    _save_inventory_rows(list(touched.values()), now)
+    MaterialAllocation.objects.bulk_update(relocated, ["location", "allocated_quantity", "updated_at"], batch_size=500)
+    MaterialAllocation.objects.bulk_create(split, batch_size=500)
+    MaterialAllocation.objects.filter(id__in=[alloc.id for alloc in consumed_allocations]).update(
+        status="ISSUED", updated_at=now
+    )
+    operator = user if user and user.is_authenticated else None
+    StockMovement.objects.bulk_create(
+        [
+            StockMovement(
                 part_number=alloc.material_code,
-                quantity=quantity_to_consume,
+                part_key_id=alloc.part_key_id,
+                quantity=alloc.allocated_quantity,
                 warehouse=alloc.warehouse,
+                location=inventory_item.location,
                 movement_type="used",
                 movement_date=now,
-                reference_document=f"ProductionPlan-{plan.id}",
-                description=f"Consumed for plan {plan.id} completion.",
-                operator=user if user and user.is_authenticated else None,
-            )
-
-            # 関連する SalesOrder があれば完了（shipped）にする
-            so_order_number_prefix = f"INT-{alloc.id.hex[:15]}"
-            SalesOrder.objects.filter(order_number__startswith=so_order_number_prefix).update(
-                status="shipped", shipped_quantity=quantity_to_consume
+                reference_document=f"ProductionPlan-{alloc.production_plan_id}",
+                description=f"Consumed for plan {alloc.production_plan_id} completion.",
+                operator=operator,
             )
-
-        except Inventory.DoesNotExist:
-            logger.error(f"Inventory not found for consumption: {alloc.material_code} in {alloc.warehouse}")
+            for alloc, inventory_item in consumed
+        ],
+        batch_size=500,
+    )
+    # 関連する社内出庫予定を完了（shipped）にする (出庫予定の数量は引当数量と同じ)
+    SalesOrder.objects.filter(source_allocation__in=consumed_allocations).update(
+        status="shipped", shipped_quantity=F("quantity"), updated_at=now
+    )
 
 
-def _restore_materials_for_plan(plan, now, user):
+def _restore_materials_for_plans(plans, now, user):
     """
     生産完了が取り消された際、消費された材料を引き当て状態（ALLOCATED）に戻します。
+    在庫行がなくなっている場合は新しく作成します。更新は消費と同じく一括で行います。
     """
-    allocations = MaterialAllocation.objects.filter(production_plan=plan, status="ISSUED").select_for_update()
+    allocations = list(
+        MaterialAllocation.objects.select_for_update()
+        .filter(production_plan__in=plans, status="ISSUED")
+        .exclude(Q(warehouse__isnull=True) | Q(warehouse=""))
+        .order_by("id")
+    )
+    if not allocations:
+        return
+    rows = _lock_allocation_inventory(allocations)
 
+    touched = {}
+    created = []
+    restored = []
     for alloc in allocations:
-        if not alloc.warehouse:
-            continue
-
-        inventory_item, created = Inventory.objects.select_for_update().get_or_create(
-            part_number=alloc.material_code,
-            warehouse=alloc.warehouse,
-            defaults={"quantity": 0, "reserved": 0, "is_active": True, "is_allocatable": True},
-        )
-
+        inventory_item = _inventory_row_for(alloc, rows)
+        if inventory_item is None:
+            inventory_item = Inventory(
+                part_number=alloc.material_code,
+                part_key_id=alloc.part_key_id,
+                warehouse=alloc.warehouse,
+                location=alloc.location,
+                quantity=0,
+                reserved=0,
+                is_active=True,
+                is_allocatable=True,
+            )
+            rows.setdefault((alloc.part_key_id, alloc.warehouse), []).append(inventory_item)
+            created.append(inventory_item)
+        else:
+            touched[inventory_item.id] = inventory_item
         # 在庫と引当を戻す
-        quantity_to_restore = alloc.allocated_quantity
-        inventory_item.quantity += quantity_to_restore
-        inventory_item.reserved += quantity_to_restore
-        inventory_item.save()
-
-        # ステータス戻し
-        alloc.status = "ALLOCATED"
-        alloc.save()
-
-        # 在庫移動履歴（取消）の作成
-        StockMovement.objects.create(
-            part_number=alloc.material_code,
-            quantity=quantity_to_restore,
-            warehouse=alloc.warehouse,
-            movement_type="incoming",
-            movement_date=now,
-            reference_document=f"Reversal for PPlan-{plan.id}",
-            description=f"Restored from plan {plan.id} reversal.",
-            operator=user if user and user.is_authenticated else None,
-        )
-
-        # 関連する SalesOrder を pending に戻す
-        so_order_number_prefix = f"INT-{alloc.id.hex[:15]}"
-        SalesOrder.objects.filter(order_number__startswith=so_order_number_prefix).update(
-            status="pending", shipped_quantity=0
-        )
+        inventory_item.quantity += alloc.allocated_quantity
+        inventory_item.reserved += alloc.allocated_quantity
+        restored.append((alloc, inventory_item))
+
+    if created:
+        Inventory.objects.bulk_create(created, batch_size=500)
+    _save_inventory_rows([*touched.values(), *created], now)
+    MaterialAllocation.objects.filter(id__in=[alloc.id for alloc in allocations]).update(
+        status="ALLOCATED", updated_at=now
+    )
+    operator = user if user and user.is_authenticated else None
+    StockMovement.objects.bulk_create(
+        [
+            StockMovement(
+                part_number=alloc.material_code,
+                part_key_id=alloc.part_key_id,
+                quantity=alloc.allocated_quantity,
+                warehouse=alloc.warehouse,
+                location=inventory_item.location,
+                movement_type="incoming",
+                movement_date=now,
+                reference_document=f"Reversal for PPlan-{alloc.production_plan_id}",
+                description=f"Restored from plan {alloc.production_plan_id} reversal.",
+                operator=operator,
+            )
+            for alloc, inventory_item in restored
+        ],
+        batch_size=500,
+    )
+    # 関連する社内出庫予定を pending に戻す
+    SalesOrder.objects.filter(source_allocation__in=allocations).update(
+        status="pending", shipped_quantity=0, updated_at=now
+    )
@@ -1,68 +1,125 @@
-from django.db.models import Sum
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
 
 from inventory.models import Inventory
-from ..models import MaterialAllocation, PartsUsed
+from ..models import MaterialAllocation, PartsUsed, WorkProgress
+
+
+def _sum_subquery(queryset, group_field, sum_field):
+    """相関サブクエリで1グループ分の合計を返す式 (該当行がなければ0) を作ります。"""
+    total = queryset.order_by().values(group_field).annotate(total=Sum(sum_field)).values("total")[:1]
+    return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+def annotate_plan_progress(queryset):
+    """
+    生産計画に作業進捗の集計を付けます (一覧の1回のクエリ内の相関サブクエリで計算します)。
+    progress_status / progress_step: 最後に更新された作業進捗のステータスと工程 / completed_quantity: 完了数量の合計
+    """
+    latest = WorkProgress.objects.filter(production_plan=OuterRef("pk")).order_by("-updated_at", "-id")
+    return queryset.annotate(
+        progress_status=Subquery(latest.values("status")[:1]),
+        progress_step=Subquery(latest.values("process_step")[:1]),
+        completed_quantity=_sum_subquery(
+            WorkProgress.objects.filter(production_plan=OuterRef("pk")), "production_plan", "quantity_completed"
+        ),
+    )
+
+
+def annotate_plan_coverage(queryset):
+    """
+    生産計画に材料の引当状況を付けます (一覧の1回のクエリ内の相関サブクエリで計算します)。
+    required_quantity: 参照生産計画の使用部品の数量合計 / allocated_quantity: 返却済みを除く引当数量の合計
+    """
+    return queryset.annotate(
+        required_quantity=_sum_subquery(
+            PartsUsed.objects.filter(production_plan=OuterRef("production_plan")), "production_plan", "quantity_used"
+        ),
+        allocated_quantity=_sum_subquery(
+            MaterialAllocation.objects.filter(
+                production_plan=OuterRef("pk"), status__in=MaterialAllocation.COVERING_STATUSES
+            ),
+            "production_plan",
+            "allocated_quantity",
+        ),
+    )
+
 
 def get_production_plan_required_parts(production_plan_instance):
     """
     特定の生産計画に必要な部品リストとその現在の在庫・引当状況を返します。
     クエリを最適化し、N+1問題を回避しています。
     """
-    plan_identifier = production_plan_instance.production_plan
-    if not plan_identifier:
-        return []
+    return get_required_parts_for_plans([production_plan_instance])[production_plan_instance.pk]
 
-    # 1. 使用部品情報を一括取得
-    parts_used_queryset = PartsUsed.objects.filter(production_plan=plan_identifier)
-    if not parts_used_queryset.exists():
-        return []
 
-    part_codes = list(parts_used_queryset.values_list("part_code", flat=True).distinct())
+def get_required_parts_for_plans(production_plans):
+    """
+    複数の生産計画の必要部品リストを {計画ID: [部品]} で返します。
+    使用部品・在庫・引当をそれぞれ1回のクエリでまとめて取得し、在庫と引当の集計は計画間で共有するため、
+    計画数に関係なく3回のクエリで完了します。
+    """
+    plans = list(production_plans)
+    results = {plan.pk: [] for plan in plans}
+    identifiers = {plan.production_plan for plan in plans if plan.production_plan}
+    if not identifiers:
+        return results
 
-    # 2. 在庫情報を一括取得
-    inventory_items = Inventory.objects.filter(part_number__in=part_codes, is_active=True, is_allocatable=True)
+    # 1. 使用部品情報を一括取得 (識別子ごと)
+    parts_used_by_identifier = {}
+    for part_used in PartsUsed.objects.filter(production_plan__in=identifiers).order_by("-used_datetime", "id"):
+        parts_used_by_identifier.setdefault(part_used.production_plan, []).append(part_used)
+    part_keys = {part_used.part_key_id for parts in parts_used_by_identifier.values() for part_used in parts}
+    if not part_keys:
+        return results
 
-    # 在庫データをマッピング (part_code -> {warehouse -> quantity}) または (part_code -> total_quantity)
+    # 2. 在庫情報を一括取得 (品番キー・倉庫ごとの利用可能数)
     inventory_map = {}
-    for inv in inventory_items:
-        if inv.part_number not in inventory_map:
-            inventory_map[inv.part_number] = {}
-        inventory_map[inv.part_number][inv.warehouse] = inventory_map[inv.part_number].get(inv.warehouse, 0) + (
-            inv.available_quantity or 0
-        )
+    for part_key, warehouse, available in (
+        Inventory.objects.filter(part_key_id__in=part_keys, is_active=True, is_allocatable=True)
+        .values_list("part_key_id", "warehouse")
+        .annotate(available=Sum(Greatest(F("quantity") - F("reserved"), Value(0))))
+        .order_by()
+    ):
+        inventory_map.setdefault(part_key, {})[warehouse] = available or 0
 
-    # 3. 引当済情報を一括取得
-    allocations = (
-        MaterialAllocation.objects.filter(production_plan=production_plan_instance, material_code__in=part_codes)
-        .values("material_code")
-        .annotate(total_allocated=Sum("allocated_quantity"))
-    )
-    allocation_map = {a["material_code"]: a["total_allocated"] for a in allocations}
+    # 3. 引当済情報を一括取得 (計画・品番キーで集計、返却済みは除く)
+    allocation_map = {
+        (plan_id, part_key): total
+        for plan_id, part_key, total in MaterialAllocation.objects.filter(
+            production_plan__in=[plan.pk for plan in plans],
+            part_key_id__in=part_keys,
+            status__in=MaterialAllocation.COVERING_STATUSES,
+        )
+        .values_list("production_plan_id", "part_key_id")
+        .annotate(total=Sum("allocated_quantity"))
+        .order_by()
+    }
 
     # 4. 結果の組み立て
-    results = []
-    for part_used in parts_used_queryset:
-        part_code = part_used.part_code
-        target_warehouse = part_used.warehouse
-
-        # 在庫数量の計算
-        if target_warehouse:
-            # 特定の倉庫が指定されている場合
-            current_inventory_quantity = inventory_map.get(part_code, {}).get(target_warehouse, 0)
-        else:
-            # 倉庫指定がない場合、全倉庫の合計
-            current_inventory_quantity = sum(inventory_map.get(part_code, {}).values())
-
-        results.append(
-            {
-                "part_code": part_code,
-                "part_name": f"{part_code} (名称は別途マスタ参照)",  # TODO: マスタ連携
-                "required_quantity": part_used.quantity_used,
-                "unit": "個",
-                "inventory_quantity": current_inventory_quantity,
-                "warehouse": target_warehouse,
-                "already_allocated_quantity": allocation_map.get(part_code, 0),
-            }
-        )
+    for plan in plans:
+        for part_used in parts_used_by_identifier.get(plan.production_plan, []):
+            part_code = part_used.part_code
+            part_key = part_used.part_key_id
+            target_warehouse = part_used.warehouse
+
+            # 在庫数量の計算
+            if target_warehouse:
+                # 特定の倉庫が指定されている場合
+                current_inventory_quantity = inventory_map.get(part_key, {}).get(target_warehouse, 0)
+            else:
+                # 倉庫指定がない場合、全倉庫の合計
+                current_inventory_quantity = sum(inventory_map.get(part_key, {}).values())
 
+            results[plan.pk].append(
+                {
+                    "part_code": part_code,
+                    "part_name": f"{part_code} (名称は別途マスタ参照)",  # TODO: マスタ連携
+                    "required_quantity": part_used.quantity_used,
+                    "unit": "個",
+                    "inventory_quantity": current_inventory_quantity,
+                    "warehouse": target_warehouse,
+                    "already_allocated_quantity": allocation_map.get((plan.pk, part_key), 0),
+                }
+            )
     return results
@@ -0,0 +1,273 @@
+import heapq
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from machine.models import Machine, MachineCapability
+
+from ..models import ProductionPlan, ScheduleAssignment, ScheduleRun
+from .bom import schedule_bom_refresh
+
+logger = logging.getLogger(__name__)
+
+# 割当の対象にできるステータス (進行中の計画は設備を占有したまま動かさない)
+SCHEDULABLE_STATUSES = [ProductionPlan.Status.PENDING, ProductionPlan.Status.ON_HOLD]
+FIXED_STATUSES = [ProductionPlan.Status.IN_PROGRESS]
+PROGRESS_INTERVAL = 500
+# サマリーに載せる計画IDの最大数
+SUMMARY_ID_LIMIT = 100
+
+
+def load_scheduling_inputs(start_from, statuses):
+    """
+    スケジューリングの入力を一括クエリで読み込みます。
+    plans: 対象の計画 / capabilities: {製品コード: [(設備ID, 個/時, 段取り分)]} /
+    busy: {設備ID: (空く日時, 最後の製品)} (進行中の計画が割り当てられている設備) / machine_numbers: {設備ID: 設備番号}
+    """
+    plans = list(
+        ProductionPlan.objects.filter(status__in=statuses)
+        .annotate(due=Coalesce("due_datetime", "planned_end_datetime"))
+        .order_by("due", "priority", "created_at")
+        .values(
+            "id",
+            "product_code",
+            "planned_quantity",
+            "planned_start_datetime",
+            "planned_end_datetime",
+            "due",
+            "priority",
+            "created_at",
+            "machine_id",
+        )
+    )
+    capabilities = {}
+    for machine_id, product_code, units_per_hour, setup_minutes in MachineCapability.objects.filter(
+        is_active=True, units_per_hour__gt=0
+    ).values_list("machine_id", "product_code", "units_per_hour", "setup_minutes"):
+        capabilities.setdefault(product_code, []).append((machine_id, float(units_per_hour), setup_minutes))
+
+    busy = {}
+    for machine_id, product_code, end in ProductionPlan.objects.filter(
+        status__in=FIXED_STATUSES, machine__isnull=False, planned_end_datetime__gt=start_from
+    ).values_list("machine_id", "product_code", "planned_end_datetime"):
+        if machine_id not in busy or end > busy[machine_id][0]:
+            busy[machine_id] = (end, product_code)
+    machine_numbers = dict(Machine.objects.values_list("id", "machine_number"))
+    return {"plans": plans, "capabilities": capabilities, "busy": busy, "machine_numbers": machine_numbers}
+
+
+def build_schedule(inputs, start_from, grouping_hours, on_progress=None):
+    """
+    有限能力のリストスケジューリングで計画を設備に割り当てます。
+    計画は納期 (due_datetime) → 優先度 → 作成日時の優先度付きキューから取り出し、段取り時間を含めて最も早く
+    終わる設備に割り当てます。続けて、納期がまとめ幅 (grouping_hours) 以内の同じ製品の計画を同じ設備に並べ、
+    段取り替えの回数を減らします。計算量は 計画数 × 製品あたりの設備数 に比例します。
+    戻り値: {"assignments": [...], "unschedulable": [計画ID]}
+    """
+    plans = inputs["plans"]
+    capabilities = inputs["capabilities"]
+    machine_numbers = inputs["machine_numbers"]
+    # 設備ごとの状態: [空く日時, 最後に生産した製品, 割当済みの件数]
+    machines = {}
+    for candidates in capabilities.values():
+        for machine_id, _, _ in candidates:
+            machines.setdefault(machine_id, [start_from, None, 0])
+    for machine_id, (end, product_code) in inputs["busy"].items():
+        if machine_id in machines:
+            machines[machine_id][0] = max(end, start_from)
+            machines[machine_id][1] = product_code
+
+    queue = []
+    by_product = {}
+    unschedulable = []
+    for index, plan in enumerate(plans):
+        if plan["product_code"] not in capabilities:
+            unschedulable.append(plan["id"])
+            continue
+        key = (plan["due"], plan["priority"], plan["created_at"], index)
+        queue.append(key)
+        by_product.setdefault(plan["product_code"], []).append(key)
+    heapq.heapify(queue)
+    for product_queue in by_product.values():
+        heapq.heapify(product_queue)
+
+    window = timedelta(hours=grouping_hours)
+    total = len(queue)
+    done = set()
+    assignments = []
+
+    def finish_time(plan, machine_id, units_per_hour, setup_minutes):
+        available_at, last_product, _ = machines[machine_id]
+        setup = 0 if last_product == plan["product_code"] else setup_minutes
+        return available_at + timedelta(minutes=setup, hours=plan["planned_quantity"] / units_per_hour), setup
+
+    def assign(index, machine_id, units_per_hour, setup_minutes):
+        plan = plans[index]
+        end, setup = finish_time(plan, machine_id, units_per_hour, setup_minutes)
+        state = machines[machine_id]
+        start = state[0] + timedelta(minutes=setup)
+        state[0], state[1], state[2] = end, plan["product_code"], state[2] + 1
+        done.add(index)
+        assignments.append(
+            {
+                "plan": plan,
+                "machine_id": machine_id,
+                "sequence": state[2],
+                "start": start.replace(microsecond=0),
+                "end": end.replace(microsecond=0),
+                "setup_minutes": setup,
+            }
+        )
+        if on_progress and len(done) % PROGRESS_INTERVAL == 0:
+            on_progress(len(done), total)
+
+    while queue:
+        key = heapq.heappop(queue)
+        if key[3] in done:
+            continue
+        plan = plans[key[3]]
+        candidates = capabilities[plan["product_code"]]
+        machine_id, units_per_hour, setup_minutes = min(
+            candidates,
+            key=lambda candidate: (*finish_time(plan, *candidate), machine_numbers.get(candidate[0], "")),
+        )
+        assign(key[3], machine_id, units_per_hour, setup_minutes)
+
+        # 段取り替えを減らすため、納期がまとめ幅以内の同じ製品の計画を続けて同じ設備に割り当てる
+        product_queue = by_product[plan["product_code"]]
+        while product_queue:
+            following = product_queue[0]
+            if following[3] in done:
+                heapq.heappop(product_queue)
+                continue
+            if following[0] > key[0] + window:
+                break
+            heapq.heappop(product_queue)
+            assign(following[3], machine_id, units_per_hour, setup_minutes)
+
+    if on_progress:
+        on_progress(total, total)
+    return {"assignments": assignments, "unschedulable": unschedulable}
+
+
+def build_assignments(run, result):
+    rows = []
+    for entry in result["assignments"]:
+        plan = entry["plan"]
+        rows.append(
+            ScheduleAssignment(
+                run=run,
+                production_plan_id=plan["id"],
+                sequence=entry["sequence"],
+                machine_id=entry["machine_id"],
+                previous_machine_id=plan["machine_id"],
+                previous_start_datetime=plan["planned_start_datetime"],
+                previous_end_datetime=plan["planned_end_datetime"],
+                planned_start_datetime=entry["start"],
+                planned_end_datetime=entry["end"],
+                setup_minutes=entry["setup_minutes"],
+                is_late=entry["end"] > plan["due"],
+                is_changed=(
+                    entry["machine_id"] != plan["machine_id"]
+                    or entry["start"] != plan["planned_start_datetime"]
+                    or entry["end"] != plan["planned_end_datetime"]
+                ),
+            )
+        )
+    return rows
+
+
+def summarize_schedule(rows, unschedulable):
+    makespan_end = max((row.planned_end_datetime for row in rows), default=None)
+    return {
+        "plans": len(rows) + len(unschedulable),
+        "scheduled": len(rows),
+        "changed": sum(1 for row in rows if row.is_changed),
+        "late": sum(1 for row in rows if row.is_late),
+        "setups": sum(1 for row in rows if row.setup_minutes),
+        "machines": len({row.machine_id for row in rows}),
+        "makespan_end": makespan_end.isoformat() if makespan_end else None,
+        "unschedulable": len(unschedulable),
+        "unschedulable_plan_ids": [str(plan_id) for plan_id in unschedulable[:SUMMARY_ID_LIMIT]],
+    }
+
+
+def create_schedule_run(user=None, start_from=None, statuses=None, grouping_hours=None):
+    return ScheduleRun.objects.create(
+        created_by=user if user is not None and user.is_authenticated else None,
+        start_from=start_from or timezone.now(),
+        statuses=list(statuses or [ProductionPlan.Status.PENDING]),
+        grouping_hours=settings.SCHEDULER_SETUP_GROUPING_HOURS if grouping_hours is None else grouping_hours,
+    )
+
+
+def run_schedule(run, on_progress=None):
+    """スケジュールを計算し、割当をプレビューとして保存します。生産計画はまだ変更しません。"""
+    run.status = ScheduleRun.Status.RUNNING
+    run.started_at = timezone.now()
+    run.save(update_fields=["status", "started_at"])
+
+    inputs = load_scheduling_inputs(run.start_from, run.statuses)
+    result = build_schedule(inputs, run.start_from, run.grouping_hours, on_progress=on_progress)
+    rows = build_assignments(run, result)
+    with transaction.atomic():
+        run.assignments.all().delete()
+        ScheduleAssignment.objects.bulk_create(rows, batch_size=1000)
+        run.summary = summarize_schedule(rows, result["unschedulable"])
+        run.status = ScheduleRun.Status.PREVIEW
+        run.finished_at = timezone.now()
+        run.save(update_fields=["summary", "status", "finished_at"])
+    logger.info("Schedule run %s: %s", run.id, run.summary)
+    return run.summary
+
+
+@transaction.atomic
+def commit_schedule(run):
+    """
+    プレビューの割当のうち変更があるものを生産計画に書き戻します。
+    計算開始後に更新された計画や、対象ステータスでなくなった計画は上書きせず、確定されなかった計画として返します。
+    """
+    run = ScheduleRun.objects.select_for_update().get(pk=run.pk)
+    if run.status != ScheduleRun.Status.PREVIEW:
+        raise ValueError("確認待ちのスケジュールだけを確定できます。")
+
+    assignments = list(run.assignments.filter(is_changed=True))
+    plans = {
+        plan.pk: plan
+        for plan in ProductionPlan.objects.select_for_update()
+        .filter(id__in=[assignment.production_plan_id for assignment in assignments])
+        .order_by("id")
+    }
+    now = timezone.now()
+    updated = []
+    stale = []
+    for assignment in assignments:
+        plan = plans.get(assignment.production_plan_id)
+        if plan is None or plan.updated_at > run.started_at or plan.status not in run.statuses:
+            stale.append(str(assignment.production_plan_id))
+            continue
+        plan.machine_id = assignment.machine_id
+        plan.planned_start_datetime = assignment.planned_start_datetime
+        plan.planned_end_datetime = assignment.planned_end_datetime
+        plan.updated_at = now
+        updated.append(plan)
+    ProductionPlan.objects.bulk_update(
+        updated, ["machine", "planned_start_datetime", "planned_end_datetime", "updated_at"], batch_size=1000
+    )
+    # bulk_update はシグナルを通らないため、開始日時の変更で BOM に使う計画が変わりうる製品はここで再計算する
+    schedule_bom_refresh(
+        product_codes={
+            plan.product_code for plan in updated if plan.bom_values() != getattr(plan, "_loaded_bom_values", None)
+        }
+    )
+
+    result = {"committed": len(updated), "stale": len(stale), "stale_plan_ids": stale[:SUMMARY_ID_LIMIT]}
+    run.summary = {**run.summary, **result}
+    run.status = ScheduleRun.Status.COMMITTED
+    run.committed_at = now
+    run.save(update_fields=["summary", "status", "committed_at"])
+    return result
@@ -0,0 +1,329 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from inventory.models import Inventory
+from inventory.services.supply_calendar import open_purchase_orders
+
+from ..models import MaterialAllocation, PartsUsed, ProductionPlan
+from .mrp import EPSILON, OPEN_PLAN_STATUSES
+
+# 1回のシミュレーションで変更できる計画数の上限
+MAX_SIMULATION_CHANGES = 100
+PLAN_FIELDS = ("id", "plan_name", "product_code", "production_plan", "planned_quantity")
+# 同じ日の入庫は、その日の所要より先に使えるものとして並べる
+RECEIPT, DEMAND = 0, 1
+
+
+def _parse_changes(changes):
+    """変更内容を検証し、{計画ID (正規化した UUID 文字列): {項目: 値}} に変換します。"""
+    if not isinstance(changes, list) or not changes:
+        raise ValueError("changes must be a non-empty list.")
+    if len(changes) > MAX_SIMULATION_CHANGES:
+        raise ValueError(f"changes must contain at most {MAX_SIMULATION_CHANGES} entries.")
+    parsed = {}
+    for change in changes:
+        if not isinstance(change, dict) or not change.get("plan_id"):
+            raise ValueError("Each change requires plan_id.")
+        try:
+            plan_id = str(uuid.UUID(str(change["plan_id"])))
+        except ValueError:
+            raise ValueError(f"Invalid plan_id: {change['plan_id']}") from None
+        values = {}
+        for field in ("planned_start_datetime", "planned_end_datetime"):
+            if change.get(field):
+                value = parse_datetime(str(change[field]))
+                if value is None:
+                    raise ValueError(f"Invalid {field}: {change[field]}")
+                values[field] = timezone.make_aware(value) if timezone.is_naive(value) else value
+        if change.get("planned_quantity") not in (None, ""):
+            try:
+                values["planned_quantity"] = int(change["planned_quantity"])
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid planned_quantity: {change['planned_quantity']}") from None
+            if values["planned_quantity"] < 0:
+                raise ValueError("planned_quantity must be zero or greater.")
+        if not values:
+            raise ValueError(f"No changes given for plan {change['plan_id']}.")
+        parsed[plan_id] = values
+    return parsed
+
+
+def load_simulation_state(plan_changes, horizon_end):
+    """
+    変更する計画と、それと部品・製品を共有する未着手・進行中の計画の需給を一括クエリで読み込みます。
+    正味所要量は品番ごとに独立して計算できるため、変更の影響を受ける品番 (変更する計画の使用部品と製品) に
+    絞って読み込みます。戻り値の辞書:
+      plans: {計画ID: {"plan_name", "product_code", "identifier", "quantity", "start", "end",
+                        "usage": {品番: 引当控除前の数量}, "covered": {品番: 引当・出庫済みの数量}}}
+      purchase_orders: {品番: [(入庫予定日, 未入庫数量, 発注ID, 発注番号)]}
+      on_hand: {品番: 利用可能数量 (在庫 - 引当)}
+      parts: 影響を受ける品番の集合
+    """
+    changed = {
+        str(row[0]): row
+        for row in ProductionPlan.objects.filter(id__in=list(plan_changes), status__in=OPEN_PLAN_STATUSES).values_list(
+            *PLAN_FIELDS, "planned_start_datetime", "planned_end_datetime"
+        )
+    }
+    missing = sorted(set(plan_changes) - set(changed))
+    if missing:
+        raise ValueError(f"Plans not found or not open: {', '.join(missing)}")
+
+    changed_identifiers = {row[3] for row in changed.values() if row[3]}
+    parts = set(
+        PartsUsed.objects.filter(production_plan__in=changed_identifiers).values_list("part_code", flat=True).distinct()
+    )
+    parts.update(row[2] for row in changed.values())
+
+    # 影響を受ける品番を使う・作る計画 (期間の終わりより後に始まる計画の所要は、期間内の不足に関係しない)
+    using_identifiers = PartsUsed.objects.filter(part_code__in=parts).values("production_plan")
+    rows = list(changed.values())
+    rows += (
+        ProductionPlan.objects.filter(status__in=OPEN_PLAN_STATUSES)
+        .filter(
+            Q(planned_start_datetime__date__lte=horizon_end, production_plan__in=using_identifiers)
+            | Q(planned_end_datetime__date__lte=horizon_end, product_code__in=parts)
+        )
+        .values_list(*PLAN_FIELDS, "planned_start_datetime", "planned_end_datetime")
+    )
+
+    plans = {}
+    for plan_id, plan_name, product_code, identifier, quantity, start, end in rows:
+        plans.setdefault(
+            str(plan_id),
+            {
+                "plan_name": plan_name,
+                "product_code": product_code,
+                "identifier": identifier,
+                "quantity": quantity,
+                "start": start,
+                "end": end,
+                "usage": {},
+                "covered": {},
+            },
+        )
+
+    usage = {}
+    identifiers = {plan["identifier"] for plan in plans.values() if plan["identifier"]}
+    for identifier, part_code, total in (
+        PartsUsed.objects.filter(production_plan__in=identifiers, part_code__in=parts)
+        .values_list("production_plan", "part_code")
+        .annotate(total=Sum("quantity_used"))
+        .order_by()
+    ):
+        usage.setdefault(identifier, {})[part_code] = total
+    for plan in plans.values():
+        plan["usage"] = usage.get(plan["identifier"], {})
+
+    for plan_id, material_code, total in (
+        MaterialAllocation.objects.filter(
+            production_plan__in=list(plans), material_code__in=parts, status__in=MaterialAllocation.COVERING_STATUSES
+        )
+        .values_list("production_plan_id", "material_code")
+        .annotate(total=Sum("allocated_quantity"))
+        .order_by()
+    ):
+        plans[str(plan_id)]["covered"][material_code] = total
+
+    purchase_orders = {}
+    for po_id, order_number, part_code, arrival, remaining in (
+        open_purchase_orders()
+        .filter(part_key__code__in=parts, expected_arrival__date__lte=horizon_end)
+        .annotate(remaining=F("quantity") - F("received_quantity"))
+        .values_list("id", "order_number", "part_key__code", "expected_arrival", "remaining")
+    ):
+        purchase_orders.setdefault(part_code, []).append((arrival, remaining, str(po_id), order_number))
+
+    on_hand = dict(
+        Inventory.objects.filter(is_active=True, is_allocatable=True, part_key__code__in=parts)
+        .values_list("part_key__code")
+        .annotate(available=Sum(F("quantity") - F("reserved")))
+        .order_by()
+    )
+    return {"plans": plans, "purchase_orders": purchase_orders, "on_hand": on_hand, "parts": parts}
+
+
+def apply_plan_changes(plans, plan_changes):
+    """
+    計画の辞書のコピーに変更を適用して返します (元の辞書は変更しません)。
+    数量を変更した計画は、使用部品の数量を計画数量に比例させます。
+    """
+    scenario = dict(plans)
+    for plan_id, values in plan_changes.items():
+        plan = scenario[plan_id] = dict(plans[plan_id])
+        plan["start"] = values.get("planned_start_datetime", plan["start"])
+        plan["end"] = values.get("planned_end_datetime", plan["end"])
+        if plan["start"] and plan["end"] and plan["start"] > plan["end"]:
+            raise ValueError(f"Plan {plan_id}: planned_start_datetime must be before planned_end_datetime.")
+        if "planned_quantity" in values:
+            quantity = values["planned_quantity"]
+            ratio = quantity / plan["quantity"] if plan["quantity"] else 1
+            plan["usage"] = {part_code: used * ratio for part_code, used in plan["usage"].items()}
+            plan["quantity"] = quantity
+    return scenario
+
+
+def _events(state, plans, today, horizon_end):
+    """品番ごとの入出庫予定 [(日付, 種別, 数量, 参照)] を作ります。期間前の予定は今日に寄せ、期間後の予定は除きます。"""
+
+    def clip(value):
+        value = timezone.localdate(value) if value is not None else today
+        return max(value, today)
+
+    events = {part_code: [] for part_code in state["parts"]}
+    for part_code, orders in state["purchase_orders"].items():
+        for arrival, remaining, po_id, order_number in orders:
+            events[part_code].append((clip(arrival), RECEIPT, remaining, ("po", po_id, order_number)))
+    for plan_id, plan in plans.items():
+        if plan["product_code"] in events and plan["quantity"]:
+            events[plan["product_code"]].append((clip(plan["end"]), RECEIPT, plan["quantity"], ("plan", plan_id)))
+        need_date = clip(plan["start"])
+        for part_code, used in plan["usage"].items():
+            remaining = used - plan["covered"].get(part_code, 0)
+            if remaining > EPSILON:
+                events[part_code].append((need_date, DEMAND, remaining, plan_id))
+    for part_code, part_events in events.items():
+        events[part_code] = [event for event in part_events if event[0] <= horizon_end]
+        events[part_code].sort(key=lambda event: (event[0], event[1]))
+    return events
+
+
+def net_part(on_hand, events):
+    """
+    1品番の予定を日付順に引き当て、在庫推移から不足を求めます。戻り値の辞書:
+      shortages: {計画ID: 不足数量} 必要日の時点で足りない数量
+      first_short_date: 最初に不足する日 / total_shortage: 不足数量の合計
+      late_receipts: [{"purchase_order_id", "order_number", "arrival", "needed_by", "plan_id", "quantity"}]
+        不足の解消を待っている間に入庫する (必要日に間に合わない) 発注
+    """
+    balance = on_hand
+    shortages = {}
+    waiting = []  # 不足のまま入庫を待っている (必要日, 計画ID)
+    late_receipts = []
+    first_short_date = None
+    for date, kind, quantity, ref in events:
+        if kind == RECEIPT:
+            balance += quantity
+            if waiting and ref[0] == "po":
+                needed_by, plan_id = waiting[0]
+                late_receipts.append(
+                    {
+                        "purchase_order_id": ref[1],
+                        "order_number": ref[2],
+                        "arrival": date,
+                        "needed_by": needed_by,
+                        "days_late": (date - needed_by).days,
+                        "plan_id": plan_id,
+                        "quantity": quantity,
+                    }
+                )
+            if balance >= -EPSILON:
+                waiting.clear()
+            continue
+        balance -= quantity
+        if balance < -EPSILON:
+            shortages[ref] = shortages.get(ref, 0) + min(quantity, -balance)
+            waiting.append((date, ref))
+            first_short_date = first_short_date or date
+    return {
+        "shortages": shortages,
+        "first_short_date": first_short_date,
+        "total_shortage": sum(shortages.values()),
+        "late_receipts": late_receipts,
+    }
+
+
+def _round(value):
+    return round(value, 3)
+
+
+def simulate_plan_changes(changes, horizon_days=None, today=None):
+    """
+    生産計画の日程・数量の変更を仮に適用した場合の部品不足の変化を返します (データベースは更新しません)。
+    需給は1回だけ読み込み、変更前と変更後の計画に対して同じ正味計算を行って比較します。戻り値の辞書:
+      parts: 不足が変化する品番 (変更前後の不足数量・最初の不足日)
+      plans: 不足が変化する計画 (変更前後の品番別不足数量と
+             impact: new_shortage / worse / improved / resolved / changed)
+      late_receipts: 変更後に必要日に間に合わなくなる発注
+    不足した計画の日程は動かさないため、不足による遅れがさらに別の計画へ波及する分は含みません。
+    """
+    plan_changes = _parse_changes(changes)
+    horizon_days = settings.MRP_HORIZON_DAYS if horizon_days is None else horizon_days
+    today = today or timezone.localdate()
+    horizon_end = today + timedelta(days=horizon_days)
+
+    state = load_simulation_state(plan_changes, horizon_end)
+    baseline_plans = state["plans"]
+    scenario_plans = apply_plan_changes(baseline_plans, plan_changes)
+    baseline_events = _events(state, baseline_plans, today, horizon_end)
+    scenario_events = _events(state, scenario_plans, today, horizon_end)
+
+    parts = []
+    plan_shortages = {}  # 計画ID -> [変更前 {品番: 数量}, 変更後 {品番: 数量}]
+    late_receipts = []
+    for part_code in sorted(state["parts"]):
+        on_hand = state["on_hand"].get(part_code) or 0
+        before = net_part(on_hand, baseline_events[part_code])
+        after = net_part(on_hand, scenario_events[part_code])
+        for index, result in enumerate((before, after)):
+            for plan_id, quantity in result["shortages"].items():
+                plan_shortages.setdefault(plan_id, [{}, {}])[index][part_code] = _round(quantity)
+        if (before["total_shortage"], before["first_short_date"]) != (
+            after["total_shortage"],
+            after["first_short_date"],
+        ):
+            parts.append(
+                {
+                    "part_code": part_code,
+                    "on_hand": on_hand,
+                    "baseline_shortage": _round(before["total_shortage"]),
+                    "scenario_shortage": _round(after["total_shortage"]),
+                    "baseline_first_short_date": before["first_short_date"],
+                    "scenario_first_short_date": after["first_short_date"],
+                }
+            )
+        already_late = {receipt["purchase_order_id"] for receipt in before["late_receipts"]}
+        late_receipts += [
+            {"part_code": part_code, **receipt}
+            for receipt in after["late_receipts"]
+            if receipt["purchase_order_id"] not in already_late
+        ]
+
+    plans = []
+    for plan_id, (before, after) in plan_shortages.items():
+        if before == after:
+            continue
+        before_total, after_total = sum(before.values()), sum(after.values())
+        if not before:
+            impact = "new_shortage"
+        elif not after:
+            impact = "resolved"
+        elif after_total != before_total:
+            impact = "worse" if after_total > before_total else "improved"
+        else:
+            impact = "changed"
+        plan = scenario_plans[plan_id]
+        plans.append(
+            {
+                "plan_id": plan_id,
+                "plan_name": plan["plan_name"],
+                "product_code": plan["product_code"],
+                "changed": plan_id in plan_changes,
+                "planned_start_datetime": plan["start"],
+                "impact": impact,
+                "baseline_shortages": before,
+                "scenario_shortages": after,
+            }
+        )
+    plans.sort(key=lambda row: (row["planned_start_datetime"] is None, row["planned_start_datetime"]))
+    return {
+        "horizon": {"date_from": today, "date_to": horizon_end},
+        "parts": parts,
+        "plans": plans,
+        "late_receipts": late_receipts,
+    }
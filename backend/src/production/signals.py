@@ -0,0 +1,43 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from base.caching import bump_cache_version
+from master.models import OutputRoutingRule
+
+from .models import PartsUsed, ProductionPlan
+from .services.bom import schedule_bom_refresh
+from .services.output_routing import CACHE_NAMESPACE as OUTPUT_ROUTING_CACHE
+
+
+@receiver([post_save, post_delete], sender=PartsUsed)
+def refresh_bom_for_parts_used(sender, instance, created=False, **kwargs):
+    """使用部品の識別子・部品コード・使用数量が変わった場合だけ、その識別子を構成として使う製品の閉包を再計算します。"""
+    loaded = getattr(instance, "_loaded_bom_values", None)
+    if kwargs.get("signal") is post_save and not created and loaded == instance.bom_values():
+        return
+    identifiers = {instance.production_plan}
+    if loaded is not None:
+        # 識別子が変更された場合は、変更前の識別子を使う製品の閉包も作り直す
+        identifiers.add(loaded[0])
+    instance._loaded_bom_values = instance.bom_values()
+    schedule_bom_refresh(identifiers=identifiers)
+
+
+@receiver([post_save, post_delete], sender=ProductionPlan)
+def refresh_bom_for_plan(sender, instance, created=False, **kwargs):
+    """生産計画の BOM に関わる項目 (製品コード・識別子・計画数量・開始日時・中止) が変わった場合だけ再計算します。"""
+    loaded = getattr(instance, "_loaded_bom_values", None)
+    if kwargs.get("signal") is post_save and not created and loaded == instance.bom_values():
+        return
+    product_codes = {instance.product_code}
+    if loaded is not None:
+        # 製品コードが変更された場合は、変更前の製品の閉包も作り直す
+        product_codes.add(loaded[0])
+    instance._loaded_bom_values = instance.bom_values()
+    schedule_bom_refresh(product_codes=product_codes)
+
+
+@receiver([post_save, post_delete], sender=OutputRoutingRule)
+def invalidate_output_routing(sender, **kwargs):
+    """完成品入庫ルールの変更時に、各プロセスのルール表を読み直させます。"""
+    bump_cache_version(OUTPUT_ROUTING_CACHE)
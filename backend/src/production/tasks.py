@@ -0,0 +1,90 @@
+from datetime import date
+
+from celery import shared_task
+from django.utils import timezone
+
+from base.models import AsyncTask
+
+from .models import MrpRun, ScheduleRun
+from .services.allocation import batch_allocate_materials_service
+from .services.mrp import run_mrp
+from .services.scheduling import run_schedule
+
+
+@shared_task(bind=True)
+def run_mrp_task(self, run_id):
+    """所要量計算 (MRP) を実行し、進捗を AsyncTask に記録します。"""
+    task = AsyncTask.objects.get(task_id=self.request.id)
+    task.status = "STARTED"
+    task.save()
+    run = MrpRun.objects.get(pk=run_id)
+
+    def on_progress(done, total):
+        task.progress = done
+        task.total = total
+        task.save(update_fields=["progress", "total", "updated_at"])
+
+    try:
+        task.result = {"run_id": str(run.id), **run_mrp(run, on_progress=on_progress)}
+        task.status = "SUCCESS"
+    except Exception as e:
+        run.status = MrpRun.Status.FAILED
+        run.finished_at = timezone.now()
+        run.summary = {"error": str(e)}
+        run.save(update_fields=["status", "finished_at", "summary"])
+        task.status = "FAILURE"
+        task.result = {"run_id": str(run.id), "error": str(e)}
+    task.save()
+
+
+@shared_task(bind=True)
+def batch_allocate_task(self, date_from, date_to, statuses=None, policy=None):
+    """期間内に開始する生産計画の材料を一括で引き当て、進捗と不足の一覧を AsyncTask に記録します。"""
+    task = AsyncTask.objects.get(task_id=self.request.id)
+    task.status = "STARTED"
+    task.save()
+
+    def on_progress(done, total):
+        task.progress = done
+        task.total = total
+        task.save(update_fields=["progress", "total", "updated_at"])
+
+    try:
+        task.result = batch_allocate_materials_service(
+            date.fromisoformat(date_from),
+            date.fromisoformat(date_to),
+            statuses=statuses,
+            policy_overrides=policy,
+            on_progress=on_progress,
+        )
+        task.status = "SUCCESS"
+    except Exception as e:
+        task.status = "FAILURE"
+        task.result = {"error": str(e)}
+    task.save()
+
+
+@shared_task(bind=True)
+def run_schedule_task(self, run_id):
+    """生産計画の設備割当を計算し、確定前のプレビューとして保存します。進捗は AsyncTask に記録します。"""
+    task = AsyncTask.objects.get(task_id=self.request.id)
+    task.status = "STARTED"
+    task.save()
+    run = ScheduleRun.objects.get(pk=run_id)
+
+    def on_progress(done, total):
+        task.progress = done
+        task.total = total
+        task.save(update_fields=["progress", "total", "updated_at"])
+
+    try:
+        task.result = {"run_id": str(run.id), **run_schedule(run, on_progress=on_progress)}
+        task.status = "SUCCESS"
+    except Exception as e:
+        run.status = ScheduleRun.Status.FAILED
+        run.finished_at = timezone.now()
+        run.summary = {"error": str(e)}
+        run.save(update_fields=["status", "finished_at", "summary"])
+        task.status = "FAILURE"
+        task.result = {"run_id": str(run.id), "error": str(e)}
+    task.save()
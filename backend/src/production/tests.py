@@ -1 +1,694 @@
 # Create your tests here.
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from inventory.models import Inventory, PurchaseOrder, SalesOrder, StockMovement
+from machine.models import Machine, MachineCapability
+from master.models import OutputRoutingRule, PartNumber
+from production.models import MaterialAllocation, PartsUsed, ProductionKpiDaily, ProductionPlan, ScheduleRun
+from production.rest_views import ProductionPlanViewSet
+from production.serializers import ProductionPlanSerializer
+from production.services.allocation import (
+    allocate_materials_service,
+    auto_allocate_materials_service,
+    batch_allocate_materials_service,
+    load_plan_requirements,
+)
+from production.services.bom import explode_bom, implode_bom
+from production.services.kpi import query_production_kpis, rebuild_production_kpis
+from production.services.mrp import create_mrp_run, run_mrp
+from production.services.output_routing import clear_cache as clear_output_routing_cache
+from production.services.output_routing import resolve_output_location
+from production.services.progress import (
+    BulkProgressError,
+    bulk_update_production_progress_service,
+    update_production_progress_service,
+)
+from production.services.queries import annotate_plan_coverage, annotate_plan_progress, get_required_parts_for_plans
+from production.services.scheduling import commit_schedule, create_schedule_run, run_schedule
+
+
+class BomClosureTests(TestCase):
+    def setUp(self):
+        # コミット時コールバックで品番キーがキャッシュされるため、ロールバック後に持ち越さないようにする
+        self.addCleanup(PartNumber.objects.clear_cache)
+
+    def _plan(self, product_code, identifier, quantity):
+        now = timezone.now()
+        ProductionPlan.objects.create(
+            plan_name=product_code,
+            product_code=product_code,
+            production_plan=identifier,
+            planned_quantity=quantity,
+            planned_start_datetime=now,
+            planned_end_datetime=now,
+        )
+
+    def test_explosion_and_implosion_follow_sub_assemblies(self):
+        """中間組立品を通した所要量が展開され、下位の構成変更が上位製品の閉包に反映されることを確認"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self._plan("PROD-A", "BOM-A", 2)
+            PartsUsed.objects.create(production_plan="BOM-A", part_code="SUB-1", quantity_used=4)
+            PartsUsed.objects.create(production_plan="BOM-A", part_code="RAW-1", quantity_used=2)
+            self._plan("SUB-1", "BOM-S", 1)
+            PartsUsed.objects.create(production_plan="BOM-S", part_code="RAW-1", quantity_used=3)
+            PartsUsed.objects.create(production_plan="BOM-S", part_code="RAW-2", quantity_used=1)
+
+        lines = {line["part_code"]: line for line in explode_bom("PROD-A", 10)}
+        self.assertEqual(set(lines), {"SUB-1", "RAW-1", "RAW-2"})
+        self.assertEqual(lines["SUB-1"]["required_quantity"], Decimal(20))
+        self.assertFalse(lines["SUB-1"]["is_leaf"])
+        # RAW-1 は直接 1個/台 + SUB-1 経由 2 x 3 = 6個/台
+        self.assertEqual(lines["RAW-1"]["quantity_per_unit"], Decimal(7))
+        self.assertEqual(
+            (lines["RAW-1"]["depth"], lines["RAW-1"]["max_depth"], lines["RAW-1"]["path_count"]), (1, 2, 2)
+        )
+        self.assertEqual(lines["RAW-2"]["depth"], 2)
+
+        used_in = {line["product_code"]: line["quantity_per_unit"] for line in implode_bom("RAW-1")}
+        self.assertEqual(used_in, {"PROD-A": Decimal(7), "SUB-1": Decimal(3)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PartsUsed.objects.create(production_plan="BOM-S", part_code="RAW-3", quantity_used=5)
+        self.assertEqual([line["product_code"] for line in implode_bom("RAW-3")], ["SUB-1", "PROD-A"])
+
+    def test_refresh_is_batched_and_limited_to_bom_changes(self):
+        """同じトランザクションの変更は1回の再計算にまとまり、進捗によるステータス変更では再計算されないことを確認"""
+
+        def closure_refreshes(queries):
+            # 再計算ごとに1回、閉包表から上位製品を検索する
+            prefix = 'SELECT "production_bomclosure"."ancestor_code"'
+            return sum(query["sql"].startswith(prefix) for query in queries.captured_queries)
+
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            self._plan("PROD-A", "BOM-A", 1)
+            for code in ("RAW-1", "RAW-2", "RAW-3"):
+                PartsUsed.objects.create(production_plan="BOM-A", part_code=code, quantity_used=1)
+        self.assertEqual(closure_refreshes(queries), 1)
+        self.assertEqual({line["part_code"] for line in explode_bom("PROD-A")}, {"RAW-1", "RAW-2", "RAW-3"})
+
+        plan = ProductionPlan.objects.get(product_code="PROD-A")
+        part = PartsUsed.objects.get(part_code="RAW-1")
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            plan.status = "IN_PROGRESS"
+            plan.save()
+            part.remarks = "メモ"
+            part.save()
+        self.assertEqual(closure_refreshes(queries), 0)
+
+        # 開始日時を新しい計画より後へ移すと、製品の BOM に使う計画が入れ替わる
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductionPlan.objects.create(
+                plan_name="PROD-A",
+                product_code="PROD-A",
+                production_plan="BOM-A2",
+                planned_quantity=1,
+                planned_start_datetime=now + timedelta(days=1),
+                planned_end_datetime=now + timedelta(days=1),
+            )
+            PartsUsed.objects.create(production_plan="BOM-A2", part_code="RAW-9", quantity_used=1)
+        self.assertEqual({line["part_code"] for line in explode_bom("PROD-A")}, {"RAW-9"})
+        with self.captureOnCommitCallbacks(execute=True):
+            plan.planned_start_datetime = now + timedelta(days=2)
+            plan.save()
+        self.assertEqual({line["part_code"] for line in explode_bom("PROD-A")}, {"RAW-1", "RAW-2", "RAW-3"})
+
+
+class BulkProgressTests(TestCase):
+    def setUp(self):
+        self.addCleanup(PartNumber.objects.clear_cache)
+        now = timezone.now()
+        self.plans = [
+            ProductionPlan.objects.create(
+                plan_name=f"P{i}",
+                product_code=product_code,
+                production_plan="BOM-A",
+                planned_quantity=5,
+                planned_start_datetime=now,
+                planned_end_datetime=now,
+            )
+            for i, product_code in enumerate(["PROD-A", "PROD-A", "PROD-B"])
+        ]
+        PartsUsed.objects.create(production_plan="BOM-A", part_code="RAW-1", quantity_used=2)
+        Inventory.objects.create(part_number="RAW-1", warehouse="WH-A", quantity=10)
+        allocate_materials_service(
+            self.plans[0], [{"part_number": "RAW-1", "warehouse": "WH-A", "quantity_to_allocate": 2}]
+        )
+
+    def test_bulk_completion_aggregates_finished_goods(self):
+        """完成品在庫を製品ごとに集計して反映し、失敗した計画は結果として報告することを確認"""
+        entries = [
+            {"plan_id": str(self.plans[0].id), "status": "COMPLETED", "good_quantity": 3},
+            {"plan_id": str(self.plans[1].id), "status": "COMPLETED", "good_quantity": 4},
+            {"plan_id": str(self.plans[2].id), "status": "COMPLETED", "good_quantity": -1},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            results = bulk_update_production_progress_service(entries, None)
+        self.assertEqual([result["success"] for result in results], [True, True, False])
+        self.assertEqual(Inventory.objects.get(part_number="PROD-A", warehouse="FG-MAIN").quantity, 7)
+        self.assertFalse(Inventory.objects.filter(part_number="PROD-B").exists())
+        self.assertEqual(StockMovement.objects.filter(movement_type="PRODUCTION_OUTPUT").count(), 2)
+        self.assertEqual(Inventory.objects.get(part_number="RAW-1").quantity, 8)
+        self.assertEqual(MaterialAllocation.objects.get().status, "ISSUED")
+        self.assertEqual(ProductionPlan.objects.get(pk=self.plans[2].pk).status, "PENDING")
+
+        # 1件でも失敗すれば何も更新しない (完成数量の取消で完成品在庫が不足する)
+        Inventory.objects.filter(part_number="PROD-A").update(quantity=3)
+        entries = [
+            {"plan_id": str(self.plans[0].id), "status": "IN_PROGRESS"},
+            {"plan_id": str(self.plans[1].id), "status": "IN_PROGRESS"},
+        ]
+        with self.assertRaises(BulkProgressError) as raised:
+            bulk_update_production_progress_service(entries, None, atomic=True)
+        self.assertEqual([result["success"] for result in raised.exception.results], [True, False])
+        self.assertEqual(ProductionPlan.objects.filter(status="COMPLETED").count(), 2)
+
+    def test_completion_maintains_kpi_rollups(self):
+        """完了・完了取消のたびに KPI 日次集計が更新され、バックフィルの結果と一致することを確認"""
+        entries = [
+            {
+                "plan_id": str(self.plans[0].id),
+                "status": "COMPLETED",
+                "good_quantity": 3,
+                "actual_quantity": 4,
+                "defective_quantity": 1,
+            },
+            {"plan_id": str(self.plans[1].id), "status": "COMPLETED", "good_quantity": 5},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update_production_progress_service(entries, None)
+            update_production_progress_service(
+                self.plans[2], {"status": "COMPLETED", "good_quantity": 2, "defective_quantity": 2}, None
+            )
+
+        today = timezone.localdate()
+        results = {
+            row["product_code"]: row for row in query_production_kpis(today, today, period="week", group_by=["product"])
+        }
+        self.assertEqual(results["PROD-A"]["completed_plans"], 2)
+        self.assertEqual(results["PROD-A"]["good_quantity"], 8)
+        self.assertEqual(results["PROD-A"]["reported_quantity"], 9)
+        self.assertEqual(results["PROD-A"]["yield_rate"], 0.8889)
+        self.assertEqual(results["PROD-B"]["yield_rate"], 0.5)
+        self.assertEqual(results["PROD-B"]["throughput_per_day"], 2)
+        self.assertEqual(results["PROD-B"]["on_time_rate"], 0)
+
+        # 完了を取り消すと集計から外れる / バックフィルで作り直しても同じ行になる
+        with self.captureOnCommitCallbacks(execute=True):
+            update_production_progress_service(
+                ProductionPlan.objects.get(pk=self.plans[2].pk), {"status": "IN_PROGRESS"}, None
+            )
+        self.assertFalse(ProductionKpiDaily.objects.filter(product_code="PROD-B").exists())
+        fields = ["date", "product_code", "operator", "completed_plans", "good_quantity", "defective_quantity"]
+        maintained = list(ProductionKpiDaily.objects.values_list(*fields))
+        self.assertEqual(rebuild_production_kpis(), 1)
+        self.assertEqual(list(ProductionKpiDaily.objects.values_list(*fields)), maintained)
+
+    def test_update_progress_replays_idempotency_key(self):
+        """同じ Idempotency-Key で再送された進捗更新は再実行されず、保存済みの応答が返ることを確認"""
+        user = get_user_model().objects.create_user(custom_id="operator")
+        view = ProductionPlanViewSet.as_view({"post": "update_progress"})
+
+        def post(data, key="tablet-1"):
+            request = APIRequestFactory().post(
+                f"/api/production/plans/{self.plans[2].pk}/update-progress/",
+                data,
+                format="json",
+                HTTP_IDEMPOTENCY_KEY=key,
+            )
+            force_authenticate(request, user=user)
+            return view(request, pk=str(self.plans[2].pk))
+
+        # 失敗した応答は保存されないため、同じキーで再試行できる
+        self.assertEqual(post({"status": "COMPLETED"}).status_code, 400)
+        data = {"status": "COMPLETED", "good_quantity": 4}
+        with self.captureOnCommitCallbacks(execute=True):
+            first = post(data)
+        retried = post(data)
+        self.assertEqual(retried.status_code, 200)
+        self.assertEqual(retried.data, json.loads(JSONRenderer().render(first.data)))
+        self.assertEqual(retried["Idempotent-Replayed"], "true")
+        self.assertEqual(Inventory.objects.get(part_number="PROD-B", warehouse="FG-MAIN").quantity, 4)
+        self.assertEqual(StockMovement.objects.filter(part_number="PROD-B").count(), 1)
+        self.assertEqual(post({**data, "good_quantity": 5}).status_code, 422)
+
+    def test_output_routing_rules_and_recorded_location(self):
+        """完成品が入庫ルールの倉庫・棚番に計上され、完了取消はルール変更後も計上した在庫行から戻すことを確認"""
+        self.addCleanup(clear_output_routing_cache)
+        with self.captureOnCommitCallbacks(execute=True):
+            rule = OutputRoutingRule.objects.create(product_code="PROD-A", warehouse="FG-A", location="A-01")
+        with self.assertNumQueries(1):
+            self.assertEqual(resolve_output_location("PROD-A"), ("FG-A", "A-01"))
+            self.assertEqual(resolve_output_location("PROD-B"), ("FG-MAIN", None))
+
+        entries = [
+            {"plan_id": str(self.plans[0].id), "status": "COMPLETED", "good_quantity": 3},
+            {"plan_id": str(self.plans[1].id), "status": "COMPLETED", "good_quantity": 4},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_update_production_progress_service(entries, None)
+            update_production_progress_service(self.plans[2], {"status": "COMPLETED", "good_quantity": 2}, None)
+        self.assertEqual(Inventory.objects.get(part_number="PROD-A", warehouse="FG-A", location="A-01").quantity, 7)
+        self.assertEqual(Inventory.objects.get(part_number="PROD-B", warehouse="FG-MAIN").quantity, 2)
+        self.assertEqual(ProductionPlan.objects.get(pk=self.plans[0].pk).output_warehouse, "FG-A")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            rule.warehouse = "FG-B"
+            rule.save()
+        self.assertEqual(resolve_output_location("PROD-A"), ("FG-B", "A-01"))
+        with self.captureOnCommitCallbacks(execute=True):
+            update_production_progress_service(
+                ProductionPlan.objects.get(pk=self.plans[0].pk), {"status": "IN_PROGRESS"}, None
+            )
+        self.assertEqual(Inventory.objects.get(part_number="PROD-A", warehouse="FG-A").quantity, 4)
+        self.assertFalse(Inventory.objects.filter(warehouse="FG-B").exists())
+        self.assertIsNone(ProductionPlan.objects.get(pk=self.plans[0].pk).output_warehouse)
+
+
+class MrpRunTests(TestCase):
+    def setUp(self):
+        self.addCleanup(PartNumber.objects.clear_cache)
+
+    def test_time_phased_netting_with_dependent_demand(self):
+        """在庫・発注残・引当を差し引いた正味所要量と、生産品の計画オーダーから展開した従属所要量を確認"""
+        now = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            # SUB-1 の構成 (完了済みの計画から取得): SUB-1 1個に RAW-1 を3個
+            ProductionPlan.objects.create(
+                plan_name="SUB",
+                product_code="SUB-1",
+                production_plan="BOM-S",
+                planned_quantity=1,
+                planned_start_datetime=now - timedelta(days=30),
+                planned_end_datetime=now - timedelta(days=29),
+                status="COMPLETED",
+            )
+            PartsUsed.objects.create(production_plan="BOM-S", part_code="RAW-1", quantity_used=3)
+            plan = ProductionPlan.objects.create(
+                plan_name="A",
+                product_code="PROD-A",
+                production_plan="BOM-A",
+                planned_quantity=10,
+                planned_start_datetime=now + timedelta(days=8),
+                planned_end_datetime=now + timedelta(days=10),
+            )
+            PartsUsed.objects.create(production_plan="BOM-A", part_code="SUB-1", quantity_used=20)
+            PartsUsed.objects.create(production_plan="BOM-A", part_code="RAW-1", quantity_used=10)
+            MaterialAllocation.objects.create(production_plan=plan, material_code="RAW-1", allocated_quantity=2)
+            Inventory.objects.create(part_number="RAW-1", warehouse="WH-A", quantity=7, reserved=2)
+            PurchaseOrder.objects.create(order_number="PO-1", part_number="RAW-1", quantity=4, expected_arrival=now)
+
+        today = timezone.localdate()
+        run = create_mrp_run(start_date=today, bucket_days=7, horizon_days=28, lead_time_days=7)
+        summary = run_mrp(run)
+
+        rows = {(r.part_code, (r.bucket_start - today).days // 7): r for r in run.requirements.all()}
+        sub = rows[("SUB-1", 1)]
+        self.assertEqual((sub.order_type, sub.planned_order_quantity), ("production", Decimal(20)))
+        self.assertEqual(sub.planned_release_date, today)
+        # SUB-1 の計画オーダー 20個の手配期間に RAW-1 60個の従属所要量。在庫 5 + 発注残 4 を差し引いて 51個
+        raw_now = rows[("RAW-1", 0)]
+        self.assertEqual(raw_now.gross_requirement, Decimal(60))
+        self.assertEqual(raw_now.planned_order_quantity, Decimal(51))
+        self.assertTrue(raw_now.is_past_due)
+        # PROD-A の直接所要 10個から引当済の 2個を差し引く
+        self.assertEqual(rows[("RAW-1", 1)].planned_order_quantity, Decimal(8))
+        self.assertEqual(summary["shortage_parts"], 2)
+
+    def test_what_if_simulation_reports_impacted_plans_without_writing(self):
+        """計画の前倒しで不足する別の計画と間に合わなくなる発注が返り、データベースは更新されないことを確認"""
+        now = timezone.now()
+        plans = {}
+        with self.captureOnCommitCallbacks(execute=True):
+            for name, start_days in (("A", 5), ("B", 12)):
+                plans[name] = ProductionPlan.objects.create(
+                    plan_name=name,
+                    product_code=f"PROD-{name}",
+                    production_plan=f"BOM-{name}",
+                    planned_quantity=4,
+                    planned_start_datetime=now + timedelta(days=start_days),
+                    planned_end_datetime=now + timedelta(days=start_days + 1),
+                )
+                PartsUsed.objects.create(production_plan=f"BOM-{name}", part_code="RAW-1", quantity_used=8)
+            Inventory.objects.create(part_number="RAW-1", warehouse="WH-A", quantity=10)
+            PurchaseOrder.objects.create(
+                order_number="PO-1", part_number="RAW-1", quantity=10, expected_arrival=now + timedelta(days=10)
+            )
+
+        view = ProductionPlanViewSet.as_view({"post": "simulate"})
+        changes = [
+            {
+                # 大文字の ID も同じ計画として扱う
+                "plan_id": str(plans["B"].pk).upper(),
+                "planned_start_datetime": (now + timedelta(days=3)).isoformat(),
+                "planned_end_datetime": (now + timedelta(days=4)).isoformat(),
+            }
+        ]
+        request = APIRequestFactory().post("/api/production/plans/simulate/", {"changes": changes}, format="json")
+        planner = get_user_model().objects.create_user(custom_id="planner")
+        force_authenticate(request, user=planner)
+        with CaptureQueriesContext(connection) as queries:
+            response = view(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries.captured_queries if not q["sql"].startswith("SELECT")])
+        # B を3日後に前倒しすると、在庫10個を B が8個使い、5日後の A は6個不足する
+        impacted = {row["plan_name"]: row for row in response.data["plans"]}
+        self.assertEqual(list(impacted), ["A"])
+        self.assertEqual(impacted["A"]["impact"], "new_shortage")
+        self.assertEqual(impacted["A"]["scenario_shortages"], {"RAW-1": 6})
+        self.assertEqual(response.data["parts"][0]["scenario_shortage"], 6)
+        # 10日後に入荷する PO-1 は A の必要日に5日遅れる
+        late = response.data["late_receipts"]
+        self.assertEqual(
+            [(r["order_number"], r["plan_id"], r["days_late"]) for r in late], [("PO-1", str(plans["A"].pk), 5)]
+        )
+        plans["B"].refresh_from_db()
+        self.assertEqual(plans["B"].planned_start_datetime, now + timedelta(days=12))
+
+        for invalid in ([], [{"plan_id": "not-a-uuid", "planned_quantity": 1}]):
+            request = APIRequestFactory().post("/api/production/plans/simulate/", {"changes": invalid}, format="json")
+            force_authenticate(request, user=planner)
+            self.assertEqual(view(request).status_code, 400)
+
+
+class AllocateMaterialsTests(TestCase):
+    def setUp(self):
+        self.addCleanup(PartNumber.objects.clear_cache)
+        now = timezone.now()
+        self.plan = ProductionPlan.objects.create(
+            plan_name="A",
+            product_code="PROD-A",
+            production_plan="BOM-A",
+            planned_quantity=1,
+            planned_start_datetime=now,
+            planned_end_datetime=now,
+        )
+
+    def _stock(self, count):
+        for i in range(count):
+            PartsUsed.objects.create(production_plan="BOM-A", part_code=f"RAW-{i}", quantity_used=5)
+            Inventory.objects.create(part_number=f"RAW-{i}", warehouse="WH-A", quantity=10)
+        return [{"part_number": f"RAW-{i}", "warehouse": "WH-A", "quantity_to_allocate": 5} for i in range(count)]
+
+    def test_allocation_is_set_based(self):
+        """引当が在庫・材料引当・社内出庫予定に反映され、クエリ数が明細数に依存しないことを確認"""
+        lines = self._stock(20)
+        with CaptureQueriesContext(connection) as few:
+            allocate_materials_service(self.plan, lines[:2])
+        with CaptureQueriesContext(connection) as many:
+            summary = allocate_materials_service(self.plan, lines[2:])
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+        self.assertEqual(len(summary), 18)
+        self.assertEqual(summary[0]["new_inventory_available"], 5)
+        self.assertEqual(Inventory.objects.get(part_number="RAW-3").reserved, 5)
+        self.assertEqual(SalesOrder.objects.filter(order_number__startswith="INT-").count(), 20)
+        self.assertEqual(MaterialAllocation.objects.filter(production_plan=self.plan).count(), 20)
+
+    def test_errors_roll_back_all_lines(self):
+        """1明細でも BOM 超過があれば、エラーを報告してどの明細も引き当てないことを確認"""
+        lines = self._stock(2)
+        lines[1]["quantity_to_allocate"] = 6
+        with self.assertRaisesMessage(ValueError, "Allocation exceeds BOM requirement for RAW-1."):
+            allocate_materials_service(self.plan, lines)
+        self.assertFalse(Inventory.objects.filter(reserved__gt=0).exists())
+        self.assertFalse(MaterialAllocation.objects.exists())
+
+    def test_returned_allocations_do_not_cover_requirements(self):
+        """返却済みの引当は、未引当の所要量・BOM 超過の判定・一覧の引当数量のどれにも数えないことを確認"""
+        lines = self._stock(1)
+        allocate_materials_service(self.plan, lines)
+        MaterialAllocation.objects.update(status="RETURNED")
+
+        self.assertEqual([line["remaining"] for line in load_plan_requirements([self.plan])[self.plan.pk]], [5])
+        self.assertEqual(annotate_plan_coverage(ProductionPlan.objects.all()).get().allocated_quantity, 0)
+        required_parts = get_required_parts_for_plans([self.plan])[self.plan.pk]
+        self.assertEqual([part["already_allocated_quantity"] for part in required_parts], [0])
+        allocate_materials_service(self.plan, lines)
+
+    def test_split_allocation_records_each_location(self):
+        """複数の棚番から引き当てた明細は棚番ごとに記録され、未登録の品番は品番辞書に登録されないことを確認"""
+        PartsUsed.objects.create(production_plan="BOM-A", part_code="RAW-S", quantity_used=10)
+        Inventory.objects.create(part_number="RAW-S", warehouse="WH-A", location="L1", quantity=6)
+        Inventory.objects.create(part_number="RAW-S", warehouse="WH-A", location="L2", quantity=6)
+        summary = allocate_materials_service(
+            self.plan, [{"part_number": "RAW-S", "warehouse": "WH-A", "quantity_to_allocate": 10}]
+        )
+        self.assertEqual(len(summary), 2)
+        allocations = MaterialAllocation.objects.filter(production_plan=self.plan).order_by("location")
+        self.assertEqual([(a.location, a.allocated_quantity) for a in allocations], [("L1", 6), ("L2", 4)])
+        reserved = Inventory.objects.filter(part_number="RAW-S").order_by("location").values_list("reserved", flat=True)
+        self.assertEqual(list(reserved), [6, 4])
+
+        with self.assertRaisesMessage(ValueError, "Inventory not found for part 'RAW-TYPO'"):
+            allocate_materials_service(
+                self.plan, [{"part_number": "RAW-TYPO", "warehouse": "WH-A", "quantity_to_allocate": 1}]
+            )
+        self.assertFalse(PartNumber.objects.filter(code="RAW-TYPO").exists())
+
+    def test_completion_consumes_each_reserved_location(self):
+        """複数の棚番にまたがる引当が、各棚番の引当数ずつ消費・取消されることを確認 (以前の棚番なしの引当を含む)"""
+        PartsUsed.objects.create(production_plan="BOM-A", part_code="RAW-S", quantity_used=10)
+        for location in ("L1", "L2"):
+            Inventory.objects.create(part_number="RAW-S", warehouse="WH-A", location=location, quantity=6)
+        allocate_materials_service(
+            self.plan, [{"part_number": "RAW-S", "warehouse": "WH-A", "quantity_to_allocate": 10}]
+        )
+
+        def stock():
+            rows = Inventory.objects.filter(part_number="RAW-S").order_by("location")
+            return list(rows.values_list("location", "quantity", "reserved"))
+
+        update_production_progress_service(self.plan, {"status": "COMPLETED", "good_quantity": 1}, None)
+        self.assertEqual(stock(), [("L1", 0, 0), ("L2", 2, 0)])
+        update_production_progress_service(self.plan, {"status": "IN_PROGRESS"}, None)
+        self.assertEqual(stock(), [("L1", 6, 6), ("L2", 6, 4)])
+
+        # 以前の形式 (棚番なしの1件) の引当も、各行の引当数ずつ消費し、取消で同じ行に戻す
+        MaterialAllocation.objects.filter(production_plan=self.plan).delete()
+        MaterialAllocation.objects.create(
+            production_plan=self.plan, material_code="RAW-S", warehouse="WH-A", allocated_quantity=10
+        )
+        update_production_progress_service(self.plan, {"status": "COMPLETED", "good_quantity": 1}, None)
+        self.assertEqual(stock(), [("L1", 0, 0), ("L2", 2, 0)])
+        allocations = MaterialAllocation.objects.filter(production_plan=self.plan).order_by("location")
+        self.assertEqual([(a.location, a.allocated_quantity) for a in allocations], [("L1", 6), ("L2", 4)])
+        update_production_progress_service(self.plan, {"status": "IN_PROGRESS"}, None)
+        self.assertEqual(stock(), [("L1", 6, 6), ("L2", 6, 4)])
+
+    def test_completion_consumes_and_reversal_restores_in_bulk(self):
+        """完了で材料を消費し、取消で元に戻すこと、クエリ数が材料数に依存しないことを確認"""
+        other = ProductionPlan.objects.create(
+            plan_name="B",
+            product_code="PROD-B",
+            production_plan="BOM-B",
+            planned_quantity=1,
+            planned_start_datetime=self.plan.planned_start_datetime,
+            planned_end_datetime=self.plan.planned_end_datetime,
+        )
+        PartsUsed.objects.create(production_plan="BOM-B", part_code="RAW-B", quantity_used=5)
+        Inventory.objects.create(part_number="RAW-B", warehouse="WH-A", quantity=10)
+        allocate_materials_service(other, [{"part_number": "RAW-B", "warehouse": "WH-A", "quantity_to_allocate": 5}])
+        allocate_materials_service(self.plan, self._stock(10))
+
+        completed = {"status": "COMPLETED", "good_quantity": 1}
+        resolve_output_location("PROD-A")  # 完成品入庫ルールの読み込みを計測から外す
+        with CaptureQueriesContext(connection) as few:
+            update_production_progress_service(other, completed, None)
+        with CaptureQueriesContext(connection) as many:
+            update_production_progress_service(self.plan, completed, None)
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+        self.assertEqual(Inventory.objects.filter(part_number="RAW-3").values_list("quantity", "reserved")[0], (5, 0))
+        self.assertFalse(MaterialAllocation.objects.filter(status="ALLOCATED").exists())
+        self.assertEqual(SalesOrder.objects.filter(status="shipped", shipped_quantity=5).count(), 11)
+        self.assertEqual(StockMovement.objects.filter(movement_type="used").count(), 11)
+
+        update_production_progress_service(self.plan, {"status": "IN_PROGRESS"}, None)
+        self.assertEqual(Inventory.objects.filter(part_number="RAW-3").values_list("quantity", "reserved")[0], (10, 5))
+        self.assertEqual(MaterialAllocation.objects.filter(status="ALLOCATED").count(), 10)
+        self.assertEqual(SalesOrder.objects.filter(status="pending", shipped_quantity=0).count(), 10)
+        self.assertEqual(self.plan.internal_sales_orders.count(), 10)
+        allocation = MaterialAllocation.objects.filter(production_plan=other).get()
+        self.assertEqual(allocation.internal_sales_order.order_number, f"INT-{allocation.id.hex[:15]}")
+
+    def test_required_parts_for_many_plans_use_constant_queries(self):
+        """複数計画の必要部品が、計画数に関係なく同じクエリ数でまとめて取得できることを確認"""
+        self._stock(3)
+        Inventory.objects.create(part_number="RAW-0", warehouse="WH-B", quantity=2, reserved=5)
+        plans = [self.plan] + [
+            ProductionPlan.objects.create(
+                plan_name=f"A{i}",
+                product_code="PROD-A",
+                production_plan="BOM-A",
+                planned_quantity=1,
+                planned_start_datetime=self.plan.planned_start_datetime,
+                planned_end_datetime=self.plan.planned_end_datetime,
+            )
+            for i in range(5)
+        ]
+        allocate_materials_service(plans[1], [{"part_number": "RAW-0", "warehouse": "WH-A", "quantity_to_allocate": 5}])
+
+        with self.assertNumQueries(3):
+            required_parts = get_required_parts_for_plans(plans)
+        self.assertEqual(len(required_parts), 6)
+        # 計画ごとの必要部品は使用日時の新しい順
+        self.assertEqual([part["part_code"] for part in required_parts[self.plan.pk]], ["RAW-2", "RAW-1", "RAW-0"])
+        self.assertEqual(required_parts[self.plan.pk][-1]["inventory_quantity"], 5)
+        self.assertEqual(required_parts[self.plan.pk][-1]["already_allocated_quantity"], 0)
+        self.assertEqual(required_parts[plans[1].pk][-1]["already_allocated_quantity"], 5)
+
+    def test_plan_list_annotations_use_single_query(self):
+        """一覧に作業進捗と引当状況の集計が1回のクエリで付くことを確認"""
+        allocate_materials_service(self.plan, self._stock(2)[:1])
+        update_production_progress_service(self.plan, {"status": "IN_PROGRESS"}, None)
+        ProductionPlan.objects.create(
+            plan_name="B",
+            product_code="PROD-B",
+            planned_quantity=1,
+            planned_start_datetime=self.plan.planned_start_datetime,
+            planned_end_datetime=self.plan.planned_end_datetime,
+        )
+
+        with self.assertNumQueries(1):
+            plans = list(annotate_plan_coverage(annotate_plan_progress(ProductionPlan.objects.order_by("plan_name"))))
+        data = ProductionPlanSerializer(plans, many=True).data
+        self.assertEqual(data[0]["progress_status"], "IN_PROGRESS")
+        self.assertEqual(data[0]["completed_quantity"], 0)
+        self.assertEqual((data[0]["required_quantity"], data[0]["allocated_quantity"]), (10, 5))
+        self.assertEqual(data[0]["allocation_coverage"], 0.5)
+        self.assertIsNone(data[1]["progress_status"])
+        self.assertIsNone(data[1]["allocation_coverage"])
+        self.assertNotIn("progress_status", ProductionPlanSerializer(self.plan).data)
+
+    def test_auto_allocate_prefers_bom_warehouse_and_commits(self):
+        """使用部品の指定倉庫を優先し、その倉庫で足りない分だけを1つの棚番から補って引き当てることを確認"""
+        PartsUsed.objects.create(production_plan="BOM-A", part_code="RAW-X", warehouse="WH-B", quantity_used=12)
+        Inventory.objects.create(part_number="RAW-X", warehouse="WH-A", location="A-1", quantity=30)
+        Inventory.objects.create(part_number="RAW-X", warehouse="WH-A", location="A-2", quantity=6)
+        Inventory.objects.create(part_number="RAW-X", warehouse="WH-B", location="B-1", quantity=5)
+        Inventory.objects.create(part_number="RAW-X", warehouse="WH-B", location="B-2", quantity=3, reserved=1)
+
+        result = auto_allocate_materials_service(self.plan)
+        self.assertFalse(result["committed"])
+        self.assertEqual(
+            [(line["location"], line["quantity_to_allocate"]) for line in result["proposal"]],
+            [("B-1", 5), ("B-2", 2), ("A-2", 5)],
+        )
+
+        result = auto_allocate_materials_service(self.plan, {"allow_partial": True, "max_splits": 1}, commit=True)
+        self.assertTrue(result["committed"])
+        self.assertEqual(result["shortages"][0]["shortage_quantity"], 7)
+        allocation = MaterialAllocation.objects.get(production_plan=self.plan)
+        self.assertEqual((allocation.warehouse, allocation.location, allocation.allocated_quantity), ("WH-B", "B-1", 5))
+        self.assertEqual(Inventory.objects.get(location="B-1").reserved, 5)
+
+    def test_batch_allocation_follows_start_and_priority(self):
+        """開始日時・優先度の順に残りの在庫から引き当て、足りない計画を不足として報告することを確認"""
+        start = (timezone.localtime() + timedelta(days=1)).replace(hour=8, minute=0)
+        plans = [
+            ProductionPlan.objects.create(
+                plan_name=name,
+                product_code="PROD-A",
+                production_plan="BOM-A",
+                planned_quantity=1,
+                planned_start_datetime=start + timedelta(hours=hours),
+                planned_end_datetime=start + timedelta(hours=hours + 1),
+                priority=priority,
+            )
+            for name, hours, priority in [("late", 2, 1), ("low", 1, 200), ("high", 1, 10)]
+        ]
+        PartsUsed.objects.create(production_plan="BOM-A", part_code="RAW-X", quantity_used=4)
+        Inventory.objects.create(part_number="RAW-X", warehouse="WH-A", location="A-1", quantity=5)
+        Inventory.objects.create(part_number="RAW-X", warehouse="WH-A", location="A-2", quantity=4)
+
+        progress = []
+        report = batch_allocate_materials_service(
+            start.date(), start.date() + timedelta(days=1), chunk_size=1, on_progress=lambda *p: progress.append(p)
+        )
+        self.assertEqual((report["plans"], report["allocated_plans"], report["skipped_plans"]), (3, 2, 1))
+        self.assertEqual(report["shortages"][0]["plan_name"], "late")
+        self.assertEqual(progress, [(0, 2), (1, 2), (2, 2)])
+        self.assertEqual({plan.plan_name for plan in plans if plan.material_allocations.exists()}, {"high", "low"})
+        self.assertEqual(Inventory.objects.filter(reserved=4).count(), 2)
+
+
+class SchedulingTests(TestCase):
+    def test_schedule_respects_capacity_and_commits(self):
+        """設備の能力・段取りを考慮して重ならない割当を作り、確定で計画に書き戻す (確認後に変更された計画は除く)"""
+        start = timezone.now().replace(microsecond=0)
+        fast = Machine.objects.create(machine_number="M-1", name="fast")
+        slow = Machine.objects.create(machine_number="M-2", name="slow")
+        MachineCapability.objects.create(machine=fast, product_code="PROD-A", units_per_hour=10, setup_minutes=30)
+        MachineCapability.objects.create(machine=slow, product_code="PROD-A", units_per_hour=5, setup_minutes=30)
+        MachineCapability.objects.create(machine=slow, product_code="PROD-B", units_per_hour=10, setup_minutes=0)
+        plans = {
+            name: ProductionPlan.objects.create(
+                plan_name=name,
+                product_code=product_code,
+                planned_quantity=10,
+                planned_start_datetime=start,
+                planned_end_datetime=start + timedelta(hours=due),
+            )
+            for name, product_code, due in [
+                ("A1", "PROD-A", 2),
+                ("B1", "PROD-B", 3),
+                ("A2", "PROD-A", 4),
+                ("C1", "X", 5),
+            ]
+        }
+
+        schedule_run = create_schedule_run(start_from=start)
+        summary = run_schedule(schedule_run)
+        self.assertEqual((summary["scheduled"], summary["unschedulable"]), (3, 1))
+        assignments = {
+            a.production_plan.plan_name: a for a in schedule_run.assignments.select_related("production_plan")
+        }
+        # A1 と A2 は段取りをまとめて速い設備で続けて生産し、B1 は遅い設備で並行して生産する
+        self.assertEqual([assignments[name].machine_id for name in ("A1", "A2", "B1")], [fast.id, fast.id, slow.id])
+        self.assertEqual(assignments["A1"].planned_end_datetime, start + timedelta(minutes=90))
+        self.assertEqual(assignments["A2"].planned_start_datetime, assignments["A1"].planned_end_datetime)
+        self.assertEqual(assignments["A2"].setup_minutes, 0)
+
+        ProductionPlan.objects.filter(pk=plans["B1"].pk).update(updated_at=timezone.now() + timedelta(seconds=1))
+        result = commit_schedule(schedule_run)
+        self.assertEqual((result["committed"], result["stale"]), (2, 1))
+        plan = ProductionPlan.objects.get(pk=plans["A2"].pk)
+        self.assertEqual((plan.machine_id, plan.planned_end_datetime), (fast.id, start + timedelta(minutes=150)))
+        self.assertEqual(plan.due_datetime, start + timedelta(hours=4))
+        self.assertEqual(ScheduleRun.objects.get().status, ScheduleRun.Status.COMMITTED)
+
+    def test_lateness_uses_due_date_across_commits(self):
+        """確定で計画終了日時が書き換わっても、次の実行の納期遅れは元の納期で判定されることを確認"""
+        start = timezone.now().replace(microsecond=0)
+        machine = Machine.objects.create(machine_number="M-1", name="m")
+        MachineCapability.objects.create(machine=machine, product_code="PROD-A", units_per_hour=10, setup_minutes=0)
+        plan = ProductionPlan.objects.create(
+            plan_name="A",
+            product_code="PROD-A",
+            planned_quantity=20,
+            planned_start_datetime=start,
+            planned_end_datetime=start + timedelta(hours=1),
+        )
+
+        first = create_schedule_run(start_from=start)
+        run_schedule(first)
+        self.assertTrue(first.assignments.get().is_late)
+        commit_schedule(first)
+        plan.refresh_from_db()
+        self.assertEqual(plan.planned_end_datetime, start + timedelta(hours=2))
+
+        second = create_schedule_run(start_from=start)
+        run_schedule(second)
+        self.assertTrue(second.assignments.get().is_late)
@@ -7,7 +7,9 @@ import {
     ProgressUpdatePayload,
     UpdateProgressResponse,
     MaterialAllocationPayload,
-    AllocateMaterialsResponse
+    AllocateMaterialsResponse,
+    PlanChange,
+    SimulationResult
 } from '../types/production';
 
 /**
@@ -80,6 +82,13 @@ const productionService = {
         return await response.json() as RequiredPart[];
     },
 
+    getRequiredPartsForPlans: async (ids: string[]) => {
+        const params = new URLSearchParams({ ids: ids.join(',') });
+        const response = await authFetch(`/api/production/plans/required-parts/?${params}`);
+        await handleError(response, 'Failed to fetch required parts');
+        return await response.json() as Record<string, RequiredPart[]>;
+    },
+
     allocateMaterials: async (id: string, allocations: MaterialAllocationPayload['allocations']) => {
         const response = await authFetch(`/api/production/plans/${id}/allocate-materials/`, {
             method: 'POST',
@@ -87,6 +96,15 @@ const productionService = {
         });
         await handleError(response, 'Allocation failed');
         return await response.json() as AllocateMaterialsResponse;
+    },
+
+    simulatePlanChanges: async (changes: PlanChange[], horizonDays?: number) => {
+        const response = await authFetch('/api/production/plans/simulate/', {
+            method: 'POST',
+            body: JSON.stringify({ changes, horizon_days: horizonDays })
+        });
+        await handleError(response, 'Simulation failed');
+        return await response.json() as SimulationResult;
     }
 };
 
@@ -5,6 +5,7 @@ export interface ProductionPlan {
     planned_quantity: number;
     planned_start_datetime: string;
     planned_end_datetime: string;
+    due_datetime?: string | null; // 納期 (スケジューラでは変更されない)
     actual_start_datetime: string | null;
     actual_end_datetime: string | null;
     status: string;
@@ -16,6 +17,14 @@ export interface ProductionPlan {
     production_plan?: string;
     created_at?: string;
     updated_at?: string;
+    // with_progress=true 指定時
+    progress_status?: string | null;
+    progress_step?: string | null;
+    completed_quantity?: number;
+    // with_coverage=true 指定時
+    required_quantity?: number;
+    allocated_quantity?: number;
+    allocation_coverage?: number | null;
 }
 
 export interface PaginationData<T> {
@@ -33,6 +42,8 @@ export interface ProductionPlanFilters {
     status__in?: string;
     page_size?: number;
     ordering?: string;
+    with_progress?: boolean;
+    with_coverage?: boolean;
 }
 
 export interface RequiredPart {
@@ -73,6 +84,45 @@ export interface AllocateMaterialsResponse {
     allocations_summary: any[];
 }
 
+export interface PlanChange {
+    plan_id: string;
+    planned_start_datetime?: string;
+    planned_end_datetime?: string;
+    planned_quantity?: number;
+}
+
+export interface SimulationResult {
+    horizon: { date_from: string; date_to: string };
+    parts: {
+        part_code: string;
+        on_hand: number;
+        baseline_shortage: number;
+        scenario_shortage: number;
+        baseline_first_short_date: string | null;
+        scenario_first_short_date: string | null;
+    }[];
+    plans: {
+        plan_id: string;
+        plan_name: string;
+        product_code: string;
+        changed: boolean;
+        planned_start_datetime: string;
+        impact: 'new_shortage' | 'worse' | 'improved' | 'resolved' | 'changed';
+        baseline_shortages: Record<string, number>;
+        scenario_shortages: Record<string, number>;
+    }[];
+    late_receipts: {
+        part_code: string;
+        purchase_order_id: string;
+        order_number: string;
+        arrival: string;
+        needed_by: string;
+        days_late: number;
+        plan_id: string;
+        quantity: number;
+    }[];
+}
+
 export const AVAILABLE_STATUSES = [
     { key: 'PENDING', label: '未着手', btnClass: 'btn-secondary', btnOutlineClass: 'btn-outline-secondary', default_selected: true },
     { key: 'IN_PROGRESS', label: '進行中', btnClass: 'btn-info', btnOutlineClass: 'btn-outline-info', default_selected: true },